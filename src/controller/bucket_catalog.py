@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+BucketCatalog keeps bucket definitions (name, type, RAM quota, compression mode) of one cluster indexed by bucket name.
+Catalog is built from output of REST API /pools/default/buckets, couchbase-cli bucket-list -o json (python repr on
+older versions), bucket-config.json files from backup repository or from bucket_list field of SnapshotDefinition.
+Output is parsed once and only the fields used by the plugin are kept. Basic statistics of bucket list from REST API
+are kept as stats of the record, so bucket_list of a snapshot records the dataset of every bucket.
+"""
+#######################################################################################################################
+
+import ast
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# used if bucket definition doesn't contain RAM quota
+DEFAULT_BUCKET_RAM = 1024000
+# statistics of bucket kept by BucketRecord: item count, bytes of data files / live data / memory, percent of items
+# resident in memory, percent of data files taken by stale data, bytes of index files of the bucket
+BUCKET_STATS = ("items", "disk_used", "data_used", "mem_used", "resident_ratio", "fragmentation", "index_disk_size")
+
+
+class BucketRecord(object):
+    __slots__ = ('name', 'bucket_type', 'ram', 'compression_mode', 'stats')
+
+    def __init__(self, name, bucket_type=None, ram=DEFAULT_BUCKET_RAM, compression_mode=None, stats=None):
+        self.name = name
+        self.bucket_type = bucket_type
+        self.ram = ram
+        self.compression_mode = compression_mode
+        # dict of BUCKET_STATS, None if bucket definition has no statistics
+        self.stats = stats
+
+    @classmethod
+    def from_json(cls, bucket):
+        """
+        Build record from bucket definition returned by REST API, couchbase-cli, backup repository or snapshot
+        """
+        if 'quota' in bucket and 'ram' in bucket['quota']:
+            ram = bucket['quota']['ram']
+        elif 'ramQuota' in bucket:
+            # this is in MB
+            ram = int(bucket['ramQuota']) * 1024 * 1024
+        elif 'ram' in bucket:
+            ram = bucket['ram']
+        else:
+            logger.debug('No memory in bucket - setting to default')
+            ram = DEFAULT_BUCKET_RAM
+        stats = dict(bucket['stats']) if bucket.get('stats') else cls.basic_stats(bucket.get('basicStats'))
+        return cls(bucket.get('name'), bucket.get('bucketType'), ram, bucket.get('compressionMode'), stats)
+
+    @staticmethod
+    def basic_stats(basic_stats):
+        """ BUCKET_STATS from basicStats of REST API bucket list, index disk size is not part of them """
+        if not basic_stats or 'itemCount' not in basic_stats:
+            return None
+        items = int(basic_stats['itemCount'])
+        disk_used = int(basic_stats.get('diskUsed', 0))
+        data_used = int(basic_stats.get('dataUsed', disk_used))
+        non_resident = int(basic_stats.get('vbActiveNumNonResident', 0))
+        return {'items': items, 'disk_used': disk_used, 'data_used': data_used,
+                'mem_used': int(basic_stats.get('memUsed', 0)),
+                'resident_ratio': round(100.0 * (items - non_resident) / items, 1) if items else 100.0,
+                'fragmentation': (disk_used - data_used) * 100 // disk_used if disk_used else 0,
+                'index_disk_size': 0}
+
+    def definition(self):
+        return {'name': self.name, 'bucketType': self.bucket_type, 'ram': self.ram,
+                'compressionMode': self.compression_mode}
+
+    def to_json(self):
+        bucket = self.definition()
+        if self.stats is not None:
+            bucket['stats'] = self.stats
+        return bucket
+
+    def __eq__(self, other):
+        # statistics change all the time, records are equal if their definitions are
+        return isinstance(other, BucketRecord) and self.definition() == other.definition()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "BucketRecord({})".format(self.to_json())
+
+
+class BucketCatalog(object):
+
+    def __init__(self, records=()):
+        self.__buckets = OrderedDict()
+        for record in records:
+            self.__buckets[record.name] = record
+
+    @classmethod
+    def parse(cls, bucket_output):
+        """
+        Build catalog from REST API or couchbase-cli bucket list output
+        """
+        if bucket_output is None or bucket_output.strip() in ("", "[]"):
+            return cls()
+        try:
+            buckets = json.loads(bucket_output)
+        except ValueError:
+            # couchbase-cli may print python representation of the list
+            buckets = ast.literal_eval(bucket_output)
+        return cls.from_json(buckets)
+
+    @classmethod
+    def from_json(cls, buckets):
+        """
+        Build catalog from list of bucket dictionaries or from JSON string with such list (snapshot bucket_list)
+        """
+        if isinstance(buckets, str):
+            buckets = json.loads(buckets) if buckets else []
+        return cls(BucketRecord.from_json(bucket) for bucket in buckets if bucket)
+
+    def to_json(self):
+        """
+        Stable serialization for SnapshotDefinition.bucket_list: buckets sorted by name, keys sorted
+        """
+        return json.dumps(self.to_list(), sort_keys=True)
+
+    def to_list(self):
+        return [self.__buckets[name].to_json() for name in sorted(self.__buckets)]
+
+    def names(self):
+        return list(self.__buckets.keys())
+
+    def names_with_ram(self):
+        """ Names of buckets with RAM quota, memcached buckets without quota are skipped """
+        return [record.name for record in self if record.ram > 0]
+
+    def get(self, name, default=None):
+        return self.__buckets.get(name, default)
+
+    @property
+    def total_ram(self):
+        return sum(record.ram for record in self)
+
+    def total_stat(self, stat):
+        """ sum of one of BUCKET_STATS over buckets with statistics """
+        return sum(record.stats.get(stat, 0) for record in self if record.stats)
+
+    def diff(self, other):
+        """
+        Compare with other catalog
+        :return: tuple of lists with names: buckets missing in other catalog, buckets only in other catalog,
+        buckets with different definition
+        """
+        missing = [name for name in self.__buckets if name not in other]
+        extra = [name for name in other.names() if name not in self]
+        changed = [name for name in self.__buckets if name in other and self.get(name) != other.get(name)]
+        return missing, extra, changed
+
+    def __contains__(self, name):
+        return name in self.__buckets
+
+    def __iter__(self):
+        return iter(list(self.__buckets.values()))
+
+    def __len__(self):
+        return len(self.__buckets)
+
+    def __repr__(self):
+        return "BucketCatalog({})".format(self.names())
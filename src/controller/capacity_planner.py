@@ -0,0 +1,204 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Capacity planner of staging and VDB clusters. From bucket statistics of the source (bucket_list of a snapshot or
+output of REST API /pools/default/buckets), index definitions and number of nodes it recommends service quotas,
+per-bucket quotas and eviction policies and estimates disk footprint, ingest and warmup times. Working set of a bucket
+is its resident data and metadata of all its items, buckets without statistics keep their quota. With physical
+memory of the hosts, quotas are fitted by memory_sizing the same way as on provision.
+
+    cd src && python -m controller.capacity_planner bucket_list.json --indexes indexes.json --nodes 3 \
+        --host-memory 16384
+"""
+#######################################################################################################################
+
+import argparse
+import json
+import logging
+import math
+import sys
+from collections import OrderedDict
+
+from controller import helper_lib
+from controller import memory_sizing
+from controller import placement
+from controller.bucket_catalog import BucketCatalog
+from db_commands.constants import BUCKET_MEMORY_MINIMUM, COMPACTION_FRAGMENTATION_THRESHOLD, MEMORY_FRACTION, \
+    PLANNER_INDEX_RESIDENT_RATIO, PLANNER_INGEST_BYTES_PER_SECOND, PLANNER_ITEM_METADATA_BYTES, \
+    PLANNER_MEMORY_HEADROOM, PLANNER_WARMUP_BYTES_PER_SECOND, SERVICE_MEMORY_MINIMUMS
+from dlpx.virtualization.platform.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# bucket types of bucket list kept on disk, memcached buckets keep the quota of their definition
+PERSISTENT_BUCKET_TYPES = ("membase", "couchbase")
+
+
+class PlannerParameters(object):
+    """ service quotas of the plan with the attributes of VirtualSourceDefinition used by memory_sizing """
+
+    def __init__(self, cluster_ram_size, cluster_index_ram_size, cluster_ftsram_size, fts_service, memory_fraction):
+        self.cluster_ram_size = cluster_ram_size
+        self.cluster_index_ram_size = cluster_index_ram_size
+        self.cluster_ftsram_size = cluster_ftsram_size
+        self.cluster_eventing_ram_size = SERVICE_MEMORY_MINIMUMS["eventing"]
+        self.cluster_analytics_ram_size = SERVICE_MEMORY_MINIMUMS["analytics"]
+        self.fts_service = fts_service
+        self.eventing_service = False
+        self.analytics_service = False
+        self.memory_fraction = memory_fraction
+
+
+def working_set(record):
+    """ bytes of bucket which should be in memory, None for bucket without statistics """
+    if not record.stats:
+        return None
+    resident = record.stats.get("data_used", 0) * record.stats.get("resident_ratio", 100.0) / 100
+    return int(resident) + record.stats.get("items", 0) * PLANNER_ITEM_METADATA_BYTES
+
+
+def bucket_quota(record, data_nodes):
+    """ recommended quota of bucket in MB per data node """
+    size = working_set(record)
+    if size is None or record.bucket_type == "memcached":
+        return helper_lib.get_bucket_size_in_MB(0, record.ram)
+    quota = int(math.ceil(float(size) * (100 + PLANNER_MEMORY_HEADROOM) / 100 / data_nodes / MB))
+    return max(BUCKET_MEMORY_MINIMUM, quota)
+
+
+def index_disk_sizes(bucket_catalog, index_definitions):
+    """
+    Bytes of index files of every bucket, estimated from number of indexes and items of a bucket if the index
+    service didn't report them
+    """
+    counts = {}
+    for definition in index_definitions:
+        keyspace = helper_lib.index_keyspace(definition)
+        if keyspace is not None:
+            bucket_name = keyspace.split(".")[0].strip("`")
+            counts[bucket_name] = counts.get(bucket_name, 0) + 1
+    sizes = OrderedDict()
+    for record in bucket_catalog:
+        stats = record.stats or {}
+        sizes[record.name] = stats.get("index_disk_size") or \
+            counts.get(record.name, 0) * stats.get("items", 0) * PLANNER_ITEM_METADATA_BYTES
+    return sizes
+
+
+def disk_footprint(record, index_disk_size):
+    """ bytes of data and index files of bucket with fragmentation allowed by auto-compaction """
+    if not record.stats:
+        return None
+    size = record.stats.get("data_used", 0) + index_disk_size
+    return size * 100 // (100 - COMPACTION_FRAGMENTATION_THRESHOLD)
+
+
+def plan_capacity(bucket_catalog, index_definitions=(), node_count=1, host_memory_mb=None,
+                  memory_fraction=MEMORY_FRACTION, fts=False):
+    """
+    :param bucket_catalog: BucketCatalog of the source, with stats for buckets sized by their working set
+    :param index_definitions: CREATE INDEX statements of the source
+    :param node_count: number of nodes of the target cluster including the primary
+    :param host_memory_mb: physical memory of the smallest host, quotas are not fitted to hosts if None
+    :return: OrderedDict with the plan, quotas in MB, sizes in bytes and times in seconds
+    :raise UserError: hosts are too small for the buckets
+    """
+    index_definitions = list(index_definitions or [])
+    bucket_list = bucket_catalog.to_list()
+    # primary keeps data, index and query, additional nodes get the layout of the placement advisor
+    services = [["data", "index", "query"]] + placement.propose_placement(node_count - 1, bucket_list,
+                                                                         index_definitions)
+    data_nodes = len([node for node in services if "data" in node])
+    index_nodes = len([node for node in services if "index" in node])
+
+    quotas = OrderedDict((record.name, bucket_quota(record, data_nodes)) for record in bucket_catalog)
+    index_sizes = index_disk_sizes(bucket_catalog, index_definitions)
+    index_quota = int(math.ceil(float(sum(index_sizes.values())) * PLANNER_INDEX_RESIDENT_RATIO / 100 /
+                                index_nodes / MB))
+    parameters = PlannerParameters(max(SERVICE_MEMORY_MINIMUMS["data"], sum(quotas.values())),
+                                   max(SERVICE_MEMORY_MINIMUMS["index"], index_quota),
+                                   SERVICE_MEMORY_MINIMUMS["fts"], fts, memory_fraction)
+
+    evictions = {}
+    if host_memory_mb is not None:
+        service_quotas, changed = memory_sizing.plan_memory(
+            parameters, [dict(record.definition(), ram=quotas[record.name] * MB) for record in bucket_catalog],
+            host_memory_mb)
+        parameters.cluster_ram_size = service_quotas["data"]
+        parameters.cluster_index_ram_size = service_quotas["index"]
+        parameters.cluster_ftsram_size = service_quotas.get("fts", parameters.cluster_ftsram_size)
+        for name, quota, eviction_policy in changed:
+            quotas[name] = quota
+            evictions[name] = eviction_policy
+
+    buckets = []
+    warmup_bytes = 0
+    for record in bucket_catalog:
+        if record.bucket_type in PERSISTENT_BUCKET_TYPES:
+            eviction_policy = evictions.get(record.name) or "valueOnly"
+            data_per_node = (record.stats or {}).get("data_used", 0) // data_nodes
+            warmup_bytes = warmup_bytes + min(data_per_node, quotas[record.name] * MB)
+        else:
+            eviction_policy = None
+        buckets.append(OrderedDict([("name", record.name), ("ram_size", quotas[record.name]),
+                                    ("eviction_policy", eviction_policy),
+                                    ("disk_footprint", disk_footprint(record, index_sizes[record.name]))]))
+
+    footprints = [bucket["disk_footprint"] for bucket in buckets if bucket["disk_footprint"] is not None]
+    return OrderedDict([
+        ("nodes", node_count), ("services", services),
+        ("cluster_ram_size", parameters.cluster_ram_size),
+        ("cluster_index_ram_size", parameters.cluster_index_ram_size),
+        ("cluster_ftsram_size", parameters.cluster_ftsram_size),
+        ("buckets", buckets),
+        ("disk_footprint", sum(footprints)),
+        ("ingest_seconds", int(math.ceil(float(bucket_catalog.total_stat("data_used")) /
+                                         PLANNER_INGEST_BYTES_PER_SECOND))),
+        ("warmup_seconds", int(math.ceil(float(warmup_bytes) / PLANNER_WARMUP_BYTES_PER_SECOND)))])
+
+
+def cluster_inputs(couchbase_obj):
+    """ bucket statistics and index definitions of a running cluster as the input of plan_capacity """
+    return couchbase_obj.bucket_statistics(), couchbase_obj.get_indexes_definition()
+
+
+def read_indexes(content):
+    """ index definitions from JSON list (indexes of a snapshot) or one statement per line """
+    if content.strip().startswith("["):
+        return json.loads(content)
+    return [line.strip() for line in content.splitlines() if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommend quotas and estimate footprint of a Couchbase cluster")
+    parser.add_argument("bucket_list", help="file with bucket list of a snapshot or of REST API, - for stdin")
+    parser.add_argument("--indexes", help="file with index definitions, JSON list or one statement per line")
+    parser.add_argument("--nodes", type=int, default=1, help="nodes of the target cluster including the primary")
+    parser.add_argument("--host-memory", type=int, help="physical memory of the smallest host in MB")
+    parser.add_argument("--memory-fraction", type=int, default=MEMORY_FRACTION,
+                        help="percent of physical memory for Couchbase quotas")
+    parser.add_argument("--fts", action="store_true", help="size the search service")
+    args = parser.parse_args(argv)
+
+    with (sys.stdin if args.bucket_list == "-" else open(args.bucket_list)) as f:
+        bucket_catalog = BucketCatalog.parse(f.read())
+    index_definitions = []
+    if args.indexes:
+        with open(args.indexes) as f:
+            index_definitions = read_indexes(f.read())
+    try:
+        plan = plan_capacity(bucket_catalog, index_definitions, args.nodes, args.host_memory,
+                             args.memory_fraction, args.fts)
+    except UserError as error:
+        sys.stderr.write("{}\n".format(error.message))
+        return 1
+    print(json.dumps(plan, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
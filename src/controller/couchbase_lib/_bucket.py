@@ -14,11 +14,12 @@ import json
 from os.path import join
 from internal_exceptions.database_exceptions import BucketOperationError
 from controller import helper_lib
-from controller.helper_lib import remap_bucket_json
+from controller.bucket_catalog import BucketCatalog
 from controller.couchbase_lib._mixin_interface import MixinInterface
+from controller.operation_metadata import STAGED_BUCKETS
 from controller.resource_builder import Resource
 from db_commands.commands import CommandFactory
-from db_commands.constants import ENV_VAR_KEY, EVICTION_POLICY
+from db_commands.constants import ENV_VAR_KEY, EVICTION_POLICY, INDEX_HTTP_PORT
 
 logger = logging.getLogger(__name__)
 
@@ -38,11 +39,7 @@ class _BucketMixin(Resource, MixinInterface):
         # It requires the before bucket delete
         logger.debug("Editing bucket: {} ".format(bucket_name))
         self.__validate_bucket_name(bucket_name)
-        env = _BucketMixin.generate_environment_map(self)
-        command = CommandFactory.bucket_edit(bucket_name=bucket_name, flush_value=flush_value, **env)
-        kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
-        logger.debug("edit bucket {}".format(command))
-        return utilities.execute_bash(self.connection, command, **kwargs)
+        return self.run_couchbase_command('bucket_edit', bucket_name=bucket_name, flush_value=flush_value)
 
     def bucket_edit_ramquota(self, bucket_name, _ramsize):
         """
@@ -53,40 +50,132 @@ class _BucketMixin(Resource, MixinInterface):
         # It requires the before bucket delete
         logger.debug("Editing bucket: {} ".format(bucket_name))
         self.__validate_bucket_name(bucket_name)
-        env = _BucketMixin.generate_environment_map(self)
-        command = CommandFactory.bucket_edit_ramquota(bucket_name=bucket_name, ramsize=_ramsize, **env)
-        kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
-        logger.debug("edit ram bucket {}".format(command))
-        return utilities.execute_bash(self.connection, command, **kwargs)
+        self.metadata.invalidate(STAGED_BUCKETS)
+        return self.run_couchbase_command('bucket_edit_ramquota', bucket_name=bucket_name, ramsize=_ramsize)
 
     def bucket_delete(self, bucket_name):
         # To delete the bucket
         logger.debug("Deleting bucket: {} ".format(bucket_name))
         self.__validate_bucket_name(bucket_name)
-        env = _BucketMixin.generate_environment_map(self)
-        command = CommandFactory.bucket_delete(bucket_name=bucket_name, **env)
-        kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
-        logger.debug("delete bucket {}".format(command))
-        return utilities.execute_bash(self.connection, command, **kwargs)
+        self.metadata.invalidate(STAGED_BUCKETS)
+        return self.run_couchbase_command('bucket_delete', bucket_name=bucket_name)
 
     def bucket_flush(self, bucket_name):
         # It requires the before bucket delete
         logger.debug("Flushing bucket: {} ".format(bucket_name))
         self.__validate_bucket_name(bucket_name)
-        env = _BucketMixin.generate_environment_map(self)
-        command = CommandFactory.bucket_flush(bucket_name=bucket_name, **env)
-        kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
-        logger.debug("flush bucket {}".format(command))
-        return utilities.execute_bash(self.connection, command, **kwargs)
+        return self.run_couchbase_command('bucket_flush', bucket_name=bucket_name)
 
     def bucket_remove(self, bucket_name):
         logger.debug("Removing bucket: {} ".format(bucket_name))
-        self.bucket_edit(bucket_name, flush_value=1)
-        self.bucket_flush(bucket_name)
-        self.bucket_edit(bucket_name, flush_value=0)
-        self.bucket_delete(bucket_name)
+        self.__validate_bucket_name(bucket_name)
+        self.metadata.invalidate(STAGED_BUCKETS)
+        # enable flush, flush, disable flush and delete are sent in one REST batch
+        self.run_couchbase_rest_batch([('bucket_edit', {'bucket_name': bucket_name, 'flush_value': 1}),
+                                       ('bucket_flush', {'bucket_name': bucket_name}),
+                                       ('bucket_edit', {'bucket_name': bucket_name, 'flush_value': 0}),
+                                       ('bucket_delete', {'bucket_name': bucket_name})])
         helper_lib.sleepForSecond(2)
 
+    def bucket_disk_usage(self):
+        """
+        :return: dict of bucket name and tuple (disk used, data used) in bytes, empty if bucket list can't be read
+        """
+        bucket_list, error, exit_code = self.run_couchbase_command('bucket_list')
+        try:
+            buckets = json.loads(bucket_list) if exit_code == 0 else []
+        except ValueError:
+            logger.debug("Bucket list without disk statistics: {}".format(bucket_list))
+            buckets = []
+        usage = {}
+        for bucket in buckets:
+            stats = bucket.get('basicStats', {})
+            if 'diskUsed' in stats:
+                usage[bucket['name']] = (int(stats['diskUsed']), int(stats.get('dataUsed', stats['diskUsed'])))
+        return usage
+
+    def bucket_statistics(self):
+        """
+        Buckets with statistics for the snapshot. Bucket list with basic statistics and statistics of the index
+        service are read by one REST batch, index disk size is 0 if the index service doesn't answer
+        :return: BucketCatalog with stats of every bucket, without stats if bucket list can't be read
+        """
+        (bucket_list, error, exit_code), (index_stats, index_error, index_exit_code) = \
+            self.run_couchbase_rest_batch([('bucket_list', {}), ('index_stats', {'port': INDEX_HTTP_PORT})])
+        if exit_code != 0:
+            logger.debug("Bucket statistics can't be read: {}".format(error))
+            return self.bucket_catalog()
+        catalog = BucketCatalog.parse(bucket_list)
+        index_sizes = {}
+        try:
+            for key, stats in (json.loads(index_stats) if index_exit_code == 0 else {}).items():
+                # keys are bucket:index or bucket:scope:collection:index, indexer keeps stats of the service
+                if key != "indexer" and isinstance(stats, dict):
+                    bucket_name = key.split(":")[0]
+                    index_sizes[bucket_name] = index_sizes.get(bucket_name, 0) + int(stats.get("disk_size", 0))
+        except ValueError:
+            logger.debug("Index statistics can't be read: {} {}".format(index_stats, index_error))
+        for record in catalog:
+            if record.stats is not None:
+                record.stats["index_disk_size"] = index_sizes.get(record.name, 0)
+        return catalog
+
+    def bucket_compact(self, bucket_names):
+        """ start compaction of data files of buckets, compaction runs in background """
+        logger.debug("Compacting buckets: {}".format(bucket_names))
+        for bucket_name in bucket_names:
+            self.__validate_bucket_name(bucket_name)
+        return self.run_couchbase_rest_batch([('bucket_compact', {'bucket_name': bucket_name})
+                                              for bucket_name in bucket_names])
+
+    def bucket_delete_many(self, bucket_names):
+        """ delete buckets by one REST batch """
+        logger.debug("Deleting buckets: {}".format(bucket_names))
+        for bucket_name in bucket_names:
+            self.__validate_bucket_name(bucket_name)
+        self.metadata.invalidate(STAGED_BUCKETS)
+        return self.run_couchbase_rest_batch([('bucket_delete', {'bucket_name': bucket_name})
+                                              for bucket_name in bucket_names])
+
+    def remove_bucket_data(self, bucket_names):
+        """ delete data files of buckets from data path of the node, server must be stopped """
+        logger.debug("Removing data files of buckets: {}".format(bucket_names))
+        for bucket_name in bucket_names:
+            self.__validate_bucket_name(bucket_name)
+        return self.run_os_command(os_command='delete_dir', dirname=" ".join(
+            join(self.data_path(), bucket_name) for bucket_name in bucket_names))
+
+    def warmup_stats(self):
+        """ cbstats warmup of all buckets on this node """
+        return self.run_couchbase_command(
+            'warmup_stats', base_path=helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path))
+
+    def bucket_set_params(self, bucket_name, params):
+        """
+        Set ep-engine parameters of bucket on this node, parameters are not persisted and are lost on restart
+        :param params: list of (parameter, value)
+        """
+        logger.debug("Setting parameters of bucket {}: {}".format(bucket_name, params))
+        self.__validate_bucket_name(bucket_name)
+        return self.run_couchbase_command(
+            'bucket_set_params', bucket_name=bucket_name, params=params,
+            base_path=helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path))
+
+    def bucket_cancel_compaction(self, bucket_names):
+        logger.debug("Cancelling compaction of buckets: {}".format(bucket_names))
+        return self.run_couchbase_rest_batch([('bucket_cancel_compaction', {'bucket_name': bucket_name})
+                                              for bucket_name in bucket_names])
+
+    def compacting_buckets(self):
+        """
+        :return: names of buckets with running compaction, None if cluster tasks can't be read
+        """
+        [(tasks, error, exit_code)] = self.run_couchbase_rest_batch([('get_tasks', {})])
+        if exit_code != 0:
+            logger.debug("Unable to read cluster tasks: {} {}".format(tasks, error))
+            return None
+        return [task.get('bucket') for task in json.loads(tasks) if task.get('type') == 'bucket_compaction']
+
     def bucket_create(self, bucket_name, ram_size, bucket_type, bucket_compression):
         logger.debug("Creating bucket: {} ".format(bucket_name))
         # To create the bucket with given ram size
@@ -110,7 +199,8 @@ class _BucketMixin(Resource, MixinInterface):
         command = CommandFactory.bucket_create(bucket_name=bucket_name, ramsize=ram_size, evictionpolicy=policy, bucket_type=bucket_type, bucket_compression=bucket_compression, **env)
         kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
         logger.debug("create bucket {}".format(command))
-        output, error, exit_code = utilities.execute_bash(self.connection, command, **kwargs)
+        self.metadata.invalidate(STAGED_BUCKETS)
+        output, error, exit_code = utilities.execute_bash(self.connection, command, category="bucket_create", **kwargs)
         logger.debug("create bucket output: {} {} {}".format(output, error, exit_code))
         helper_lib.sleepForSecond(2)
 
@@ -118,30 +208,22 @@ class _BucketMixin(Resource, MixinInterface):
     def bucket_list(self, return_type=list):
         # See the all bucket. 
         # It will return also other information like ramused, ramsize etc
+        return self.bucket_catalog().to_list()
+
+    def bucket_catalog(self):
+        """
+        Buckets of staged / target cluster as BucketCatalog. Read once per operation, bucket create/delete/edit
+        clear it. Returned catalog is shared, don't modify it
+        """
+        return self.metadata.get(STAGED_BUCKETS, self.__read_bucket_catalog)
+
+    def __read_bucket_catalog(self):
         logger.debug("Finding staged bucket list")
-        env = _BucketMixin.generate_environment_map(self)
-        command = CommandFactory.bucket_list(**env)
-        kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
-        logger.debug("list bucket {}".format(command))
-        bucket_list, error, exit_code = utilities.execute_bash(self.connection, command, **kwargs)
+        bucket_list, error, exit_code = self.run_couchbase_command('bucket_list')
         logger.debug("list bucket output{}".format(bucket_list))
-        if return_type == list:
-            #bucket_list = bucket_list.split("\n")
-            if bucket_list == "[]" or bucket_list is None:
-                logger.debug("empty list")
-                return []
-            else:
-                logger.debug("clean up json")
-                bucket_list = bucket_list.replace("u'","'")
-                bucket_list = bucket_list.replace("'", "\"")
-                bucket_list = bucket_list.replace("True", "\"True\"")
-                bucket_list = bucket_list.replace("False", "\"False\"")
-                logger.debug("parse json")
-                bucket_list_dict = json.loads(bucket_list)
-                logger.debug("remap json")
-                bucket_list_dict = list(map(helper_lib.remap_bucket_json, bucket_list_dict))
-        logger.debug("Bucket details in staged environment: {}".format(bucket_list))
-        return bucket_list_dict
+        catalog = BucketCatalog.parse(bucket_list)
+        logger.debug("Bucket details in staged environment: {}".format(catalog))
+        return catalog
 
 
     def move_bucket(self, bucket_name, direction):
@@ -154,16 +236,16 @@ class _BucketMixin(Resource, MixinInterface):
             dst = join(self.virtual_source.parameters.mount_path,'data',".{}.delphix".format(bucket_name))
             command = CommandFactory.os_mv(src, dst, self.need_sudo, self.uid)
             logger.debug("rename command: {}".format(command))         
-            stdout, error, exit_code = utilities.execute_bash(self.connection, command)
+            stdout, error, exit_code = utilities.execute_bash(self.connection, command, category="os_mv")
         elif direction == 'restore':
             dst = join(self.virtual_source.parameters.mount_path,'data',bucket_name)
             src = join(self.virtual_source.parameters.mount_path,'data',".{}.delphix".format(bucket_name))
             command = CommandFactory.delete_dir(dst, self.need_sudo, self.uid)
             logger.debug("delete command: {}".format(command))         
-            stdout, error, exit_code = utilities.execute_bash(self.connection, command)
+            stdout, error, exit_code = utilities.execute_bash(self.connection, command, category="delete_dir")
             command = CommandFactory.os_mv(src, dst, self.need_sudo, self.uid)
             logger.debug("rename command: {}".format(command))         
-            stdout, error, exit_code = utilities.execute_bash(self.connection, command)
+            stdout, error, exit_code = utilities.execute_bash(self.connection, command, category="os_mv")
         
 
 
@@ -171,23 +253,28 @@ class _BucketMixin(Resource, MixinInterface):
     def monitor_bucket(self, bucket_name, staging_UUID):
         # To monitor the replication
         logger.debug("Monitoring the replication for bucket {} ".format(bucket_name))
+        pending_docs = self.replication_changes_left(bucket_name, staging_UUID)
+        while pending_docs != 0:
+            logger.debug("Documents pending for replication: {}".format(pending_docs))
+            helper_lib.sleepForSecond(30)
+            pending_docs = self.replication_changes_left(bucket_name, staging_UUID)
+        else:
+            logger.debug("Replication for bucket {} completed".format(bucket_name))
+
+    def replication_changes_left(self, bucket_name, staging_UUID):
+        """
+        :return: number of documents of the bucket not replicated to staging yet
+        """
         kwargs = {ENV_VAR_KEY: {'password': self.staged_source.parameters.xdcr_admin_password}}
         command = CommandFactory.monitor_replication(source_username=self.staged_source.parameters.xdcr_admin,
                                                      source_hostname=self.source_config.couchbase_src_host,
                                                      source_port=self.source_config.couchbase_src_port,
                                                      bucket_name=bucket_name, uuid=staging_UUID)
-        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, **kwargs)
+        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, category="monitor_replication",
+                                                           **kwargs)
         logger.debug("stdout: {}".format(stdout))
         content = json.loads(stdout)
-        pending_docs = self._get_last_value_of_node_stats(list(content["nodeStats"].values())[0])
-        while pending_docs != 0:
-            logger.debug("Documents pending for replication: {}".format(pending_docs))
-            helper_lib.sleepForSecond(30)
-            stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, **kwargs)
-            content = json.loads(stdout)
-            pending_docs = self._get_last_value_of_node_stats(list(content["nodeStats"].values())[0])
-        else:
-            logger.debug("Replication for bucket {} completed".format(bucket_name))
+        return self._get_last_value_of_node_stats(list(content["nodeStats"].values())[0])
 
     @staticmethod
     def _get_last_value_of_node_stats(content_list):
@@ -7,12 +7,15 @@
 This is child class of Resource and parent class of CouchbaseOperation
 """
 #######################################################################################################################
+import hashlib
 import logging
 from utils import utilities
 from controller import helper_lib
 from controller.couchbase_lib._mixin_interface import MixinInterface
+from controller.operation_metadata import BACKUP_BUCKETS
+from controller.restore_progress import RestoreProgress, parse_backup_info
 from controller.resource_builder import Resource
-from db_commands.constants import ENV_VAR_KEY
+from db_commands.constants import ENV_VAR_KEY, RESTORE_JOB_TIMEOUT
 from db_commands.commands import CommandFactory
 from dlpx.virtualization.platform.exceptions import UserError
 
@@ -35,6 +38,23 @@ class _CBBackupMixin(Resource, MixinInterface):
 
 
 
+    def cb_backup_info(self):
+        """
+        :return: dict of bucket name and dict with items and size of the bucket in the latest backup, empty if
+        cbbackupmgr doesn't report them
+        """
+        return self.metadata.get(BACKUP_BUCKETS, self.__read_backup_info)
+
+    def __read_backup_info(self):
+        stdout, stderr, exit_code = self.run_couchbase_command(
+            couchbase_command='cb_backup_info', backup_location=self.parameters.couchbase_bak_loc,
+            backup_repo=self.parameters.couchbase_bak_repo,
+            base_path=helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path))
+        if exit_code != 0:
+            logger.debug("Backup info is not available: {} {}".format(stdout, stderr))
+            return {}
+        return parse_backup_info(stdout)
+
     def cb_backup_full(self, csv_bucket):
         logger.debug("Starting Restore via Backup file...")
         logger.debug("csv_bucket_list: {}".format(csv_bucket))
@@ -63,13 +83,31 @@ class _CBBackupMixin(Resource, MixinInterface):
         # utilities.execute_bash(self.connection, cmd, **kwargs)
 
 
-        stdout, stderr, exit_code = self.run_couchbase_command(couchbase_command='cb_backup_full',
-                                                            backup_location=self.parameters.couchbase_bak_loc,
-                                                            csv_bucket_list=csv_bucket,
-                                                            backup_repo=self.parameters.couchbase_bak_repo, 
-                                                            skip=skip, 
-                                                            base_path=helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path)
-                                                        )
+        # restore runs detached, so it survives lost connections to the staging host. Job is named by the repository,
+        # the backup and its buckets, a job restoring an older backup or another repository is never attached again
+        restored = "{}/{}|{}|{}".format(self.parameters.couchbase_bak_loc, self.parameters.couchbase_bak_repo,
+                                        self.latest_backup_date(), csv_bucket)
+        job_name = "restore_{}".format(hashlib.md5(restored.encode("utf-8")).hexdigest()[:12])
+        progress = RestoreProgress(self, csv_bucket.split(","), self.cb_backup_info())
+        try:
+            stdout, stderr, exit_code = self.run_couchbase_job(job_name=job_name,
+                                                                timeout=RESTORE_JOB_TIMEOUT,
+                                                                monitor=progress.sample,
+                                                                couchbase_command='cb_backup_full',
+                                                                backup_location=self.parameters.couchbase_bak_loc,
+                                                                csv_bucket_list=csv_bucket,
+                                                                backup_repo=self.parameters.couchbase_bak_repo, 
+                                                                skip=skip, 
+                                                                base_path=helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path)
+                                                            )
+        except Exception:
+            # status of the restore doesn't stay "running", error of the job is raised even if the report fails
+            try:
+                progress.finish(False)
+            except Exception as err:
+                logger.debug("Unable to report failed restore: {}".format(err))
+            raise
+        progress.finish(exit_code == 0)
 
         if exit_code != 0:
             raise UserError("Problem with restoring backup using cbbackupmgr", "Check if repo and all privileges are correct",
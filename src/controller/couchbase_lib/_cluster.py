@@ -14,6 +14,7 @@ from utils import utilities
 from controller.helper_lib import sleepForSecond
 from db_commands.commands import CommandFactory
 from controller.couchbase_lib._mixin_interface import MixinInterface
+from controller.operation_metadata import STAGED_BUCKETS
 from db_commands.constants import ENV_VAR_KEY
 from controller.resource_builder import Resource
 
@@ -52,6 +53,7 @@ class _ClusterMixin(Resource, MixinInterface):
     def cluster_init(self):
         # Cluster initialization
         logger.debug("Cluster Initialization started")
+        self.metadata.invalidate(STAGED_BUCKETS)
         fts_service = self.parameters.fts_service
         #analytics_service = self.parameters.analytics_service
         eventing_service = self.parameters.eventing_service
@@ -72,7 +74,7 @@ class _ClusterMixin(Resource, MixinInterface):
         cmd = CommandFactory.cluster_init(cluster_name=cluster_name, **env)
         logger.debug("Cluster init: {}".format(cmd))
         stdout, stderr, exit_code = utilities.execute_bash(self.connection, command_name=cmd, callback_func=lambda_expr,
-                                                           **kwargs)
+                                                           category="cluster_init", **kwargs)
         if re.search(r"ERROR", str(stdout)):
             if re.search(r"ERROR: Cluster is already initialized", stdout):
                 logger.debug("Performing cluster setting as cluster is already initialized")
@@ -89,12 +91,10 @@ class _ClusterMixin(Resource, MixinInterface):
 
     def cluster_setting(self):
         logger.debug("Cluster setting process has started")
-        kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
         cluster_name = self._get_cluster_name()
         env = _ClusterMixin.generate_environment_map(self)
-        cmd = CommandFactory.cluster_setting(cluster_name=cluster_name, **env)
-        stdout, stderr, exit_code = utilities.execute_bash(self.connection, cmd, **kwargs)
-        if re.search(r"ERROR", str(stdout)):
+        stdout, stderr, exit_code = self.run_couchbase_command('cluster_setting', cluster_name=cluster_name, **env)
+        if exit_code != 0 or re.search(r"ERROR", str(stdout)):
             logger.error("Cluster modification failed, killing the execution")
             raise Exception(stdout)
         logger.debug("Cluster modification succeeded")
@@ -0,0 +1,140 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+This class contains methods for detached jobs. Long running commands (restore of backup, rebalance) are started in
+their own session on the host, so they don't hold the remote shell open and keep running when the connection is lost.
+Output, error and exit status of a job are written to files in the folder of the job, the plugin polls the state of
+the job with short commands and reads its output incrementally. Jobs are named, a job which is still running when
+the operation is retried is attached again instead of being started twice.
+This is child class of Resource and parent class of CouchbaseOperation
+"""
+#######################################################################################################################
+import logging
+import time
+
+from utils import utilities
+from controller import helper_lib
+from controller.couchbase_lib._mixin_interface import MixinInterface
+from controller.resource_builder import Resource
+from db_commands.commands import CommandFactory
+from db_commands.constants import DELPHIX_HIDDEN_FOLDER, JOBS_FOLDER, JOB_ATTACHED, JOB_POLL_INTERVAL, \
+    JOB_UNREACHABLE_TIMEOUT, JOB_STDERR_DELIMITER
+from dlpx.virtualization.platform.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+# job states reported by job_status, "missing" - folder of the job doesn't exist
+JOB_STARTING = "starting"
+JOB_RUNNING = "running"
+JOB_EXITED = "exited"
+JOB_LOST = "lost"
+JOB_MISSING = "missing"
+
+
+class _JobMixin(Resource, MixinInterface):
+
+    def __init__(self, builder):
+        super(_JobMixin, self).__init__(builder)
+
+    @MixinInterface.check_attribute_error
+    def generate_environment_map(self):
+        env = {'jobs_path': "{}/{}/{}".format(self.parameters.mount_path, DELPHIX_HIDDEN_FOLDER, JOBS_FOLDER)}
+        # MixinInterface.read_map(env)
+        return env
+
+    def job_path(self, job_name):
+        return "{}/{}".format(_JobMixin.generate_environment_map(self)['jobs_path'], job_name)
+
+    def job_state(self, job_name, offset=0):
+        """
+        :param offset: bytes of stdout of the job already read
+        :return: tuple of state, exit code (None until the job exits), size of stdout, stdout written since offset
+        and stderr of exited job
+        """
+        command = CommandFactory.job_status(self.job_path(job_name), offset)
+        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, category="job_status")
+        if exit_code != 0:
+            logger.debug("Job {} is not found: {}".format(job_name, stderr))
+            return JOB_MISSING, None, 0, "", ""
+        status, _, output = stdout.partition("\n")
+        output, _, error = output.partition(JOB_STDERR_DELIMITER)
+        fields = status.split()
+        job_exit_code = int(fields[1]) if fields[0] == JOB_EXITED else None
+        return fields[0], job_exit_code, int(fields[-1]), output.strip(), error.strip()
+
+    def start_job(self, job_name, command, environment_vars=None):
+        """
+        Start command as detached job, job of the same name which is still running is attached again
+        :param environment_vars: variables of the command (passwords), they are inherited by the job
+        """
+        stdout, stderr, exit_code = utilities.execute_bash(
+            self.connection, CommandFactory.job_start(self.job_path(job_name), command),
+            environment_vars=environment_vars, category="job_start")
+        if exit_code != 0:
+            raise UserError("Unable to start job {}".format(job_name),
+                            "Check that the mount path is writable by the environment user",
+                            "stdout: {}, stderr: {}".format(stdout, stderr))
+        if stdout == JOB_ATTACHED:
+            logger.info("Job {} is running, waiting for it instead of starting it again".format(job_name))
+        else:
+            logger.debug("Job {} started".format(job_name))
+
+    def wait_for_job(self, job_name, timeout=None, monitor=None):
+        """
+        Poll the job until it exits, new output of the job is logged in every round. Failed checks (lost connection
+        to the host) are retried for JOB_UNREACHABLE_TIMEOUT seconds, the job keeps running meanwhile.
+        :param timeout: seconds, None - no limit
+        :param monitor: function called after every check of the running job, e.g. to report its progress, its
+        exceptions are logged and ignored
+        :return: list of output, error string and exit code of the job
+        :raise UserError: job was killed or removed, or it's still running after timeout
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        offset = 0
+        output = []
+        failing_since = None
+        while True:
+            helper_lib.sleepForSecond(JOB_POLL_INTERVAL)
+            try:
+                state, exit_code, size, new_output, error = self.job_state(job_name, offset)
+                failing_since = None
+            except Exception as err:
+                if failing_since is None:
+                    failing_since = time.time()
+                elif time.time() - failing_since > JOB_UNREACHABLE_TIMEOUT:
+                    raise UserError("Unable to check job {} for {} seconds".format(job_name, JOB_UNREACHABLE_TIMEOUT),
+                                    "Job keeps running on the host, run the operation again when the host is "
+                                    "reachable, it waits for the running job", str(err))
+                logger.warn("Unable to check job {}, it will be checked again: {}".format(job_name, err))
+                continue
+            if size > offset:
+                output.append(new_output)
+                for line in new_output.splitlines():
+                    logger.info("{}: {}".format(job_name, line))
+                offset = size
+            if state == JOB_EXITED:
+                break
+            if state in (JOB_LOST, JOB_MISSING):
+                raise UserError("Job {} ended without exit status".format(job_name),
+                                "Check if the host was restarted or the job was killed and run the operation again",
+                                "\n".join(output))
+            if end_time is not None and time.time() > end_time:
+                raise UserError("Job {} is still running after {} seconds".format(job_name, timeout),
+                                "Check the job on the host in {}".format(self.job_path(job_name)), "\n".join(output))
+            if monitor is not None:
+                try:
+                    monitor()
+                except Exception as err:
+                    # monitor only reports, the job is waited for even if the report fails
+                    logger.warn("Monitor of job {} failed: {}".format(job_name, err))
+
+        logger.debug("Job {} exited with {}".format(job_name, exit_code))
+        return ["\n".join(output), error, exit_code]
+
+    def run_job(self, job_name, command, environment_vars=None, timeout=None, monitor=None):
+        """ start command as detached job (or attach the running one) and wait until it exits """
+        self.start_job(job_name, command, environment_vars)
+        return self.wait_for_job(job_name, timeout, monitor)
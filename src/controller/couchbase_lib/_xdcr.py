@@ -15,6 +15,7 @@ from controller import helper_lib
 from db_commands.commands import CommandFactory
 from controller.couchbase_lib._mixin_interface import MixinInterface
 from controller.resource_builder import Resource
+from controller.operation_metadata import REMOTE_CLUSTERS, STREAM_IDS, HOST_IPS
 from dlpx.virtualization.platform.exceptions import UserError
 from db_commands.constants import ENV_VAR_KEY
 
@@ -39,13 +40,23 @@ class _XDCrMixin(Resource, MixinInterface):
         # MixinInterface.read_map(env)
         return env
 
+    def __xdcr_command_arguments(self):
+        """
+        Arguments of XDCR commands for run_couchbase_command. Commands run against source cluster,
+        staging cluster is a remote cluster reference.
+        """
+        return {'source_hostname': self.source_config.couchbase_src_host,
+                'source_port': self.source_config.couchbase_src_port,
+                'source_username': self.parameters.xdcr_admin,
+                'source_password': self.parameters.xdcr_admin_password,
+                'hostname': self.connection.environment.host.name,
+                'password': self.parameters.couchbase_admin_password}
+
     def xdcr_delete(self, cluster_name):
         logger.debug("XDCR deletion for cluster_name {} has started ".format(cluster_name))
-        kwargs = {ENV_VAR_KEY: {'source_password': self.parameters.xdcr_admin_password,
-                                'password': self.parameters.couchbase_admin_password}}
-        env = _XDCrMixin.generate_environment_map(self)
-        cmd = CommandFactory.xdcr_delete(cluster_name=cluster_name, **env)
-        stdout, stderr, exit_code = utilities.execute_bash(self.connection, cmd, **kwargs)
+        stdout, stderr, exit_code = self.run_couchbase_command('xdcr_delete', cluster_name=cluster_name,
+                                                               **self.__xdcr_command_arguments())
+        self.metadata.invalidate(REMOTE_CLUSTERS, STREAM_IDS)
         if exit_code != 0:
             logger.error("XDCR Setup deletion failed")
             if stdout:
@@ -58,21 +69,20 @@ class _XDCrMixin(Resource, MixinInterface):
 
     def xdcr_setup(self):
         logger.debug("Started XDCR set up ...")
-        kwargs = {ENV_VAR_KEY: {'source_password': self.parameters.xdcr_admin_password,
-                                'password': self.parameters.couchbase_admin_password}}
-        env = _XDCrMixin.generate_environment_map(self)
-        cmd = CommandFactory.xdcr_setup(cluster_name=self.parameters.stg_cluster_name, **env)
-        stdout, stderr, exit_code = utilities.execute_bash(self.connection, cmd, **kwargs)
+        stdout, stderr, exit_code = self.run_couchbase_command('xdcr_setup',
+                                                               cluster_name=self.parameters.stg_cluster_name,
+                                                               **self.__xdcr_command_arguments())
+        self.metadata.invalidate(REMOTE_CLUSTERS, STREAM_IDS)
         helper_lib.sleepForSecond(3)
 
     def xdcr_replicate(self, src, tgt):
         try:
             logger.debug("Started XDCR replication for bucket {}".format(src))
-            kwargs = {ENV_VAR_KEY: {'source_password': self.parameters.xdcr_admin_password}}
-            env = _XDCrMixin.generate_environment_map(self)
-            cmd = CommandFactory.xdcr_replicate(source_bucket_name=src, target_bucket_name=tgt,
-                                                cluster_name=self.parameters.stg_cluster_name, **env)
-            stdout, stderr, exit_code = utilities.execute_bash(self.connection, cmd, **kwargs)
+            stdout, stderr, exit_code = self.run_couchbase_command('xdcr_replicate', source_bucket_name=src,
+                                                                   target_bucket_name=tgt,
+                                                                   cluster_name=self.parameters.stg_cluster_name,
+                                                                   **self.__xdcr_command_arguments())
+            self.metadata.invalidate(STREAM_IDS)
             if exit_code != 0:
                 logger.debug("XDCR replication create failed")
                 raise Exception(stdout)
@@ -86,44 +96,16 @@ class _XDCrMixin(Resource, MixinInterface):
         # False for string
         logger.debug("Finding the replication uuid through host name")
         is_ip_or_string = False
-        kwargs = {ENV_VAR_KEY: {}}
         cluster_name = self.parameters.stg_cluster_name
 
-        stdout, stderr, exit_code = self.run_couchbase_command('get_replication_uuid', 
-                                                               source_hostname=self.source_config.couchbase_src_host,
-                                                               source_port=self.source_config.couchbase_src_port, 
-                                                               source_username=self.parameters.xdcr_admin,
-                                                               source_password=self.parameters.xdcr_admin_password
-                                                              )
-
-
-        if exit_code != 0 or stdout is None or stdout == "":
-            logger.debug("No Replication ID identified")
-            return None
-
         try:
+            clusters = self._remote_cluster_references()
+            if clusters is None:
+                logger.debug("No Replication ID identified")
+                return None
 
-            logger.debug("xdcr remote references : {}".format(stdout))
             stg_hostname = self.connection.environment.host.name
             logger.debug("Environment hostname {}".format(stg_hostname))
-            # it can have more than single IP address
-            host_ips = self.get_ip()
-            # conver output into variables
-            clusters = {}
-            l = stdout.split("\n")
-            while l:
-                line = l.pop(0)
-                g = re.match(r"\s*cluster name:\s(\S*)", line)
-                if g:
-                    xdrc_cluster_name = g.group(1)
-                    uuid = re.match(r"\s*uuid:\s(\S*)", l.pop(0)).group(1)
-                    hostname = re.match(r"\s*host name:\s(\S*):(\d*)", l.pop(0)).group(1)
-                    user_name = l.pop(0)
-                    uri = l.pop(0)
-                    clusters[xdrc_cluster_name.lower()] = {
-                        "hostname": hostname,
-                        "uuid": uuid
-                    }
 
             # check if a cluster name is really connected to staging - just in case
 
@@ -144,6 +126,8 @@ class _XDCrMixin(Resource, MixinInterface):
 
                     logger.debug(clusters[cluster_name.lower()])
 
+                    # it can have more than single IP address
+                    host_ips = self.get_ip()
 
                     if clusters[cluster_name.lower()]["hostname"] in host_ips:
                         # ip matched
@@ -169,14 +153,50 @@ class _XDCrMixin(Resource, MixinInterface):
             logger.warn("UUID is None. Not able to find any cluster")
             return None
 
+    def _remote_cluster_references(self):
+        """
+        Remote cluster references defined on the source. Output is read once per operation,
+        xdcr setup and delete clear it.
+        :return: dict cluster name (lower case) -> hostname and uuid or None if source returns nothing
+        """
+        return self.metadata.get(REMOTE_CLUSTERS, self.__read_remote_cluster_references)
+
+    def __read_remote_cluster_references(self):
+        stdout, stderr, exit_code = self.run_couchbase_command('get_replication_uuid', 
+                                                               source_hostname=self.source_config.couchbase_src_host,
+                                                               source_port=self.source_config.couchbase_src_port, 
+                                                               source_username=self.parameters.xdcr_admin,
+                                                               source_password=self.parameters.xdcr_admin_password
+                                                              )
+
+        if exit_code != 0 or stdout is None or stdout == "":
+            return None
+
+        logger.debug("xdcr remote references : {}".format(stdout))
+        clusters = helper_lib.parse_remote_clusters(stdout)
+        return clusters
+
 
     def get_stream_id(self):
         logger.debug("Finding the stream id for provided cluster name")
         uuid = self.get_replication_uuid()
         if uuid is None:
             return None
+
+        stream_ids = self.metadata.get(STREAM_IDS, self.__read_stream_ids)
+        logger.debug(stream_ids)
+        logger.debug(uuid)
+        if stream_ids is None:
+            logger.debug("No stream ID identified")
+            return None
+        else:
+            stream_id = [ x for x in stream_ids if x.startswith(uuid) ]
+            logger.debug("Stream id found: {}".format(stream_id))
+            return stream_id
+
+    def __read_stream_ids(self):
         cluster_name = self.parameters.stg_cluster_name
-        
+
         stdout, stderr, exit_code = self.run_couchbase_command('get_stream_id', 
                                                                source_hostname=self.source_config.couchbase_src_host,
                                                                source_port=self.source_config.couchbase_src_port, 
@@ -184,16 +204,9 @@ class _XDCrMixin(Resource, MixinInterface):
                                                                source_password=self.parameters.xdcr_admin_password,
                                                                cluster_name=cluster_name
                                                               )
-
-        logger.debug(stdout)
-        logger.debug(uuid)
         if exit_code != 0 or stdout is None or stdout == "":
-            logger.debug("No stream ID identified")
             return None
-        else:
-            stream_id = re.findall(r"(?<=stream id:\s){}.*".format(uuid), stdout)
-            logger.debug("Stream id found: {}".format(stream_id))
-            return stream_id
+        return helper_lib.parse_stream_ids(stdout)
 
 
     def delete_replication(self):
@@ -214,6 +227,7 @@ class _XDCrMixin(Resource, MixinInterface):
                                                                 cluster_name=cluster_name,
                                                                 id=id
                                                                 )
+            self.metadata.invalidate(STREAM_IDS)
 
             if exit_code != 0:
                 logger.warn("stream_id: {} deletion failed".format(id))
@@ -222,34 +236,44 @@ class _XDCrMixin(Resource, MixinInterface):
         return True, cluster_name
 
     def get_ip(self):
+        return list(self.metadata.get(HOST_IPS, self.__read_ip))
+
+    def __read_ip(self):
         cmd = CommandFactory.get_ip_of_hostname()
-        stdout, stderr, exit_code = utilities.execute_bash(self.connection, cmd)
+        stdout, stderr, exit_code = utilities.execute_bash(self.connection, cmd, category="get_ip_of_hostname")
         logger.debug("IP is {}".format(stdout))
         return stdout.split()
 
 
-    def setup_replication(self):
+    def setup_remote_cluster(self):
         uuid = self.get_replication_uuid()
-        
+
         if uuid is None:
             logger.info("Setting up XDRC remote cluster")
             self.xdcr_setup()
-        
 
+    def replicated_buckets(self):
+        """
+        :return: names of source buckets with replication stream to staging cluster
+        """
         streams_id = self.get_stream_id()
 
         if streams_id is not None:
-            alredy_replicated_buckets = [ m.group(1) for m in ( re.match(r'\S*/(\S*)/\S*', x) for x in streams_id ) if m ]
+            return [ m.group(1) for m in ( re.match(r'\S*/(\S*)/\S*', x) for x in streams_id ) if m ]
         else:
-            alredy_replicated_buckets = []
+            return []
+
+    def setup_replication(self):
+        self.setup_remote_cluster()
+
+        alredy_replicated_buckets = self.replicated_buckets()
 
         config_setting = self.staged_source.parameters.config_settings_prov
 
         if len(config_setting) > 0:
             bucket_list = [ config_bucket["bucketName"] for config_bucket in config_setting ]
         else:
-            bucket_details_source = self.source_bucket_list()
-            bucket_list = helper_lib.filter_bucket_name_from_json(bucket_details_source)
+            bucket_list = self.source_bucket_catalog().names_with_ram()
 
         logger.debug("Bucket list to create replication for")
         logger.debug(bucket_list)
@@ -261,4 +285,4 @@ class _XDCrMixin(Resource, MixinInterface):
                 logger.debug("Creating replication for {}".format(bkt_name))
                 self.xdcr_replicate(bkt_name, bkt_name)
             else:
-                logger.debug("Bucket {} replication already configured".format(bkt_name))
\ No newline at end of file
+                logger.debug("Bucket {} replication already configured".format(bkt_name))
@@ -5,7 +5,7 @@
 #######################################################################################################################
 """
 This class defines methods for couchbase operations. Parent classes are: _BucketMixin, _ClusterMixin,
- _XDCrMixin, _CBBackupMixin. Modules name is explaining about the operations for which module is created for.
+ _XDCrMixin, _CBBackupMixin, _JobMixin. Modules name is explaining about the operations for which module is created for.
 The constructor of this class expects a `builder` on which each database operation will be performed
 Commands are defined for each method in module commands.py. To perform any delphix operation we need to create
 the object of this class. This class is single connector between other modules and `controller` package.
@@ -25,13 +25,18 @@ from internal_exceptions.database_exceptions import CouchbaseServicesError
 from utils import utilities
 from controller.resource_builder import Resource
 from controller import helper_lib
+from controller.operation_metadata import OperationMetadata, SOURCE_BUCKETS, STAGED_BUCKETS, BACKUP_DATE
 from controller.couchbase_lib._bucket import _BucketMixin
 from controller.couchbase_lib._cluster import _ClusterMixin
 from controller.couchbase_lib._xdcr import _XDCrMixin
 from controller.couchbase_lib._cb_backup import _CBBackupMixin
+from controller.couchbase_lib._job import _JobMixin
 from db_commands.commands import CommandFactory
-from db_commands.constants import ENV_VAR_KEY, StatusIsActive, DELPHIX_HIDDEN_FOLDER, CONFIG_FILE_NAME
-from controller.helper_lib import remap_bucket_json
+from db_commands.rest_commands import RestCommand
+from db_commands.constants import ENV_VAR_KEY, StatusIsActive, DELPHIX_HIDDEN_FOLDER, CONFIG_FILE_NAME, \
+    REBALANCE_JOB_TIMEOUT
+from controller.bucket_catalog import BucketCatalog
+from controller.placement import node_services
 import time
 from db_commands import constants
 
@@ -40,7 +45,7 @@ from dlpx.virtualization.platform.exceptions import UserError
 logger = logging.getLogger(__name__)
 
 
-class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin):
+class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin, _JobMixin):
 
     def __init__(self, builder, node_connection=None):
         """
@@ -59,6 +64,8 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         self.__need_sudo = helper_lib.need_sudo(self.connection, self.repository.uid, self.repository.gid)
         self.__uid = self.repository.uid
         self.__gid = self.repository.gid
+        # metadata read from clusters during this operation
+        self.metadata = OperationMetadata()
 
 
     @property
@@ -74,9 +81,85 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         return self.__gid
 
 
-    def run_couchbase_command(self, couchbase_command, **kwargs):
+    def run_couchbase_command(self, couchbase_command, backend=None, **kwargs):
+        """
+        Run Couchbase command by couchbase-cli or by REST API
+        :param couchbase_command: name of command from CommandFactory / RestCommand
+        :param backend: COUCHBASE_REST or COUCHBASE_CLI. By default commands from REST_DEFAULT_COMMANDS are sent
+        as REST calls, if REST call fails with transport error or not supported endpoint, command is executed by
+        couchbase-cli
+        :return: list of output of command, error string, exit code
+        """
         logger.debug('run_couchbase_command')
         logger.debug('couchbase_command: {}'.format(couchbase_command))
+        env, command_kwargs = self.__couchbase_command_arguments(kwargs)
+
+        if backend is None:
+            if couchbase_command in constants.REST_DEFAULT_COMMANDS:
+                backend = constants.COUCHBASE_REST
+            else:
+                backend = constants.COUCHBASE_CLI
+
+        if backend == constants.COUCHBASE_REST and hasattr(RestCommand, couchbase_command):
+            request = getattr(RestCommand, couchbase_command)(**command_kwargs)
+            result = self.__run_rest_requests([request], env, [couchbase_command])[0]
+            if result is not None:
+                return result
+            logger.debug("REST call for {} not completed, using couchbase-cli".format(couchbase_command))
+
+        method_to_call = getattr(CommandFactory, couchbase_command)
+        command = method_to_call(**command_kwargs)
+
+        logger.debug("couchbase command to run: {}".format(command))
+        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, environment_vars=env,
+                                                           category=couchbase_command)
+        return [stdout, stderr, exit_code]
+
+    def run_couchbase_job(self, job_name, couchbase_command, timeout=None, monitor=None, **kwargs):
+        """
+        Run couchbase-cli command as detached job, see _JobMixin.run_job
+        :param job_name: name of the job, running job of the same name is attached again
+        :return: list of output of command, error string, exit code
+        """
+        env, command_kwargs = self.__couchbase_command_arguments(kwargs)
+        command = getattr(CommandFactory, couchbase_command)(**command_kwargs)
+        logger.debug("couchbase command to run as job {}: {}".format(job_name, command))
+        return self.run_job(job_name, command, environment_vars=env, timeout=timeout, monitor=monitor)
+
+    def run_couchbase_rest_batch(self, couchbase_commands, **kwargs):
+        """
+        Run list of Couchbase commands as REST calls using one remote curl invocation.
+        All commands share credentials and connection arguments from kwargs. Commands for which REST call
+        fails with transport error or not supported endpoint are executed one by one by couchbase-cli, REST only
+        commands fail.
+        :param couchbase_commands: list of tuples (command name, dict of command arguments)
+        :return: list of [output, error, exit code] for each command
+        """
+        env, command_kwargs = self.__couchbase_command_arguments(kwargs)
+        requests = []
+        for couchbase_command, arguments in couchbase_commands:
+            call_kwargs = dict(command_kwargs)
+            call_kwargs.update(arguments)
+            requests.append(getattr(RestCommand, couchbase_command)(**call_kwargs))
+
+        results = self.__run_rest_requests(requests, env, [name for name, _ in couchbase_commands])
+        for i, (couchbase_command, arguments) in enumerate(couchbase_commands):
+            if results[i] is None and not hasattr(CommandFactory, couchbase_command):
+                results[i] = ["", "REST call for {} not completed".format(couchbase_command), 1]
+            elif results[i] is None:
+                logger.debug("REST call for {} not completed, using couchbase-cli".format(couchbase_command))
+                call_kwargs = dict(kwargs)
+                call_kwargs.update(arguments)
+                results[i] = self.run_couchbase_command(couchbase_command, backend=constants.COUCHBASE_CLI,
+                                                        **call_kwargs)
+        return results
+
+    def __couchbase_command_arguments(self, kwargs):
+        """
+        Split arguments of Couchbase command into environment variables (passwords) and command arguments
+        with defaults for connection to this cluster
+        """
+        kwargs = dict(kwargs)
         if "password" in kwargs:
             password = kwargs.pop('password')
         else:
@@ -105,19 +188,42 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
 
         new_kwargs = {k: v for k, v in kwargs.items() if k not in autoparams}
 
-        method_to_call = getattr(CommandFactory, couchbase_command)
-        command = method_to_call(shell_path=self.repository.cb_shell_path,
-                                 install_path=self.repository.cb_install_path,
-                                 username=username,
-                                 port=self.parameters.couchbase_port,
-                                 sudo=self.need_sudo,
-                                 uid=self.uid,
-                                 hostname=hostname,
-                                 **new_kwargs)
-
-        logger.debug("couchbase command to run: {}".format(command))
-        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, environment_vars=env)
-        return [stdout, stderr, exit_code]
+        command_kwargs = dict(shell_path=self.repository.cb_shell_path,
+                              install_path=self.repository.cb_install_path,
+                              username=username,
+                              port=self.parameters.couchbase_port,
+                              sudo=self.need_sudo,
+                              uid=self.uid,
+                              hostname=hostname,
+                              **new_kwargs)
+        return env, command_kwargs
+
+    def __run_rest_requests(self, requests, env, names):
+        """
+        Send REST requests by one curl invocation
+        :param names: names of commands, used as the category of the curl invocation in instrumentation
+        :return: list of [output, error, exit code] for each request or None if request has to be repeated
+        by couchbase-cli
+        """
+        command = RestCommand.curl_batch(requests)
+        logger.debug("couchbase REST requests to run: {}".format(requests))
+        category = "rest:" + "+".join(sorted(set(names)))
+        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, environment_vars=env,
+                                                           category=category)
+        if exit_code == 127:
+            logger.debug("curl is not available: {}".format(stderr))
+            return [None] * len(requests)
+
+        results = []
+        for request, (body, http_code) in zip(requests, RestCommand.parse_batch_output(stdout, len(requests))):
+            logger.debug("{} - HTTP code: {}".format(request, http_code))
+            if http_code in request.fallback_codes:
+                results.append(None)
+            elif http_code.startswith("2"):
+                results.append([body, stderr, 0])
+            else:
+                results.append([body, stderr, 1])
+        return results
 
 
     def run_os_command(self, os_command, **kwargs):
@@ -130,7 +236,7 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
                                  **kwargs)
 
         logger.debug("os command to run: {}".format(command))
-        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command)
+        stdout, stderr, exit_code = utilities.execute_bash(self.connection, command, category=os_command)
         return [stdout, stderr, exit_code]
 
 
@@ -317,18 +423,18 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
                 multinode = False
 
             
-            for line in server_info.split("\n"):
-                logger.debug("Checking line: {}".format(line))
-                if read_ip_file in line:
+            for node in helper_lib.parse_server_list(server_info):
+                logger.debug("Checking node: {}".format(node))
+                if read_ip_file in node["hostname"]:
                     logger.debug("Checking IP: {}".format(read_ip_file))
-                    if "unhealthy" in line:
+                    if node["status"] == "unhealthy":
                         logger.error("We have unhealthy active node")
                         return Status.INACTIVE
-                    if "healthy" in line:
+                    if node["status"] == "healthy":
                         logger.debug("We have healthy active node")
                         return Status.ACTIVE
             
-                    if multinode and "warmup" in line:
+                    if multinode and node["status"] == "warmup":
                         logger.debug("We have starting mode in multinode cluster")
                         return Status.ACTIVE
 
@@ -413,6 +519,16 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         numReplicas
         :return:
         """
+        return self.source_bucket_catalog().to_list()
+
+    def source_bucket_catalog(self):
+        """
+        Buckets of source server as BucketCatalog. Source buckets are read once per operation,
+        returned catalog is shared, don't modify it
+        """
+        return self.metadata.get(SOURCE_BUCKETS, self.__read_source_bucket_catalog)
+
+    def __read_source_bucket_catalog(self):
         # See the bucket list on source server
         logger.debug("Collecting bucket list information present on source server ")
 
@@ -431,21 +547,9 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
                                                 password=self.staged_source.parameters.xdcr_admin_password
                                             )
 
-
-        if bucket_list == "[]" or bucket_list is None:
-            return []
-        else:
-            logger.debug("clean up json")
-            bucket_list = bucket_list.replace("u'","'")
-            bucket_list = bucket_list.replace("'", "\"")
-            bucket_list = bucket_list.replace("True", "\"True\"")
-            bucket_list = bucket_list.replace("False", "\"False\"")
-            logger.debug("parse json")
-            bucket_list_dict = json.loads(bucket_list)
-            bucket_list_dict = list(map(helper_lib.remap_bucket_json, bucket_list_dict))
-
-        logger.debug("Source Bucket Information {}".format(bucket_list_dict))
-        return bucket_list_dict
+        catalog = BucketCatalog.parse(bucket_list)
+        logger.debug("Source Bucket Information {}".format(catalog))
+        return catalog
 
 
     def get_backup_date(self, x):
@@ -457,6 +561,9 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
             return ''
 
     def source_bucket_list_offline(self):
+        return self.source_bucket_catalog_offline().to_list()
+
+    def source_bucket_catalog_offline(self):
         """
         This function will be used in CB backup manager. It will return the same output as by
         source_bucket_list method. To avoid source/production server dependency this function will be used.
@@ -468,7 +575,7 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         From here all source bucket list information we can fetch and other related data of this bucket should be placed
         at backup location.
         :param filename: filename(couchbase_src_bucket_info.cfg) where bucket information is kept.
-        :return: bucket list information
+        :return: bucket list information as BucketCatalog
         """
 
 
@@ -494,10 +601,11 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         date_list.sort()
         logger.debug("date list: {}".format(date_list))
         files_to_process = [ x for x in backup_list if date_list[-1] in x ]
+        self.metadata.put(BACKUP_DATE, date_list[-1])
 
         logger.debug(files_to_process)
 
-        bucket_list_dict = []
+        buckets = []
 
         for f in files_to_process:
             # command = CommandFactory.cat(f, self.need_sudo, self.uid)
@@ -511,8 +619,7 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
 
 
             logger.debug(bucket_file_content)
-            bucket_json = json.loads(bucket_file_content)
-            bucket_list_dict.append(remap_bucket_json(bucket_json))
+            buckets.append(json.loads(bucket_file_content))
 
 
         # command = CommandFactory.read_file(filename)
@@ -520,8 +627,17 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         # if bucket_list == "" or bucket_list is None:
         #     return []
         # bucket_list = bucket_list.split("\n")
-        logger.debug("Bucket search output: {}".format(bucket_list_dict))
-        return bucket_list_dict
+        catalog = BucketCatalog.from_json(buckets)
+        logger.debug("Bucket search output: {}".format(catalog))
+        return catalog
+
+    def latest_backup_date(self):
+        """
+        :return: date of the latest backup in backup repository, the one restored by cb_backup_full
+        """
+        if BACKUP_DATE not in self.metadata:
+            self.source_bucket_catalog_offline()
+        return self.metadata.get(BACKUP_DATE, lambda: "")
 
     def node_init(self, nodeno=1):
         """
@@ -532,7 +648,7 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
 
         command_output, std_err, exit_code = self.run_couchbase_command(
                                                 couchbase_command='node_init',
-                                                data_path="{}/data_{}".format(self.parameters.mount_path, nodeno)
+                                                data_path=self.data_path(nodeno)
                                             )
 
         # kwargs = {ENV_VAR_KEY: {'password': self.parameters.couchbase_admin_password}}
@@ -543,6 +659,16 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
 
         logger.debug("Command Output {} ".format(command_output))
 
+    def data_path(self, nodeno=1):
+        """
+        data / index path of node on the mount point. Additional staging nodes don't mount staging file system, they
+        leave the cluster before every snapshot, their data is kept in data directory of Couchbase on the node.
+        """
+        if self.dSource and nodeno > 1:
+            return "{}/../var/lib/couchbase/data".format(
+                helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path))
+        return "{}/data_{}".format(self.parameters.mount_path, nodeno)
+
     def get_config_directory(self):
         """
         Hidden directory path inside mount directory will be returned. which is created in method create_config_dir
@@ -620,6 +746,32 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
                 indexes.append(i['definition'].replace('defer_build":true','defer_build":false'))
         return indexes
 
+    def staging_indexes(self):
+        """
+        Indexes defined on staging cluster
+        :return: list of dicts with keys bucket, indexName, definition
+        """
+        command_output, std_err, exit_code = self.run_couchbase_command(
+                                    couchbase_command='get_indexes_name',
+                                    hostname=self.connection.environment.host.name
+                                )
+        try:
+            return [{'bucket': i['bucket'], 'indexName': i['indexName'], 'definition': i['definition']}
+                    for i in json.loads(command_output)['indexes']]
+        except Exception as e:
+            logger.debug("Unable to read indexes of staging: {} {}".format(str(e), std_err))
+            return []
+
+    def drop_index(self, bucket_name, index_name):
+        command_output, std_err, exit_code = self.run_couchbase_command(
+                                    couchbase_command='drop_index',
+                                    base_path=helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path),
+                                    bucket_name=bucket_name,
+                                    index_name=index_name
+                                )
+        logger.debug("command_output is {}".format(command_output))
+        return command_output
+
     # Defined for future updates
     def build_index(self, index_def):
         command_output, std_err, exit_code = self.run_couchbase_command(
@@ -670,6 +822,20 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
             except Exception as e:
                 logger.debug(str(e))
 
+    def unbuilt_indexes(self):
+        """
+        Indexes not online yet, used by ingestion pipeline to check index builds of every bucket by one query
+        :return: dict bucket name -> number of indexes not online, None if the query failed
+        """
+        command_output, std_err, exit_code = self.run_couchbase_command(
+                                    couchbase_command='check_index_build_per_bucket',
+                                    base_path=helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path)
+                                )
+        try:
+            return {row['bucket']: row['unbuilt'] for row in json.loads(command_output)['results']}
+        except Exception as e:
+            logger.debug("Unable to read index build state: {} {}".format(str(e), std_err))
+            return None
 
 
 
@@ -783,7 +949,8 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
                                                 couchbase_command='get_server_list',
                                                 hostname=self.connection.environment.host.name)
 
-        if "healthy active" in command_output:
+        nodes = helper_lib.parse_server_list(command_output)
+        if any(node["status"] == "healthy" and node["clusterMembership"] == "active" for node in nodes):
             return True
         else:
             return False
@@ -795,7 +962,9 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         filename = os.path.join(self.get_config_directory(),"config.dat")
         cmd = CommandFactory.check_file(filename)
         logger.debug("check file cmd: {}".format(cmd))
-        command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd, callback_func=self.ignore_err) 
+        command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd,
+                                                                    callback_func=self.ignore_err,
+                                                                    category="check_file")
 
         if exit_code == 0 and "Found" in command_output: 
             return True
@@ -808,6 +977,7 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         # Error handling
 
         logger.debug("start restore_config")
+        self.metadata.invalidate(STAGED_BUCKETS)
 
         sourcedir = self.get_config_directory()
 
@@ -906,12 +1076,14 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
             newpath = "{}/data_{}".format(self.parameters.mount_path, nodeno)
             cmd = CommandFactory.sed(filename, 's|view_index_dir.*|view_index_dir={}|'.format(newpath), self.need_sudo, self.uid)
             logger.debug("sed config cmd: {}".format(cmd))
-            command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd) 
+            command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd,
+                                                                        category="sed")
             logger.debug("setting index paths - exit_code: {} stdout: {} std_err: {}".format(exit_code, command_output, std_err))
 
             cmd = CommandFactory.sed(filename, 's|database_dir.*|database_dir={}|'.format(newpath), self.need_sudo, self.uid)
             logger.debug("sed config cmd: {}".format(cmd))
-            command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd) 
+            command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd,
+                                                                        category="sed")
             logger.debug("setting data paths - exit_code: {} stdout: {} std_err: {}".format(exit_code, command_output, std_err))
         
 
@@ -922,17 +1094,21 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         # error handling
 
         logger.debug("start delete_config")
+        self.metadata.invalidate(STAGED_BUCKETS)
 
         filename = "{}/../var/lib/couchbase/config/config.dat".format(helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path))
 
         cmd = CommandFactory.check_file(filename, self.need_sudo, self.uid)
         logger.debug("check file cmd: {}".format(cmd))
-        command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd, callback_func=self.ignore_err) 
+        command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd,
+                                                                    callback_func=self.ignore_err,
+                                                                    category="check_file")
 
         if exit_code == 0 and "Found" in command_output: 
             cmd = CommandFactory.os_mv(filename, "{}.bak".format(filename), self.need_sudo, self.uid)
             logger.debug("rename config cmd: {}".format(cmd))
-            command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd) 
+            command_output, std_err, exit_code = utilities.execute_bash(self.connection, command_name=cmd,
+                                                                        category="os_mv")
             logger.debug("rename config.dat to bak - exit_code: {} stdout: {} std_err: {}".format(exit_code, command_output, std_err))
 
         filename = "{}/../etc/couchdb/local.ini".format(helper_lib.get_base_directory_of_given_path(self.repository.cb_shell_path))
@@ -981,6 +1157,10 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
     def start_node_bootstrap(self):
         logger.debug("start start_node_bootstrap")
         self.start_couchbase(no_wait=True)
+        self.wait_for_bootstrap()
+
+    def wait_for_bootstrap(self):
+        """ wait until node started without configuration is ready to be initialized """
         end_time = time.time() + 3660
         server_status = Status.INACTIVE
 
@@ -992,29 +1172,25 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
 
 
 
-    def addnode(self, nodeno, node_def):
+    def addnode(self, nodeno, node_def, rebalance=True, bootstrap=True):
+        """
+        Bootstrap this node and add it to the cluster of the primary node
+        :param rebalance: False if the cluster is rebalanced once after all nodes are added
+        :param bootstrap: False if the node was already started without configuration, e.g. together with other
+        nodes added to the cluster
+        """
         logger.debug("start addnode")
 
-
-        self.delete_config()
-
-        self.start_node_bootstrap()
+        if bootstrap:
+            self.delete_config()
+            self.start_node_bootstrap()
 
         self.node_init(nodeno)
 
 
         helper_lib.sleepForSecond(10)
 
-        services = [ 'data', 'index', 'query' ]
-
-        if "fts_service" in node_def and node_def["fts_service"] == True:
-            services.append('fts')
-
-        if "eventing_service" in node_def and node_def["eventing_service"] == True:
-            services.append('eventing')
-
-        if "analytics_service" in node_def and node_def["analytics_service"] == True:
-            services.append('analytics')
+        services = node_services(node_def)
 
         logger.debug("services to add: {}".format(services))
 
@@ -1025,12 +1201,7 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
         # logger.debug("host ip Output {} ".format(host_ip_output))
 
 
-        logger.debug("node host name / IP: {}".format(node_def["node_addr"]))
-
-        resolve_name_command = CommandFactory.resolve_name(hostname=node_def["node_addr"])
-        logger.debug("resolve_name_command command: {}".format(resolve_name_command))
-        resolve_name_output, std_err, exit_code = utilities.execute_bash(self.connection, resolve_name_command)
-        logger.debug("resolve_name_command Output {} ".format(resolve_name_output))
+        resolve_name_output = self.node_address(node_def)
 
         command_output, std_err, exit_code = self.run_couchbase_command(
                                                 couchbase_command='server_add',
@@ -1046,12 +1217,38 @@ class CouchbaseOperation(_BucketMixin, _ClusterMixin, _XDCrMixin, _CBBackupMixin
             logger.debug("Adding node error")
             raise UserError("Problem with adding node", "Check an output and fix problem before retrying to provision a VDB", "stdout: {} stderr:{}".format(command_output, std_err))
 
+        if rebalance:
+            self.rebalance()
 
+    def node_address(self, node_def):
+        """ IP address of node_addr of additional node as seen by this host """
+        logger.debug("node host name / IP: {}".format(node_def["node_addr"]))
 
+        resolve_name_command = CommandFactory.resolve_name(hostname=node_def["node_addr"])
+        logger.debug("resolve_name_command command: {}".format(resolve_name_command))
+        resolve_name_output, std_err, exit_code = utilities.execute_bash(self.connection, resolve_name_command,
+                                                                         category="resolve_name")
+        logger.debug("resolve_name_command Output {} ".format(resolve_name_output))
+        return resolve_name_output
 
+    def cluster_members(self):
+        """ addresses of healthy active nodes of the cluster """
         command_output, std_err, exit_code = self.run_couchbase_command(
+                                                couchbase_command='get_server_list',
+                                                hostname=self.connection.environment.host.name)
+        return [node["hostname"].rsplit(":", 1)[0] for node in helper_lib.parse_server_list(command_output)
+                if node["status"] == "healthy" and node["clusterMembership"] == "active"]
+
+    def rebalance(self, remove=()):
+        """
+        :param remove: addresses of nodes moved out of the cluster by this rebalance
+        """
+        command_output, std_err, exit_code = self.run_couchbase_job(
+                                                job_name='rebalance',
+                                                timeout=REBALANCE_JOB_TIMEOUT,
                                                 couchbase_command='rebalance',
-                                                hostname=self.connection.environment.host.name
+                                                hostname=self.connection.environment.host.name,
+                                                server_remove=','.join(remove)
                                              )
 
 
@@ -22,8 +22,10 @@ import time
 from datetime import datetime
 
 import db_commands
+from controller.bucket_catalog import BucketRecord
 from db_commands.commands import CommandFactory
-from db_commands.constants import DEFAULT_CB_BIN_PATH
+from db_commands.constants import DEFAULT_CB_BIN_PATH, REPOSITORY_CACHE_FILENAME
+from dlpx.virtualization.common import RemoteConnection, RemoteEnvironment, RemoteUser
 from dlpx.virtualization.platform.exceptions import UserError
 
 from dlpx.virtualization.platform import Status
@@ -42,7 +44,8 @@ def find_binary_path(source_connection):
     :return: Bin path defined in environment variable '$COUCHBASE_PATH'. If it is not defined then "/opt/couchbase/bin"
     """
     logger.debug("Finding Binary Path...")
-    binary_paths, std_err, exit_code = utilities.execute_bash(source_connection, CommandFactory.find_binary_path())
+    binary_paths, std_err, exit_code = utilities.execute_bash(source_connection, CommandFactory.find_binary_path(),
+                                                              category="find_binary_path")
     if binary_paths == "":
         logger.debug("Please verify COUCHBASE_PATH is defined. Checking at default location {}".format(DEFAULT_CB_BIN_PATH))
         binary_paths = DEFAULT_CB_BIN_PATH
@@ -52,67 +55,84 @@ def find_binary_path(source_connection):
     return binary_paths
 
 
-def find_shell_path(source_connection, binary_path):
+def find_repositories(source_connection):
     """
-    :param source_connection:Connection for the source environment
-    :param binary_path: Couchbase binary path
-    :return:path of cluster management utility: {couchbase-cli}
-    """
-    logger.debug("Finding Shell Path...")
-    shell_path, std_err, exit_code = utilities.execute_bash(source_connection,
-                                                            CommandFactory.find_shell_path(binary_path))
-    if shell_path == "":
-        message = "Shell path {}/couchbase-cli not found".format(binary_path)
-        raise RepositoryDiscoveryError(message)
-    return shell_path
-
-
-def find_install_path(source_connection, binary_path):
-    """
-
-    :param source_connection:Connection for the source environment
-    :param binary_path: Couchbase binary path
-    :return: path of couchbase-server, through which daemon processes can start in background
+    Probe every Couchbase installation listed in '$COUCHBASE_PATH' with a single remote command.
+    Installations with an unchanged couchbase-server binary (inode:size:uid:gid and the date printed by ls -ln) are
+    served from the discovery cache kept in the toolkit directory, others are probed and the cache is refreshed.
+    The date of ls has minute resolution (day for files older than six months), so a binary replaced within the same
+    minute by one of the same size and inode is served from the cache until the next change.
+    :param source_connection: Connection for the source environment
+    :return: list of dicts with keys binary_path, install_path, shell_path, version, uid, gid
     """
-    logger.debug("Finding install Path...")
-    install_path, std_err, exit_code = utilities.execute_bash(source_connection,
-                                                              CommandFactory.find_install_path(binary_path))
-    if install_path == "":
-        message = "Install path {}/couchbase-server not found".format(binary_path)
-        raise RepositoryDiscoveryError(message)
-    else:
-        logger.debug("couchbase-server found in directory {}".format(install_path))
-    return install_path
-
+    logger.debug("Probing Couchbase installations...")
+    std_out, std_err, exit_code = utilities.execute_bash(source_connection,
+                                                         CommandFactory.discover_repositories(
+                                                             DEFAULT_CB_BIN_PATH, REPOSITORY_CACHE_FILENAME),
+                                                         category="discover_repositories")
+    logger.debug("discovery probe output: {}".format(std_out))
+    installs = []
+    cache_file = ""
+    cached_count = 0
+    probed = 0
+    for line in std_out.splitlines():
+        if line.startswith("CACHE|"):
+            cache_file, cached_count = line.split("|", 2)[1:]
+            cached_count = int(cached_count.strip()) if cached_count.strip().isdigit() else 0
+        elif line.startswith("CACHED|"):
+            installs.append(json.loads(line[len("CACHED|"):]))
+        elif line.startswith("REPO|"):
+            binary_path, install_path, shell_path, version, uid, gid, fingerprint = line.split("|", 7)[1:]
+            if install_path == "":
+                raise RepositoryDiscoveryError("Install path {}/couchbase-server not found".format(binary_path))
+            if shell_path == "":
+                raise RepositoryDiscoveryError("Shell path {}/couchbase-cli not found".format(binary_path))
+            installs.append({
+                'binary_path': binary_path,
+                'install_path': install_path,
+                'shell_path': shell_path,
+                'version': parse_version(version),
+                'uid': int(uid) if uid.isdigit() else -1,
+                'gid': int(gid) if gid.isdigit() else -1,
+                'fingerprint': fingerprint
+            })
+            probed = probed + 1
+    logger.debug("Couchbase installations found: {} (probed: {})".format(installs, probed))
+    # installs without fingerprint are never cached, they don't count as entries missing from the cache
+    cacheable = len([install for install in installs if install['fingerprint'] != ""])
+    if cache_file and (probed > len(installs) - cacheable or cached_count != cacheable):
+        _save_repository_cache(source_connection, cache_file, installs)
+    return installs
+
+
+def _save_repository_cache(source_connection, cache_file, installs):
+    """ write discovery cache, one line per install: binary_path|install_path|shell_path|fingerprint|<json>"""
+    lines = []
+    for install in installs:
+        if install['fingerprint'] == "":
+            continue
+        key = "|".join([install['binary_path'], install['install_path'], install['shell_path'], install['fingerprint']])
+        lines.append("{}|{}".format(key, json.dumps(install, sort_keys=True)))
+    std_out, std_err, exit_code = utilities.execute_bash(source_connection,
+                                                         CommandFactory.write_text_file(cache_file, "\n".join(lines)),
+                                                         category="write_text_file")
+    if exit_code != 0:
+        # cache is only an optimization, next discovery will do a full probe again
+        logger.debug("Unable to save discovery cache {}: {}".format(cache_file, std_err))
 
-def find_version(source_connection, install_path):
-    """ return the couchbase version installed on the host"""
-    cb_version, std_err, exit_code = utilities.execute_bash(source_connection,
-                                                             CommandFactory.get_version(install_path))
-    version = re.search(r"\d.*$", cb_version).group()
-    logger.debug("Couchbase version installed {}".format(version))
-    return version
 
+def parse_version(version_output):
+    """ return the version number from 'couchbase-server --version' output"""
+    version = re.search(r"\d.*$", version_output)
+    if version is None:
+        raise RepositoryDiscoveryError("Unable to read Couchbase version from '{}'".format(version_output))
+    return version.group()
 
-def find_ids(source_connection, install_path):
-    """ return the couchbase uid and gid"""
-    std_out, std_err, exit_code = utilities.execute_bash(source_connection,
-                                                             CommandFactory.get_ids(install_path))
-    logger.debug("find ids output: {}".format(std_out))
-    ids = re.search(r"[-rwx.]+\s\d\s([\d]+)\s([\d]+).*", std_out)
-    if ids:
-        uid = int(ids.group(1))
-        gid = int(ids.group(2))
-    else:
-        uid = -1
-        gid = -1
-    logger.debug("Couchbase user uid {} gid {}".format(uid, gid))
-    return (uid, gid)
 
 def find_whoami(source_connection):
     """ return the user env id"""
     std_out, std_err, exit_code = utilities.execute_bash(source_connection,
-                                                             CommandFactory.whoami())
+                                                             CommandFactory.whoami(), category="whoami")
     logger.debug("find whoami output: {}".format(std_out))
     ids = re.search(r"uid=([\d]+).*gid=([\d]+)", std_out)
     if ids:
@@ -135,7 +155,8 @@ def need_sudo(source_connection, couchbase_uid, couchbase_gid):
 
 def is_instance_present_of_gosecrets(source_connection):
     """ check couchbase server is running or not"""
-    instance, stderr, exit_code = utilities.execute_bash(source_connection, CommandFactory.get_process())
+    instance, stderr, exit_code = utilities.execute_bash(source_connection, CommandFactory.get_process(),
+                                                         category="get_process")
     # return true if 'gosecrets' string is present in output of get_process
     return "gosecrets" in instance
 
@@ -162,24 +183,108 @@ def get_base_directory_of_given_path(binary_path):
 
 
 def remap_bucket_json(bucket):
-    output = {}
-    if 'bucketType' in bucket:
-        output['bucketType'] = bucket['bucketType']
-    if 'name' in bucket:
-        output['name'] = bucket['name']
-    if 'quota' in bucket and 'ram' in bucket['quota']:
-        output['ram'] = bucket['quota']['ram']
-    elif 'ramQuota' in bucket:
-        # this is in MB
-        output['ram'] = int(bucket['ramQuota']) * 1024 * 1024
-    else:
-        logger.debug('No memory in bucket - setting to default')
-        output['ram'] = 1024000
-    if 'compressionMode' in bucket:
-        output['compressionMode'] = bucket['compressionMode']
-    else:
-        output['compressionMode'] = None
-    return output
+    """ Keep only bucket fields used by plugin: name, bucketType, ram, compressionMode and stats """
+    return BucketRecord.from_json(bucket).to_json()
+
+
+def parse_server_list(server_list_output):
+    """
+    Parse list of cluster nodes from REST API /pools/default (JSON) or couchbase-cli server-list output.
+    :return: list of dicts with hostname, status and clusterMembership of each node
+    """
+    nodes = []
+    try:
+        pool = json.loads(server_list_output)
+        if isinstance(pool, dict):
+            for node in pool.get("nodes", []):
+                nodes.append({"hostname": node.get("hostname", ""), "status": node.get("status", ""),
+                              "clusterMembership": node.get("clusterMembership", "")})
+        return nodes
+    except ValueError:
+        pass
+    # ns_1@10.0.0.1 10.0.0.1:8091 healthy active
+    for line in server_list_output.split("\n"):
+        fields = line.split()
+        if len(fields) >= 4 and fields[0].startswith("ns_1@"):
+            nodes.append({"hostname": fields[1], "status": fields[2], "clusterMembership": fields[3]})
+    return nodes
+
+
+def parse_remote_clusters(remote_clusters_output):
+    """
+    Parse XDCR remote cluster references from REST API /pools/default/remoteClusters (JSON) or
+    couchbase-cli xdcr-setup --list output.
+    :return: dict cluster name (lower case) -> dict with hostname and uuid
+    """
+    clusters = {}
+    try:
+        for cluster in json.loads(remote_clusters_output):
+            if cluster.get("deleted"):
+                continue
+            clusters[cluster["name"].lower()] = {
+                "hostname": cluster["hostname"].rsplit(":", 1)[0],
+                "uuid": cluster["uuid"]
+            }
+        return clusters
+    except ValueError:
+        pass
+    l = remote_clusters_output.split("\n")
+    while l:
+        line = l.pop(0)
+        g = re.match(r"\s*cluster name:\s(\S*)", line)
+        if g:
+            xdrc_cluster_name = g.group(1)
+            uuid = re.match(r"\s*uuid:\s(\S*)", l.pop(0)).group(1)
+            hostname = re.match(r"\s*host name:\s(\S*):(\d*)", l.pop(0)).group(1)
+            user_name = l.pop(0)
+            uri = l.pop(0)
+            clusters[xdrc_cluster_name.lower()] = {
+                "hostname": hostname,
+                "uuid": uuid
+            }
+    return clusters
+
+
+def parse_stream_ids(replication_output):
+    """
+    Parse XDCR replication ids (remote uuid/source bucket/target bucket) from REST API /pools/default/tasks (JSON)
+    or couchbase-cli xdcr-replicate --list output.
+    """
+    try:
+        tasks = json.loads(replication_output)
+        return [task["id"] for task in tasks if task.get("type") == "xdcr" and "id" in task]
+    except ValueError:
+        return re.findall(r"(?<=stream id:\s)\S+", replication_output)
+
+
+def index_name(index_definition):
+    """ name of index from CREATE INDEX statement, unnamed primary index is #primary """
+    match = re.search(r"\bINDEX\s+`([^`]+)`", index_definition, re.IGNORECASE)
+    return match.group(1) if match else "#primary"
+
+
+def index_keyspace(index_definition):
+    """ keyspace (`bucket` or `bucket`.`scope`.`collection`) from CREATE INDEX / BUILD INDEX statement """
+    match = re.search(r"\bON\s+(`[^`]+`(?:\.`[^`]+`)*)", index_definition, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def is_create_index(index_definition):
+    return re.match(r"\s*CREATE\s", index_definition, re.IGNORECASE) is not None
+
+
+def deferred_index_definition(index_definition):
+    """
+    CREATE INDEX statement with defer_build set, so indexes of one keyspace can be built together by BUILD INDEX
+    """
+    match = re.search(r"\bWITH\s+(\{.*\})\s*$", index_definition, re.IGNORECASE | re.DOTALL)
+    if match is None:
+        return '{} WITH {{"defer_build":true}}'.format(index_definition.rstrip())
+    options = json.loads(match.group(1))
+    options["defer_build"] = True
+    return "{} WITH {}".format(index_definition[:match.start()].rstrip(),
+                               json.dumps(options, sort_keys=True, separators=(',', ':')))
+
 
 def get_all_bucket_list_with_size(bucket_output):
     """ 
@@ -310,7 +415,8 @@ def write_file(connection, content, filename):
     """Add given data into passed filename"""
     logger.debug("writing data {} in file {}".format(content,filename))
     try:
-        utilities.execute_bash(connection, CommandFactory.write_file(data=content, filename=filename))
+        utilities.execute_bash(connection, CommandFactory.write_file(data=content, filename=filename),
+                               category="write_file")
     except Exception as e:
         logger.debug("Failed to Write into file")
         raise FileIOError("Failed to Write into file ")
@@ -320,7 +426,8 @@ def write_file(connection, content, filename):
 def check_file_present(connection, config_file_path):
     """ return True if file is present else return False"""
     try:
-        stdout, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.check_file(config_file_path))
+        stdout, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.check_file(config_file_path),
+                                                           category="check_file")
         if stdout == "Found":
             logger.debug("file path exist {}".format(config_file_path))
             return True
@@ -332,7 +439,8 @@ def check_file_present(connection, config_file_path):
 def check_dir_present(connection, dir):
     """ return True if directory is present else return False"""
     try:
-        stdout, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.check_directory(dir))
+        stdout, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.check_directory(dir),
+                                                           category="check_directory")
         if stdout == "Found":
             logger.debug("dir path found {} ".format(dir))
             return True
@@ -346,14 +454,15 @@ def read_file(connection, filename):
     """read the file content and return the content"""
     logger.debug("Reading file {}".format(filename))
     command = CommandFactory.read_file(filename)
-    stdout, stderr, exit_code = utilities.execute_bash(connection, command)
+    stdout, stderr, exit_code = utilities.execute_bash(connection, command, category="read_file")
     return [stdout, stderr, exit_code]
 
 
 # delete file
 def delete_file(connection, filename):
     logger.debug("Deleting file {}".format(filename))
-    stdout, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.delete_file(filename))
+    stdout, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.delete_file(filename),
+                                                       category="delete_file")
     return [stdout, stderr, exit_code]
 
 
@@ -365,7 +474,7 @@ def get_snapshot_id():
 def unmount_file_system(rx_connection, path):
     """ unmount the file system which will use in cbbackup manager after post snapshot"""
     try:
-        utilities.execute_bash(rx_connection, CommandFactory.unmount_file_system(path))
+        utilities.execute_bash(rx_connection, CommandFactory.unmount_file_system(path), category="unmount_file_system")
     except Exception as err:
         logger.debug("error here {}".format(str(err)))
         raise UnmountFileSystemError(str(err))
@@ -395,7 +504,7 @@ def check_stale_mountpoint(connection, path):
 
 
 
-    output, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.df(path))
+    output, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.df(path), category="df")
     if exit_code != 0:
         if "No such file or directory" in stderr:
             # this is actually OK
@@ -412,7 +521,7 @@ def check_server_is_used(connection, path):
 
     ret = Status.INACTIVE
 
-    output, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.mount())
+    output, stderr, exit_code = utilities.execute_bash(connection, CommandFactory.mount(), category="mount")
     if exit_code != 0:
         logger.error("mount retured error")
         logger.error("stdout: {} stderr: {} exit_code: {}".format(output, stderr, exit_code))
@@ -443,10 +552,22 @@ def clean_stale_mountpoint(connection, path):
 
 
 
-    umount_std, umount_stderr, umount_exit_code = utilities.execute_bash(connection, CommandFactory.unmount_file_system(mount_path=path, options='-lf'))
+    command = CommandFactory.unmount_file_system(mount_path=path, options='-lf')
+    umount_std, umount_stderr, umount_exit_code = utilities.execute_bash(connection, command,
+                                                                         category="unmount_file_system")
     if umount_exit_code != 0:
         logger.error("Problem with cleaning mount path")
         logger.error("stderr {}".format(umount_stderr))
         raise UserError("Problem with cleaning mount path", "Ask OS admin to check mount points", umount_stderr)
 
 
+
+
+def make_nonprimary_connection(primary_connection, secondary_env_ref, secondary_user_ref):
+    """
+    Connection to additional node (node_list of VDB or dSource), host of primary connection is only a placeholder
+    """
+    dummy_host = primary_connection.environment.host
+    user = RemoteUser(name="unused", reference=secondary_user_ref)
+    environment = RemoteEnvironment(name="unused", reference=secondary_env_ref, host=dummy_host)
+    return RemoteConnection(environment=environment, user=user)
@@ -0,0 +1,181 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+IngestProfile switches the staging cluster into bulk ingest settings (INGEST_PROFILE: memcached reader / writer
+threads, auto-compaction paused) for the duration of resync / snapsync and sets the original values back afterwards.
+Profile is reverted also when ingestion fails. Original values are kept in a JSON file in the hidden folder of the
+staging mount point until they are set back, so if the revert can't be done (lost connection to the staging host)
+the profile doesn't become the new original: the next ingestion reverts to the values from the file.
+Eviction policy and bucket priority are not part of the profile, changing them restarts the bucket.
+"""
+#######################################################################################################################
+
+import json
+import logging
+
+from db_commands.constants import INGEST_PROFILE, INGEST_PROFILE_FILENAME
+
+logger = logging.getLogger(__name__)
+
+MEMCACHED_SETTINGS = ["num_reader_threads", "num_writer_threads"]
+FRAGMENTATION_THRESHOLDS = ["databaseFragmentationThreshold", "viewFragmentationThreshold"]
+
+
+def setting_value(value):
+    """ values are compared and posted as they are sent by curl """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def form_fields(settings, prefix=None):
+    """ nested settings as form fields of Couchbase REST API, e.g. allowedTimePeriod[fromHour] """
+    fields = {}
+    for name, value in settings.items():
+        field = name if prefix is None else "{}[{}]".format(prefix, name)
+        if isinstance(value, dict):
+            fields.update(form_fields(value, field))
+        else:
+            fields[field] = setting_value(value)
+    return fields
+
+
+class IngestProfile(object):
+
+    def __init__(self, couchbase_obj, profile=None):
+        self.__couchbase_obj = couchbase_obj
+        self.profile = dict(INGEST_PROFILE if profile is None else profile)
+        self.filename = couchbase_obj.get_config_directory() + "/" + INGEST_PROFILE_FILENAME
+
+    def apply(self):
+        """
+        Set profile on staging cluster. Settings which can't be read or set are left as they are, ingestion
+        works without the profile.
+        :return: list of changed settings (name, original value, new value)
+        """
+        current = self.read_settings()
+        if current is None:
+            logger.warn("Unable to read settings of staging cluster, ingest profile is not applied")
+            return []
+        originals = self.__saved_settings()
+        if originals is None:
+            originals = current
+            if not self.__save(originals):
+                logger.warn("Ingest profile is not applied, original settings can't be saved")
+                return []
+        target = dict(current)
+        target.update((name, setting_value(value)) for name, value in self.profile.items())
+        changes = self.__set(current, target)
+        self.__report("Ingest profile applied to staging cluster", changes)
+        return changes
+
+    def revert(self):
+        """
+        Set original values saved by apply back
+        :return: list of changed settings (name, profile value, original value)
+        """
+        originals = self.__saved_settings()
+        if originals is None:
+            logger.debug("No ingest profile to revert")
+            return []
+        current = self.read_settings()
+        if current is None:
+            logger.warn("Unable to read settings of staging cluster, ingest profile is not reverted")
+            return []
+        changes = self.__set(current, originals)
+        self.__report("Ingest profile reverted on staging cluster", changes)
+        self.__couchbase_obj.run_os_command(os_command='delete_file', filename=self.filename)
+        return changes
+
+    def revert_after_ingestion(self):
+        """
+        revert in finally block of ingestion, failure is logged and doesn't replace the error of ingestion. Original
+        values stay in the file and the next ingestion reverts to them.
+        """
+        try:
+            return self.revert()
+        except Exception as err:
+            logger.warn("Unable to revert ingest profile on staging cluster: {}".format(err))
+            return []
+
+    def read_settings(self):
+        """
+        :return: dict of setting name and value as string, None if settings can't be read
+        """
+        (memcached, _, memcached_code), (compaction, _, compaction_code) = \
+            self.__couchbase_obj.run_couchbase_rest_batch([('get_memcached_settings', {}),
+                                                           ('get_auto_compaction', {})])
+        if memcached_code != 0 or compaction_code != 0:
+            logger.debug("Reading of staging settings failed: {} {}".format(memcached, compaction))
+            return None
+        try:
+            memcached = json.loads(memcached)
+            compaction = json.loads(compaction)
+        except ValueError:
+            logger.debug("Unexpected staging settings: {} {}".format(memcached, compaction))
+            return None
+
+        # not configured thread settings are not returned by the server
+        settings = {name: setting_value(memcached.get(name, "default")) for name in MEMCACHED_SETTINGS}
+        # setAutoCompaction replaces all auto-compaction settings, the ones not in the profile (allowed time period,
+        # index compaction) are posted back as they are read
+        settings.update(form_fields(compaction.get("autoCompactionSettings", {})))
+        for threshold in FRAGMENTATION_THRESHOLDS:
+            for unit in ["percentage", "size"]:
+                settings.setdefault("{}[{}]".format(threshold, unit), "undefined")
+        settings.setdefault("parallelDBAndViewCompaction", setting_value(False))
+        if "purgeInterval" in compaction:
+            settings["purgeInterval"] = setting_value(compaction["purgeInterval"])
+        return settings
+
+    def __set(self, current, target):
+        """ send settings of target which differ from current, auto-compaction is always set as a whole """
+        changes = [(name, current.get(name), value) for name, value in sorted(target.items())
+                   if current.get(name) != value]
+        changed = set(name for name, _, _ in changes)
+        commands = []
+        memcached = {name: target[name] for name in MEMCACHED_SETTINGS if name in changed}
+        if memcached:
+            commands.append(('set_memcached_settings', {'settings': memcached}))
+        if changed - set(MEMCACHED_SETTINGS):
+            compaction = {name: value for name, value in target.items() if name not in MEMCACHED_SETTINGS}
+            commands.append(('set_auto_compaction', {'settings': compaction}))
+        if not commands:
+            return []
+
+        failed = set()
+        for (command, arguments), (output, error, exit_code) in \
+                zip(commands, self.__couchbase_obj.run_couchbase_rest_batch(commands)):
+            if exit_code != 0:
+                logger.warn("Unable to change staging settings {}: {} {}".format(sorted(arguments['settings']),
+                                                                               output, error))
+                failed.update(arguments['settings'])
+        return [change for change in changes if change[0] not in failed]
+
+    def __saved_settings(self):
+        content, std_err, exit_code = self.__couchbase_obj.run_os_command(os_command='cat', path=self.filename)
+        if exit_code != 0 or content == "":
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            logger.debug("Saved settings {} are corrupted, ignoring them".format(self.filename))
+            return None
+
+    def __save(self, settings):
+        std_out, std_err, exit_code = self.__couchbase_obj.run_os_command(
+            os_command='write_text_file', filename=self.filename, data=json.dumps(settings, sort_keys=True))
+        if exit_code != 0:
+            logger.debug("Unable to write {}: {}".format(self.filename, std_err))
+        return exit_code == 0
+
+    @staticmethod
+    def __report(message, changes):
+        if changes:
+            logger.info("{}: {}".format(message, ", ".join("{} {} -> {}".format(name, old, new)
+                                                           for name, old, new in changes)))
+        else:
+            logger.info("{}: no setting changed".format(message))
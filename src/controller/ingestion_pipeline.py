@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+IngestionPipeline moves every bucket independently through stages of ingestion, e.g.
+    create -> replicate -> drain -> index   (XDCR)
+    create -> restore -> index              (Couchbase Backup Manager)
+A bucket enters the next stage as soon as its previous stage is finished, so index build of a small bucket runs
+while the big ones are still replicating and ingestion takes as long as the slowest bucket, not the sum of phases.
+Stage is started for one bucket by start(bucket). Stage with finished(buckets) is asynchronous (replication,
+index build): all buckets waiting in the stage are checked by one call and the pipeline sleeps between checks.
+Stage without finished is done when start returns. Limit of stage is the maximum number of buckets started and not
+finished in the stage.
+Whole pipeline has a deadline, buckets still in a stage when it runs out fail the ingestion.
+Pipeline runs in the plugin thread, concurrency comes from work done by Couchbase between the checks.
+"""
+#######################################################################################################################
+
+import logging
+import time
+
+from controller import helper_lib
+from db_commands.constants import INGESTION_POLL_INTERVAL, INGESTION_TIMEOUT
+from dlpx.virtualization.platform.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+
+class Stage(object):
+
+    def __init__(self, name, start, finished=None, limit=None, done=None):
+        """
+        :param name: name of stage used in the log
+        :param start: function(bucket name) starting the stage for the bucket
+        :param finished: function(list of bucket names) returning names of buckets which finished the stage,
+        None for stage finished when start returns
+        :param limit: maximum number of buckets in the stage, None - no limit
+        :param done: function(bucket name) returning True if the stage is not needed for the bucket
+        """
+        self.name = name
+        self.start = start
+        self.finished = finished
+        self.limit = limit
+        self.done = done
+
+
+class IngestionPipeline(object):
+
+    def __init__(self, stages, poll_interval=INGESTION_POLL_INTERVAL, timeout=INGESTION_TIMEOUT):
+        """
+        :param timeout: seconds for all buckets to finish all stages
+        """
+        self.stages = stages
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def run(self, bucket_names):
+        """
+        Run all stages for buckets, buckets are started in the given order
+        :return: dict bucket name -> seconds from start of the pipeline when the bucket finished the last stage
+        :raise UserError: buckets didn't finish before timeout
+        """
+        started = time.time()
+        position = {bucket_name: 0 for bucket_name in bucket_names}
+        running = [[] for _ in self.stages]
+        completed = {}
+
+        while True:
+            started_now = self.__start_ready(bucket_names, position, running)
+            for bucket_name in bucket_names:
+                if position[bucket_name] == len(self.stages) and bucket_name not in completed:
+                    completed[bucket_name] = time.time() - started
+                    logger.info("Ingestion of bucket {} completed after {:.0f}s".format(
+                        bucket_name, completed[bucket_name]))
+            if len(completed) == len(bucket_names):
+                return completed
+            # buckets which just entered a stage are checked without waiting, short stages finish immediately
+            if len(started_now) > 0 and self.__collect_finished(position, running, started_now):
+                continue
+            if time.time() - started > self.timeout:
+                self.__timed_out(running)
+            helper_lib.sleepForSecond(self.poll_interval)
+            self.__collect_finished(position, running)
+
+    def __timed_out(self, running):
+        waiting = ["{} ({})".format(bucket_name, stage.name)
+                   for stage, bucket_names in zip(self.stages, running) for bucket_name in bucket_names]
+        raise UserError("Ingestion of buckets didn't finish in {} seconds".format(self.timeout),
+                        "Check replication and index build of the buckets on the staging cluster and run the "
+                        "operation again",
+                        "Buckets still in progress: {}".format(", ".join(waiting)))
+
+    def __start_ready(self, bucket_names, position, running):
+        """
+        Start stages until every bucket is running a stage, waiting for a stage limit or completed
+        :return: buckets which entered an asynchronous stage
+        """
+        started_now = []
+        progressed = True
+        while progressed:
+            progressed = False
+            # later stages first, buckets in progress have priority over new ones
+            for index in reversed(range(len(self.stages))):
+                stage = self.stages[index]
+                for bucket_name in bucket_names:
+                    if position[bucket_name] != index or bucket_name in running[index]:
+                        continue
+                    if stage.limit is not None and len(running[index]) >= stage.limit:
+                        break
+                    progressed = True
+                    if stage.done is not None and stage.done(bucket_name):
+                        logger.debug("Stage {} of bucket {} not needed".format(stage.name, bucket_name))
+                        position[bucket_name] = index + 1
+                        continue
+                    logger.debug("Starting stage {} of bucket {}".format(stage.name, bucket_name))
+                    stage.start(bucket_name)
+                    if stage.finished is None:
+                        position[bucket_name] = index + 1
+                    else:
+                        running[index].append(bucket_name)
+                        started_now.append(bucket_name)
+        return started_now
+
+    def __collect_finished(self, position, running, bucket_names=None):
+        """
+        :param bucket_names: buckets to check, all running buckets by default
+        :return: True if any bucket finished its stage
+        """
+        progressed = False
+        for index, stage in enumerate(self.stages):
+            waiting = [bucket_name for bucket_name in running[index]
+                       if bucket_names is None or bucket_name in bucket_names]
+            if len(waiting) == 0:
+                continue
+            for bucket_name in stage.finished(waiting):
+                if bucket_name in running[index]:
+                    logger.debug("Stage {} of bucket {} finished".format(stage.name, bucket_name))
+                    running[index].remove(bucket_name)
+                    position[bucket_name] = index + 1
+                    progressed = True
+        return progressed
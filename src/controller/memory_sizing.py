@@ -0,0 +1,155 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Memory sizing of provisioned VDB. Configuration restored from the snapshot keeps quotas of the staging cluster, which
+may not fit into a smaller target host. Service quotas of VDB parameters, scaled down to memoryFraction percent of
+physical memory of the smallest VDB host if needed, replace them and bucket quotas of the snapshot are scaled into
+the data service quota. Buckets with a reduced quota are switched to full eviction, so only part of their data has
+to be resident. All changes are sent in one REST batch after the cluster is started.
+"""
+#######################################################################################################################
+
+import logging
+import re
+from collections import OrderedDict
+
+from controller.bucket_catalog import BucketCatalog
+from db_commands.constants import BUCKET_MEMORY_MINIMUM, MEMORY_FRACTION, SERVICE_MEMORY_MINIMUMS
+from dlpx.virtualization.platform.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+# bucket types of snapshot which can use full eviction
+EVICTABLE_BUCKET_TYPES = ("membase", "couchbase")
+
+
+def host_memory_mb(couchbase_obj):
+    """
+    :return: physical memory of host of couchbase_obj in MB, None if it can't be read
+    """
+    meminfo, std_err, exit_code = couchbase_obj.run_os_command(os_command='cat', path='/proc/meminfo')
+    match = re.search(r"^MemTotal:\s+(\d+)\s+kB", meminfo or "", re.M)
+    if exit_code != 0 or match is None:
+        logger.debug("Unable to read physical memory: {}".format(std_err))
+        return None
+    return int(match.group(1)) // 1024
+
+
+def memory_fraction(parameters):
+    return MEMORY_FRACTION if parameters.memory_fraction is None else parameters.memory_fraction
+
+
+def service_quotas(parameters):
+    """ quotas (MB) of VDB parameters of services which are sized, FTS / eventing / analytics only if enabled """
+    quotas = OrderedDict([("data", parameters.cluster_ram_size), ("index", parameters.cluster_index_ram_size)])
+    for service, enabled, quota in [("fts", parameters.fts_service, parameters.cluster_ftsram_size),
+                                    ("eventing", parameters.eventing_service, parameters.cluster_eventing_ram_size),
+                                    ("analytics", parameters.analytics_service,
+                                     parameters.cluster_analytics_ram_size)]:
+        if enabled:
+            quotas[service] = quota
+    return quotas
+
+
+def plan_memory(parameters, bucket_list, memory_mb):
+    """
+    :param bucket_list: bucket_list of snapshot
+    :param memory_mb: physical memory of the smallest VDB host
+    :return: tuple (service quotas, list of (bucket name, quota, eviction policy) of buckets to change),
+             eviction policy is None for buckets without eviction (ephemeral)
+    """
+    fraction = memory_fraction(parameters)
+    budget = memory_mb * fraction // 100
+    quotas = service_quotas(parameters)
+    catalog = BucketCatalog.from_json(bucket_list)
+    buckets = OrderedDict((bucket.name, bucket.ram // 1024 // 1024) for bucket in catalog)
+
+    if sum(quotas.values()) > budget:
+        # every service gets its share of the budget, data service gets what is left above minimums of the others
+        factor = float(budget) / sum(quotas.values())
+        for service in quotas:
+            if service != "data":
+                quotas[service] = max(SERVICE_MEMORY_MINIMUMS[service], int(quotas[service] * factor))
+        quotas["data"] = budget - sum(quota for service, quota in quotas.items() if service != "data")
+        if quotas["data"] < SERVICE_MEMORY_MINIMUMS["data"]:
+            raise UserError("{} MB of memory of the smallest VDB host is not enough for Couchbase services".format(
+                memory_mb), "Use a host with more memory, raise memory fraction or disable services of the VDB",
+                "memory fraction {}%, minimum quotas {}".format(fraction, SERVICE_MEMORY_MINIMUMS))
+
+    bucket_quotas = scale_buckets(buckets, quotas["data"])
+    changed = []
+    for bucket in catalog:
+        if bucket_quotas[bucket.name] < buckets[bucket.name]:
+            eviction_policy = "fullEviction" if bucket.bucket_type in EVICTABLE_BUCKET_TYPES else None
+            changed.append((bucket.name, bucket_quotas[bucket.name], eviction_policy))
+    return quotas, changed
+
+
+def scale_buckets(buckets, data_quota):
+    """
+    Scale bucket quotas proportionally into data quota, buckets which would get less than BUCKET_MEMORY_MINIMUM
+    keep the minimum and the rest is shared by the others
+    :param buckets: dict of bucket name and quota
+    :return: dict of bucket name and scaled quota
+    """
+    scaled = {}
+    flexible = dict(buckets)
+    available = data_quota
+    while flexible:
+        total = sum(flexible.values())
+        if total <= available:
+            scaled.update(flexible)
+            break
+        proposal = {name: int(quota * float(available) / total) for name, quota in flexible.items()}
+        small = [name for name, quota in proposal.items() if quota < BUCKET_MEMORY_MINIMUM]
+        if not small:
+            scaled.update(proposal)
+            break
+        for name in small:
+            scaled[name] = BUCKET_MEMORY_MINIMUM
+            available -= BUCKET_MEMORY_MINIMUM
+            del flexible[name]
+    if sum(scaled.values()) > data_quota:
+        raise UserError("Data service quota of {} MB is not enough for {} buckets of the snapshot".format(
+            data_quota, len(buckets)), "Use a host with more memory or raise memory fraction or cluster RAM size",
+            "minimum bucket quota is {} MB".format(BUCKET_MEMORY_MINIMUM))
+    return scaled
+
+
+def size_cluster(couchbase_obj, bucket_list, node_objs=()):
+    """
+    Fit quotas of started VDB cluster to the memory of its hosts, before additional nodes join it
+    :param bucket_list: bucket_list of snapshot buckets provisioned to the VDB
+    :param node_objs: CouchbaseOperation of every additional node
+    """
+    parameters = couchbase_obj.parameters
+    if memory_fraction(parameters) == 0:
+        logger.debug("Memory sizing is disabled")
+        return
+    memory = [host_memory_mb(node_obj) for node_obj in [couchbase_obj] + list(node_objs)]
+    if None in memory:
+        logger.warn("Physical memory of VDB hosts can't be read, quotas of the snapshot are kept")
+        return
+    quotas, buckets = plan_memory(parameters, bucket_list, min(memory))
+
+    # bucket quotas are lowered before the data service quota, it can't be below their sum
+    commands = [('bucket_edit_memory', {'bucket_name': name, 'ramsize': quota, 'eviction_policy': eviction_policy})
+                for name, quota, eviction_policy in buckets]
+    commands.append(('cluster_setting', {
+        'cluster_name': parameters.tgt_cluster_name, 'cluster_ramsize': quotas["data"],
+        'cluster_index_ramsize': quotas["index"],
+        'cluster_fts_ramsize': quotas.get("fts", parameters.cluster_ftsram_size),
+        'cluster_eventing_ramsize': quotas.get("eventing", parameters.cluster_eventing_ram_size),
+        'cluster_analytics_ramsize': quotas.get("analytics", parameters.cluster_analytics_ram_size)}))
+    for (command, arguments), (output, error, exit_code) in zip(commands,
+                                                                couchbase_obj.run_couchbase_rest_batch(commands)):
+        if exit_code != 0:
+            raise UserError("Unable to fit memory quotas of VDB to {} MB of physical memory".format(min(memory)),
+                            "Check an output and fix problem before retrying to provision a VDB",
+                            "{} {}: {} {}".format(command, arguments, output, error))
+    logger.info("Memory quotas set for {}% of {} MB of physical memory: services {}, buckets {}".format(
+        memory_fraction(parameters), min(memory),
+        dict(quotas), ", ".join("{} {} MB".format(name, quota) for name, quota, _ in buckets) or "unchanged"))
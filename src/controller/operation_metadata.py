@@ -0,0 +1,67 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+OperationMetadata keeps cluster metadata which was already read during one plugin operation (resync, snapsync,
+enable/disable, provision). Every CouchbaseOperation object owns one instance, so the cache lives as long as the
+operation which created the object.
+Lookups are memoized by key and methods which change the cluster state (bucket create/delete, XDCR setup/replicate/
+delete, config restore) invalidate the affected keys explicitly. Nothing expires by time.
+"""
+#######################################################################################################################
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Keys of memoized metadata
+SOURCE_BUCKETS = "source_bucket_list"
+STAGED_BUCKETS = "staged_bucket_list"
+REMOTE_CLUSTERS = "remote_cluster_references"
+STREAM_IDS = "stream_ids"
+HOST_IPS = "host_ips"
+BACKUP_DATE = "backup_date"
+BACKUP_BUCKETS = "backup_bucket_statistics"
+
+
+class OperationMetadata(object):
+
+    def __init__(self):
+        self.__cache = {}
+
+    def get(self, key, loader):
+        """
+        Return memoized value for the key. Loader is called only if the key is not cached yet.
+        If loader raises an exception nothing is cached.
+        :param key: metadata key
+        :param loader: function without arguments returning the value
+        :return: value for the key
+        """
+        if key in self.__cache:
+            logger.debug("Using cached metadata: {}".format(key))
+            return self.__cache[key]
+        value = loader()
+        self.__cache[key] = value
+        return value
+
+    def put(self, key, value):
+        """
+        Memoize value which was read together with other metadata
+        """
+        self.__cache[key] = value
+
+    def invalidate(self, *keys):
+        """
+        Drop memoized values. Without keys all values are dropped.
+        """
+        if not keys:
+            keys = list(self.__cache.keys())
+        for key in keys:
+            if key in self.__cache:
+                del self.__cache[key]
+                logger.debug("Cached metadata invalidated: {}".format(key))
+
+    def __contains__(self, key):
+        return key in self.__cache
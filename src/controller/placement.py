@@ -0,0 +1,99 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Service placement of additional nodes of VDB cluster. Services of a node are either the service flags of its
+node_list entry or the layout proposed by propose_placement from number of nodes and bucket / index profile of
+the snapshot. Proposed layout separates index / query nodes from data nodes, so indexer and data service don't
+compete for memory and CPU of one node. Primary node keeps the services of the snapshot configuration and FTS,
+eventing and analytics are always taken from node_list.
+"""
+#######################################################################################################################
+
+import logging
+import math
+from collections import OrderedDict
+
+from controller.bucket_catalog import BucketCatalog
+from db_commands.constants import PLACEMENT_INDEXES_PER_BUCKET, SERVICE_PLACEMENT_ADVISOR
+from dlpx.virtualization.platform.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+# node_list flag -> couchbase-cli service name, data / index / query are on by default for nodes defined without them
+SERVICE_FLAGS = OrderedDict([("data_service", "data"), ("index_service", "index"), ("query_service", "query"),
+                             ("fts_service", "fts"), ("eventing_service", "eventing"),
+                             ("analytics_service", "analytics")])
+PLACED_SERVICES = ["data", "index", "query"]
+
+
+def node_services(node_def):
+    """
+    :return: list of services of node definition from node_list
+    """
+    services = [service for flag, service in SERVICE_FLAGS.items()
+                if node_def.get(flag, service in PLACED_SERVICES) is True]
+    if not services:
+        raise UserError("No service is enabled on node {}".format(node_def.get("node_addr")),
+                        "Enable at least one service of the node in the list of additional nodes")
+    return services
+
+
+def with_services(node_def, services):
+    """ copy of node definition with data / index / query flags set to services """
+    node_def = dict(node_def)
+    for flag, service in SERVICE_FLAGS.items():
+        if service in PLACED_SERVICES:
+            node_def[flag] = service in services
+    return node_def
+
+
+def propose_placement(node_count, bucket_list, index_definitions):
+    """
+    Propose data / index / query services of additional nodes. Index and query are placed on dedicated nodes,
+    their share of nodes grows with number of indexes per bucket and is half of the nodes for
+    PLACEMENT_INDEXES_PER_BUCKET indexes per bucket. At least one node is left for data if there is more than one.
+    :param node_count: number of additional nodes
+    :param bucket_list: bucket_list of snapshot
+    :param index_definitions: indexes of snapshot
+    :return: list of service lists, data nodes first
+    """
+    bucket_count = max(1, len(BucketCatalog.from_json(bucket_list or [])))
+    index_count = len(index_definitions or [])
+    if node_count == 0:
+        return []
+    if index_count == 0:
+        return [["data"]] * node_count
+    if node_count == 1:
+        return [["index", "query"]]
+    share = float(index_count) / (index_count + PLACEMENT_INDEXES_PER_BUCKET * bucket_count)
+    index_nodes = min(node_count - 1, max(1, int(math.ceil(node_count * share))))
+    return [["data"]] * (node_count - index_nodes) + [["index", "query"]] * index_nodes
+
+
+def place_services(parameters, snapshot, nodes, members=()):
+    """
+    Services of nodes being added to VDB cluster, layout proposed by the advisor is logged also if services
+    of node_list are used
+    :param nodes: node definitions of nodes being added
+    :param members: node definitions of additional nodes already in the cluster, their services don't change
+    :return: node definitions with data / index / query flags of their services
+    """
+    if not nodes:
+        return []
+    proposal = propose_placement(len(members) + len(nodes), snapshot.bucket_list, snapshot.indexes)
+    # layout of existing members is taken out of the proposal, new nodes fill the rest
+    for member in members:
+        services = [service for service in node_services(member) if service in PLACED_SERVICES]
+        if services in proposal:
+            proposal.remove(services)
+    proposed = [with_services(node, services) for node, services in zip(nodes, proposal)]
+    layout = ", ".join("{}: {}".format(node["node_addr"], ",".join(node_services(node))) for node in proposed)
+
+    if parameters.service_placement != SERVICE_PLACEMENT_ADVISOR:
+        logger.info("Services of node list are used, placement advisor proposes {}".format(layout))
+        return list(nodes)
+    logger.info("Service placement proposed by placement advisor: {}".format(layout))
+    return proposed
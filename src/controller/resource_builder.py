@@ -7,7 +7,7 @@
 There are two purposes which this module is created for:
 Purpose1:
  This class is being used by child classes to initialize their attributes. Child classes of this are :
- _bucket.py,_cb_backup.py, _cluster.py, _replication.py, _xdcr.py. To add any new feature let say 'X', create a class
+ _bucket.py,_cb_backup.py, _cluster.py, _job.py, _replication.py, _xdcr.py. To add any new feature let say 'X', create a class
  for that 'X' feature in x module and make the Resource class as parent for X.
  Here we are using builder design pattern to initialize the properties.
  Reason of using this approach:
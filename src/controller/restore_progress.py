@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Progress of cbbackupmgr restore. cbbackupmgr runs with --no-progress-bar as a detached job, so the progress is taken
+from the staging cluster: items of the restored buckets are read once per interval while the plugin waits for the
+job and compared with items of the buckets in the backup (cbbackupmgr info). Every sample is logged and written to
+a JSON file in the hidden folder with throughput and ETA. Bytes per second are the bytes of the backup restored in a
+second, i.e. read rate of the archive, resident ratio of the buckets below 100 means the bucket quota is full and
+the restore also waits for the data to be ejected to disk.
+Restore of snapsync overwrites items which are already in the buckets, its percent and rates are only approximate.
+"""
+#######################################################################################################################
+
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from db_commands.constants import RESTORE_PROGRESS_FILENAME, RESTORE_PROGRESS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def parse_backup_info(output):
+    """
+    :param output: output of cbbackupmgr info --json
+    :return: dict of bucket name and dict with items and size in bytes of the bucket in the latest backup
+    """
+    try:
+        info = json.loads(output)
+    except ValueError:
+        logger.debug("Backup info without bucket statistics: {}".format(output))
+        return {}
+    backups = sorted(info.get("backups") or [], key=lambda backup: backup.get("date", ""))
+    if not backups:
+        return {}
+    return dict((bucket["name"], {"items": int(bucket.get("items", 0)), "size": int(bucket.get("size", 0))})
+                for bucket in backups[-1].get("buckets") or [])
+
+
+def rate(previous, current, elapsed):
+    return (current - previous) / elapsed if elapsed > 0 else 0.0
+
+
+def progress_summary(bucket_names, backup_buckets, samples, state):
+    """
+    :param backup_buckets: result of parse_backup_info, total of bucket which isn't in it is unknown
+    :param samples: list of (time, dict of bucket name and tuple of items and resident ratio), the first sample is the
+    start of the restore
+    :return: OrderedDict with the progress, rates of the last interval, ETA in seconds (None if unknown)
+    """
+    started, _ = samples[0]
+    previous_time, previous = samples[-2] if len(samples) > 1 else samples[0]
+    now, current = samples[-1]
+    buckets = []
+    for name in bucket_names:
+        items, resident_ratio = current.get(name, (0, None))
+        total = backup_buckets.get(name, {}).get("items")
+        item_bytes = float(backup_buckets[name]["size"]) / total if total else 0
+        buckets.append(OrderedDict([
+            ("name", name), ("items", items), ("total_items", total),
+            ("percent", round(min(100.0, 100.0 * items / total), 1) if total else None),
+            ("items_per_second", int(rate(previous.get(name, (0, None))[0], items, now - previous_time))),
+            ("bytes_per_second", int(rate(previous.get(name, (0, None))[0], items, now - previous_time) *
+                                     item_bytes)),
+            ("resident_ratio", resident_ratio)]))
+
+    items = sum(bucket["items"] for bucket in buckets)
+    known = all(bucket["total_items"] is not None for bucket in buckets)
+    total = sum(bucket["total_items"] for bucket in buckets) if known else None
+    items_per_second = sum(bucket["items_per_second"] for bucket in buckets)
+    eta = None
+    if total is not None and state == "running" and items_per_second > 0:
+        eta = int(max(0, total - items) / items_per_second)
+    return OrderedDict([
+        ("state", state), ("started", int(started)), ("elapsed_seconds", int(now - started)),
+        ("items", items), ("total_items", total),
+        ("percent", round(min(100.0, 100.0 * items / total), 1) if total else None),
+        ("items_per_second", items_per_second),
+        ("bytes_per_second", sum(bucket["bytes_per_second"] for bucket in buckets)),
+        ("average_items_per_second", int(rate(0, items, now - started))),
+        ("eta_seconds", eta), ("buckets", buckets)])
+
+
+def format_summary(summary):
+    """ one line of the plugin log """
+    if summary["percent"] is None:
+        progress = "{} items".format(summary["items"])
+    else:
+        progress = "{}% ({} of {} items)".format(summary["percent"], summary["items"], summary["total_items"])
+    line = "Restore of {} {}: {}, {} items/s, {:.1f} MB/s".format(
+        ", ".join(bucket["name"] for bucket in summary["buckets"]), summary["state"], progress,
+        summary["items_per_second"], float(summary["bytes_per_second"]) / MB)
+    if summary["eta_seconds"] is not None:
+        line = line + ", ETA {} s".format(summary["eta_seconds"])
+    return line + ", elapsed {} s".format(summary["elapsed_seconds"])
+
+
+class RestoreProgress(object):
+
+    def __init__(self, couchbase_obj, bucket_names, backup_buckets, interval=RESTORE_PROGRESS_INTERVAL):
+        self.__couchbase_obj = couchbase_obj
+        self.bucket_names = list(bucket_names)
+        self.backup_buckets = backup_buckets
+        self.interval = interval
+        self.filename = couchbase_obj.get_config_directory() + "/" + RESTORE_PROGRESS_FILENAME
+        # items are counted from empty buckets, the first sample is read after the first interval
+        self.samples = [(time.time(), {})]
+
+    def sample(self):
+        """ monitor of the restore job, reads the buckets if interval passed since the last sample """
+        if time.time() - self.samples[-1][0] < self.interval:
+            return
+        items = {}
+        for record in self.__couchbase_obj.bucket_statistics():
+            if record.name in self.bucket_names and record.stats is not None:
+                items[record.name] = (record.stats["items"], record.stats["resident_ratio"])
+        self.samples.append((time.time(), items))
+        summary = self.report("running")
+        ejecting = [bucket["name"] for bucket in summary["buckets"]
+                    if bucket["resident_ratio"] is not None and bucket["resident_ratio"] < 100]
+        if ejecting:
+            logger.info("Buckets {} don't fit into their quota, restore also waits for ejection of items to "
+                        "disk".format(", ".join(ejecting)))
+
+    def finish(self, succeeded):
+        """ final summary, successful restore has all items of the backup """
+        items = dict((name, (self.backup_buckets[name]["items"] if succeeded and name in self.backup_buckets
+                             else self.samples[-1][1].get(name, (0, None))[0], None))
+                     for name in self.bucket_names)
+        self.samples = [self.samples[0], (time.time(), items)]
+        return self.report("complete" if succeeded else "failed")
+
+    def report(self, state):
+        summary = progress_summary(self.bucket_names, self.backup_buckets, self.samples, state)
+        logger.info(format_summary(summary))
+        std_out, std_err, exit_code = self.__couchbase_obj.run_os_command(
+            os_command='write_text_file', filename=self.filename, data=json.dumps(summary))
+        if exit_code != 0:
+            logger.debug("Unable to write {}: {}".format(self.filename, std_err))
+        return summary
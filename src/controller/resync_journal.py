@@ -0,0 +1,121 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+ResyncJournal records steps of resync which are already completed, so a resync repeated after a failure (network
+problem during replication monitoring, timeout of index build) continues where the failed one stopped.
+Journal is a JSON file in the hidden folder of the staging mount point:
+    {"identity": {...}, "cluster": true,
+     "buckets": {"<bucket>": {"created": true, "replication": true, "drained": true, "restored": "<backup date>",
+                              "indexes": ["<index definition>", ...]}}}
+Identity (dSource type, source, staging cluster name, configured buckets) has to match the dSource, otherwise the
+journal is ignored. Every step is still validated against the cluster before it is skipped: a bucket is reused only
+if it exists on staging with the expected definition and a recreated bucket drops all later steps of the bucket.
+Journal is deleted when resync completes, next resync starts from scratch.
+"""
+#######################################################################################################################
+
+import json
+import logging
+import re
+
+from db_commands.constants import RESYNC_JOURNAL_FILENAME
+
+logger = logging.getLogger(__name__)
+
+# Steps of bucket
+CREATED = "created"
+REPLICATED = "replication"
+DRAINED = "drained"
+RESTORED = "restored"
+INDEXES = "indexes"
+
+INDEX_BUCKET = re.compile(r"\bon\s+`([^`]+)`", re.IGNORECASE)
+
+
+def index_bucket(index_definition):
+    """ bucket name from CREATE INDEX / BUILD INDEX statement or None """
+    match = INDEX_BUCKET.search(index_definition)
+    return match.group(1) if match else None
+
+
+class ResyncJournal(object):
+
+    def __init__(self, couchbase_obj, identity, state=None):
+        self.__couchbase_obj = couchbase_obj
+        self.identity = identity
+        self.filename = couchbase_obj.get_config_directory() + "/" + RESYNC_JOURNAL_FILENAME
+        self.__state = state or {"identity": identity, "cluster": False, "buckets": {}}
+
+    @classmethod
+    def open(cls, couchbase_obj, identity):
+        """
+        Read journal of previous resync from staging mount point
+        :param identity: dict identifying dSource configuration, journal with other identity is ignored
+        :return: ResyncJournal, empty if there is no valid journal
+        """
+        journal = cls(couchbase_obj, identity)
+        content, std_err, exit_code = couchbase_obj.run_os_command(os_command='cat', path=journal.filename)
+        if exit_code != 0 or content == "":
+            logger.debug("No resync journal found")
+            return journal
+        try:
+            state = json.loads(content)
+        except ValueError:
+            logger.debug("Resync journal {} is corrupted, ignoring it".format(journal.filename))
+            return journal
+        if state.get("identity") != identity:
+            logger.debug("Resync journal belongs to other configuration {}, ignoring it".format(state.get("identity")))
+            return journal
+        logger.info("Continuing resync from journal: {}".format(state))
+        return cls(couchbase_obj, identity, state)
+
+    def cluster_configured(self):
+        return self.__state["cluster"]
+
+    def complete_cluster(self):
+        """ written together with the next completed step """
+        self.__state["cluster"] = True
+
+    def done(self, bucket_name, step):
+        return self.__state["buckets"].get(bucket_name, {}).get(step)
+
+    def complete(self, bucket_names, step, value=True, save=True):
+        """ mark step completed for buckets, journal is written once for all of them """
+        for bucket_name in bucket_names:
+            self.__state["buckets"].setdefault(bucket_name, {})[step] = value
+        if save:
+            self.save()
+
+    def reset_bucket(self, bucket_name):
+        """ bucket was created again, all steps of the bucket have to be repeated """
+        if bucket_name in self.__state["buckets"]:
+            logger.debug("Resetting resync journal of bucket {}".format(bucket_name))
+            del self.__state["buckets"][bucket_name]
+
+    def built_indexes(self):
+        built = []
+        for steps in self.__state["buckets"].values():
+            built.extend(steps.get(INDEXES, []))
+        return built
+
+    def complete_indexes(self, index_definitions):
+        for index_definition in index_definitions:
+            bucket = self.__state["buckets"].setdefault(index_bucket(index_definition) or "", {})
+            if index_definition not in bucket.setdefault(INDEXES, []):
+                bucket[INDEXES].append(index_definition)
+        self.save()
+
+    def save(self):
+        content = json.dumps(self.__state, sort_keys=True)
+        std_out, std_err, exit_code = self.__couchbase_obj.run_os_command(os_command='write_text_file',
+                                                                          filename=self.filename, data=content)
+        if exit_code != 0:
+            # resync itself doesn't depend on the journal, retry will only repeat more steps
+            logger.warn("Unable to write resync journal {}: {}".format(self.filename, std_err))
+
+    def remove(self):
+        logger.debug("Removing resync journal {}".format(self.filename))
+        self.__couchbase_obj.run_os_command(os_command='delete_file', filename=self.filename)
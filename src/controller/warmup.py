@@ -0,0 +1,150 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Warmup of VDB buckets. Couchbase Server reports a node healthy while its buckets are still warming up and by default
+warmup reads every value from disk before the bucket is done. Warmup thresholds of VDB parameters let a bucket finish
+warmup once a share of its items / memory quota is loaded, the rest is read on first access, and the access scanner
+keeps the access log, so warmup loads recently used items first. Thresholds are ep-engine parameters which are not
+persisted, they are set by cbepctl after every start while buckets are warming up. The readiness gate then polls
+cbstats warmup of every data node of the VDB until warmup of selected buckets is complete.
+"""
+#######################################################################################################################
+
+import logging
+import time
+
+from controller import helper_lib
+from db_commands.constants import WARMUP_POLL_INTERVAL, WARMUP_THRESHOLD, WARMUP_TIMEOUT
+from dlpx.virtualization.platform.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+# bucket types of bucket catalog which are warmed up from disk
+WARMUP_BUCKET_TYPES = ("membase", "couchbase")
+
+
+def warmup_params(parameters):
+    """
+    :return: list of (ep-engine parameter, value) of VDB parameters, empty if they are ep-engine defaults
+    """
+    items = WARMUP_THRESHOLD if parameters.warmup_min_items_threshold is None \
+        else parameters.warmup_min_items_threshold
+    memory = WARMUP_THRESHOLD if parameters.warmup_min_memory_threshold is None \
+        else parameters.warmup_min_memory_threshold
+    access_log = parameters.access_log_warmup is not False
+    if (items, memory, access_log) == (WARMUP_THRESHOLD, WARMUP_THRESHOLD, True):
+        return []
+    return [("warmup_min_items_threshold", items), ("warmup_min_memory_threshold", memory),
+            ("access_scanner_enabled", "true" if access_log else "false")]
+
+
+def warmup_buckets(bucket_catalog):
+    """ names of buckets which are warmed up from disk """
+    return [bucket.name for bucket in bucket_catalog if bucket.bucket_type in WARMUP_BUCKET_TYPES]
+
+
+def ready_buckets(parameters, bucket_catalog):
+    """
+    :return: names of buckets the readiness gate waits for, all warmed up buckets for empty readyBuckets
+    """
+    warming = warmup_buckets(bucket_catalog)
+    selected = parameters.ready_buckets or warming
+    skipped = [name for name in selected if name not in warming]
+    if skipped:
+        logger.warn("Buckets {} are not warmed up buckets of the VDB, readiness gate skips them".format(
+            ", ".join(skipped)))
+    return [name for name in selected if name in warming]
+
+
+def parse_warmup_stats(output):
+    """
+    :param output: output of cbstats -a warmup, stats of every bucket follow a line of asterisks and bucket name
+    :return: dict of bucket name and dict of its stats
+    """
+    buckets = {}
+    stats = None
+    header = False
+    for line in (output or "").splitlines():
+        if line.startswith("*"):
+            header = True
+        elif header and line.strip():
+            stats = buckets.setdefault(line.strip(), {})
+            header = False
+        elif stats is not None:
+            name, separator, value = line.partition(":")
+            if separator:
+                stats[name.strip()] = value.strip()
+    return buckets
+
+
+def warmup_complete(stats):
+    return stats.get("ep_warmup_thread") == "complete"
+
+
+def warmup_progress(stats):
+    """ warmup state of bucket with loaded / estimated values if they are known """
+    state = stats.get("ep_warmup_state", "unknown")
+    estimated = stats.get("ep_warmup_estimated_value_count", "unknown")
+    if estimated == "unknown":
+        return state
+    return "{}, {} of {} values".format(state, stats.get("ep_warmup_value_count", 0), estimated)
+
+
+def tune_warmup(parameters, bucket_names, node_objs):
+    """ set warmup thresholds of VDB parameters to warming up buckets on every node """
+    params = warmup_params(parameters)
+    if not params:
+        logger.debug("Warmup parameters are ep-engine defaults")
+        return
+    for node_obj in node_objs:
+        for bucket_name in bucket_names:
+            output, error, exit_code = node_obj.bucket_set_params(bucket_name, params)
+            if exit_code != 0:
+                logger.warn("Unable to set warmup parameters of bucket {} on {}: {} {}".format(
+                    bucket_name, node_obj.connection.environment.host.name, output, error))
+
+
+def wait_for_buckets(bucket_names, node_objs, timeout=WARMUP_TIMEOUT):
+    """
+    Wait until warmup of buckets is complete on every node, progress of every bucket is logged in each round
+    :raise UserError: warmup is not complete in timeout seconds
+    """
+    pending = [(node_obj, bucket_name) for node_obj in node_objs for bucket_name in bucket_names]
+    end_time = time.time() + timeout
+    while pending:
+        progress = []
+        for node_obj in [node_obj for node_obj in node_objs if any(node is node_obj for node, _ in pending)]:
+            host = node_obj.connection.environment.host.name
+            output, error, exit_code = node_obj.warmup_stats()
+            if exit_code == 127:
+                logger.warn("cbstats is not available, buckets are not checked for warmup: {}".format(error))
+                return
+            buckets = parse_warmup_stats(output) if exit_code == 0 else {}
+            for bucket_name in [name for node, name in pending if node is node_obj]:
+                stats = buckets.get(bucket_name, {})
+                if warmup_complete(stats):
+                    logger.info("Bucket {} on {} is warmed up: {}".format(bucket_name, host, warmup_progress(stats)))
+                    pending.remove((node_obj, bucket_name))
+                else:
+                    progress.append("{} on {}: {}".format(bucket_name, host,
+                                                          warmup_progress(stats) if stats else "not available"))
+        if not pending:
+            break
+        logger.info("Waiting for warmup of buckets: {}".format("; ".join(progress)))
+        if time.time() > end_time:
+            raise UserError("Warmup of buckets is not complete in {} seconds".format(timeout),
+                            "Lower warmup thresholds of the VDB or select fewer buckets to wait for",
+                            "; ".join(progress))
+        helper_lib.sleepForSecond(WARMUP_POLL_INTERVAL)
+
+
+def warm_up(parameters, bucket_catalog, node_objs):
+    """
+    Tune warmup of buckets of started VDB cluster and wait until selected buckets are warmed up
+    :param node_objs: CouchbaseOperation of every data node
+    """
+    tune_warmup(parameters, warmup_buckets(bucket_catalog), node_objs)
+    wait_for_buckets(ready_buckets(parameters, bucket_catalog), node_objs)
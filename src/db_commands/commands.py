@@ -17,6 +17,7 @@ so no need to create an object of the class, we can use the direct class name to
 import inspect
 import logging
 
+from db_commands.constants import JOB_ATTACHED, JOB_STDERR_DELIMITER, MEMCACHED_PORT
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +37,56 @@ class OSCommand(object):
     def find_shell_path(binary_path, **kwargs):
         return "find {binary_path} -name couchbase-cli".format(binary_path=binary_path)
 
+    @staticmethod
+    def discover_repositories(default_binary_path, cache_filename, **kwargs):
+        # First record points to the discovery cache: CACHE|<cache_file>|<number of cached entries>
+        # then one record per entry of $COUCHBASE_PATH, either a cache hit: CACHED|<json>
+        # or a full probe: REPO|<binary_path>|<install_path>|<shell_path>|<version>|<uid>|<gid>|<fingerprint>
+        # Binaries are resolved directly in <binary_path> or <binary_path>/bin instead of a recursive find.
+        # The fingerprint (inode:size:uid:gid:date of couchbase-server from ls -ln, as in get_ids, stat -c is GNU only)
+        # decides if a cached entry is still valid, install without fingerprint (ls failed) is always probed.
+        # Toolkit directory is 6 levels above the jq binary, same as in CouchbaseOperation.create_config_dir
+        return """IFS=';'
+cb_cache=""; cb_cached_count=0
+if [ -n "$DLPX_BIN_JQ" ]; then
+  cb_cache="$DLPX_BIN_JQ"
+  for cb_level in 1 2 3 4 5 6; do cb_cache=$(dirname "$cb_cache"); done
+  cb_cache="$cb_cache/.delphix/{cache_filename}"
+  [ -f "$cb_cache" ] && cb_cached_count=$(wc -l < "$cb_cache")
+fi
+echo "CACHE|$cb_cache|$cb_cached_count"
+for cb_path in ${{COUCHBASE_PATH:-{default_binary_path}}}; do
+  [ -d "$cb_path" ] || continue
+  cb_install=""; cb_shell=""; cb_version=""; cb_ids="|"; cb_fingerprint=""
+  for cb_dir in "$cb_path" "$cb_path/bin"; do
+    [ -z "$cb_install" ] && [ -f "$cb_dir/couchbase-server" ] && cb_install="$cb_dir/couchbase-server"
+    [ -z "$cb_shell" ] && [ -f "$cb_dir/couchbase-cli" ] && cb_shell="$cb_dir/couchbase-cli"
+  done
+  if [ -n "$cb_install" ]; then
+    cb_ls=$(ls -lni "$cb_install" 2>/dev/null)
+    cb_fingerprint=$(echo "$cb_ls" | awk 'NF >= 10 {{print $1 ":" $6 ":" $4 ":" $5 ":" $7 " " $8 " " $9}}')
+    cb_key="$cb_path|$cb_install|$cb_shell|$cb_fingerprint|"
+    cb_entry=""
+    [ -n "$cb_fingerprint" ] && [ -n "$cb_cache" ] && [ -f "$cb_cache" ] && \
+      cb_entry=$(grep -F "$cb_key" "$cb_cache" | head -n 1)
+    case "$cb_entry" in
+      "$cb_key"*) echo "CACHED|${{cb_entry#"$cb_key"}}"; continue ;;
+    esac
+    cb_version=$("$cb_install" --version 2>/dev/null | tail -n 1)
+    cb_ids=$(echo "$cb_ls" | awk 'NF >= 10 {{print $4 "|" $5}}')
+    [ -n "$cb_ids" ] || cb_ids="|"
+  fi
+  echo "REPO|$cb_path|$cb_install|$cb_shell|$cb_version|$cb_ids|$cb_fingerprint"
+done""".format(default_binary_path=default_binary_path, cache_filename=cache_filename)
+
+    @staticmethod
+    def capture_environment(**kwargs):
+        return "env"
+
+    @staticmethod
+    def find_command(name, **kwargs):
+        return "command -v {name}".format(name=name)
+
     @staticmethod
     def get_process():
         return "ps -ef"
@@ -73,6 +124,16 @@ class OSCommand(object):
     def write_file(filename, data, **kwargs):
         return "echo {data} > {filename}".format(filename=filename, data=data)
 
+    @staticmethod
+    def write_text_file(filename, data, sudo=False, uid=None, **kwargs):
+        # quoted here-document, so the content is written as is without any shell expansion
+        if sudo:
+            return "sudo -u \#{uid} mkdir -p $(dirname {filename}) && sudo -u \#{uid} sh -c 'cat > {filename}' <<'DLPX_EOF'\n{data}\nDLPX_EOF".format(
+                filename=filename, data=data, uid=uid)
+        else:
+            return "mkdir -p $(dirname {filename}) && cat > {filename} <<'DLPX_EOF'\n{data}\nDLPX_EOF".format(
+                filename=filename, data=data)
+
     @staticmethod
     def get_ip_of_hostname(**kwargs):
         return "hostname -I"
@@ -85,8 +146,11 @@ class OSCommand(object):
             return "[ -d {dir_path} ] && echo 'Found'".format(dir_path=dir_path)
 
     @staticmethod
-    def delete_file(filename, **kwargs):
-        return "rm  -f  {filename}".format(filename=filename)
+    def delete_file(filename, sudo=False, uid=None, **kwargs):
+        if sudo:
+            return "sudo -u \#{uid} rm  -f  {filename}".format(filename=filename, uid=uid)
+        else:
+            return "rm  -f  {filename}".format(filename=filename)
 
     @staticmethod
     def delete_dir(dirname, sudo=False, uid=None, **kwargs):
@@ -159,6 +223,27 @@ class OSCommand(object):
     def resolve_name(hostname, **kwargs):
         return "getent ahostsv4 {hostname} | grep STREAM | head -n 1 | cut -d ' ' -f 1".format(hostname=hostname)
 
+    @staticmethod
+    def job_start(job_dir, command, **kwargs):
+        # command runs in its own session, so it isn't killed with the remote shell. Launcher runs as user of the
+        # connection, command inherits its environment variables ($password) and uses sudo itself if it's needed.
+        # Job of the folder which is still running is not started again.
+        script = "({command}); echo $? > exit_code.tmp; mv exit_code.tmp exit_code".format(command=command)
+        return "mkdir -p {job_dir} && cd {job_dir} && if [ -f pid ] && [ ! -f exit_code ] && kill -0 $(cat pid) " \
+               "2>/dev/null; then echo {attached}; else rm -f pid exit_code stdout stderr && " \
+               "(setsid nohup sh -c '{script}' > stdout 2> stderr < /dev/null & echo $! > pid); fi".format(
+                job_dir=job_dir, attached=JOB_ATTACHED, script=script.replace("'", "'\\''"))
+
+    @staticmethod
+    def job_status(job_dir, offset=0, **kwargs):
+        # first line is the state and size of stdout of the job, stdout written since offset follows and stderr of
+        # the job after delimiter once the job exits
+        return "cd {job_dir} && size=$(wc -c < stdout) && if [ -f exit_code ]; then state=\"exited $(cat exit_code)\"; " \
+               "elif [ ! -s pid ]; then state=starting; elif kill -0 $(cat pid) 2>/dev/null; then state=running; " \
+               "else state=lost; fi && echo \"$state $size\" && tail -c +{start} stdout | head -c $((size - {offset})) " \
+               "&& if [ -f exit_code ]; then echo; echo '{delimiter}'; cat stderr; fi".format(
+                job_dir=job_dir, start=offset + 1, offset=offset, delimiter=JOB_STDERR_DELIMITER)
+
 class DatabaseCommand(object):
     def __init__(self):
         pass
@@ -375,6 +460,15 @@ class DatabaseCommand(object):
             ramsize=ramsize
         )
 
+    @staticmethod
+    def bucket_edit_memory(shell_path, hostname, port, username, bucket_name, ramsize, eviction_policy=None,
+                           **kwargs):
+        eviction_option = " --bucket-eviction-policy {}".format(eviction_policy) if eviction_policy else ""
+        return "{shell_path} bucket-edit --cluster {hostname}:{port} --username {username} --password $password --bucket={bucket_name} --bucket-ramsize {ramsize}{eviction_option}".format(
+            shell_path=shell_path, hostname=hostname, port=port, username=username, bucket_name=bucket_name,
+            ramsize=ramsize, eviction_option=eviction_option
+        )
+
     @staticmethod
     def bucket_delete(shell_path, hostname, port, username, bucket_name, **kwargs):
         return "{shell_path} bucket-delete --cluster {hostname}:{port} --username {username} --password $password  --bucket={bucket_name}".format(
@@ -387,6 +481,12 @@ class DatabaseCommand(object):
             shell_path=shell_path, hostname=hostname, port=port, username=username, bucket_name=bucket_name
         )
 
+    @staticmethod
+    def bucket_compact(shell_path, hostname, port, username, bucket_name, **kwargs):
+        return "{shell_path} bucket-compact --cluster {hostname}:{port} --username {username} --password $password --bucket={bucket_name} --data-only".format(
+            shell_path=shell_path, hostname=hostname, port=port, username=username, bucket_name=bucket_name
+        )
+
     @staticmethod
     def bucket_create(shell_path, hostname, port, username, bucket_name, ramsize, evictionpolicy, bucket_type, bucket_compression, **kwargs):
         return "{shell_path} bucket-create --cluster 127.0.0.1:{port} --username {username} --password $password --bucket {bucket_name} --bucket-type {bucket_type} --bucket-ramsize {ramsize} --bucket-replica 0 --bucket-eviction-policy {evictionpolicy} {bucket_compression} --conflict-resolution sequence --wait".format(
@@ -428,12 +528,41 @@ class DatabaseCommand(object):
             base_path=base_path, hostname=hostname, port=port, username=username, index_def=index_def
         )
 
+    @staticmethod
+    def drop_index(base_path, hostname, port, username, bucket_name, index_name, **kwargs):
+        return "{base_path}/cbq -e {hostname}:{port} -u {username} -p $password -q=true -s='DROP INDEX `{bucket_name}`.`{index_name}`'".format(
+            base_path=base_path, hostname=hostname, port=port, username=username, bucket_name=bucket_name,
+            index_name=index_name
+        )
+
+    @staticmethod
+    def warmup_stats(base_path, hostname, username, **kwargs):
+        # -a iterates over all buckets, stats of each bucket follow a header with its name
+        return "{base_path}/cbstats {hostname}:{port} -u {username} -p $password -a warmup".format(
+            base_path=base_path, hostname=hostname, port=MEMCACHED_PORT, username=username
+        )
+
+    @staticmethod
+    def bucket_set_params(base_path, hostname, username, bucket_name, params, **kwargs):
+        # cbepctl sets one parameter per call
+        return " && ".join(
+            "{base_path}/cbepctl {hostname}:{port} -u {username} -p $password -b {bucket_name} set flush_param "
+            "{param} {value}".format(base_path=base_path, hostname=hostname, port=MEMCACHED_PORT, username=username,
+                                     bucket_name=bucket_name, param=param, value=value)
+            for param, value in params)
+
     @staticmethod
     def check_index_build(base_path, hostname, port, username, **kwargs):
         return "{base_path}/cbq -e {hostname}:{port} -u {username} -p $password -q=true -s=\"SELECT COUNT(*) as unbuilt FROM system:indexes WHERE state <> 'online'\"".format(
             base_path=base_path, hostname=hostname, port=port, username=username
         )
 
+    @staticmethod
+    def check_index_build_per_bucket(base_path, hostname, port, username, **kwargs):
+        return "{base_path}/cbq -e {hostname}:{port} -u {username} -p $password -q=true -s=\"SELECT keyspace_id as bucket, COUNT(*) as unbuilt FROM system:indexes WHERE state <> 'online' GROUP BY keyspace_id\"".format(
+            base_path=base_path, hostname=hostname, port=port, username=username
+        )
+
     @staticmethod
     def cb_backup_full(base_path, backup_location, backup_repo, hostname, port, username, csv_bucket_list, sudo, uid, skip, **kwargs):
         if sudo:
@@ -462,6 +591,15 @@ class DatabaseCommand(object):
                 skip=skip
             )
 
+    @staticmethod
+    def cb_backup_info(base_path, backup_location, backup_repo, sudo, uid, **kwargs):
+        if sudo:
+            return "sudo -u \#{uid} {base_path}/cbbackupmgr info --archive {backup_location} --repo {backup_repo} --json".format(
+                base_path=base_path, backup_location=backup_location, backup_repo=backup_repo, uid=uid)
+        else:
+            return "{base_path}/cbbackupmgr info --archive {backup_location} --repo {backup_repo} --json".format(
+                base_path=base_path, backup_location=backup_location, backup_repo=backup_repo)
+
     @staticmethod
     def monitor_replication(source_username, source_hostname, source_port, bucket_name, uuid, **kwargs):
         return "curl --silent -u {source_username}:$password http://{source_hostname}:{source_port}/pools/default/buckets/{bucket_name}/stats/replications%2F{uuid}%2F{bucket_name}%2F{bucket_name}%2Fchanges_left".format(
@@ -503,10 +641,12 @@ class DatabaseCommand(object):
 
 
     @staticmethod
-    def rebalance(shell_path, hostname, port, username, **kwargs):
+    def rebalance(shell_path, hostname, port, username, server_remove=None, **kwargs):
+        server_remove_option = " --server-remove {}".format(server_remove) if server_remove else ""
         return "{shell_path} rebalance --cluster {hostname}:{port} --username {username} --password $password \
-            --no-progress-bar".format(
-            shell_path=shell_path, hostname=hostname, port=port, username=username
+            --no-progress-bar{server_remove_option}".format(
+            shell_path=shell_path, hostname=hostname, port=port, username=username,
+            server_remove_option=server_remove_option
         )
 
 class CommandFactory(DatabaseCommand, OSCommand):
@@ -10,6 +10,12 @@
 LOCK_SYNC_OPERATION = "DO_NOT_DELETE_DELPHIX_sync.lck"
 LOCK_SNAPSYNC_OPERATION = "DO_NOT_DELETE_DELPHIX_snapsync.lck"
 SRC_BUCKET_INFO_FILENAME = "couchbase_src_bucket_info.cfg"
+REPOSITORY_CACHE_FILENAME = "couchbase_repository_cache.dat"  # discovery cache inside toolkit hidden folder
+RESYNC_JOURNAL_FILENAME = "resync_journal.json"  # completed resync steps inside hidden folder of staging mount
+INGEST_PROFILE_FILENAME = "ingest_profile.json"  # staging settings replaced by ingest profile, inside hidden folder
+COMPACTION_REPORT_FILENAME = "compaction_report.json"  # disk usage before / after pre-snapshot compaction
+STAGING_NODES_FILENAME = "staging_nodes.json"  # additional nodes joined to staging cluster, inside hidden folder
+VDB_NODES_FILENAME = "vdb_nodes.json"  # additional nodes of VDB cluster, inside hidden folder of VDB mount
 ENV_VAR_KEY = 'environment_vars'
 StatusIsActive = "healthy"  # it shows the status of server is good
 DELPHIX_HIDDEN_FOLDER = ".delphix"  # Folder inside which config file will create
@@ -18,6 +24,90 @@ EVICTION_POLICY = "valueOnly"
 DEFAULT_CB_BIN_PATH = "/opt/couchbase/bin"
 CBBKPMGR = "Couchbase Backup Manager"
 XDCR = "XDCR"
+SERVICE_PLACEMENT_NODE_LIST = "Node List"
+SERVICE_PLACEMENT_ADVISOR = "Placement Advisor"
+# Whole environment of login shell is read once per operation and connection, other commands run without login
+# shell with these variables. Commands failing with "command not found" are repeated in login shell.
+USE_CAPTURED_ENVIRONMENT = True
+# variables of login shell which are set by the shell running the command, they are not captured
+CAPTURED_ENV_SKIPPED = ["_", "PWD", "OLDPWD", "SHLVL", "SHELLOPTS", "BASHOPTS"]
+# opt-in profiling of plugin entry points: "cpu" (cProfile) or "cpu,memory" (cProfile and tracemalloc)
+PROFILE_ENV_VAR = "DLPX_COUCHBASE_PROFILE"
+PROFILE_FOLDER = "profiles"  # inside toolkit hidden folder
+# Buckets are ingested by pipeline of stages (controller/ingestion_pipeline.py). Maximum number of buckets in one
+# stage at the same time, None - no limit. Index builds of drained buckets overlap replication of other buckets.
+# Restore stage runs one cbbackupmgr restore for all its buckets.
+INGESTION_STAGE_LIMITS = {"create": None, "replicate": 4, "restore": None, "index": 2}
+INGESTION_POLL_INTERVAL = 30  # seconds between checks of replication / index build progress
+INGESTION_TIMEOUT = 12 * 3600  # seconds, ingestion of all buckets, the same limit as index build of one resync
+INDEX_BUILD_CHECK_RETRIES = 10  # failed checks of index build in a row before ingestion is given up
+# Settings of staging cluster during resync / snapsync of backup (controller/ingest_profile.py), original values
+# are set back when ingestion ends. More reader / writer threads for the bulk load and no auto-compaction
+# ("undefined" fragmentation thresholds), the files are compacted by the restored settings afterwards.
+INGEST_PROFILE = {"num_reader_threads": 12, "num_writer_threads": 12,
+                  "databaseFragmentationThreshold[percentage]": "undefined",
+                  "databaseFragmentationThreshold[size]": "undefined",
+                  "viewFragmentationThreshold[percentage]": "undefined",
+                  "viewFragmentationThreshold[size]": "undefined"}
+# Buckets of staging with higher fragmentation are compacted before snapshot, within the time budget. Defaults for
+# dSources without compactionFragmentationThreshold / compactionTimeBudget parameters.
+COMPACTION_FRAGMENTATION_THRESHOLD = 30  # percent, 0 - compaction is disabled
+COMPACTION_TIME_BUDGET = 900  # seconds, compaction still running is cancelled
+COMPACTION_POLL_INTERVAL = 10  # seconds between checks of compaction tasks
+# Placement advisor of VDB services (controller/placement.py): number of indexes per bucket at which index / query
+# nodes get half of additional nodes
+PLACEMENT_INDEXES_PER_BUCKET = 4
+# Memory sizing of provisioned VDB (controller/memory_sizing.py): quotas are scaled down to memoryFraction percent
+# of physical memory of the smallest VDB host, but not below minimums of Couchbase Server
+MEMORY_FRACTION = 80  # VDBs without memoryFraction parameter
+SERVICE_MEMORY_MINIMUMS = {"data": 256, "index": 256, "fts": 256, "eventing": 256, "analytics": 1024}  # MB
+BUCKET_MEMORY_MINIMUM = 100  # MB
+# Warmup of VDB buckets (controller/warmup.py): thresholds are ep-engine defaults for VDBs without warmup
+# parameters, readiness gate polls cbstats of every bucket until warmup is done
+WARMUP_THRESHOLD = 100  # percent
+WARMUP_TIMEOUT = 3600  # seconds
+WARMUP_POLL_INTERVAL = 5  # seconds
+# Capacity planner (controller/capacity_planner.py): memory above working set of buckets, bytes of metadata of one
+# item kept in memory also by full eviction, share of index files kept in memory and rates of a typical staging host
+PLANNER_MEMORY_HEADROOM = 25  # percent
+PLANNER_ITEM_METADATA_BYTES = 100
+PLANNER_INDEX_RESIDENT_RATIO = 30  # percent
+PLANNER_INGEST_BYTES_PER_SECOND = 20 * 1024 * 1024
+PLANNER_WARMUP_BYTES_PER_SECOND = 100 * 1024 * 1024
+MEMCACHED_PORT = 11210
+# REST port of the index service, statistics of indexes for the snapshot
+INDEX_HTTP_PORT = 9102
+# Long running commands (restore of backup, rebalance) run as detached jobs (couchbase_lib/_job.py), output and exit
+# status are kept in a folder of the job inside hidden folder, the plugin polls the job state
+JOBS_FOLDER = "jobs"
+JOB_POLL_INTERVAL = 10  # seconds between checks of a running job
+# seconds of failed checks in a row (lost connection to the host) before the job is given up, the job keeps running
+# and the retried operation attaches to it
+JOB_UNREACHABLE_TIMEOUT = 1800
+JOB_ATTACHED = "attached"  # output of job launcher if the job is already running
+JOB_STDERR_DELIMITER = "<<CB_JOB_STDERR>>"  # separates stdout and stderr of exited job in output of job status
+RESTORE_JOB_TIMEOUT = 24 * 3600  # seconds, cbbackupmgr restore of buckets
+REBALANCE_JOB_TIMEOUT = 12 * 3600  # seconds
+# Progress of cbbackupmgr restore (controller/restore_progress.py): restored items are read from the staging buckets
+# once per interval, summary is logged and written to a file in the hidden folder
+RESTORE_PROGRESS_FILENAME = "restore_progress.json"
+RESTORE_PROGRESS_INTERVAL = 60  # seconds
+
+# Couchbase command backends used by run_couchbase_command
+COUCHBASE_CLI = "cli"
+COUCHBASE_REST = "rest"
+# commands sent through REST API by default, the rest is executed by couchbase-cli
+REST_DEFAULT_COMMANDS = ["get_server_list", "couchbase_server_info", "get_source_bucket_list", "bucket_list",
+                         "bucket_edit", "bucket_edit_ramquota", "bucket_edit_memory", "bucket_delete", "bucket_flush",
+                         "bucket_compact", "cluster_setting", "xdcr_setup", "xdcr_delete", "xdcr_replicate",
+                         "get_replication_uuid", "get_stream_id", "delete_replication"]
+REST_RESPONSE_DELIMITER = "<<CB_REST>>"
+# HTTP codes for which command is executed again by couchbase-cli (000 - no response from curl)
+REST_FALLBACK_HTTP_CODES = ("000", "404", "405")
+# DELETE of missing resource answers 404, couchbase-cli would only fail the same way
+REST_DELETE_FALLBACK_HTTP_CODES = ("000", "405")
+# status polling: no response means the server is down, couchbase-cli would not reach it either
+REST_POLL_FALLBACK_HTTP_CODES = ("405",)
 
 
 # String literals to match and throw particular type of exceptions. used by db_exception_handler.py
@@ -0,0 +1,227 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+REST equivalents of couchbase-cli commands from commands.py. Methods have the same names as in CommandFactory,
+but instead of a command line they return RestRequest objects. Any number of requests is sent by one curl invocation
+(curl_batch) and the output is split back into JSON bodies and HTTP codes (parse_batch_output).
+Credentials are never part of the request. Request refers to an environment variable (password or source_password)
+which is expanded by the remote shell, same as for the CLI commands.
+"""
+#######################################################################################################################
+
+import logging
+import re
+from shlex import quote
+from urllib.parse import quote as urlquote
+
+from db_commands.constants import REST_RESPONSE_DELIMITER, REST_FALLBACK_HTTP_CODES, REST_DELETE_FALLBACK_HTTP_CODES, \
+    REST_POLL_FALLBACK_HTTP_CODES
+
+logger = logging.getLogger(__name__)
+
+
+class RestRequest(object):
+    """
+    One call of Couchbase REST API.
+    Data values starting with $ are names of environment variables and are expanded by remote shell.
+    """
+
+    def __init__(self, method, hostname, port, username, path, data=None, password_var='password',
+                 fallback_codes=REST_FALLBACK_HTTP_CODES):
+        self.method = method
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.path = path
+        self.data = data if data is not None else []
+        self.password_var = password_var
+        self.fallback_codes = fallback_codes
+
+    def url(self):
+        return "http://{}:{}{}".format(self.hostname, self.port, self.path)
+
+    def curl_arguments(self):
+        arguments = ["--silent", "--show-error", "-X", self.method,
+                     "-u", "\"{}:${}\"".format(self.username, self.password_var)]
+        for key, value in self.data:
+            value = str(value)
+            if value.startswith("$"):
+                arguments.append("--data-urlencode \"{}={}\"".format(key, value))
+            else:
+                arguments.append("--data-urlencode {}".format(quote("{}={}".format(key, value))))
+        arguments.append("-w '\\n{}%{{http_code}}\\n'".format(REST_RESPONSE_DELIMITER))
+        arguments.append(quote(self.url()))
+        return " ".join(arguments)
+
+    def __repr__(self):
+        return "RestRequest({} {})".format(self.method, self.url())
+
+
+class RestCommand(object):
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def curl_batch(requests):
+        """
+        Build one curl command for all requests. Every response body is followed by delimiter line with HTTP code.
+        """
+        return "curl " + " --next ".join(request.curl_arguments() for request in requests)
+
+    @staticmethod
+    def parse_batch_output(output, count):
+        """
+        Split output of curl_batch into list of (body, http_code) tuples.
+        Requests without response (curl failed before the delimiter was written) get http code 000.
+        """
+        parts = re.split(r"\n?{}(\d{{3}})\n?".format(re.escape(REST_RESPONSE_DELIMITER)), output or "")
+        responses = []
+        for i in range(0, len(parts) - 1, 2):
+            responses.append((parts[i].strip(), parts[i + 1]))
+        while len(responses) < count:
+            responses.append(("", "000"))
+        return responses[:count]
+
+    @staticmethod
+    def get_server_list(hostname, port, username, **kwargs):
+        # unknown pool (404) is a valid answer for not configured cluster
+        return RestRequest("GET", hostname, port, username, "/pools/default",
+                           fallback_codes=REST_POLL_FALLBACK_HTTP_CODES)
+
+    @staticmethod
+    def couchbase_server_info(hostname, port, username, **kwargs):
+        return RestRequest("GET", hostname, port, username, "/nodes/self")
+
+    @staticmethod
+    def get_source_bucket_list(source_hostname, source_port, source_username, **kwargs):
+        return RestRequest("GET", source_hostname, source_port, source_username, "/pools/default/buckets?skipMap=true")
+
+    @staticmethod
+    def bucket_list(hostname, port, username, **kwargs):
+        return RestRequest("GET", hostname, port, username, "/pools/default/buckets?skipMap=true")
+
+    @staticmethod
+    def index_stats(hostname, port, username, **kwargs):
+        return RestRequest("GET", hostname, port, username, "/api/v1/stats")
+
+    @staticmethod
+    def bucket_edit(hostname, port, username, bucket_name, flush_value, **kwargs):
+        return RestRequest("POST", hostname, port, username, "/pools/default/buckets/{}".format(urlquote(bucket_name)),
+                           data=[("flushEnabled", flush_value)])
+
+    @staticmethod
+    def bucket_edit_ramquota(hostname, port, username, bucket_name, ramsize, **kwargs):
+        return RestRequest("POST", hostname, port, username, "/pools/default/buckets/{}".format(urlquote(bucket_name)),
+                           data=[("ramQuotaMB", ramsize)])
+
+    @staticmethod
+    def bucket_edit_memory(hostname, port, username, bucket_name, ramsize, eviction_policy=None, **kwargs):
+        data = [("ramQuotaMB", ramsize)]
+        if eviction_policy:
+            data.append(("evictionPolicy", eviction_policy))
+        return RestRequest("POST", hostname, port, username, "/pools/default/buckets/{}".format(urlquote(bucket_name)),
+                           data=data)
+
+    @staticmethod
+    def bucket_delete(hostname, port, username, bucket_name, **kwargs):
+        return RestRequest("DELETE", hostname, port, username,
+                           "/pools/default/buckets/{}".format(urlquote(bucket_name)), fallback_codes=REST_DELETE_FALLBACK_HTTP_CODES)
+
+    @staticmethod
+    def bucket_flush(hostname, port, username, bucket_name, **kwargs):
+        return RestRequest("POST", hostname, port, username,
+                           "/pools/default/buckets/{}/controller/doFlush".format(urlquote(bucket_name)))
+
+    @staticmethod
+    def bucket_compact(hostname, port, username, bucket_name, **kwargs):
+        return RestRequest("POST", hostname, port, username,
+                           "/pools/default/buckets/{}/controller/compactBucket".format(urlquote(bucket_name)))
+
+    @staticmethod
+    def bucket_cancel_compaction(hostname, port, username, bucket_name, **kwargs):
+        return RestRequest("POST", hostname, port, username,
+                           "/pools/default/buckets/{}/controller/cancelBucketCompaction".format(urlquote(bucket_name)),
+                           fallback_codes=())
+
+    @staticmethod
+    def get_tasks(hostname, port, username, **kwargs):
+        return RestRequest("GET", hostname, port, username, "/pools/default/tasks", fallback_codes=())
+
+    @staticmethod
+    def bucket_create(port, username, bucket_name, ramsize, evictionpolicy, bucket_type, bucket_compression=None,
+                      **kwargs):
+        data = [("name", bucket_name), ("bucketType", bucket_type), ("ramQuotaMB", ramsize), ("replicaNumber", 0),
+                ("evictionPolicy", evictionpolicy), ("conflictResolutionType", "seqno")]
+        if bucket_compression:
+            data.append(("compressionMode", bucket_compression))
+        return RestRequest("POST", "127.0.0.1", port, username, "/pools/default/buckets", data=data)
+
+    @staticmethod
+    def cluster_setting(hostname, port, username, cluster_ramsize, cluster_name, cluster_index_ramsize,
+                        cluster_fts_ramsize, cluster_eventing_ramsize, cluster_analytics_ramsize, **kwargs):
+        return RestRequest("POST", hostname, port, username, "/pools/default",
+                           data=[("memoryQuota", cluster_ramsize), ("indexMemoryQuota", cluster_index_ramsize),
+                                 ("ftsMemoryQuota", cluster_fts_ramsize),
+                                 ("eventingMemoryQuota", cluster_eventing_ramsize),
+                                 ("cbasMemoryQuota", cluster_analytics_ramsize), ("clusterName", cluster_name)])
+
+    @staticmethod
+    def xdcr_setup(source_hostname, source_port, source_username, hostname, port, username, cluster_name, **kwargs):
+        return RestRequest("POST", source_hostname, source_port, source_username, "/pools/default/remoteClusters",
+                           data=[("name", cluster_name), ("hostname", "{}:{}".format(hostname, port)),
+                                 ("username", username), ("password", "$password")],
+                           password_var='source_password')
+
+    @staticmethod
+    def xdcr_delete(source_hostname, source_port, source_username, cluster_name, **kwargs):
+        return RestRequest("DELETE", source_hostname, source_port, source_username,
+                           "/pools/default/remoteClusters/{}".format(urlquote(cluster_name)),
+                           password_var='source_password', fallback_codes=REST_DELETE_FALLBACK_HTTP_CODES)
+
+    @staticmethod
+    def xdcr_replicate(source_hostname, source_port, source_username, source_bucket_name, target_bucket_name,
+                       cluster_name, **kwargs):
+        return RestRequest("POST", source_hostname, source_port, source_username, "/controller/createReplication",
+                           data=[("fromBucket", source_bucket_name), ("toCluster", cluster_name),
+                                 ("toBucket", target_bucket_name), ("replicationType", "continuous")],
+                           password_var='source_password')
+
+    @staticmethod
+    def get_replication_uuid(source_hostname, source_port, source_username, **kwargs):
+        return RestRequest("GET", source_hostname, source_port, source_username, "/pools/default/remoteClusters",
+                           password_var='source_password')
+
+    @staticmethod
+    def get_stream_id(source_hostname, source_port, source_username, **kwargs):
+        return RestRequest("GET", source_hostname, source_port, source_username, "/pools/default/tasks",
+                           password_var='source_password')
+
+    @staticmethod
+    def delete_replication(source_hostname, source_port, source_username, id, **kwargs):
+        return RestRequest("DELETE", source_hostname, source_port, source_username,
+                           "/controller/cancelXDCR/{}".format(urlquote(id, safe='')),
+                           password_var='source_password', fallback_codes=REST_DELETE_FALLBACK_HTTP_CODES)
+
+    # settings of ingest profile, there is no couchbase-cli fallback for them
+
+    @staticmethod
+    def get_memcached_settings(hostname, port, username, **kwargs):
+        return RestRequest("GET", hostname, port, username, "/pools/default/settings/memcached/global",
+                           fallback_codes=())
+
+    @staticmethod
+    def set_memcached_settings(hostname, port, username, settings, **kwargs):
+        return RestRequest("POST", hostname, port, username, "/pools/default/settings/memcached/global",
+                           data=sorted(settings.items()), fallback_codes=())
+
+    @staticmethod
+    def get_auto_compaction(hostname, port, username, **kwargs):
+        return RestRequest("GET", hostname, port, username, "/settings/autoCompaction", fallback_codes=())
+
+    @staticmethod
+    def set_auto_compaction(hostname, port, username, settings, **kwargs):
+        return RestRequest("POST", hostname, port, username, "/controller/setAutoCompaction",
+                           data=sorted(settings.items()), fallback_codes=())
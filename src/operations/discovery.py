@@ -26,18 +26,15 @@ def find_repos(source_connection):
         Object of RepositoryDefinition class
     """
     try:
-        binary_paths = helper_lib.find_binary_path(source_connection)
         repositories = []
-        for binary_path in binary_paths.split(';'):
-            if helper_lib.check_dir_present(source_connection, binary_path):
-                install_path = helper_lib.find_install_path(source_connection, binary_path)
-                shell_path = helper_lib.find_shell_path(source_connection, binary_path)
-                version = helper_lib.find_version(source_connection, install_path)
-                (uid, gid) = helper_lib.find_ids(source_connection, install_path)
-                pretty_name = "Couchbase ({})".format(version)
-                repository_definition = RepositoryDefinition(cb_install_path=install_path, cb_shell_path=shell_path,
-                                                             version=version, pretty_name=pretty_name, uid=uid, gid=gid)
-                repositories.append(repository_definition)
+        # all installations are probed in one remote call
+        for install in helper_lib.find_repositories(source_connection):
+            pretty_name = "Couchbase ({})".format(install['version'])
+            repository_definition = RepositoryDefinition(cb_install_path=install['install_path'],
+                                                         cb_shell_path=install['shell_path'],
+                                                         version=install['version'], pretty_name=pretty_name,
+                                                         uid=install['uid'], gid=install['gid'])
+            repositories.append(repository_definition)
 
         return repositories
     except RepositoryDiscoveryError as err:
@@ -16,6 +16,10 @@ from controller import helper_lib
 from controller.couchbase_operation import CouchbaseOperation
 from controller.helper_lib import get_bucket_size_in_MB, get_sync_lock_file_name
 from controller.resource_builder import Resource
+from controller.ingest_profile import IngestProfile
+from controller.ingestion_pipeline import Stage
+from controller.resync_journal import ResyncJournal, RESTORED
+from db_commands.constants import INGESTION_STAGE_LIMITS
 from generated.definitions import SnapshotDefinition
 from internal_exceptions.plugin_exceptions import MultipleSyncError, MultipleSnapSyncError
 from operations import config
@@ -37,26 +41,67 @@ def resync_cbbkpmgr(staged_source, repository, source_config, input_parameters):
 
     linking.check_for_concurrent(resync_process, dsource_type, dsource_name, couchbase_host)
 
+    # steps completed by previous failed resync
+    journal = ResyncJournal.open(resync_process, linking.resync_identity(resync_process))
+
     # validate if this works as well for backup
-    linking.configure_cluster(resync_process)
+    linking.configure_cluster(resync_process, journal)
 
 
     logger.debug("Finding source and staging bucket list")
-    bucket_details_source = resync_process.source_bucket_list_offline()
-    bucket_details_staged = helper_lib.filter_bucket_name_from_output(resync_process.bucket_list())
-
-    buckets_toprocess = linking.buckets_precreation(resync_process, bucket_details_source, bucket_details_staged)
+    bucket_details_source = resync_process.source_bucket_catalog_offline()
+    bucket_details_staged = resync_process.bucket_catalog()
 
-    csv_bucket_list = ",".join(buckets_toprocess)
-    logger.debug("Started CB backup manager")
-    helper_lib.sleepForSecond(30)
-    resync_process.cb_backup_full(csv_bucket_list)
-    helper_lib.sleepForSecond(30)
+    buckets_toprocess = linking.ingestion_buckets(resync_process, bucket_details_source, bucket_details_staged)
 
-    linking.build_indexes(resync_process)
+    ingest_profile = IngestProfile(resync_process)
+    ingest_profile.apply()
+    try:
+        # buckets are restored together once all of them are created, indexes are built after the restore
+        linking.ingest_buckets(resync_process, buckets_toprocess,
+                               [linking.create_stage(resync_process, bucket_details_source, bucket_details_staged,
+                                                     journal),
+                                restore_stage(resync_process, journal,
+                                              [bucket.name for bucket in buckets_toprocess])],
+                               linking.IndexStage(resync_process, journal, reload=True))
+    finally:
+        ingest_profile.revert_after_ingestion()
+
+    # snapshot is provisioned from the first node, additional nodes join again after the snapshot
+    linking.leave_staging_nodes(resync_process)
     logger.info("Stopping Couchbase")
     resync_process.stop_couchbase()
     resync_process.save_config('parent')
+    journal.remove()
+
+
+def restore_stage(couchbase_obj, journal, bucket_names):
+    """
+    Buckets are restored by one cbbackupmgr run, so the backup archive is read once. The run starts when the last
+    bucket to restore is created, index builds of the buckets wait for it.
+    Buckets restored from the same backup by previous resync are not restored again.
+    """
+    backup_date = couchbase_obj.latest_backup_date()
+
+    def restored(bucket_name):
+        return journal.done(bucket_name, RESTORED) == backup_date
+
+    pending = [bucket_name for bucket_name in bucket_names if not restored(bucket_name)]
+
+    def restore(bucket_name):
+        logger.debug("Bucket {} is waiting for restore".format(bucket_name))
+
+    def finished(waiting):
+        if any(bucket_name not in waiting for bucket_name in pending):
+            return []
+        logger.debug("Started CB backup manager")
+        helper_lib.sleepForSecond(30)
+        couchbase_obj.cb_backup_full(",".join(pending))
+        journal.complete(pending, RESTORED, backup_date)
+        return waiting
+
+    return Stage("restore", restore, finished=finished, limit=INGESTION_STAGE_LIMITS["restore"], done=restored)
+
 
 def pre_snapshot_cbbkpmgr(staged_source, repository, source_config, input_parameters):
 
@@ -76,16 +121,22 @@ def pre_snapshot_cbbkpmgr(staged_source, repository, source_config, input_parame
     linking.check_for_concurrent(pre_snapshot_process, dsource_type, dsource_name, couchbase_host)
 
     logger.debug("Finding source and staging bucket list")
-    bucket_details_source = pre_snapshot_process.source_bucket_list_offline()
-    bucket_details_staged = helper_lib.filter_bucket_name_from_output(pre_snapshot_process.bucket_list())
-
-    bucket_details_staged = pre_snapshot_process.bucket_list()
-    filter_bucket_list = helper_lib.filter_bucket_name_from_output(bucket_details_staged)
-    csv_bucket_list = ",".join(filter_bucket_list)
-    pre_snapshot_process.cb_backup_full(csv_bucket_list)
-    logger.info("Re-ingesting from latest backup complete.")
-
-    linking.build_indexes(pre_snapshot_process)
+    bucket_list = pre_snapshot_process.bucket_catalog().names()
+    ingest_profile = IngestProfile(pre_snapshot_process)
+    ingest_profile.apply()
+    try:
+        # indexes are not maintained during restore, they are built deferred once the buckets are loaded
+        suspended = linking.suspend_indexes(pre_snapshot_process, bucket_list)
+        pre_snapshot_process.cb_backup_full(",".join(bucket_list))
+        logger.info("Re-ingesting from latest backup complete.")
+        linking.resume_indexes(pre_snapshot_process, suspended)
+
+        linking.build_indexes(pre_snapshot_process)
+    finally:
+        ingest_profile.revert_after_ingestion()
+    linking.compact_buckets(pre_snapshot_process)
+    # snapshot is provisioned from the first node, additional nodes join again after the snapshot
+    linking.leave_staging_nodes(pre_snapshot_process)
     logger.info("Stopping Couchbase")
     pre_snapshot_process.stop_couchbase()
     pre_snapshot_process.save_config('parent')
@@ -98,9 +149,10 @@ def post_snapshot_cbbkpmgr(staged_source, repository, source_config, dsource_typ
             source_config).build())
     rx_connection = staged_source.staged_connection
     post_snapshot_process.start_couchbase()
+    linking.join_staging_nodes(post_snapshot_process)
     snapshot = SnapshotDefinition(validate=False)
     bucket_list = []
-    bucket_details = post_snapshot_process.bucket_list()
+    bucket_details = post_snapshot_process.bucket_statistics()
 
     # if len(staged_source.parameters.config_settings_prov) != 0:
     #     bucket_list = []
@@ -119,11 +171,16 @@ def post_snapshot_cbbkpmgr(staged_source, repository, source_config, dsource_typ
     snapshot.db_path = staged_source.parameters.mount_path
     snapshot.couchbase_port = source_config.couchbase_src_port
     snapshot.couchbase_host = source_config.couchbase_src_host
-    snapshot.bucket_list = json.dumps(bucket_details)
+    snapshot.bucket_list = bucket_details.to_json()
+    linking.log_bucket_statistics(bucket_details)
     snapshot.time_stamp = helper_lib.current_time()
     snapshot.snapshot_id = str(helper_lib.get_snapshot_id())
     snapshot.couchbase_admin = post_snapshot_process.parameters.couchbase_admin
     snapshot.couchbase_admin_password = post_snapshot_process.parameters.couchbase_admin_password
+    report = linking.compaction_report(post_snapshot_process)
+    if report is not None:
+        snapshot.disk_used_before_compaction = report["before"]
+        snapshot.disk_used_after_compaction = report["after"]
     #logger.debug("snapshot schema: {}".format(snapshot))
     logger.debug("Deleting the lock files")
     helper_lib.delete_file(rx_connection, config.SNAP_SYNC_FILE_NAME)
@@ -144,12 +201,15 @@ def start_staging_cbbkpmgr(staged_source, repository, source_config):
     # TODO error handling
     start_staging.restore_config(what='current')
     start_staging.start_couchbase()
+    linking.join_staging_nodes(start_staging)
 
 
 def stop_staging_cbbkpmgr(staged_source, repository, source_config):
     stop_staging = CouchbaseOperation(
         Resource.ObjectBuilder.set_staged_source(staged_source).set_repository(repository).set_source_config(
             source_config).build())
+    # configuration of the first node is saved without the additional nodes, they join again when enabled
+    linking.leave_staging_nodes(stop_staging)
     stop_staging.stop_couchbase()
     stop_staging.save_config(what='current')
     stop_staging.delete_config()
@@ -174,6 +234,7 @@ def unmount_file_system_in_error_case(staged_source, repository, source_config):
             Resource.ObjectBuilder.set_staged_source(staged_source).set_repository(repository).set_source_config(
                 source_config).build())
         obj.stop_couchbase()
+        linking.stop_staging_nodes(obj)
         helper_lib.unmount_file_system(staged_source.staged_connection, staged_source.parameters.mount_path)
         logger.debug("Un mounting completed")
     except Exception as err:
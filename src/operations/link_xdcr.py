@@ -15,6 +15,10 @@ import db_commands
 from controller import helper_lib
 from controller.couchbase_operation import CouchbaseOperation
 from controller.resource_builder import Resource
+from controller.ingest_profile import IngestProfile
+from controller.ingestion_pipeline import Stage
+from controller.resync_journal import ResyncJournal, DRAINED, REPLICATED
+from db_commands.constants import INGESTION_STAGE_LIMITS
 from generated.definitions import SnapshotDefinition
 from internal_exceptions.database_exceptions import DuplicateClusterError
 from internal_exceptions.plugin_exceptions import MultipleSyncError, MultipleXDCRSyncError
@@ -41,19 +45,21 @@ def resync_xdcr(staged_source, repository, source_config, input_parameters):
 
     linking.check_for_concurrent(resync_process, dsource_type, dsource_name, couchbase_host)
 
-    linking.configure_cluster(resync_process)
+    # steps completed by previous failed resync
+    journal = ResyncJournal.open(resync_process, linking.resync_identity(resync_process))
+
+    linking.configure_cluster(resync_process, journal)
 
     
 
 
     # common steps for both XDCR & CB back up
 
-    bucket_details_source = resync_process.source_bucket_list()
-    bucket_details_staged = resync_process.bucket_list()
-    buckets_toprocess = linking.buckets_precreation(resync_process, bucket_details_source, bucket_details_staged)
+    bucket_details_source = resync_process.source_bucket_catalog()
+    bucket_details_staged = resync_process.bucket_catalog()
+    buckets_toprocess = linking.ingestion_buckets(resync_process, bucket_details_source, bucket_details_staged)
 
-    # run this for all buckets 
-    resync_process.setup_replication()       
+    resync_process.setup_remote_cluster()
 
     logger.debug("Finding staging_uuid & cluster_name on staging")
     staging_uuid = resync_process.get_replication_uuid()
@@ -63,18 +69,55 @@ def resync_xdcr(staged_source, repository, source_config, input_parameters):
         logger.debug("Can't find a replication UUID after setting it up")
         raise UserError("Can't find a replication UUID after setting it up")
 
-    # bucket_details_staged = resync_process.bucket_list()
-    # logger.debug("Filtering bucket name from output")
-    # filter_bucket_list = helper_lib.filter_bucket_name_from_output(bucket_details_staged)
-    for bkt in buckets_toprocess:
-        resync_process.monitor_bucket(bkt, staging_uuid)
-
-
-    linking.build_indexes(resync_process)
-
+    ingest_profile = IngestProfile(resync_process)
+    ingest_profile.apply()
+    try:
+        # every bucket is replicated and its indexes are built as soon as it is created / drained
+        linking.ingest_buckets(resync_process, buckets_toprocess,
+                               [linking.create_stage(resync_process, bucket_details_source, bucket_details_staged,
+                                                     journal),
+                                replicate_stage(resync_process, staging_uuid, journal)],
+                               linking.IndexStage(resync_process, journal))
+    finally:
+        ingest_profile.revert_after_ingestion()
+
+    # snapshot is provisioned from the first node, additional nodes join again after the snapshot
+    linking.leave_staging_nodes(resync_process)
     logger.info("Stopping Couchbase")
     resync_process.stop_couchbase()
     resync_process.save_config('parent')
+    journal.remove()
+
+
+def replicate_stage(couchbase_obj, staging_uuid, journal):
+    # replication of bucket is started if it doesn't exist yet, stage finishes when replication is drained
+    already_replicated = couchbase_obj.replicated_buckets()
+    logger.debug("Already replicated buckets: {}".format(already_replicated))
+
+    def replicate(bucket_name):
+        journal.complete([bucket_name], REPLICATED, save=False)
+        if bucket_name in already_replicated:
+            logger.debug("Bucket {} replication already configured".format(bucket_name))
+            return
+        logger.debug("Creating replication for {}".format(bucket_name))
+        couchbase_obj.xdcr_replicate(bucket_name, bucket_name)
+
+    def drained(bucket_names):
+        finished = []
+        for bucket_name in bucket_names:
+            if journal.done(bucket_name, DRAINED):
+                logger.debug("Replication of bucket {} drained by previous resync".format(bucket_name))
+                finished.append(bucket_name)
+                continue
+            pending_docs = couchbase_obj.replication_changes_left(bucket_name, staging_uuid)
+            logger.debug("Documents pending for replication of bucket {}: {}".format(bucket_name, pending_docs))
+            if pending_docs == 0:
+                finished.append(bucket_name)
+        if len(finished) > 0:
+            journal.complete(finished, DRAINED)
+        return finished
+
+    return Stage("replicate", replicate, drained, INGESTION_STAGE_LIMITS["replicate"])
 
 
 def pre_snapshot_xdcr(staged_source, repository, source_config, input_parameters):
@@ -92,6 +135,9 @@ def pre_snapshot_xdcr(staged_source, repository, source_config, input_parameters
         msg = db_commands.constants.RESYNCE_OR_SNAPSYNC_FOR_OTHER_OBJECT_IN_PROGRESS.format(source_config.pretty_name,
                                                                                             input_parameters.couchbase_host)
         helper_lib.write_file(staged_source.staged_connection, msg,  config.SNAP_SYNC_FILE_NAME)
+    linking.compact_buckets(pre_snapshot_process)
+    # snapshot is provisioned from the first node, additional nodes join again after the snapshot
+    linking.leave_staging_nodes(pre_snapshot_process)
     logger.info("Stopping Couchbase")
     pre_snapshot_process.stop_couchbase()
     pre_snapshot_process.save_config('parent')
@@ -106,8 +152,8 @@ def post_snapshot_xdcr(staged_source, repository, source_config, dsource_type):
 
     # post_snapshot_process.save_config()
     post_snapshot_process.start_couchbase()
+    linking.join_staging_nodes(post_snapshot_process)
     snapshot = SnapshotDefinition(validate=False)
-    bucket_details = post_snapshot_process.bucket_list()
 
     # if len(staged_source.parameters.config_settings_prov) != 0:
     #     bucket_list = []
@@ -121,16 +167,21 @@ def post_snapshot_xdcr(staged_source, repository, source_config, dsource_type):
 
     snapshot.indexes = ind
 
-    bucket_details = post_snapshot_process.bucket_list()
+    bucket_details = post_snapshot_process.bucket_statistics()
 
     snapshot.db_path = staged_source.parameters.mount_path
     snapshot.couchbase_port = source_config.couchbase_src_port
     snapshot.couchbase_host = source_config.couchbase_src_host
-    snapshot.bucket_list = json.dumps(bucket_details)
+    snapshot.bucket_list = bucket_details.to_json()
+    linking.log_bucket_statistics(bucket_details)
     snapshot.time_stamp = helper_lib.current_time()
     snapshot.snapshot_id = str(helper_lib.get_snapshot_id())
     snapshot.couchbase_admin = post_snapshot_process.parameters.couchbase_admin
     snapshot.couchbase_admin_password = post_snapshot_process.parameters.couchbase_admin_password
+    report = linking.compaction_report(post_snapshot_process)
+    if report is not None:
+        snapshot.disk_used_before_compaction = report["before"]
+        snapshot.disk_used_after_compaction = report["after"]
     #logger.debug("snapshot schema: {}".format(snapshot))
     logger.debug("Deleting the snap sync lock file {}".format(config.SNAP_SYNC_FILE_NAME))
     helper_lib.delete_file(staged_source.staged_connection, config.SNAP_SYNC_FILE_NAME)
@@ -152,6 +203,7 @@ def start_staging_xdcr(staged_source, repository, source_config):
     # TODO error handling
     start_staging.restore_config(what='current')
     start_staging.start_couchbase()
+    linking.join_staging_nodes(start_staging)
 
     # already_set_up_done, name_conflict = start_staging.check_duplicate_replication(
     #     start_staging.parameters.stg_cluster_name)
@@ -194,6 +246,8 @@ def stop_staging_xdcr(staged_source, repository, source_config):
     helper_lib.delete_file(rx_connection,
                            config_dir + "/" + helper_lib.get_sync_lock_file_name(dsource_type,
                                                                                  source_config.pretty_name))
+    # configuration of the first node is saved without the additional nodes, they join again when enabled
+    linking.leave_staging_nodes(stop_staging)
     stop_staging.stop_couchbase()
     stop_staging.save_config(what='current')
     stop_staging.delete_config()
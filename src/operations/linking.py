@@ -9,17 +9,24 @@ import logging
 import os
 import json
 import time
+from collections import OrderedDict
 
 from dlpx.virtualization.platform import Status
 
 import db_commands
 from controller import helper_lib
+from controller.bucket_catalog import BUCKET_STATS
 from controller.couchbase_operation import CouchbaseOperation
 from controller.helper_lib import get_bucket_size_in_MB, get_sync_lock_file_name
 from controller.resource_builder import Resource
+from controller import resync_journal
+from controller.ingestion_pipeline import IngestionPipeline, Stage
 from generated.definitions import SnapshotDefinition
 from internal_exceptions.database_exceptions import DuplicateClusterError
 from internal_exceptions.plugin_exceptions import MultipleSyncError, MultipleXDCRSyncError
+from db_commands.constants import INGESTION_STAGE_LIMITS, COMPACTION_FRAGMENTATION_THRESHOLD, \
+    COMPACTION_TIME_BUDGET, COMPACTION_POLL_INTERVAL, COMPACTION_REPORT_FILENAME, \
+    INDEX_BUILD_CHECK_RETRIES, STAGING_NODES_FILENAME
 from operations import config
 from dlpx.virtualization.platform.exceptions import UserError
 
@@ -61,9 +68,28 @@ def verify_sync_lock_file_for_this_job(rx_connection, sync_filename):
     return True
 
 
-def configure_cluster(couchbase_obj):
+def resync_identity(couchbase_obj):
+    """ configuration of dSource which has to match the resync journal """
+    parameters = couchbase_obj.parameters
+    if parameters.d_source_type == db_commands.constants.CBBKPMGR:
+        source = "{}/{}".format(parameters.couchbase_bak_loc, parameters.couchbase_bak_repo)
+    else:
+        source = "{}:{}".format(couchbase_obj.source_config.couchbase_src_host,
+                                couchbase_obj.source_config.couchbase_src_port)
+    return {"d_source_type": parameters.d_source_type,
+            "source": source,
+            "cluster_name": parameters.stg_cluster_name,
+            "bucket_size": parameters.bucket_size,
+            "buckets": sorted(config_bucket["bucketName"] for config_bucket in parameters.config_settings_prov)}
+
+
+def configure_cluster(couchbase_obj, journal=None):
     # configure Couchbase cluster
 
+    if journal is not None and journal.cluster_configured() and couchbase_obj.check_cluster_configured():
+        logger.debug("Cluster configured by previous resync and running - skipping configuration")
+        return
+
     logger.debug("Checking cluster config")
     if couchbase_obj.check_config():
         logger.debug("cluster config found - restoring")
@@ -102,87 +128,365 @@ def configure_cluster(couchbase_obj):
                 logger.debug("Cluster configured but not with user/password given in Delphix potentially another cluster")
                 raise UserError("Cluster configured but not with user/password given in Delphix potentially another cluster")
 
-
-def buckets_precreation(couchbase_obj, bucket_details_source, bucket_details_staged):
+    join_staging_nodes(couchbase_obj)
+
+    if journal is not None:
+        journal.complete_cluster()
+
+
+def staging_nodes(couchbase_obj):
+    """
+    Additional nodes of staging cluster (node_list of dSource)
+    :return: list of tuples (node number, node definition, CouchbaseOperation connected to the node)
+    """
+    return [(nodeno, node, _staging_node_operation(couchbase_obj, node))
+            for nodeno, node in enumerate(couchbase_obj.parameters.node_list or [], 2)]
+
+
+def staging_members(couchbase_obj):
+    """
+    Additional nodes joined to staging cluster, as saved by join_staging_nodes. Nodes removed from node_list since
+    then are still members of the cluster until the next rebalance moves them out.
+    :return: list of tuples (node number, node definition, CouchbaseOperation connected to the node)
+    """
+    filename = couchbase_obj.get_config_directory() + "/" + STAGING_NODES_FILENAME
+    content, std_err, exit_code = couchbase_obj.run_os_command(os_command='cat', path=filename)
+    if exit_code != 0 or content.strip() == "":
+        return []
+    try:
+        nodes = json.loads(content)
+    except ValueError:
+        raise UserError("Saved nodes of staging cluster {} are corrupted".format(filename),
+                        "Remove nodes which are not in node list of dSource from staging cluster manually and "
+                        "delete the file")
+    return [(node["nodeno"], node, _staging_node_operation(couchbase_obj, node)) for node in nodes]
+
+
+def _save_staging_members(couchbase_obj, nodes):
+    filename = couchbase_obj.get_config_directory() + "/" + STAGING_NODES_FILENAME
+    std_out, std_err, exit_code = couchbase_obj.run_os_command(
+        os_command='write_text_file', filename=filename,
+        data=json.dumps([dict(node, nodeno=nodeno) for nodeno, node, _ in nodes], sort_keys=True))
+    if exit_code != 0:
+        raise UserError("Unable to save nodes of staging cluster to {}".format(filename),
+                        "Check free space and permissions of the mount point", std_err)
+
+
+def _staging_node_operation(couchbase_obj, node):
+    return CouchbaseOperation(
+        Resource.ObjectBuilder.set_staged_source(couchbase_obj.staged_source).set_repository(
+            couchbase_obj.repository).set_source_config(couchbase_obj.source_config).build(),
+        helper_lib.make_nonprimary_connection(couchbase_obj.connection, node['environment'],
+                                              node['environmentUser']))
+
+
+def _removed_staging_members(couchbase_obj, nodes):
+    environments = [node["environment"] for _, node, _ in nodes]
+    return [member for member in staging_members(couchbase_obj) if member[1]["environment"] not in environments]
+
+
+def join_staging_nodes(couchbase_obj):
+    """
+    Nodes of node_list not active in staging cluster yet are bootstrapped and added, nodes removed from node_list
+    are moved out of the cluster, by a single rebalance (same as _resize_cluster of VDB)
+    """
+    nodes = staging_nodes(couchbase_obj)
+    removed = _removed_staging_members(couchbase_obj, nodes)
+    if len(nodes) == 0 and len(removed) == 0:
+        return
+    members = couchbase_obj.cluster_members()
+    added = []
+    for nodeno, node, node_obj in nodes:
+        if couchbase_obj.node_address(node) in members:
+            logger.debug("Staging node {} already in cluster".format(node['node_addr']))
+            continue
+        node_obj.addnode(nodeno, node, rebalance=False)
+        added.append(node['node_addr'])
+    remove = [address for address in [couchbase_obj.node_address(node) for _, node, _ in removed]
+              if address in members]
+    if len(added) > 0 or len(remove) > 0:
+        logger.info("Rebalancing staging cluster, adding nodes {} and removing nodes {}".format(added, remove))
+        couchbase_obj.rebalance(remove=remove)
+    for nodeno, node, node_obj in removed:
+        node_obj.stop_couchbase()
+        node_obj.delete_config()
+    _save_staging_members(couchbase_obj, nodes)
+
+
+def leave_staging_nodes(couchbase_obj):
+    """
+    Move additional nodes out of staging cluster and stop them before snapshot and when dSource is disabled.
+    VDB is provisioned from configuration and data of the first node (config.dat_1, data_1), so the rebalance moves
+    all vBuckets to the first node and its configuration doesn't name staging hosts as members. Nodes join again
+    after the snapshot or when dSource is enabled (join_staging_nodes).
+    """
+    nodes = staging_nodes(couchbase_obj)
+    nodes = nodes + _removed_staging_members(couchbase_obj, nodes)
+    if len(nodes) == 0:
+        return
+    members = couchbase_obj.cluster_members()
+    remove = [address for address in [couchbase_obj.node_address(node) for _, node, _ in nodes] if address in members]
+    if len(remove) > 0:
+        logger.info("Rebalancing staging nodes {} out of the cluster".format(remove))
+        couchbase_obj.rebalance(remove=remove)
+    for nodeno, node, node_obj in nodes:
+        node_obj.stop_couchbase()
+        # ejected node has no cluster, it is bootstrapped again when it joins
+        node_obj.delete_config()
+    _save_staging_members(couchbase_obj, [])
+
+
+def stop_staging_nodes(couchbase_obj):
+    """ Stop additional staging nodes, including nodes removed from node_list which are still members """
+    nodes = staging_nodes(couchbase_obj)
+    for nodeno, node, node_obj in nodes + _removed_staging_members(couchbase_obj, nodes):
+        node_obj.stop_couchbase()
+
+
+def ingestion_buckets(couchbase_obj, bucket_details_source, bucket_details_staged):
     # common steps for both XDCR & CB back up
-    # return a list of precreated buckets to process
-    logger.debug("buckets_precreation")
-    bucket_list = []
+    # bucket_details_source and bucket_details_staged are BucketCatalog objects
+    # return a list of source buckets to ingest, buckets on staging which are not configured are removed
+    logger.debug("ingestion_buckets")
     config_setting = couchbase_obj.parameters.config_settings_prov
     logger.debug("Bucket names passed for configuration: {}".format(config_setting))
-    bucket_configured_staged = []
-    if len(config_setting) > 0:
-        # process for list of buckets 
-        logger.debug("Getting bucket information from config")
-        buckets_dict = { b["name"]:b  for b in bucket_details_source }
-        for config_bucket in config_setting:
-            bucket_configured_staged.append(config_bucket["bucketName"])
-            logger.debug("Filtering bucket name with size only from above output") 
-            bucket = buckets_dict[config_bucket["bucketName"]]
-            logger.debug("Running bucket operations for {}".format(bucket))
-            bkt_name = bucket['name']
-            bkt_size = bucket['ram']
-            bkt_type = bucket['bucketType']
-            bkt_compression = bucket['compressionMode']
-
-            bkt_size_mb = helper_lib.get_bucket_size_in_MB(couchbase_obj.parameters.bucket_size, bkt_size)
-
-            if config_bucket["bucketName"] not in bucket_details_staged:
-                couchbase_obj.bucket_create(config_bucket["bucketName"], bkt_size_mb, bkt_type, bkt_compression)
-            else:
-                logger.debug("Bucket {} already present in staged environment. Recreating bucket ".format(
-                    config_bucket["bucketName"]))
-                couchbase_obj.bucket_remove(config_bucket["bucketName"])
-                couchbase_obj.bucket_create(config_bucket["bucketName"], bkt_size_mb, bkt_type, bkt_compression)
-            
-            bucket_list.append(config_bucket["bucketName"])
-
-
-        logger.debug("Finding buckets present at staged server")
-        bucket_details_staged = couchbase_obj.bucket_list()
-        filter_bucket_list = helper_lib.filter_bucket_name_from_output(bucket_details_staged)
-        extra_bucket = list(set(filter_bucket_list) - set(bucket_configured_staged))
-
-        logger.debug("Extra bucket found to delete:{} ".format(extra_bucket))
-        for bucket in extra_bucket:
-            couchbase_obj.bucket_remove(bucket)
-    else:
+    if len(config_setting) == 0:
         # process for all buckets 
-        filter_source_bucket = helper_lib.filter_bucket_name_from_json(bucket_details_source)
-        for items in bucket_details_source:
-            if items:
-                logger.debug("Running bucket operations for {}".format(items))
-                bkt_name = items['name']
-                bkt_size = items['ram']
-                bkt_type = items['bucketType']
-                bkt_compression = items['compressionMode']
-
-                bkt_size_mb = helper_lib.get_bucket_size_in_MB(couchbase_obj.parameters.bucket_size, bkt_size)
-                if bkt_name not in bucket_details_staged:
-                    couchbase_obj.bucket_create(bkt_name, bkt_size_mb, bkt_type, bkt_compression)
-                else:
-                    logger.debug(
-                        "Bucket {} already present in staged environment. Recreating bucket ".format(bkt_name))
-                    couchbase_obj.bucket_remove(bkt_name)
-                    couchbase_obj.bucket_create(bkt_name, bkt_size_mb, bkt_type, bkt_compression)
-                bucket_list.append(bkt_name)
-
+        return list(bucket_details_source)
 
+    # process for list of buckets 
+    logger.debug("Getting bucket information from config")
+    bucket_list = []
+    for config_bucket in config_setting:
+        bucket = bucket_details_source.get(config_bucket["bucketName"])
+        if bucket is None:
+            raise UserError("Bucket {} not found on source".format(config_bucket["bucketName"]),
+                            "Check bucket names configured for dSource")
+        bucket_list.append(bucket)
+
+    extra_bucket = list(set(bucket_details_staged.names()) - set(bucket.name for bucket in bucket_list))
+    logger.debug("Extra bucket found to delete:{} ".format(extra_bucket))
+    for bucket in extra_bucket:
+        couchbase_obj.bucket_remove(bucket)
     return bucket_list
 
 
+def create_stage(couchbase_obj, bucket_details_source, bucket_details_staged, journal=None):
+    # first stage of ingestion pipeline, buckets created by previous resync (journal) are kept
+    # if definition on staging is still valid
+    def create(bucket_name):
+        logger.debug("Running bucket operations for {}".format(bucket_name))
+        _recreate_bucket(couchbase_obj, bucket_details_source.get(bucket_name), bucket_details_staged, journal)
+        if journal is not None:
+            # written together with the next completed step of the bucket
+            journal.complete([bucket_name], resync_journal.CREATED, save=False)
+
+    return Stage("create", create, limit=INGESTION_STAGE_LIMITS["create"])
+
+
+def _recreate_bucket(couchbase_obj, bucket, bucket_details_staged, journal=None):
+    bkt_size_mb = helper_lib.get_bucket_size_in_MB(couchbase_obj.parameters.bucket_size, bucket.ram)
+    if journal is not None:
+        staged = bucket_details_staged.get(bucket.name)
+        if journal.done(bucket.name, resync_journal.CREATED) and staged is not None and \
+                staged.ram == bkt_size_mb * 1024 * 1024 and staged.bucket_type == bucket.bucket_type:
+            logger.debug("Bucket {} created by previous resync - keeping it".format(bucket.name))
+            return
+        journal.reset_bucket(bucket.name)
+    if bucket.name in bucket_details_staged:
+        logger.debug("Bucket {} already present in staged environment. Recreating bucket ".format(bucket.name))
+        couchbase_obj.bucket_remove(bucket.name)
+    couchbase_obj.bucket_create(bucket.name, bkt_size_mb, bucket.bucket_type, bucket.compression_mode)
+
+
+class IndexStage(Stage):
+    """
+    Last stage of ingestion pipeline, indexes of one bucket are built when the bucket is ingested.
+    Index definitions are read once, or for every bucket if reload is set (backup ingestion reads definitions
+    restored into the bucket). Indexes built by previous resync (journal) are skipped.
+    """
+
+    def __init__(self, couchbase_obj, journal=None, reload=False):
+        super(IndexStage, self).__init__("index", self.start_build, self.builds_finished,
+                                         INGESTION_STAGE_LIMITS["index"], self.all_built)
+        self.couchbase_obj = couchbase_obj
+        self.journal = journal
+        self.reload = reload
+        self.definitions = None
+        self.pending = {}
+        self.failed_checks = 0
+
+    def bucket_definitions(self, bucket_name):
+        if self.definitions is None or self.reload:
+            self.definitions = {}
+            for index_definition in self.couchbase_obj.get_indexes_definition():
+                self.definitions.setdefault(resync_journal.index_bucket(index_definition), []).append(index_definition)
+            logger.debug("indexes definition : {}".format(self.definitions))
+        built = self.journal.built_indexes() if self.journal is not None else []
+        return [i for i in self.definitions.get(bucket_name, []) if i not in built]
+
+    def all_built(self, bucket_name):
+        self.pending[bucket_name] = self.bucket_definitions(bucket_name)
+        return len(self.pending[bucket_name]) == 0
+
+    def start_build(self, bucket_name):
+        build_deferred(self.couchbase_obj, self.pending[bucket_name])
+
+    def builds_finished(self, bucket_names):
+        unbuilt = self.couchbase_obj.unbuilt_indexes()
+        if unbuilt is None:
+            # query failed, builds are not known to be running, pipeline must not wait for them forever
+            self.failed_checks = self.failed_checks + 1
+            if self.failed_checks > INDEX_BUILD_CHECK_RETRIES:
+                raise UserError("Unable to check index build of buckets {}".format(", ".join(bucket_names)),
+                                "Check that the query and index services are running on the staging cluster",
+                                "Index build state couldn't be read {} times in a row".format(self.failed_checks))
+            return []
+        self.failed_checks = 0
+        finished = [bucket_name for bucket_name in bucket_names if unbuilt.get(bucket_name, 0) == 0]
+        if self.journal is not None and len(finished) > 0:
+            self.journal.complete_indexes([i for bucket_name in finished for i in self.pending[bucket_name]])
+        return finished
+
+    def build_remaining(self):
+        """ definitions without a bucket name are built after the pipeline, as by build_indexes """
+        remaining = (self.definitions or {}).get(None, [])
+        if len(remaining) == 0:
+            return
+        build_deferred(self.couchbase_obj, remaining)
+        self.couchbase_obj.check_index_build()
+
+
+def ingest_buckets(couchbase_obj, buckets, stages, index_stage):
+    # run ingestion pipeline, every bucket is processed independently from other buckets
+    bucket_names = [bucket.name for bucket in buckets]
+    logger.debug("Ingesting buckets {} by stages {}".format(bucket_names, [stage.name for stage in stages]))
+    completed = IngestionPipeline(stages + [index_stage]).run(bucket_names)
+    index_stage.build_remaining()
+    return completed
+
+
 def build_indexes(couchbase_obj):
     # create indexes based on the index definition
 
     logger.debug("index builder")
     ind = couchbase_obj.get_indexes_definition()
     logger.debug("indexes definition : {}".format(ind))
-    for i in ind:
-        logger.debug(i)
-        couchbase_obj.build_index(i)
+    build_deferred(couchbase_obj, ind)
     couchbase_obj.check_index_build()
 
 
+def build_deferred(couchbase_obj, index_definitions):
+    # indexes are created deferred and built by one BUILD INDEX per keyspace, so data of the keyspace is scanned
+    # once for all its indexes. BUILD statements (indexes restored by cbbackupmgr) are run as they are.
+    deferred = OrderedDict()
+    for i in index_definitions:
+        logger.debug(i)
+        if helper_lib.is_create_index(i):
+            couchbase_obj.build_index(helper_lib.deferred_index_definition(i))
+            deferred.setdefault(helper_lib.index_keyspace(i), []).append(helper_lib.index_name(i))
+        else:
+            couchbase_obj.build_index(i)
+    for keyspace, names in deferred.items():
+        couchbase_obj.build_index("BUILD INDEX ON {}({})".format(keyspace, ",".join("`{}`".format(name)
+                                                                                    for name in names)))
+
+
+def suspend_indexes(couchbase_obj, bucket_names):
+    # indexes of buckets are dropped before bulk load, so they are not maintained for every loaded document
+    # return definitions of dropped indexes
+    suspended = [i for i in couchbase_obj.staging_indexes() if i['bucket'] in bucket_names]
+    for i in suspended:
+        logger.debug("Dropping index {} of bucket {} before load".format(i['indexName'], i['bucket']))
+        couchbase_obj.drop_index(i['bucket'], i['indexName'])
+    return suspended
+
+
+def resume_indexes(couchbase_obj, suspended):
+    # indexes dropped by suspend_indexes and not restored by the load are created again as deferred,
+    # build_indexes builds them together with the restored ones
+    if len(suspended) == 0:
+        return
+    existing = set((i['bucket'], i['indexName']) for i in couchbase_obj.staging_indexes())
+    for i in suspended:
+        if (i['bucket'], i['indexName']) not in existing:
+            couchbase_obj.build_index(helper_lib.deferred_index_definition(i['definition']))
+
+
+def compact_buckets(couchbase_obj):
+    """
+    Compact data files of buckets with fragmentation above compactionFragmentationThreshold before snapshot and wait
+    for it at most compactionTimeBudget seconds. Dead blocks of updated documents are not captured by the snapshot.
+    Disk usage before and after is written to the hidden folder for the snapshot metadata (compaction_report).
+    """
+    threshold = couchbase_obj.parameters.compaction_fragmentation_threshold
+    if threshold is None:
+        threshold = COMPACTION_FRAGMENTATION_THRESHOLD
+    time_budget = couchbase_obj.parameters.compaction_time_budget
+    if time_budget is None:
+        time_budget = COMPACTION_TIME_BUDGET
+
+    before = couchbase_obj.bucket_disk_usage()
+    fragmented = []
+    for bucket_name, (disk_used, data_used) in sorted(before.items()):
+        fragmentation = 100 * (disk_used - data_used) // disk_used if disk_used > 0 else 0
+        logger.debug("Bucket {} fragmentation {}%".format(bucket_name, fragmentation))
+        if threshold > 0 and fragmentation >= threshold:
+            fragmented.append(bucket_name)
+
+    after = before
+    if len(fragmented) > 0:
+        logger.info("Compacting buckets {} before snapshot".format(fragmented))
+        couchbase_obj.bucket_compact(fragmented)
+        end_time = time.time() + time_budget
+        compacting = couchbase_obj.compacting_buckets()
+        while compacting and time.time() < end_time:
+            helper_lib.sleepForSecond(COMPACTION_POLL_INTERVAL)
+            compacting = couchbase_obj.compacting_buckets()
+        if compacting:
+            # temporary files of unfinished compaction would only make the snapshot bigger
+            logger.warn("Compaction of buckets {} not finished in {} seconds, cancelling it".format(compacting,
+                                                                                                   time_budget))
+            couchbase_obj.bucket_cancel_compaction(compacting)
+        after = couchbase_obj.bucket_disk_usage()
+
+    report = {"before": sum(disk_used for disk_used, _ in before.values()),
+              "after": sum(disk_used for disk_used, _ in after.values()),
+              "compacted": fragmented}
+    logger.info("Disk used by buckets before snapshot: {before} bytes, after compaction: {after} bytes".format(
+        **report))
+    couchbase_obj.run_os_command(os_command='write_text_file', data=json.dumps(report, sort_keys=True),
+                                 filename=couchbase_obj.get_config_directory() + "/" + COMPACTION_REPORT_FILENAME)
+    return report
+
+
+def compaction_report(couchbase_obj):
+    """
+    Report written by compact_buckets of this snapshot, the report is removed so the next snapshot doesn't reuse it
+    :return: dict with disk usage before and after compaction or None
+    """
+    filename = couchbase_obj.get_config_directory() + "/" + COMPACTION_REPORT_FILENAME
+    content, std_err, exit_code = couchbase_obj.run_os_command(os_command='cat', path=filename)
+    if exit_code != 0 or content == "":
+        return None
+    couchbase_obj.run_os_command(os_command='delete_file', filename=filename)
+    try:
+        return json.loads(content)
+    except ValueError:
+        logger.debug("Compaction report {} is corrupted".format(filename))
+        return None
+
+
+def log_bucket_statistics(bucket_catalog):
+    """ dataset of the snapshot, per bucket statistics are kept in bucket_list of the snapshot """
+    for record in bucket_catalog:
+        if record.stats is not None:
+            logger.info("Bucket {} in snapshot: {}".format(record.name, ", ".join(
+                "{} {}".format(stat, record.stats[stat]) for stat in BUCKET_STATS if stat in record.stats)))
+    logger.info("Buckets in snapshot: {} items, {} bytes of data, {} bytes on disk, {} bytes of indexes".format(
+        bucket_catalog.total_stat("items"), bucket_catalog.total_stat("data_used"),
+        bucket_catalog.total_stat("disk_used"), bucket_catalog.total_stat("index_disk_size")))
+
 
 def d_source_status(staged_source, repository, source_config):
     status_obj = CouchbaseOperation(
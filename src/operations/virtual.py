@@ -20,14 +20,17 @@ from generated.definitions import SourceConfigDefinition
 
 from internal_exceptions.database_exceptions import FailedToReadBucketDataFromSnapshot, CouchbaseServicesError
 from controller import helper_lib
+from controller import memory_sizing
+from controller import placement
+from controller import warmup
+from controller.helper_lib import make_nonprimary_connection
 from controller.couchbase_operation import CouchbaseOperation
+from controller.bucket_catalog import BucketCatalog
+from db_commands.constants import VDB_NODES_FILENAME
 import logging
 from controller.resource_builder import Resource
-from dlpx.virtualization.common import RemoteEnvironment
-from dlpx.virtualization.common import RemoteHost
-from dlpx.virtualization.common import RemoteUser
-from dlpx.virtualization.common import RemoteConnection
 from dlpx.virtualization.platform import Status
+from dlpx.virtualization.platform.exceptions import UserError
 
 # Global logger for this File
 logger = logging.getLogger(__name__)
@@ -57,21 +60,22 @@ def vdb_unconfigure(virtual_source, repository, source_config):
     Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
         source_config).build())
 
-    vdb_stop(virtual_source, repository, source_config)
+    try:
+        nodes = vdb_nodes(provision_process)
+    except UserError as err:
+        # VDB is deleted, nodes of node_list are cleaned up even without saved nodes
+        logger.warn("{}, unconfiguring nodes of node list".format(err.message))
+        nodes = [dict(node, nodeno=nodeno) for nodeno, node in enumerate(provision_process.parameters.node_list, 2)]
+
+    provision_process.stop_couchbase()
     provision_process.delete_config()
 
+    for nodeno, node, node_obj in _node_operations(provision_process, nodes):
+        logger.debug("Unconfiguring node {}: {}".format(nodeno, node))
+        node_obj.delete_config()
+        node_obj.stop_couchbase()
 
-    if provision_process.parameters.node_list is not None and len(provision_process.parameters.node_list) > 0:
-        for node in provision_process.parameters.node_list:
-            logger.debug("+++++++++++++++++++++++++++")
-            logger.debug(node)
-            logger.debug("+++++++++++++++++++++++++++")
-            addnode = CouchbaseOperation(
-                Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
-                    source_config).build(),
-                    make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
-            addnode.delete_config()
-            addnode.stop_couchbase()
+    provision_process.run_os_command(os_command='delete_file', filename=_nodes_file(provision_process))
 
 
 def vdb_reconfigure(virtual_source, repository, source_config, snapshot):
@@ -81,81 +85,177 @@ def vdb_reconfigure(virtual_source, repository, source_config, snapshot):
     logger.debug("In vdb_reconfigure...")
     provision_process = CouchbaseOperation(
         Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
-            source_config).build())
-
+            source_config).set_snapshot(snapshot).build())
 
     provision_process.stop_couchbase()
-    
-    if provision_process.parameters.node_list is not None and len(provision_process.parameters.node_list) > 0:
-        multinode = True
-        server_count = len(provision_process.parameters.node_list) + 1
-    else:
-        multinode = False
 
-    nodeno = 1
-    provision_process.restore_config(what='current', nodeno=nodeno)
+    # nodes of the cluster when VDB was disabled, node_list may have been changed since then
+    nodes = _node_operations(provision_process, vdb_nodes(provision_process))
+    removed = _removed_nodes(provision_process, nodes)
+    if removed:
+        # data of the nodes is on their mounts, the cluster can't be started without them
+        raise UserError("Nodes {} removed from node list are members of the VDB cluster".format(
+                            [node["node_addr"] for _, node, _ in removed]),
+                        "Add the nodes back to node list and enable the VDB. Remove them from node list while the "
+                        "VDB is enabled, they are moved out of the cluster when the VDB stops.")
+    multinode = len(nodes) > 0
+
+    provision_process.restore_config(what='current', nodeno=1)
     provision_process.start_couchbase(no_wait=multinode)
 
+    for nodeno, node, node_obj in nodes:
+        logger.debug("Restoring node {}: {}".format(nodeno, node))
+        node_obj.stop_couchbase()
+        node_obj.restore_config(what='current', nodeno=nodeno)
+        node_obj.start_couchbase(no_wait=multinode)
 
-    if provision_process.parameters.node_list is not None and len(provision_process.parameters.node_list) > 0:
-        for node in provision_process.parameters.node_list:
-            nodeno = nodeno + 1
-            logger.debug("+++++++++++++++++++++++++++")
-            logger.debug(node)
-            logger.debug(nodeno)
-            logger.debug("+++++++++++++++++++++++++++")
-            addnode = CouchbaseOperation(
-                Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
-                    source_config).build(),
-                    make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
-            addnode.stop_couchbase()
-            addnode.restore_config(what='current', nodeno=nodeno)
-            addnode.start_couchbase(no_wait=multinode)
-
-    
     logger.debug("reconfigure for multinode: {}".format(multinode))
 
+    if multinode:
+        _wait_for_nodes([provision_process] + [node_obj for _, _, node_obj in nodes])
 
-    if multinode == True:
-
-
-        active_servers = {}
-        logger.debug("wait for nodes")
-        logger.debug("server count: {} active servers: {}".format(server_count, sum(active_servers.values())))
-
-        end_time = time.time() + 3660
+    _warm_up(provision_process, nodes)
+    _resize_cluster(provision_process, nodes)
 
+    return _source_config(virtual_source, repository, source_config, snapshot)
 
 
-        #break the loop either end_time is exceeding from 1 minute or server is successfully started
-        while time.time() < end_time and sum(active_servers.values()) != server_count:
-            logger.debug("server count 2: {} active servers: {}".format(server_count, sum(active_servers.values())))
-            nodeno = 1
-            helper_lib.sleepForSecond(1) # waiting for 1 second
-            server_status = provision_process.status() # fetching status
+def vdb_nodes(provision_process):
+    """
+    Additional nodes of VDB cluster as saved by last provision / reconfigure in the hidden folder of the VDB, so
+    they are part of every snapshot of the VDB together with configuration of the nodes
+    :return: list of node definitions with number of saved node configuration in "nodeno"
+    :raise UserError: saved nodes of VDB with node_list are missing or corrupted
+    """
+    filename = _nodes_file(provision_process)
+    content, std_err, exit_code = provision_process.run_os_command(os_command='cat', path=filename)
+    if exit_code == 0 and content.strip() != "":
+        try:
+            return json.loads(content)
+        except ValueError:
+            raise UserError("Saved nodes of VDB cluster {} are corrupted".format(filename),
+                            "Restore the file from a snapshot of the VDB", content)
+    if not provision_process.parameters.node_list:
+        return []
+    raise UserError("Nodes of VDB cluster are not saved in {}".format(filename),
+                    "Restore the file from a snapshot of the VDB, or save there node list entries of the nodes "
+                    "which are members of the cluster as JSON list, with number of their saved configuration "
+                    "(config.dat_<number>) in nodeno", std_err)
+
+
+def _nodes_file(provision_process):
+    return provision_process.get_config_directory() + "/" + VDB_NODES_FILENAME
+
+
+def _save_vdb_nodes(provision_process, nodes):
+    filename = _nodes_file(provision_process)
+    std_out, std_err, exit_code = provision_process.run_os_command(
+        os_command='write_text_file', filename=filename, data=json.dumps(nodes, sort_keys=True))
+    if exit_code != 0:
+        raise UserError("Unable to save nodes of VDB cluster to {}".format(filename),
+                        "Check free space and permissions of the mount point", std_err)
+
+
+def _removed_nodes(provision_process, nodes):
+    """ nodes of the cluster which are not in node_list, they are not mounted by the mount specification """
+    environments = [node["environment"] for node in provision_process.parameters.node_list or []]
+    return [(nodeno, node, node_obj) for nodeno, node, node_obj in nodes if node["environment"] not in environments]
+
+
+def _node_operations(provision_process, nodes):
+    """
+    :param nodes: node definitions with node number in "nodeno"
+    :return: list of tuples (node number, node definition, CouchbaseOperation connected to the node)
+    """
+    node_operations = []
+    for node in nodes:
+        node_obj = CouchbaseOperation(
+            Resource.ObjectBuilder.set_virtual_source(provision_process.virtual_source).set_repository(
+                provision_process.repository).set_source_config(provision_process.source_config).set_snapshot(
+                provision_process.snapshot).build(),
+            make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
+        node_operations.append((node["nodeno"], node, node_obj))
+    return node_operations
+
+
+def _wait_for_nodes(node_objs):
+    active_servers = set()
+    logger.debug("wait for nodes")
+    end_time = time.time() + 3660
+
+    #break the loop either end_time is exceeding from 1 minute or all servers are successfully started
+    while time.time() < end_time and len(active_servers) != len(node_objs):
+        helper_lib.sleepForSecond(1) # waiting for 1 second
+        for nodeno, node_obj in enumerate(node_objs):
+            if nodeno in active_servers:
+                continue
+            server_status = node_obj.status() # fetching status
             logger.debug("server status {}".format(server_status))
             if server_status == Status.ACTIVE:
-                active_servers[nodeno] = 1
-
-            for node in provision_process.parameters.node_list:
-                nodeno = nodeno + 1
-                logger.debug("+++++++++++++++++++++++++++")
-                logger.debug(node)
-                logger.debug(nodeno)
-                logger.debug("+++++++++++++++++++++++++++")
-                addnode = CouchbaseOperation(
-                    Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
-                        source_config).build(),
-                        make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
-                server_status = addnode.status() # fetching status
-                logger.debug("server status {}".format(server_status))
-                if server_status == Status.ACTIVE:
-                    active_servers[nodeno] = 1
-
-
-
-
-    return _source_config(virtual_source, repository, source_config, snapshot)
+                active_servers.add(nodeno)
+        logger.debug("server count: {} active servers: {}".format(len(node_objs), len(active_servers)))
+
+
+def _join_nodes(provision_process, nodes, remove=()):
+    """
+    Nodes are bootstrapped in parallel and added to the cluster, cluster is rebalanced once
+    :param nodes: list of tuples (node number, node definition, CouchbaseOperation) of nodes to add
+    :param remove: addresses of nodes moved out of the cluster by the same rebalance
+    """
+    for nodeno, node, node_obj in nodes:
+        node_obj.delete_config()
+        node_obj.start_couchbase(no_wait=True)
+
+    for nodeno, node, node_obj in nodes:
+        node_obj.wait_for_bootstrap()
+        node_obj.addnode(nodeno, node, rebalance=False, bootstrap=False)
+
+    provision_process.rebalance(remove=remove)
+
+
+def _resize_cluster(provision_process, nodes, add=True):
+    """
+    Nodes added to node_list of running VDB join the cluster and nodes removed from node_list are moved out of it,
+    by a single rebalance. Configuration of every node is saved again, so next reconfigure restores the new cluster.
+    :param nodes: current additional nodes as returned by _node_operations
+    :param add: False - nodes are only removed, nodes added to node_list are not mounted yet (VDB stops)
+    :return: additional nodes of the resized cluster
+    """
+    node_list = provision_process.parameters.node_list or []
+    wanted = {node["environment"]: node for node in node_list}
+    members = [node["environment"] for _, node, _ in nodes]
+
+    removed = [(nodeno, node, node_obj) for nodeno, node, node_obj in nodes if node["environment"] not in wanted]
+    # kept nodes take changed definition from node_list
+    kept = [(nodeno, dict(wanted[node["environment"]], nodeno=nodeno), node_obj)
+            for nodeno, node, node_obj in nodes if node["environment"] in wanted]
+    # numbers of saved configurations of nodes removed by the same rebalance are not reused, their data paths are
+    # still in use
+    next_nodeno = max([1] + [nodeno for nodeno, _, _ in nodes]) + 1
+    added = []
+    if add:
+        added = _node_operations(provision_process, placement.place_services(
+            provision_process.parameters, provision_process.snapshot,
+            [dict(node, nodeno=nodeno) for nodeno, node in enumerate(
+                [node for node in node_list if node["environment"] not in members], next_nodeno)],
+            members=[node for _, node, _ in kept]))
+
+    if added or removed:
+        logger.info("Resizing VDB cluster, adding nodes {} and removing nodes {}".format(
+            [node["node_addr"] for _, node, _ in added], [node["node_addr"] for _, node, _ in removed]))
+        _join_nodes(provision_process, added,
+                    remove=[provision_process.node_address(node) for _, node, _ in removed])
+
+        for nodeno, node, node_obj in removed:
+            node_obj.stop_couchbase()
+            node_obj.delete_config()
+
+        provision_process.save_config(what='current', nodeno=1)
+        for nodeno, node, node_obj in kept + added:
+            node_obj.save_config(what='current', nodeno=nodeno)
+
+    _save_vdb_nodes(provision_process, [node for _, node, _ in kept + added])
+    return kept + added
 
 
 def vdb_configure(virtual_source, snapshot, repository):
@@ -184,7 +284,7 @@ def vdb_configure(virtual_source, snapshot, repository):
     # couchbase will delete directory while starting 
     # so we have to rename it before start
 
-    bucket_list_and_size = json.loads(snapshot.bucket_list)
+    bucket_list_and_size = BucketCatalog.from_json(snapshot.bucket_list)
 
     if not bucket_list_and_size:
         raise FailedToReadBucketDataFromSnapshot("Snapshot Data is empty.")
@@ -193,6 +293,16 @@ def vdb_configure(virtual_source, snapshot, repository):
 
 
 
+    # unselected buckets lose their data files before the start, so they are never warmed up
+    dropped = _dropped_buckets(provision_process.parameters, bucket_list_and_size)
+    if dropped:
+        output, error, exit_code = provision_process.remove_bucket_data(dropped)
+        if exit_code != 0:
+            raise UserError("Unable to remove data files of buckets {} not selected to be provisioned".format(
+                                ", ".join(dropped)),
+                            "Check permissions of the mount point and fix problem before retrying to provision a VDB",
+                            "{} {}".format(output, error))
+
     # for item in helper_lib.filter_bucket_name_from_output(bucket_list_and_size):
     #     logger.debug("Checking bucket: {}".format(item))
     #     bucket_name = item.split(',')[0]
@@ -201,6 +311,8 @@ def vdb_configure(virtual_source, snapshot, repository):
 
     provision_process.restart_couchbase(provision=True)
     provision_process.rename_cluster()
+    if dropped:
+        _delete_buckets(provision_process, dropped)
     #provision_process.node_init()
     #provision_process.cluster_init()
     
@@ -218,28 +330,19 @@ def vdb_configure(virtual_source, snapshot, repository):
     #         connection=make_nonprimary_connection(self.config.connection, self.__node_environment, self.__node_envuser)
 
 
-    nodeno = 1
-
-
     logger.debug("MAIN CONNECTION HOST: {}".format(provision_process.connection.environment.host.name))
 
-    if provision_process.parameters.node_list is not None and len(provision_process.parameters.node_list) > 0:
-        for node in provision_process.parameters.node_list:
-            nodeno = nodeno + 1
-            logger.debug("+++++++++++++++++++++++++++")
-            logger.debug(node)
-            logger.debug(nodeno)
-            logger.debug("+++++++++++++++++++++++++++")
-            addnode = CouchbaseOperation(
-                Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_snapshot(
-                    snapshot).build(),
-                    make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
-            logger.debug("ADDITIONAL CONNECTION HOST: {}".format(provision_process.connection.environment.host.name))
-            addnode.addnode(nodeno, node)
-            # TODO
-            # FINISH HERE
-            # addnode.delete_config()
-            # addnode.stop_couchbase()
+    provisioned = BucketCatalog(bucket for bucket in bucket_list_and_size if bucket.name not in dropped)
+    nodes = _node_operations(provision_process, placement.place_services(
+        provision_process.parameters, snapshot,
+        [dict(node, nodeno=nodeno) for nodeno, node in enumerate(provision_process.parameters.node_list or [], 2)]))
+    # quotas are fitted before additional nodes join, they get them from the cluster
+    memory_sizing.size_cluster(provision_process, provisioned.to_list(), [node_obj for _, _, node_obj in nodes])
+    # additional nodes get warmed up buckets by rebalance
+    _warm_up(provision_process, [], provisioned)
+    if nodes:
+        _join_nodes(provision_process, nodes)
+    _save_vdb_nodes(provision_process, [node for _, node, _ in nodes])
 
 
     src_cfg_obj = _source_config(virtual_source, repository, None, snapshot)
@@ -253,26 +356,53 @@ def vdb_configure(virtual_source, snapshot, repository):
     #     raise
 
 
-def make_nonprimary_connection(primary_connection, secondary_env_ref, secondary_user_ref):
-    dummy_host = primary_connection.environment.host
-    user = RemoteUser(name="unused", reference=secondary_user_ref)
-    environment = RemoteEnvironment(name="unused", reference=secondary_env_ref, host=dummy_host)
-    return RemoteConnection(environment=environment, user=user)
+def _warm_up(provision_process, nodes, bucket_catalog=None):
+    """
+    Tune warmup of buckets and wait until they are warmed up on the primary and every additional data node
+    :param bucket_catalog: buckets of the VDB, read from the cluster if not given
+    """
+    node_objs = [provision_process] + [node_obj for _, node, node_obj in nodes
+                                       if "data" in placement.node_services(node)]
+    warmup.warm_up(provision_process.parameters, bucket_catalog or provision_process.bucket_catalog(), node_objs)
+
+
+def _dropped_buckets(parameters, bucket_catalog):
+    """
+    :return: names of buckets of the snapshot which are not selected to be provisioned, all are kept for empty
+             provisionBuckets
+    """
+    selected = parameters.provision_buckets or []
+    unknown = [name for name in selected if name not in bucket_catalog]
+    if unknown:
+        raise UserError("Buckets {} are not in the snapshot".format(", ".join(unknown)),
+                        "Select buckets from the snapshot: {}".format(", ".join(bucket_catalog.names())))
+    if not selected:
+        return []
+    return [name for name in bucket_catalog.names() if name not in selected]
+
+
+def _delete_buckets(provision_process, bucket_names):
+    """ delete unselected buckets restored from the snapshot configuration, their quota is freed """
+    for bucket_name, (output, error, exit_code) in zip(bucket_names,
+                                                       provision_process.bucket_delete_many(bucket_names)):
+        if exit_code != 0:
+            raise UserError("Unable to delete bucket {} not selected to be provisioned".format(bucket_name),
+                            "Check an output and fix problem before retrying to provision a VDB",
+                            "{} {}".format(output, error))
+    logger.info("Buckets not selected to be provisioned are deleted: {}".format(", ".join(bucket_names)))
 
 
 def _do_provision(provision_process, snapshot):
-    bucket_list_and_size = snapshot.bucket_list
+    bucket_list_and_size = BucketCatalog.from_json(snapshot.bucket_list)
 
     if not bucket_list_and_size:
         raise FailedToReadBucketDataFromSnapshot("Snapshot Data is empty.")
     else:
         logger.debug("snapshot bucket data is: {}".format(bucket_list_and_size))
 
-    bucket_list_and_size = json.loads(bucket_list_and_size)
-
+    bucket_list = []
     try:
-        bucket_list = provision_process.bucket_list()
-        bucket_list = helper_lib.filter_bucket_name_from_output(bucket_list)
+        bucket_list = provision_process.bucket_catalog()
         logger.debug(bucket_list)
     except Exception as err:
         logger.debug("Failed to get bucket list. Error is " + str(err))
@@ -283,10 +413,10 @@ def _do_provision(provision_process, snapshot):
     for item in bucket_list_and_size:
         logger.debug("Checking bucket: {}".format(item))
         # try:
-        bucket_name = item['name']
-        bkt_size = item['ram']
-        bkt_type = item['bucketType']
-        bkt_compression = item['compressionMode']
+        bucket_name = item.name
+        bkt_size = item.ram
+        bkt_type = item.bucket_type
+        bkt_compression = item.compression_mode
         bkt_size_mb = helper_lib.get_bucket_size_in_MB(0, bkt_size)
         if bucket_name not in bucket_list:
             # a new bucket needs to be created
@@ -299,9 +429,8 @@ def _do_provision(provision_process, snapshot):
     
     provision_process.stop_couchbase()
 
-    for item in helper_lib.filter_bucket_name_from_output(bucket_list_and_size):
-        logger.debug("Checking bucket: {}".format(item))
-        bucket_name = item.split(',')[0]
+    for bucket_name in bucket_list_and_size.names():
+        logger.debug("Checking bucket: {}".format(bucket_name))
         logger.debug("restoring folders")
         provision_process.move_bucket(bucket_name, 'restore')
     
@@ -395,39 +524,33 @@ def vdb_start(virtual_source, repository, source_config):
         Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
             source_config).build())
     logger.debug("Starting couchbase server")
+    nodes = _node_operations(provision_process, vdb_nodes(provision_process))
     try:
         provision_process.start_couchbase()
-        if provision_process.parameters.node_list is not None and len(provision_process.parameters.node_list) > 0:
-            for node in provision_process.parameters.node_list:
-                logger.debug("+++++++++++++++++++++++++++")
-                logger.debug(node)
-                logger.debug("+++++++++++++++++++++++++++")
-                addnode = CouchbaseOperation(
-                    Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
-                        source_config).build(),
-                        make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
-                addnode.start_couchbase()
+        for nodeno, node, node_obj in nodes:
+            logger.debug("Starting node {}: {}".format(nodeno, node))
+            node_obj.start_couchbase()
     except Exception:
         raise CouchbaseServicesError(" Start").to_user_error()(None).with_traceback(sys.exc_info()[2])
+    _warm_up(provision_process, nodes)
 
 
 def vdb_stop(virtual_source, repository, source_config):
     provision_process = CouchbaseOperation(
         Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
             source_config).build())
+    nodes = _node_operations(provision_process, vdb_nodes(provision_process))
+    # nodes removed from node_list are still mounted, their data is moved to the other nodes before they are
+    # unmounted
+    if _removed_nodes(provision_process, nodes) and provision_process.status() == Status.ACTIVE:
+        nodes = _resize_cluster(provision_process, nodes, add=False)
+
     logger.debug("Stopping couchbase server")
     provision_process.stop_couchbase()
 
-    if provision_process.parameters.node_list is not None and len(provision_process.parameters.node_list) > 0:
-        for node in provision_process.parameters.node_list:
-            logger.debug("+++++++++++++++++++++++++++")
-            logger.debug(node)
-            logger.debug("+++++++++++++++++++++++++++")
-            addnode = CouchbaseOperation(
-                Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
-                    source_config).build(),
-                    make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
-            addnode.stop_couchbase()
+    for nodeno, node, node_obj in nodes:
+        logger.debug("Stopping node {}: {}".format(nodeno, node))
+        node_obj.stop_couchbase()
 
 def vdb_pre_snapshot(virtual_source, repository, source_config):
     logger.debug("In Pre snapshot...")
@@ -436,22 +559,11 @@ def vdb_pre_snapshot(virtual_source, repository, source_config):
             source_config).build())
 
 
-    nodeno = 1
-
-    provision_process.save_config(what='current', nodeno=nodeno)
+    provision_process.save_config(what='current', nodeno=1)
 
-    if provision_process.parameters.node_list is not None and len(provision_process.parameters.node_list) > 0:
-        for node in provision_process.parameters.node_list:
-            nodeno = nodeno + 1
-            logger.debug("+++++++++++++++++++++++++++")
-            logger.debug(node)
-            logger.debug(nodeno)
-            logger.debug("+++++++++++++++++++++++++++")
-            addnode = CouchbaseOperation(
-                Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).set_source_config(
-                    source_config).build(),
-                    make_nonprimary_connection(provision_process.connection, node['environment'], node['environmentUser']))
-            addnode.save_config(what='current', nodeno=nodeno)
+    for nodeno, node, node_obj in _node_operations(provision_process, vdb_nodes(provision_process)):
+        logger.debug("Saving configuration of node {}: {}".format(nodeno, node))
+        node_obj.save_config(what='current', nodeno=nodeno)
 
 
 def post_snapshot(virtual_source, repository, source_config):
@@ -473,7 +585,7 @@ def post_snapshot(virtual_source, repository, source_config):
 
 
 
-        bucket_details = json.dumps(provision_process.bucket_list())
+        bucket_details = provision_process.bucket_catalog().to_json()
         logger.debug("BUCKET_LIST={}".format(bucket_details))
         db_path = virtual_source.parameters.mount_path
         time_stamp = helper_lib.current_time()
@@ -494,7 +606,7 @@ def post_snapshot(virtual_source, repository, source_config):
 
 # This function returns the bucket name from snapshot.
 def _find_bucket_name_from_snapshot(snapshot):
-    bucket_list_and_size = json.loads(snapshot.bucket_list)
+    bucket_list_and_size = BucketCatalog.from_json(snapshot.bucket_list)
     logger.debug("SnapShot bucket data is: {}".format(bucket_list_and_size))
     # # bucket_list_and_size contains the ramsize e.g. "Bucket1,122:Bucket2,3432"
     # # Filtering the size from above information.
@@ -503,7 +615,7 @@ def _find_bucket_name_from_snapshot(snapshot):
     # # bucket details in snapshot : Bucket_name1,RamSize1:Bucket_name2,RamSize2:
     # bucket_name = re.sub(',[0-9]*:', ':', bucket_list_and_size)
     # bucket_name = bucket_name.strip(':')
-    bucket_name = helper_lib.filter_bucket_name_from_output(bucket_list_and_size)
+    bucket_name = bucket_list_and_size.names()
     return bucket_name
 
 
@@ -7,7 +7,9 @@ from dlpx.virtualization.platform import Mount, MountSpecification, Plugin, Stat
 from dlpx.virtualization.platform import OwnershipSpecification
 from operations import discovery, linked, virtual
 from utils import setup_logger
-from db_commands.constants import EVICTION_POLICY
+from utils import instrumentation
+from utils import profiling
+from db_commands.constants import EVICTION_POLICY, SERVICE_PLACEMENT_NODE_LIST
 import logging
 from dlpx.virtualization.common import RemoteEnvironment
 from dlpx.virtualization.common import RemoteHost
@@ -33,6 +35,8 @@ logger = logging.getLogger(__name__)
 #
 # Mark the function below as the operation that does repository discovery.
 @plugin.discovery.repository()
+@instrumentation.operation("repository_discovery")
+@profiling.profile("repository_discovery")
 def repository_discovery(source_connection):
     #
     # This is an object generated from the repositoryDefinition schema.
@@ -43,6 +47,8 @@ def repository_discovery(source_connection):
 
 
 @plugin.discovery.source_config()
+@instrumentation.operation("source_config_discovery")
+@profiling.profile("source_config_discovery")
 def source_config_discovery(source_connection, repository):
     #
     # To have automatic discovery of source configs, return a list of
@@ -53,11 +59,15 @@ def source_config_discovery(source_connection, repository):
 
 
 @plugin.linked.post_snapshot()
+@instrumentation.operation("linked_post_snapshot")
+@profiling.profile("linked_post_snapshot")
 def linked_post_snapshot(staged_source, repository, source_config, optional_snapshot_parameters):
     return linked.post_snapshot(staged_source, repository, source_config,staged_source.parameters.d_source_type)
 
 
 @plugin.linked.mount_specification()
+@instrumentation.operation("linked_mount_specification")
+@profiling.profile("linked_mount_specification")
 def linked_mount_specification(staged_source, repository):
     mount_path = staged_source.parameters.mount_path
 
@@ -75,10 +85,14 @@ def linked_mount_specification(staged_source, repository):
     mounts = [Mount(environment, mount_path)]
     logger.debug("Setting ownership to uid {} and gid {}".format(repository.uid, repository.gid))
     ownership_spec = OwnershipSpecification(repository.uid, repository.gid)
+
+    # additional staging nodes don't mount staging file system, they leave the cluster before every snapshot
     return MountSpecification(mounts, ownership_spec)
 
 
 @plugin.linked.pre_snapshot()
+@instrumentation.operation("linked_pre_snapshot")
+@profiling.profile("linked_pre_snapshot")
 def linked_pre_snapshot(staged_source, repository, source_config, optional_snapshot_parameters):
     if optional_snapshot_parameters and int(optional_snapshot_parameters.resync) == 1:
         linked.resync(staged_source, repository, source_config, staged_source.parameters)
@@ -87,51 +101,71 @@ def linked_pre_snapshot(staged_source, repository, source_config, optional_snaps
 
 
 @plugin.linked.status()
+@instrumentation.operation("linked_status")
+@profiling.profile("linked_status")
 def linked_status(staged_source, repository, source_config):
     return linked.d_source_status(staged_source, repository, source_config)
 
 @plugin.linked.stop_staging()
+@instrumentation.operation("stop_staging")
+@profiling.profile("stop_staging")
 def stop_staging(staged_source, repository, source_config):
     linked.stop_staging(staged_source, repository, source_config)
 
 
 @plugin.linked.start_staging()
+@instrumentation.operation("start_staging")
+@profiling.profile("start_staging")
 def start_staging(staged_source, repository, source_config):
     linked.start_staging(staged_source, repository, source_config)
 
 
 
 @plugin.virtual.configure()
+@instrumentation.operation("configure")
+@profiling.profile("configure")
 def configure(virtual_source, snapshot, repository):
     return virtual.vdb_configure(virtual_source, snapshot, repository)
 
 
 @plugin.virtual.reconfigure()
+@instrumentation.operation("reconfigure")
+@profiling.profile("reconfigure")
 def reconfigure(virtual_source, repository, source_config, snapshot):
     return virtual.vdb_reconfigure(virtual_source, repository, source_config, snapshot)
 
 
 @plugin.virtual.pre_snapshot()
+@instrumentation.operation("virtual_pre_snapshot")
+@profiling.profile("virtual_pre_snapshot")
 def virtual_pre_snapshot(virtual_source, repository, source_config):
     virtual.vdb_pre_snapshot(virtual_source, repository, source_config)
 
 
 @plugin.virtual.post_snapshot()
+@instrumentation.operation("virtual_post_snapshot")
+@profiling.profile("virtual_post_snapshot")
 def virtual_post_snapshot(virtual_source, repository, source_config):
     return virtual.post_snapshot(virtual_source, repository, source_config)
 
 
 @plugin.virtual.start()
+@instrumentation.operation("start")
+@profiling.profile("start")
 def start(virtual_source, repository, source_config):
     virtual.vdb_start(virtual_source, repository, source_config)
 
 
 @plugin.virtual.stop()
+@instrumentation.operation("stop")
+@profiling.profile("stop")
 def stop(virtual_source, repository, source_config):
     virtual.vdb_stop(virtual_source, repository, source_config)
 
 
 @plugin.virtual.mount_specification()
+@instrumentation.operation("virtual_mount_specification")
+@profiling.profile("virtual_mount_specification")
 def virtual_mount_specification(virtual_source, repository):
     mount_path = virtual_source.parameters.mount_path
 
@@ -150,11 +184,22 @@ def virtual_mount_specification(virtual_source, repository):
 
     logger.debug("in mounting: {}".format(str(virtual_source.parameters.node_list)))
 
+    # nodes removed from node_list are moved out of the cluster when the VDB stops, before they are unmounted
+    mounts.extend(_node_mounts(virtual_source.parameters.node_list, mount_path,
+                               Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(
+                                   repository).build()))
+    return MountSpecification(mounts, ownership_spec)
+
 
-     
-    if virtual_source.parameters.node_list is not None and len(virtual_source.parameters.node_list) > 0:
+def _node_mounts(node_list, mount_path, resource):
+    """
+    Mounts of additional nodes of VDB. Couchbase running on stale mount point of a node
+    is stopped by operation built from resource.
+    """
+    mounts = []
+    if node_list is not None and len(node_list) > 0:
         # more nodes
-        for m in virtual_source.parameters.node_list:
+        for m in node_list:
             logger.debug("in loop: {}".format(str(m)))
             node_host = RemoteHost(name='foo',
                                    reference=m["environment"].replace('_ENVIRONMENT', ''),
@@ -173,25 +218,26 @@ def virtual_mount_specification(virtual_source, repository):
 
 
             if check_stale_mountpoint(clean_node_conn, mount_path):
-                clean_node = CouchbaseOperation(
-                    Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).build(),
-                    clean_node_conn )
+                clean_node = CouchbaseOperation(resource, clean_node_conn)
                 clean_node.stop_couchbase()
                 clean_stale_mountpoint(clean_node_conn, mount_path)
             
             check_server_is_used(clean_node_conn, mount_path)
 
-
-    return MountSpecification(mounts, ownership_spec)
+    return mounts
 
 
 @plugin.virtual.status()
+@instrumentation.operation("virtual_status")
+@profiling.profile("virtual_status")
 def virtual_status(virtual_source, repository, source_config):
     logger.debug("in status")
     return virtual.vdb_status(virtual_source, repository, source_config)
 
 
 @plugin.virtual.unconfigure()
+@instrumentation.operation("unconfigure")
+@profiling.profile("unconfigure")
 def unconfigure(virtual_source, repository, source_config):
     logger.debug("UNCONFIGURE")
     virtual.vdb_unconfigure(virtual_source, repository, source_config)
@@ -214,3 +260,54 @@ def add_node_to_virtual(old_virtual_source):
   logger.debug("After changes")
   logger.debug(new_virt)  
   return new_virt
+
+
+@plugin.upgrade.linked_source("2021.11.02")
+def add_compaction_to_linked(old_linked_source):
+    new_linked = dict(old_linked_source)
+    new_linked["compactionFragmentationThreshold"] = 30
+    new_linked["compactionTimeBudget"] = 900
+    return new_linked
+
+
+@plugin.upgrade.linked_source("2021.11.16")
+def add_node_to_linked(old_linked_source):
+    new_linked = dict(old_linked_source)
+    new_linked["node_list"] = []
+    return new_linked
+
+
+@plugin.upgrade.virtual_source("2021.11.23")
+def add_service_placement_to_virtual(old_virtual_source):
+    new_virt = dict(old_virtual_source)
+    new_virt["servicePlacement"] = SERVICE_PLACEMENT_NODE_LIST
+    for node in new_virt["node_list"]:
+        node["data_service"] = True
+        node["index_service"] = True
+        node["query_service"] = True
+    return new_virt
+
+
+@plugin.upgrade.virtual_source("2021.11.30")
+def add_memory_fraction_to_virtual(old_virtual_source):
+    # existing VDBs keep quotas of their snapshot when refreshed
+    new_virt = dict(old_virtual_source)
+    new_virt["memoryFraction"] = 0
+    return new_virt
+
+
+@plugin.upgrade.virtual_source("2021.12.07")
+def add_provision_buckets_to_virtual(old_virtual_source):
+    new_virt = dict(old_virtual_source)
+    new_virt["provisionBuckets"] = []
+    return new_virt
+
+
+@plugin.upgrade.virtual_source("2021.12.14")
+def add_warmup_to_virtual(old_virtual_source):
+    new_virt = dict(old_virtual_source)
+    new_virt["warmupMinItemsThreshold"] = 100
+    new_virt["warmupMinMemoryThreshold"] = 100
+    new_virt["accessLogWarmup"] = True
+    new_virt["readyBuckets"] = []
+    return new_virt
@@ -0,0 +1,152 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Timing of remote commands. utilities.execute_bash records every command with wall time, size of stdout / stderr,
+exit code and category. Category is the name of CommandFactory method which built the command, callers of
+execute_bash pass it explicitly, commands without category are recorded as unknown.
+Records are grouped by plugin operation, every entry point of plugin_runner.py is decorated by @operation which
+logs the summary of slowest and most frequent categories when the entry point ends.
+Records of finished operations are kept in memory, benchmarks and tests read them by records() and summary().
+"""
+#######################################################################################################################
+
+import functools
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# number of categories in the summary logged at the end of operation
+SUMMARY_TOP_N = 5
+# number of finished operations kept in memory
+MAX_OPERATIONS = 50
+UNKNOWN_CATEGORY = "unknown"
+# records outside of any plugin operation
+NO_OPERATION = "no_operation"
+
+_current = []
+_operations = OrderedDict()
+# changes when an operation starts or ends, state kept for one operation is dropped when it changes
+_generation = [0]
+
+
+class CommandRecord(object):
+    __slots__ = ('operation', 'category', 'seconds', 'stdout_bytes', 'stderr_bytes', 'exit_code')
+
+    def __init__(self, operation, category, seconds, stdout_bytes, stderr_bytes, exit_code):
+        self.operation = operation
+        self.category = category
+        self.seconds = seconds
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        self.exit_code = exit_code
+
+    def __repr__(self):
+        return "CommandRecord({} {} {:.3f}s exit_code={})".format(self.operation, self.category, self.seconds,
+                                                                  self.exit_code)
+
+
+def current_operation():
+    return _current[-1] if _current else NO_OPERATION
+
+
+def operation_generation():
+    """ number identifying the running operation, or the time between two operations """
+    return _generation[0]
+
+
+def record(category, seconds, stdout, stderr, exit_code):
+    name = current_operation()
+    entry = CommandRecord(name, category, seconds, len(stdout or ""), len(stderr or ""), exit_code)
+    _operations.setdefault(name, []).append(entry)
+    return entry
+
+
+def operation(name):
+    """
+    Decorator of plugin entry points. Commands executed by the decorated function are grouped under the name and
+    the summary is logged when the function ends. Nested operations are counted in the outer one.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current:
+                return function(*args, **kwargs)
+            _start_operation(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _current.pop()
+                _generation[0] += 1
+                logger.info(format_summary(name))
+        return wrapper
+    return decorator
+
+
+def _start_operation(name):
+    _current.append(name)
+    _generation[0] += 1
+    _operations.pop(name, None)
+    _operations[name] = []
+    while len(_operations) > MAX_OPERATIONS:
+        _operations.popitem(last=False)
+
+
+def operations():
+    return list(_operations.keys())
+
+
+def records(name=None):
+    """
+    :param name: operation name, last recorded operation by default
+    :return: list of CommandRecord
+    """
+    if name is None:
+        name = next(reversed(_operations), None) if _operations else None
+    return list(_operations.get(name, []))
+
+
+def summary(name=None):
+    """
+    :param name: operation name, last recorded operation by default
+    :return: dict with totals and per category statistics (count, seconds, stdout_bytes, stderr_bytes, failures)
+    sorted by total time
+    """
+    entries = records(name)
+    categories = {}
+    for entry in entries:
+        stats = categories.setdefault(entry.category, {"count": 0, "seconds": 0.0, "stdout_bytes": 0,
+                                                       "stderr_bytes": 0, "failures": 0})
+        stats["count"] += 1
+        stats["seconds"] += entry.seconds
+        stats["stdout_bytes"] += entry.stdout_bytes
+        stats["stderr_bytes"] += entry.stderr_bytes
+        stats["failures"] += 1 if entry.exit_code != 0 else 0
+    ordered = sorted(categories.items(), key=lambda item: (-item[1]["seconds"], item[0]))
+    return {"commands": len(entries),
+            "seconds": sum(entry.seconds for entry in entries),
+            "stdout_bytes": sum(entry.stdout_bytes for entry in entries),
+            "stderr_bytes": sum(entry.stderr_bytes for entry in entries),
+            "categories": OrderedDict(ordered)}
+
+
+def format_summary(name, top=SUMMARY_TOP_N):
+    stats = summary(name)
+    lines = ["Operation {}: {} remote commands, {:.2f}s, {} bytes of output".format(
+        name, stats["commands"], stats["seconds"], stats["stdout_bytes"] + stats["stderr_bytes"])]
+    categories = stats["categories"]
+    slowest = list(categories.items())[:top]
+    frequent = sorted(categories.items(), key=lambda item: (-item[1]["count"], item[0]))[:top]
+    for title, entries in (("slowest", slowest), ("most frequent", frequent)):
+        if entries:
+            lines.append("  {}: {}".format(title, ", ".join(
+                "{} x{} {:.2f}s".format(category, item["count"], item["seconds"]) for category, item in entries)))
+    return "\n".join(lines)
+
+
+def reset():
+    del _current[:]
+    _operations.clear()
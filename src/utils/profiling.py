@@ -0,0 +1,148 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Opt-in profiling of plugin entry points. Profiling is enabled by the environment variable DLPX_COUCHBASE_PROFILE of
+the plugin process: "cpu" runs every entry point under cProfile, "cpu,memory" also traces allocations by tracemalloc.
+The profile report is written to a timestamped file in <toolkit>/.delphix/profiles on the host of the operation
+and a short summary is logged: total time, time spent waiting on remote commands (libs.run_bash), Python time and
+peak of allocated memory.
+If the variable is not set at import of plugin_runner.py, @profile returns the entry point unchanged.
+"""
+#######################################################################################################################
+
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+from db_commands.commands import CommandFactory
+from db_commands.constants import DELPHIX_HIDDEN_FOLDER, PROFILE_ENV_VAR, PROFILE_FOLDER
+from utils import utilities
+
+logger = logging.getLogger(__name__)
+
+CPU = "cpu"
+MEMORY = "memory"
+# number of functions in the written report and in the logged summary
+REPORT_FUNCTIONS = 40
+SUMMARY_FUNCTIONS = 5
+REPORT_ALLOCATIONS = 20
+# function of Virtualization SDK which waits for remote commands
+REMOTE_CALL = "run_bash"
+
+
+def enabled_modes(value=None):
+    """
+    :param value: value of DLPX_COUCHBASE_PROFILE, read from environment by default
+    :return: set of enabled modes, empty if profiling is disabled
+    """
+    if value is None:
+        value = os.environ.get(PROFILE_ENV_VAR, "")
+    modes = set(mode.strip().lower() for mode in value.split(",") if mode.strip())
+    if modes - {"0", "false", "no"}:
+        modes.add(CPU)
+    return modes & {CPU, MEMORY}
+
+
+def profile(name, modes=None):
+    """
+    Decorator of plugin entry points
+    :param name: operation name used in the report file name
+    :param modes: enabled modes, by default from DLPX_COUCHBASE_PROFILE
+    """
+    modes = enabled_modes() if modes is None else modes
+
+    def decorator(function):
+        if not modes:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return run_profiled(name, modes, function, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_profiled(name, modes, function, *args, **kwargs):
+    tracing = MEMORY in modes
+    if tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    started = time.time()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        elapsed = time.time() - started
+        peak, snapshot = None, None
+        if tracing:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        try:
+            report = _report(name, profiler, elapsed, peak, snapshot)
+            logger.info("\n".join(report.splitlines()[:2]))
+            _write_report(_find_connection(args), name, report)
+        except Exception as err:
+            # profiling must never change the result of the operation
+            logger.debug("Unable to write profile of {}: {}".format(name, str(err)))
+
+
+def _report(name, profiler, elapsed, peak, snapshot):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    remote = sum(entry[3] for key, entry in stats.stats.items() if key[2] == REMOTE_CALL)
+    lines = ["Profile of {}: {:.2f}s total, {:.2f}s waiting on remote commands, {:.2f}s in Python{}".format(
+        name, elapsed, remote, max(0.0, elapsed - remote),
+        ", peak memory {:.1f} MiB".format(peak / 1048576.0) if peak is not None else "")]
+
+    # own time of functions, time of called functions (remote commands included) is not counted
+    own_time = sorted(((entry[2], key) for key, entry in stats.stats.items() if key[2] != REMOTE_CALL),
+                      reverse=True)
+    lines.append("Top functions by own time: " + ", ".join(
+        "{}:{}({}) {:.3f}s".format(os.path.basename(key[0]), key[1], key[2], seconds)
+        for seconds, key in own_time[:SUMMARY_FUNCTIONS]))
+
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(REPORT_FUNCTIONS)
+    lines.append(output.getvalue())
+    if snapshot is not None:
+        lines.append("Top allocations:")
+        for statistic in snapshot.statistics("lineno")[:REPORT_ALLOCATIONS]:
+            lines.append(str(statistic))
+    return "\n".join(lines)
+
+
+def _find_connection(args):
+    """ connection of the operation from arguments of the entry point """
+    for argument in args:
+        for attribute in ("staged_connection", "connection"):
+            if getattr(argument, attribute, None) is not None:
+                return getattr(argument, attribute)
+        if getattr(argument, "environment", None) is not None:
+            return argument
+    return None
+
+
+def _write_report(connection, name, report):
+    if connection is None:
+        logger.debug("No connection for profile of {}, report not written".format(name))
+        return
+    bin_directory = utilities.execute_bash(connection, CommandFactory.get_dlpx_bin(), category="get_dlpx_bin")[0]
+    if bin_directory == "":
+        raise Exception("Failed to find the toolkit directory")
+    # Toolkit directory is 6 levels above the jq binary, same as in CouchbaseOperation.create_config_dir
+    for _ in range(6):
+        bin_directory = os.path.dirname(bin_directory)
+    filename = "{}/{}/{}/{}-{}.txt".format(bin_directory, DELPHIX_HIDDEN_FOLDER, PROFILE_FOLDER, name,
+                                           time.strftime("%Y%m%d-%H%M%S"))
+    std_out, std_err, exit_code = utilities.execute_bash(connection, CommandFactory.write_text_file(filename, report),
+                                                         category="write_text_file")
+    if exit_code != 0:
+        raise Exception(std_err)
+    logger.info("Profile of {} written to {}".format(name, filename))
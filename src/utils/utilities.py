@@ -3,29 +3,59 @@
 #
 
 import logging
+import re
+import time
 
 from dlpx.virtualization import libs
 from dlpx.virtualization.libs import exceptions
 
 from db_commands import commands
+from db_commands import constants
+from utils import instrumentation
 
 # logger object
 logger = logging.getLogger(__name__)
 
+# environment captured from login shell per connection (environment reference, user reference),
+# None if commands of the connection have to run in login shell. Environments are captured again by every plugin
+# operation (instrumentation.operation_generation), so a changed profile of the environment user is picked up.
+_captured_environments = {}
+_captured_generation = [None]
 
-def execute_bash(source_connection, command_name, callback_func=None, environment_vars=None):
+# first line of a variable in output of env, following lines without NAME= continue a multi-line value
+_VARIABLE = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)=(.*)$")
+
+# name of the command which wasn't found in error of bash or sh, e.g. "bash: line 1: cbq: command not found"
+_NOT_FOUND = re.compile(r"([^\s:]+): (?:command )?not found")
+
+
+def execute_bash(source_connection, command_name, callback_func=None, environment_vars=None, category=None):
     """
     :param callback_func:
     :param source_connection: Connection object for the source environment
     :param command_name: Command to be search from dictionary of bash command
     :param environment_vars: Expecting environment variables which are required to execute the command
+    :param category: name of the command reported by instrumentation, name of CommandFactory method which
+    built the command
     :return: list of output of command, error string, exit code
     """
 
     if source_connection is None:
         raise exceptions.PluginScriptError("Connection object cannot be empty")
 
-    result = libs.run_bash(source_connection, command=command_name, variables=environment_vars, use_login_shell=True)
+    category = category or instrumentation.UNKNOWN_CATEGORY
+    captured = _captured_environment(source_connection)
+    if captured is None:
+        result = _run_bash(source_connection, command_name, environment_vars, True, category)
+    else:
+        variables = dict(captured)
+        variables.update(environment_vars or {})
+        result = _run_bash(source_connection, command_name, variables, False, category)
+        if _missing_environment(source_connection, result, variables):
+            logger.debug("Command failed without login shell, running it again in login shell: {}".format(
+                result.stderr.strip()))
+            _captured_environments[_connection_key(source_connection)] = None
+            result = _run_bash(source_connection, command_name, environment_vars, True, category)
 
     # strip the each part of result to remove spaces from beginning and last of output
     output = result.stdout.strip()
@@ -38,6 +68,72 @@ def execute_bash(source_connection, command_name, callback_func=None, environmen
     return [output, error, exit_code]
 
 
+def _run_bash(source_connection, command, variables, use_login_shell, category):
+    started = time.time()
+    result = libs.run_bash(source_connection, command=command, variables=variables, use_login_shell=use_login_shell)
+    instrumentation.record(category, time.time() - started, result.stdout, result.stderr, result.exit_code)
+    return result
+
+
+def _connection_key(source_connection):
+    return source_connection.environment.reference, source_connection.user.reference
+
+
+def _captured_environment(source_connection):
+    """
+    Environment variables of login shell of the connection, except the ones set by the shell itself
+    (CAPTURED_ENV_SKIPPED). Variables are read by one command in login shell, later commands of the connection run
+    without login shell with these variables.
+    :return: dict of variables or None if commands have to run in login shell
+    """
+    if not constants.USE_CAPTURED_ENVIRONMENT:
+        return None
+    if _captured_generation[0] != instrumentation.operation_generation():
+        _captured_environments.clear()
+        _captured_generation[0] = instrumentation.operation_generation()
+    key = _connection_key(source_connection)
+    if key not in _captured_environments:
+        command = commands.CommandFactory.capture_environment()
+        result = _run_bash(source_connection, command, None, True, "capture_environment")
+        captured = None
+        if result.exit_code == 0:
+            captured = {}
+            name = None
+            for line in result.stdout.splitlines():
+                variable = _VARIABLE.match(line)
+                if variable is not None:
+                    name = variable.group(1)
+                    captured[name] = variable.group(2)
+                elif name is not None:
+                    captured[name] = captured[name] + "\n" + line
+            for name in constants.CAPTURED_ENV_SKIPPED:
+                captured.pop(name, None)
+        logger.debug("Environment captured from login shell: {}".format(captured))
+        _captured_environments[key] = captured
+    return _captured_environments[key]
+
+
+def _missing_environment(source_connection, result, variables):
+    """
+    Failure caused by command which can't be found without environment of login shell. Exit code 127 alone doesn't
+    mean that, the command may have failed after it ran, so the missing command is looked up by command -v with the
+    captured environment and the failed command is run again only if the lookup fails too.
+    """
+    if result.exit_code == 0:
+        return False
+    missing = _NOT_FOUND.search(result.stderr)
+    if missing is None:
+        return False
+    command = commands.CommandFactory.find_command(missing.group(1))
+    probe = _run_bash(source_connection, command, variables, False, "find_command")
+    return probe.exit_code != 0
+
+
+def reset_captured_environments():
+    _captured_environments.clear()
+    _captured_generation[0] = None
+
+
 def _handle_exit_code(exit_code, std_err=None, std_output=None, callback_func=None):
     if exit_code == 0:
         return
@@ -0,0 +1,12 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Round trip benchmarks of plugin entry points. Every entry point of plugin_runner.py runs against the local stand-in
+(test/standin) and remote commands, couchbase-cli spawns and simulated wait time are counted per operation, together
+with command categories recorded by utils.instrumentation.
+run_benchmarks.py compares the counts with baseline.json and fails if an operation needs more remote commands.
+"""
+#######################################################################################################################
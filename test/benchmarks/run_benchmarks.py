@@ -0,0 +1,111 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Run round trip benchmarks for a matrix of buckets, indexes and VDB nodes and compare results with the baseline.
+
+    python -m test.benchmarks.run_benchmarks --buckets 1,4 --indexes 0,8 --nodes 1,2 --output results.json
+    python -m test.benchmarks.run_benchmarks --update-baseline
+
+Exit code is 1 if any operation needs more remote commands or couchbase-cli spawns than recorded in the baseline.
+"""
+#######################################################################################################################
+
+import argparse
+import itertools
+import json
+import os
+import sys
+from collections import OrderedDict
+
+from test.benchmarks.scenario import Scenario
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# counters which are gated, simulated time is reported only
+GATED = ("commands", "cli_spawns")
+
+
+def _numbers(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def run_case(buckets, indexes, nodes):
+    scenario = Scenario(buckets=buckets, indexes=indexes, nodes=nodes)
+    return OrderedDict([("case", scenario.name), ("buckets", buckets), ("indexes", indexes), ("nodes", nodes),
+                        ("operations", scenario.run())])
+
+
+def run_matrix(buckets=(1, 4), indexes=(0, 8), nodes=(1, 2)):
+    return {"results": [run_case(*case) for case in itertools.product(buckets, indexes, nodes)]}
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+
+
+def compare(results, baseline):
+    """
+    :return: list of regressions (case, operation, counter, baseline value, current value). Cases and operations
+    missing in the baseline are not compared.
+    """
+    expected = dict((case["case"], case["operations"]) for case in baseline["results"])
+    regressions = []
+    for case in results["results"]:
+        for operation, stats in case["operations"].items():
+            base = expected.get(case["case"], {}).get(operation)
+            if base is None:
+                continue
+            for counter in GATED:
+                if stats[counter] > base[counter]:
+                    regressions.append((case["case"], operation, counter, base[counter], stats[counter]))
+    return regressions
+
+
+def report(results):
+    lines = []
+    for case in results["results"]:
+        lines.append(case["case"])
+        for operation, stats in case["operations"].items():
+            lines.append("  {:40} commands={:<4} cli_spawns={:<4} rest_requests={:<4} simulated_seconds={}".format(
+                operation, stats["commands"], stats["cli_spawns"], stats["rest_requests"],
+                stats["simulated_seconds"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Round trip benchmarks of plugin operations")
+    parser.add_argument("--buckets", type=_numbers, default=[1, 4])
+    parser.add_argument("--indexes", type=_numbers, default=[0, 8])
+    parser.add_argument("--nodes", type=_numbers, default=[1, 2])
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="write results into the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_matrix(args.buckets, args.indexes, args.nodes)
+    print(report(results))
+    if args.output:
+        save(results, args.output)
+    if args.update_baseline:
+        save(results, args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print("Baseline {} not found, nothing to compare".format(args.baseline))
+        return 0
+    regressions = compare(results, load(args.baseline))
+    for regression in regressions:
+        print("REGRESSION {}: {} {} baseline={} current={}".format(*regression))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Scenario builds hosts, clusters and plugin objects for one benchmark case (number of buckets, indexes and VDB nodes)
+and runs entry points of plugin_runner.py in the order used by Delphix Engine: discovery, dSource (XDCR and backup
+ingestion) linking, snapshots, disable / enable, then VDB provisioning, snapshot, stop / start, reconfigure and
+unconfigure. Commands of every entry point are counted by the stand-in.
+"""
+#######################################################################################################################
+
+import logging
+import os
+import sys
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from dlpx.virtualization import libs
+from dlpx.virtualization.platform import Mount, StagedSource, VirtualSource
+from generated.definitions import LinkedSourceDefinition, SnapshotParametersDefinition, SourceConfigDefinition, \
+    VirtualSourceDefinition
+
+from utils import instrumentation, utilities
+
+from test.standin import Bucket, Index, StandIn
+
+SOURCE_ADMIN = ("source_admin", "source_password")
+STAGING_ADMIN = ("admin", "password")
+VDB_ADMIN = ("vdb_admin", "vdb_password")
+XDCR_MOUNT = "/mnt/provision/xdcr"
+BACKUP_MOUNT = "/mnt/provision/backup"
+VDB_MOUNT = "/mnt/provision/vdb"
+BACKUP_ARCHIVE = "/backup"
+BACKUP_REPO = "production"
+
+
+def _import_plugin_runner():
+    import plugin_runner
+    # platform handler works only inside of Delphix Engine
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, libs.PlatformHandler):
+            root.removeHandler(handler)
+    root.setLevel(logging.WARNING)
+    return plugin_runner
+
+
+class Scenario(object):
+
+    def __init__(self, buckets=2, indexes=2, nodes=1, items=20000, latency=None):
+        self.buckets = buckets
+        self.indexes = indexes
+        self.nodes = nodes
+        self.items = items
+        self.standin = StandIn(latency)
+        self.snapshot = None
+        self.__build()
+
+    @property
+    def name(self):
+        return "buckets={},indexes={},nodes={}".format(self.buckets, self.indexes, self.nodes)
+
+    def __build(self):
+        standin = self.standin
+        self.source = standin.add_host("source", ips=("10.0.0.10",))
+        self.xdcr_staging = standin.add_host("xdcr-staging", ips=("10.0.0.20",))
+        self.backup_staging = standin.add_host("backup-staging", ips=("10.0.0.21",))
+        self.targets = [standin.add_host("target{}".format(i + 1), ips=("10.0.1.{}".format(i + 1),))
+                        for i in range(self.nodes)]
+
+        buckets = [Bucket("bucket_{}".format(i), ram_quota_mb=128, items=self.items)
+                   for i in range(self.buckets)]
+        indexes = []
+        for i in range(self.indexes):
+            bucket = buckets[i % len(buckets)].name
+            indexes.append(Index(bucket, "idx_{}".format(i), ["field_{}".format(i)], deferred=i % 2 == 1))
+        standin.add_cluster(self.source, "production", *SOURCE_ADMIN, buckets=buckets, indexes=indexes)
+        standin.add_backup(self.backup_staging, BACKUP_ARCHIVE, BACKUP_REPO, "2021-10-01T10_00_00.000000000Z",
+                           buckets, indexes)
+
+        self.source_config = SourceConfigDefinition(couchbase_src_host=self.source.name, couchbase_src_port=8091,
+                                                    pretty_name="Couchbase:8091 - production",
+                                                    db_path="/opt/couchbase/var")
+        self.xdcr_source = self.__staged_source(self.xdcr_staging, "XDCR", XDCR_MOUNT, "xdcr_cluster")
+        self.backup_source = self.__staged_source(self.backup_staging, "Couchbase Backup Manager", BACKUP_MOUNT,
+                                                  "backup_cluster")
+        self.virtual_source = self.__virtual_source()
+
+    def __staged_source(self, host, dsource_type, mount_path, cluster_name):
+        connection = self.standin.connection(host)
+        parameters = LinkedSourceDefinition(d_source_type=dsource_type, couchbase_host=host.name,
+                                            couchbase_port=8091, couchbase_bak_loc=BACKUP_ARCHIVE,
+                                            couchbase_bak_repo=BACKUP_REPO, mount_path=mount_path,
+                                            stg_cluster_name=cluster_name, cluster_ram_size=4096,
+                                            cluster_index_ram_size=512, cluster_ftsram_size=256,
+                                            cluster_eventing_ram_size=256, cluster_analytics_ram_size=1024,
+                                            bucket_eviction_policy="valueOnly", bucket_size=0,
+                                            couchbase_admin=STAGING_ADMIN[0],
+                                            couchbase_admin_password=STAGING_ADMIN[1], xdcr_admin=SOURCE_ADMIN[0],
+                                            xdcr_admin_password=SOURCE_ADMIN[1], fts_service=False,
+                                            eventing_service=False, analytics_service=False, config_settings_prov=[])
+        return StagedSource(guid="{}-guid".format(host.name), source_connection=connection, parameters=parameters,
+                            mount=Mount(connection.environment, mount_path), staged_connection=connection)
+
+    def __virtual_source(self):
+        connection = self.standin.connection(self.targets[0])
+        node_list = [{"environment": host.reference, "environmentUser": host.user_reference, "node_addr": host.name,
+                      "fts_service": False, "analytics_service": False, "eventing_service": False}
+                     for host in self.targets[1:]]
+        parameters = VirtualSourceDefinition(couchbase_port=8091, mount_path=VDB_MOUNT, tgt_cluster_name="vdb_cluster",
+                                             cluster_ram_size=4096, cluster_index_ram_size=512,
+                                             cluster_ftsram_size=256, cluster_eventing_ram_size=256,
+                                             cluster_analytics_ram_size=1024, bucket_eviction_policy="valueOnly",
+                                             couchbase_admin=VDB_ADMIN[0], couchbase_admin_password=VDB_ADMIN[1],
+                                             fts_service=False, analytics_service=False, eventing_service=False,
+                                             node_list=node_list)
+        return VirtualSource(guid="vdb-guid", connection=connection, parameters=parameters,
+                             mounts=[Mount(connection.environment, VDB_MOUNT)])
+
+    def __provision_mounts(self):
+        """ snapshot of XDCR staging mount is mounted on every VDB node """
+        for host in self.targets:
+            self.standin.clone_mount(self.xdcr_staging, XDCR_MOUNT, host, VDB_MOUNT)
+
+    def operations(self, runner):
+        """ (name, function) of entry points in workflow order, mounts are made by Delphix Engine in between """
+        xdcr, backup, vdb = self.xdcr_source, self.backup_source, self.virtual_source
+        resync = SnapshotParametersDefinition(resync=1)
+        snapsync = SnapshotParametersDefinition(resync=0)
+        discovered = {}
+
+        def repository_discovery():
+            discovered["repository"] = runner.repository_discovery(xdcr.staged_connection)[0]
+
+        def linked_mount_specification(staged_source):
+            def mount_specification():
+                runner.linked_mount_specification(staged_source, discovered["repository"])
+                self.standin.mount(self.standin.host_for(staged_source.staged_connection),
+                                   staged_source.parameters.mount_path)
+            return mount_specification
+
+        def linked_post_snapshot(staged_source):
+            def post_snapshot():
+                snapshot = runner.linked_post_snapshot(staged_source, discovered["repository"], self.source_config,
+                                                       None)
+                if staged_source is xdcr:
+                    self.snapshot = snapshot
+            return post_snapshot
+
+        def virtual_mount_specification():
+            runner.virtual_mount_specification(vdb, discovered["repository"])
+            self.__provision_mounts()
+
+        def configure():
+            discovered["vdb_config"] = runner.configure(vdb, self.snapshot, discovered["repository"])
+
+        repository = lambda: discovered["repository"]
+        vdb_config = lambda: discovered["vdb_config"]
+        return [
+            ("repository_discovery", repository_discovery),
+            ("source_config_discovery", lambda: runner.source_config_discovery(xdcr.staged_connection,
+                                                                               repository())),
+            ("xdcr.linked_mount_specification", linked_mount_specification(xdcr)),
+            ("xdcr.linked_pre_snapshot.resync", lambda: runner.linked_pre_snapshot(xdcr, repository(),
+                                                                                  self.source_config, resync)),
+            ("xdcr.linked_post_snapshot", linked_post_snapshot(xdcr)),
+            ("xdcr.linked_status", lambda: runner.linked_status(xdcr, repository(), self.source_config)),
+            ("xdcr.linked_pre_snapshot", lambda: runner.linked_pre_snapshot(xdcr, repository(), self.source_config,
+                                                                           snapsync)),
+            ("xdcr.linked_post_snapshot.snapsync", linked_post_snapshot(xdcr)),
+            ("xdcr.stop_staging", lambda: runner.stop_staging(xdcr, repository(), self.source_config)),
+            ("xdcr.start_staging", lambda: runner.start_staging(xdcr, repository(), self.source_config)),
+            ("backup.linked_mount_specification", linked_mount_specification(backup)),
+            ("backup.linked_pre_snapshot.resync", lambda: runner.linked_pre_snapshot(backup, repository(),
+                                                                                    self.source_config, resync)),
+            ("backup.linked_post_snapshot", linked_post_snapshot(backup)),
+            ("backup.linked_pre_snapshot", lambda: runner.linked_pre_snapshot(backup, repository(),
+                                                                             self.source_config, snapsync)),
+            ("backup.linked_post_snapshot.snapsync", linked_post_snapshot(backup)),
+            ("virtual_mount_specification", virtual_mount_specification),
+            ("configure", configure),
+            ("virtual_status", lambda: runner.virtual_status(vdb, repository(), vdb_config())),
+            ("virtual_pre_snapshot", lambda: runner.virtual_pre_snapshot(vdb, repository(), vdb_config())),
+            ("virtual_post_snapshot", lambda: runner.virtual_post_snapshot(vdb, repository(), vdb_config())),
+            ("stop", lambda: runner.stop(vdb, repository(), vdb_config())),
+            ("reconfigure", lambda: runner.reconfigure(vdb, repository(), vdb_config(), self.snapshot)),
+            ("start", lambda: runner.start(vdb, repository(), vdb_config())),
+            ("unconfigure", lambda: runner.unconfigure(vdb, repository(), vdb_config())),
+        ]
+
+    def run(self):
+        """
+        Run all entry points
+        :return: OrderedDict operation name -> statistics of remote commands (StandIn.summary)
+        """
+        runner = _import_plugin_runner()
+        results = OrderedDict()
+        # environment is captured again for hosts of this scenario
+        utilities.reset_captured_environments()
+        with self.standin.patch():
+            for name, operation in self.operations(runner):
+                self.standin.reset()
+                instrumentation.reset()
+                operation()
+                results[name] = self.standin.summary()
+                results[name]["by_category"] = OrderedDict(
+                    (category, stats["count"]) for category, stats in sorted(instrumentation.summary()[
+                        "categories"].items()))
+        return results
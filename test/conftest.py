@@ -161,28 +161,28 @@ def get_couchbase_object():
         obj_builder = Resource.ObjectBuilder
         for key in params:
             if key == "staged_source":
-                print " Setting staged_source"
+                print(" Setting staged_source")
                 obj_builder.set_staged_source(kwargs[key])
             elif key == "dsource":
-                print " Setting dsource"
+                print(" Setting dsource")
                 obj_builder.set_dsource(kwargs[key])
             elif key == "virtual_source":
-                print " Setting staged_source"
+                print(" Setting staged_source")
                 obj_builder.set_virtual_source(kwargs[key])
             elif key == "repository":
-                print " Setting repository"
+                print(" Setting repository")
                 obj_builder.set_repository(kwargs[key])
             elif key == "source_config":
-                print " Setting source_config"
+                print(" Setting source_config")
                 obj_builder.set_source_config(kwargs[key])
             elif key == "connection":
-                print " Setting connection"
+                print(" Setting connection")
                 obj_builder.set_connection(kwargs[key])
             elif key == "snapshot_parameters":
-                print " Setting snapshot_parameters"
+                print(" Setting snapshot_parameters")
                 obj_builder.set_snapshot_parameters(kwargs[key])
             elif key == "snapshot":
-                print " Setting snapshot"
+                print(" Setting snapshot")
                 obj_builder.set_snapshot(kwargs[key])
             else:
                 raise Exception("Invalid key passed")
@@ -0,0 +1,16 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+# Tests in this folder run without a Couchbase host: unit tests of controller modules and end to end runs against the
+# local stand-in (test/standin). Host bound session fixtures of test/conftest.py are overridden here, the tests define
+# their own staged source, repository and source config.
+#######################################################################################################################
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def main_class():
+    return None
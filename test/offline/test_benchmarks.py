@@ -0,0 +1,26 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Round trip budget of plugin operations, see test/benchmarks
+#######################################################################################################################
+
+import copy
+
+from test.benchmarks import run_benchmarks
+
+
+def test_round_trips_within_baseline():
+    results = run_benchmarks.run_matrix(buckets=[1, 4], indexes=[8], nodes=[2])
+    baseline = run_benchmarks.load(run_benchmarks.BASELINE)
+
+    assert run_benchmarks.compare(results, baseline) == []
+
+
+def test_regression_detected():
+    results = run_benchmarks.run_matrix(buckets=[1], indexes=[0], nodes=[1])
+    baseline = copy.deepcopy(results)
+    baseline["results"][0]["operations"]["configure"]["commands"] -= 1
+
+    regressions = run_benchmarks.compare(results, baseline)
+    assert [(operation, counter) for _, operation, counter, _, _ in regressions] == [("configure", "commands")]
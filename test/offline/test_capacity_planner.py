@@ -0,0 +1,59 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Capacity planner of staging and VDB clusters, see src/controller/capacity_planner.py
+#######################################################################################################################
+
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from controller import capacity_planner
+from controller.bucket_catalog import BucketCatalog
+
+MB = 1024 * 1024
+BUCKETS = [{"name": "travel", "bucketType": "membase", "ram": 1024 * MB,
+            "basicStats": {"itemCount": 1000000, "diskUsed": 1500 * MB, "dataUsed": 1000 * MB, "memUsed": 500 * MB,
+                           "vbActiveNumNonResident": 500000}},
+           {"name": "beer", "bucketType": "membase", "ram": 256 * MB,
+            "basicStats": {"itemCount": 10000, "diskUsed": 10 * MB, "dataUsed": 10 * MB}},
+           {"name": "cache", "bucketType": "memcached", "ram": 128 * MB}]
+INDEXES = ["CREATE INDEX `idx_city` ON `travel`(`city`)", "CREATE INDEX `idx_country` ON `travel`(`country`)",
+           "CREATE PRIMARY INDEX ON `beer`"]
+
+
+def test_plan_three_nodes():
+    plan = capacity_planner.plan_capacity(BucketCatalog.from_json(BUCKETS), INDEXES, 3)
+
+    assert plan["services"] == [["data", "index", "query"], ["data"], ["index", "query"]]
+    # resident half of travel and metadata of its items with headroom, shared by two data nodes
+    assert [(bucket["name"], bucket["ram_size"], bucket["eviction_policy"]) for bucket in plan["buckets"]] == [
+        ("travel", 373, "valueOnly"), ("beer", 100, "valueOnly"), ("cache", 128, None)]
+    assert (plan["cluster_ram_size"], plan["cluster_index_ram_size"]) == (601, 256)
+    # data and estimated index files of travel with 30% fragmentation
+    assert plan["buckets"][0]["disk_footprint"] == (1000 * MB + 2 * 1000000 * 100) * 100 // 70
+    assert plan["ingest_seconds"] == 51
+
+
+def test_plan_fitted_to_small_host():
+    plan = capacity_planner.plan_capacity(BucketCatalog.from_json(BUCKETS), INDEXES, 1, host_memory_mb=1024)
+
+    # search service is not sized, its quota isn't taken from the host
+    assert plan["cluster_ram_size"] + plan["cluster_index_ram_size"] == 1024 * 80 // 100
+    assert sum(bucket["ram_size"] for bucket in plan["buckets"]) <= plan["cluster_ram_size"]
+    assert plan["buckets"][0]["eviction_policy"] == "fullEviction"
+
+
+def test_main_reads_recorded_bucket_list(tmp_path, capsys):
+    bucket_list = tmp_path / "bucket_list.json"
+    bucket_list.write_text(json.dumps(BUCKETS))
+    indexes = tmp_path / "indexes.txt"
+    indexes.write_text("\n".join(INDEXES))
+
+    assert capacity_planner.main([str(bucket_list), "--indexes", str(indexes), "--nodes", "3"]) == 0
+    assert json.loads(capsys.readouterr().out)["cluster_ram_size"] == 601
+    assert capacity_planner.main([str(bucket_list), "--host-memory", "256"]) == 1
+    assert capsys.readouterr().err
@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Scheduling of per-bucket ingestion stages, see src/controller/ingestion_pipeline.py
+#######################################################################################################################
+
+import os
+import sys
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from controller.ingestion_pipeline import IngestionPipeline, Stage
+from dlpx.virtualization.platform.exceptions import UserError
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        self.now = self.now + seconds
+
+
+@pytest.fixture
+def clock():
+    clock = _Clock()
+    with mock.patch("time.time", new=lambda: clock.now), mock.patch("time.sleep", new=clock.sleep):
+        yield clock
+
+
+def _timed_stage(name, clock, durations, limit=None, log=None):
+    """ asynchronous stage taking durations[bucket] seconds """
+    ends = {}
+
+    def start(bucket_name):
+        ends[bucket_name] = clock.now + durations[bucket_name]
+        if log is not None:
+            log.append((name, bucket_name, clock.now))
+
+    def finished(bucket_names):
+        return [bucket_name for bucket_name in bucket_names if ends[bucket_name] <= clock.now]
+
+    return Stage(name, start, finished, limit)
+
+
+def test_buckets_do_not_wait_for_each_other(clock):
+    log = []
+    pipeline = IngestionPipeline([_timed_stage("replicate", clock, {"big": 300, "small": 10}, log=log),
+                                  _timed_stage("index", clock, {"big": 20, "small": 20}, log=log)],
+                                 poll_interval=10)
+
+    completed = pipeline.run(["big", "small"])
+
+    # index of the small bucket is built while the big one is still replicating
+    assert ("index", "small", 10) in log
+    assert completed["small"] == 30
+    # critical path is the big bucket, not the sum of phases
+    assert completed["big"] == 320
+
+
+def test_stage_limit_and_skipped_stage(clock):
+    log = []
+    started = []
+    pipeline = IngestionPipeline([Stage("create", started.append, done=lambda bucket_name: bucket_name == "kept"),
+                                  _timed_stage("index", clock, {"a": 30, "b": 30, "kept": 30}, limit=1, log=log)],
+                                 poll_interval=10)
+
+    completed = pipeline.run(["a", "b", "kept"])
+
+    assert started == ["a", "b"]
+    assert [entry[2] for entry in log] == [0, 30, 60]
+    assert sorted(completed) == ["a", "b", "kept"]
+
+
+def test_pipeline_gives_up_after_timeout(clock):
+    stage = _timed_stage("replicate", clock, {"stuck": 10 ** 6, "quick": 10})
+    pipeline = IngestionPipeline([stage], poll_interval=10, timeout=100)
+
+    with pytest.raises(UserError) as error:
+        pipeline.run(["stuck", "quick"])
+
+    assert "100 seconds" in error.value.message
+    assert clock.now <= 110
@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Timing of remote commands per plugin operation, see src/utils/instrumentation.py
+#######################################################################################################################
+
+import os
+import sys
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from db_commands.commands import CommandFactory
+from utils import instrumentation, utilities
+
+
+class _Result(object):
+    def __init__(self, stdout, stderr="", exit_code=0):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+
+
+@pytest.fixture(autouse=True)
+def clean_records():
+    instrumentation.reset()
+    # only commands of the test, environment of login shell is not captured
+    with mock.patch("db_commands.constants.USE_CAPTURED_ENVIRONMENT", False):
+        yield
+    instrumentation.reset()
+
+
+@instrumentation.operation("linked_status")
+def _status(connection, results):
+    with mock.patch("dlpx.virtualization.libs.run_bash", side_effect=results):
+        utilities.execute_bash(connection, CommandFactory.check_file("/mnt/provision/.delphix/config.dat"),
+                               category="check_file")
+        utilities.execute_bash(connection, CommandFactory.get_process(), category="get_process")
+        utilities.execute_bash(connection, CommandFactory.get_process(), category="get_process")
+        utilities.execute_bash(connection, "curl --version", category="rest:bucket_list")
+
+
+def test_commands_grouped_by_operation():
+    _status(mock.Mock(), [_Result("Found"), _Result("1234\n"), _Result("", "no process", 1), _Result("7.58.0")])
+
+    assert instrumentation.operations() == ["linked_status"]
+    stats = instrumentation.summary("linked_status")
+    assert stats["commands"] == 4
+    assert stats["stdout_bytes"] == len("Found") + len("1234\n") + len("7.58.0")
+    assert stats["stderr_bytes"] == len("no process")
+    assert stats["categories"]["get_process"]["count"] == 2
+    assert stats["categories"]["get_process"]["failures"] == 1
+    assert sorted(stats["categories"]) == ["check_file", "get_process", "rest:bucket_list"]
+    assert [record.category for record in instrumentation.records()][:2] == ["check_file", "get_process"]
+
+
+def test_summary_lists_slowest_and_most_frequent():
+    _status(mock.Mock(), [_Result("Found"), _Result("1"), _Result("2"), _Result("3")])
+
+    text = instrumentation.format_summary("linked_status", top=1)
+    assert text.startswith("Operation linked_status: 4 remote commands")
+    assert "most frequent: get_process x2" in text
+
+
+def test_same_command_of_different_categories():
+    read_file, cat = CommandFactory.read_file("/etc/hosts"), CommandFactory.cat("/etc/hosts")
+    assert read_file == cat
+    with mock.patch("dlpx.virtualization.libs.run_bash", return_value=_Result("ok")):
+        utilities.execute_bash(mock.Mock(), read_file, category="read_file")
+        utilities.execute_bash(mock.Mock(), cat, category="cat")
+
+    assert [r.category for r in instrumentation.records(instrumentation.NO_OPERATION)] == ["read_file", "cat"]
+
+
+def test_untagged_command():
+    with mock.patch("dlpx.virtualization.libs.run_bash", return_value=_Result("ok")):
+        utilities.execute_bash(mock.Mock(), "uname -a")
+
+    assert [(r.operation, r.category) for r in instrumentation.records(instrumentation.NO_OPERATION)] == \
+        [(instrumentation.NO_OPERATION, instrumentation.UNKNOWN_CATEGORY)]
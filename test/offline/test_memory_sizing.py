@@ -0,0 +1,59 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Memory sizing of provisioned VDB, see src/controller/memory_sizing.py
+#######################################################################################################################
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from controller import memory_sizing
+from dlpx.virtualization.platform.exceptions import UserError
+from generated.definitions import VirtualSourceDefinition
+
+MB = 1024 * 1024
+BUCKETS = json.dumps([{"name": "travel", "bucketType": "membase", "ram": 4096 * MB},
+                      {"name": "beer", "bucketType": "membase", "ram": 512 * MB},
+                      {"name": "sessions", "bucketType": "ephemeral", "ram": 1024 * MB}])
+
+
+def _parameters(memory_fraction=None, **kwargs):
+    parameters = dict(cluster_ram_size=8192, cluster_index_ram_size=2048, cluster_ftsram_size=512,
+                      cluster_eventing_ram_size=256, cluster_analytics_ram_size=1024, fts_service=True,
+                      eventing_service=False, analytics_service=False, memory_fraction=memory_fraction)
+    parameters.update(kwargs)
+    return VirtualSourceDefinition(**parameters)
+
+
+def test_quotas_kept_on_large_host():
+    quotas, buckets = memory_sizing.plan_memory(_parameters(), BUCKETS, 65536)
+
+    assert dict(quotas) == {"data": 8192, "index": 2048, "fts": 512}
+    assert buckets == []
+
+
+def test_quotas_and_buckets_scaled_on_small_host():
+    quotas, buckets = memory_sizing.plan_memory(_parameters(memory_fraction=50), BUCKETS, 4096)
+
+    # 2048 MB budget: index is scaled, FTS is kept at its minimum and data gets the rest
+    assert dict(quotas) == {"data": 1402, "index": 390, "fts": 256}
+    assert sum(quota for _, quota, _ in buckets) <= quotas["data"]
+    assert [(name, eviction_policy) for name, _, eviction_policy in buckets] == [
+        ("travel", "fullEviction"), ("beer", "fullEviction"), ("sessions", None)]
+
+
+def test_scale_buckets_keeps_minimum():
+    assert memory_sizing.scale_buckets({"big": 900, "small": 100}, 500) == {"big": 400, "small": 100}
+    with pytest.raises(UserError):
+        memory_sizing.scale_buckets({"a": 200, "b": 200, "c": 200}, 250)
+
+
+def test_host_too_small():
+    with pytest.raises(UserError):
+        memory_sizing.plan_memory(_parameters(), BUCKETS, 512)
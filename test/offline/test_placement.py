@@ -0,0 +1,55 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Service placement of additional VDB nodes, see src/controller/placement.py
+#######################################################################################################################
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from controller import placement
+from db_commands.constants import SERVICE_PLACEMENT_ADVISOR, SERVICE_PLACEMENT_NODE_LIST
+from dlpx.virtualization.platform.exceptions import UserError
+from generated.definitions import SnapshotDefinition, VirtualSourceDefinition
+
+BUCKETS = json.dumps([{"name": "travel", "ram": 268435456}, {"name": "beer", "ram": 134217728}])
+
+
+def _node(name, **flags):
+    return dict({"environment": name, "environmentUser": name + "-user", "node_addr": name}, **flags)
+
+
+def test_node_services():
+    assert placement.node_services(_node("a")) == ["data", "index", "query"]
+    assert placement.node_services(_node("a", data_service=False, fts_service=True)) == ["index", "query", "fts"]
+    with pytest.raises(UserError):
+        placement.node_services(_node("a", data_service=False, index_service=False, query_service=False))
+
+
+def test_propose_placement():
+    assert placement.propose_placement(3, BUCKETS, []) == [["data"]] * 3
+    assert placement.propose_placement(1, BUCKETS, ["CREATE INDEX i1 ON travel(city)"]) == [["index", "query"]]
+    # 2 buckets with 8 indexes: index / query get half of the nodes
+    assert placement.propose_placement(4, BUCKETS, ["index"] * 8) == [["data"]] * 2 + [["index", "query"]] * 2
+    # a data node is always left
+    assert placement.propose_placement(2, BUCKETS, ["index"] * 100) == [["data"], ["index", "query"]]
+
+
+def test_place_services():
+    snapshot = SnapshotDefinition(bucket_list=BUCKETS, indexes=["index"] * 8)
+    nodes = [_node("b"), _node("c", fts_service=True)]
+
+    parameters = VirtualSourceDefinition(service_placement=SERVICE_PLACEMENT_NODE_LIST)
+    assert placement.place_services(parameters, snapshot, nodes) == nodes
+
+    parameters = VirtualSourceDefinition(service_placement=SERVICE_PLACEMENT_ADVISOR)
+    placed = placement.place_services(parameters, snapshot, nodes, members=[_node("a", index_service=False,
+                                                                                    query_service=False)])
+    # data node a is already in the cluster, both new nodes are index / query nodes
+    assert [placement.node_services(node) for node in placed] == [["index", "query"], ["index", "query", "fts"]]
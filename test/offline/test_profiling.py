@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Opt-in profiling of plugin entry points, see src/utils/profiling.py
+#######################################################################################################################
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from controller import helper_lib
+from utils import instrumentation, profiling
+
+from test.standin import StandIn
+
+
+@pytest.fixture
+def standin():
+    standin = StandIn()
+    standin.add_host("staging", ips=("10.0.0.20",))
+    with standin.patch():
+        yield standin
+
+
+def test_enabled_modes():
+    assert profiling.enabled_modes("") == set()
+    assert profiling.enabled_modes("0") == set()
+    assert profiling.enabled_modes("1") == {profiling.CPU}
+    assert profiling.enabled_modes("cpu") == {profiling.CPU}
+    assert profiling.enabled_modes("cpu,memory") == {profiling.CPU, profiling.MEMORY}
+
+
+def test_disabled_returns_function():
+    def entry_point(source_connection):
+        return source_connection
+
+    assert profiling.profile("repository_discovery", modes=set())(entry_point) is entry_point
+
+
+def test_profile_written_to_toolkit(standin):
+    host = standin.find_host("staging")
+    connection = standin.connection(host)
+
+    @profiling.profile("repository_discovery", modes={profiling.CPU, profiling.MEMORY})
+    def repository_discovery(source_connection):
+        return helper_lib.find_binary_path(source_connection)
+
+    assert repository_discovery(connection) == "/opt/couchbase/bin"
+
+    reports = [name for name in host.files if "/.delphix/profiles/repository_discovery-" in name]
+    assert len(reports) == 1
+    report = host.read(reports[0])
+    assert report.startswith("Profile of repository_discovery:")
+    assert "waiting on remote commands" in report and "peak memory" in report
+    assert "Top allocations:" in report
+
+
+def test_profile_written_inside_operation(standin):
+    host = standin.find_host("staging")
+    connection = standin.connection(host)
+    instrumentation.reset()
+
+    # same order as in plugin_runner.py, the report is written by commands of the operation
+    @instrumentation.operation("repository_discovery")
+    @profiling.profile("repository_discovery", modes={profiling.CPU})
+    def repository_discovery(source_connection):
+        return helper_lib.find_binary_path(source_connection)
+
+    repository_discovery(connection)
+
+    assert instrumentation.operations() == ["repository_discovery"]
+    categories = [record.category for record in instrumentation.records("repository_discovery")]
+    assert categories.count("capture_environment") == 1
+    assert "write_text_file" in categories
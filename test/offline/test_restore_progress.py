@@ -0,0 +1,58 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Progress of cbbackupmgr restore, see src/controller/restore_progress.py
+#######################################################################################################################
+
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from controller import restore_progress
+
+MB = 1024 * 1024
+INFO = {"name": "PROD", "count": 2, "backups": [
+    {"date": "2021-10-02T10_00_00.000000000Z", "type": "INCR",
+     "buckets": [{"name": "travel", "items": 120000, "mutations": 1000, "size": 120000 * 1024},
+                 {"name": "beer", "items": 7300, "mutations": 7300, "size": 7300 * 512}]},
+    {"date": "2021-10-01T10_00_00.000000000Z", "type": "FULL",
+     "buckets": [{"name": "travel", "items": 100000, "mutations": 100000, "size": 100000 * 1024}]}]}
+BACKUP = restore_progress.parse_backup_info(json.dumps(INFO))
+
+
+def test_parse_backup_info():
+    # latest backup of the repository is restored
+    assert BACKUP == {"travel": {"items": 120000, "size": 120000 * 1024}, "beer": {"items": 7300, "size": 7300 * 512}}
+    assert restore_progress.parse_backup_info("Error: unknown flag --json") == {}
+    assert restore_progress.parse_backup_info(json.dumps({"name": "PROD", "backups": []})) == {}
+
+
+def test_progress_summary():
+    samples = [(1000.0, {}),
+               (1060.0, {"travel": (30000, 100.0), "beer": (7300, 100.0)}),
+               (1120.0, {"travel": (60000, 80.5), "beer": (7300, 100.0)})]
+    summary = restore_progress.progress_summary(["travel", "beer"], BACKUP, samples, "running")
+
+    assert (summary["items"], summary["total_items"], summary["percent"]) == (67300, 127300, 52.9)
+    # rates of the last interval, beer is already restored
+    assert summary["items_per_second"] == 500
+    assert summary["bytes_per_second"] == 500 * 1024
+    assert summary["average_items_per_second"] == 560
+    assert summary["eta_seconds"] == 120
+    assert [(bucket["name"], bucket["percent"], bucket["resident_ratio"]) for bucket in summary["buckets"]] == [
+        ("travel", 50.0, 80.5), ("beer", 100.0, 100.0)]
+    assert restore_progress.format_summary(summary) == \
+        "Restore of travel, beer running: 52.9% (67300 of 127300 items), 500 items/s, 0.5 MB/s, ETA 120 s, " \
+        "elapsed 120 s"
+
+
+def test_progress_summary_without_backup_info():
+    samples = [(1000.0, {}), (1100.0, {"travel": (5000, 100.0)})]
+    summary = restore_progress.progress_summary(["travel"], {}, samples, "running")
+
+    assert (summary["percent"], summary["eta_seconds"], summary["bytes_per_second"]) == (None, None, 0)
+    assert restore_progress.format_summary(summary) == \
+        "Restore of travel running: 5000 items, 50 items/s, 0.0 MB/s, elapsed 100 s"
@@ -0,0 +1,716 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# End to end runs of plugin operations against the local Couchbase stand-in (test/standin)
+#######################################################################################################################
+
+import json
+import os
+import sys
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from db_commands.constants import SERVICE_PLACEMENT_ADVISOR
+from dlpx.virtualization.platform import Mount, StagedSource, Status, VirtualSource
+from dlpx.virtualization.platform.exceptions import UserError
+from generated.definitions import LinkedSourceDefinition, RepositoryDefinition, SourceConfigDefinition, \
+    VirtualSourceDefinition
+from operations import link_xdcr, virtual
+from utils import utilities
+
+from test.standin import Bucket, Index, StandIn
+
+STAGING_MOUNT = "/mnt/provision/staging"
+VDB_MOUNT = "/mnt/provision/vdb"
+
+
+@pytest.fixture
+def standin():
+    standin = StandIn()
+    source = standin.add_host("source", ips=("10.0.0.10",))
+    standin.add_host("staging", ips=("10.0.0.20",))
+    standin.add_host("target", ips=("10.0.0.30",))
+    standin.add_host("target2", ips=("10.0.0.31",))
+    standin.add_cluster(source, "production", "source_admin", "source_password",
+                        buckets=[Bucket("travel", ram_quota_mb=256, items=120000),
+                                 Bucket("beer", ram_quota_mb=128, items=7300)],
+                        indexes=[Index("travel", "idx_city", ["city"]),
+                                 Index("travel", "idx_country", ["country"], deferred=True),
+                                 Index("beer", "#primary", primary=True)])
+    utilities.reset_captured_environments()
+    with standin.patch():
+        yield standin
+
+
+def _host(standin, name):
+    return standin.find_host(name)
+
+
+@pytest.fixture
+def repository(standin):
+    host = _host(standin, "staging")
+    return RepositoryDefinition(cb_install_path=host.install_path, cb_shell_path=host.shell_path,
+                                version=host.version, pretty_name="Couchbase ({})".format(host.version),
+                                uid=host.uid, gid=host.gid)
+
+
+@pytest.fixture
+def source_config():
+    return SourceConfigDefinition(couchbase_src_host="source", couchbase_src_port=8091,
+                                  pretty_name="Couchbase:8091 - production", db_path="/opt/couchbase/var")
+
+
+@pytest.fixture
+def staged_source(standin):
+    host = _host(standin, "staging")
+    standin.mount(host, STAGING_MOUNT)
+    connection = standin.connection(host)
+    parameters = LinkedSourceDefinition(d_source_type="XDCR", couchbase_host="staging", couchbase_port=8091,
+                                        mount_path=STAGING_MOUNT, stg_cluster_name="staging_cluster",
+                                        cluster_ram_size=2048, cluster_index_ram_size=512,
+                                        cluster_ftsram_size=256, cluster_eventing_ram_size=256,
+                                        cluster_analytics_ram_size=1024, bucket_eviction_policy="valueOnly",
+                                        bucket_size=0, couchbase_admin="admin", couchbase_admin_password="password",
+                                        xdcr_admin="source_admin", xdcr_admin_password="source_password",
+                                        fts_service=False, eventing_service=False, analytics_service=False,
+                                        config_settings_prov=[])
+    return StagedSource(guid="staging-guid", source_connection=connection, parameters=parameters,
+                        mount=Mount(connection.environment, STAGING_MOUNT), staged_connection=connection)
+
+
+def _virtual_source(standin, node_list=()):
+    connection = standin.connection(_host(standin, "target"))
+    parameters = VirtualSourceDefinition(couchbase_port=8091, mount_path=VDB_MOUNT, tgt_cluster_name="vdb_cluster",
+                                         cluster_ram_size=2048, cluster_index_ram_size=512, cluster_ftsram_size=256,
+                                         cluster_eventing_ram_size=256, cluster_analytics_ram_size=1024,
+                                         bucket_eviction_policy="valueOnly", couchbase_admin="vdb_admin",
+                                         couchbase_admin_password="vdb_password", fts_service=False,
+                                         analytics_service=False, eventing_service=False, node_list=list(node_list))
+    return VirtualSource(guid="vdb-guid", connection=connection, parameters=parameters,
+                         mounts=[Mount(connection.environment, VDB_MOUNT)])
+
+
+def _provision(standin, staged_source, repository, source_config, node_list=()):
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    snapshot = link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    standin.clone_mount(_host(standin, "staging"), STAGING_MOUNT, _host(standin, "target"), VDB_MOUNT)
+    virtual_source = _virtual_source(standin, node_list)
+    virtual.vdb_configure(virtual_source, snapshot, repository)
+    return virtual_source, snapshot
+
+
+def test_repository_discovery_cache(standin):
+    from controller import helper_lib
+    staging = _host(standin, "staging")
+    connection = standin.connection(staging)
+
+    probed = helper_lib.find_repositories(connection)
+    assert helper_lib.find_repositories(connection) == probed
+    assert len([name for name in staging.files if name.endswith("/couchbase_repository_cache.dat")]) == 1
+
+    # owner of the binaries is part of the fingerprint, changed owner is probed again
+    staging.uid = staging.uid + 1
+    assert helper_lib.find_repositories(connection)[0]["uid"] == probed[0]["uid"] + 1
+
+
+def test_repository_discovery_cache_not_rewritten_for_install_without_fingerprint(standin):
+    from controller import helper_lib
+    cached = {"binary_path": "/opt/couchbase/bin", "install_path": "/opt/couchbase/bin/couchbase-server",
+              "shell_path": "/opt/couchbase/bin/couchbase-cli", "version": "7.0.2", "uid": 1000, "gid": 1000,
+              "fingerprint": "1234:100:1000:1000:Oct 1 10:00"}
+    output = "\n".join(["CACHE|/toolkit/.delphix/couchbase_repository_cache.dat|1", "CACHED|" + json.dumps(cached),
+                        "REPO|/opt/other|/opt/other/couchbase-server|/opt/other/couchbase-cli|"
+                        "Couchbase Server 6.6.0|||"])
+
+    with mock.patch.object(utilities, "execute_bash", return_value=[output, "", 0]) as execute_bash:
+        installs = helper_lib.find_repositories(standin.connection(_host(standin, "staging")))
+
+    # install whose binary can't be listed is probed every time, the cache of the other one stays valid
+    assert [install["fingerprint"] for install in installs] == [cached["fingerprint"], ""]
+    assert execute_bash.call_count == 1
+
+
+def test_resync_xdcr(standin, staged_source, repository, source_config):
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+
+    staging = _host(standin, "staging")
+    cluster = [cluster for cluster in standin.clusters.values() if cluster.name == "staging_cluster"][0]
+    assert sorted(cluster.buckets) == ["beer", "travel"]
+    assert cluster.buckets["travel"].items == 120000
+    assert cluster.buckets["beer"].items == 7300
+    assert sorted(index.name for index in cluster.indexes.values()) == ["#primary", "idx_city", "idx_country"]
+    assert all(index.state == "online" for index in cluster.indexes.values())
+    assert not staging.server.running
+    assert json.loads(staging.read(STAGING_MOUNT + "/.delphix/config.dat_1"))["uuid"] == cluster.uuid
+    assert standin.count(tool="cbq") > 0
+    assert standin.clock.slept > 0
+
+
+def test_post_snapshot_records_bucket_statistics(standin, staged_source, repository, source_config):
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    standin.reset()
+    snapshot = link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+
+    stats = {bucket["name"]: bucket["stats"] for bucket in json.loads(snapshot.bucket_list)}
+    assert stats["travel"]["items"] == 120000
+    assert stats["travel"]["data_used"] == 120000 * 1024
+    assert 0 < stats["travel"]["resident_ratio"] <= 100
+    # two indexes of travel, one of beer, read from the index service in the same REST batch as the bucket list
+    assert stats["travel"]["index_disk_size"] == 2 * 120000 * 64
+    assert stats["beer"]["index_disk_size"] == 7300 * 64
+    assert [record.requests for record in standin.records if "/api/v1/stats" in record.command] == [2]
+
+
+def test_capacity_plan_of_staging(standin, staged_source, repository, source_config):
+    from controller import capacity_planner
+    from controller.couchbase_operation import CouchbaseOperation
+    from controller.resource_builder import Resource
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    staging = CouchbaseOperation(Resource.ObjectBuilder.set_staged_source(staged_source).set_repository(
+        repository).set_source_config(source_config).build())
+    staging.start_couchbase()
+
+    plan = capacity_planner.plan_capacity(*capacity_planner.cluster_inputs(staging), node_count=2)
+
+    # three indexes of two buckets, second node is an index node
+    assert plan["services"][1] == ["index", "query"]
+    assert sorted(bucket["name"] for bucket in plan["buckets"]) == ["beer", "travel"]
+    assert all(bucket["disk_footprint"] > 0 for bucket in plan["buckets"])
+    assert plan["cluster_ram_size"] >= sum(bucket["ram_size"] for bucket in plan["buckets"])
+
+
+def test_vdb_configure(standin, staged_source, repository, source_config):
+    virtual_source, snapshot = _provision(standin, staged_source, repository, source_config)
+
+    assert json.loads(snapshot.bucket_list)[0]["name"] == "beer"
+    target = _host(standin, "target")
+    cluster = target.server.cluster
+    assert cluster.name == "vdb_cluster"
+    assert cluster.authorized("vdb_admin", "vdb_password")
+    assert cluster.uuid != json.loads(target.read(VDB_MOUNT + "/.delphix/config.dat_1"))["uuid"]
+    assert cluster.buckets["travel"].items == 120000
+    assert virtual.vdb_status(virtual_source, repository, None) == Status.ACTIVE
+
+
+def test_rest_answers_not_repeated_by_couchbase_cli(standin, staged_source, repository, source_config):
+    virtual_source, snapshot = _provision(standin, staged_source, repository, source_config)
+    vdb = _vdb(virtual_source, repository)
+    standin.reset()
+
+    # missing bucket and stopped server are answers, couchbase-cli would fail the same way
+    assert vdb.bucket_delete("missing")[2] != 0
+    standin.stop_server(_host(standin, "target"))
+    assert vdb.status() == Status.INACTIVE
+    assert standin.count(tool="couchbase-cli") == 0
+
+
+def test_vdb_reconfigure_multinode(standin, staged_source, repository, source_config):
+    node_list = [{"environment": _host(standin, "target2").reference,
+                  "environmentUser": _host(standin, "target2").user_reference,
+                  "node_addr": "target2", "fts_service": False, "analytics_service": False,
+                  "eventing_service": False}]
+    virtual_source, snapshot = _provision(standin, staged_source, repository, source_config, node_list)
+
+    target, target2 = _host(standin, "target"), _host(standin, "target2")
+    assert target2.server.cluster is target.server.cluster
+    assert len(target.server.cluster.nodes) == 2
+
+    virtual.vdb_pre_snapshot(virtual_source, repository, None)
+    virtual.vdb_stop(virtual_source, repository, None)
+    assert not target.server.running and not target2.server.running
+
+    standin.reset()
+    virtual.vdb_reconfigure(virtual_source, repository, None, snapshot)
+
+    cluster = target.server.cluster
+    assert target2.server.cluster is cluster
+    assert [node.status(standin.clock.now, standin.warmup_seconds) for node in cluster.nodes] == ["healthy"] * 2
+    assert standin.summary()["commands"] == len(standin.records) > 0
+
+
+def _node(host):
+    return {"environment": host.reference, "environmentUser": host.user_reference, "node_addr": host.name,
+            "fts_service": False, "analytics_service": False, "eventing_service": False}
+
+
+def _vdb(virtual_source, repository):
+    return virtual.CouchbaseOperation(
+        virtual.Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).build())
+
+
+def test_vdb_resizes_cluster(standin, staged_source, repository, source_config):
+    target, target2 = _host(standin, "target"), _host(standin, "target2")
+    target3 = standin.add_host("target3", ips=("10.0.0.32",))
+    virtual_source, snapshot = _provision(standin, staged_source, repository, source_config, [_node(target2)])
+    # nodes are saved with the data of the VDB
+    assert VDB_MOUNT + "/.delphix/vdb_nodes.json" in target.files
+
+    # target2 replaced by target3, removed node is moved out of the cluster while it's still mounted
+    virtual_source.parameters.node_list = [_node(target3)]
+    cluster = target.server.cluster
+    virtual.vdb_stop(virtual_source, repository, None)
+    assert [member.host for member in cluster.nodes] == [target]
+    assert not target2.server.running
+    standin.reset()
+    virtual.vdb_reconfigure(virtual_source, repository, None, snapshot)
+
+    assert [member.host for member in target.server.cluster.nodes] == [target, target3]
+    assert standin.count(tool="couchbase-cli", name="rebalance") == 1
+    assert [entry["node_addr"] for entry in virtual.vdb_nodes(_vdb(virtual_source, repository))] == ["target3"]
+
+    # next reconfigure restores the resized cluster from the saved configuration
+    virtual.vdb_stop(virtual_source, repository, None)
+    virtual.vdb_reconfigure(virtual_source, repository, None, snapshot)
+    assert target3.server.cluster is target.server.cluster
+    assert [member.status(standin.clock.now, standin.warmup_seconds)
+            for member in target.server.cluster.nodes] == ["healthy"] * 2
+
+
+def test_vdb_node_removed_while_disabled_fails_reconfigure(standin, staged_source, repository, source_config):
+    target2 = _host(standin, "target2")
+    virtual_source, snapshot = _provision(standin, staged_source, repository, source_config, [_node(target2)])
+    virtual.vdb_pre_snapshot(virtual_source, repository, None)
+    virtual.vdb_stop(virtual_source, repository, None)
+
+    # removed node isn't mounted by the mount specification, its data is not available
+    virtual_source.parameters.node_list = []
+    with pytest.raises(UserError) as error:
+        virtual.vdb_reconfigure(virtual_source, repository, None, snapshot)
+    assert "target2" in error.value.message
+
+
+def test_vdb_without_saved_nodes_fails(standin, staged_source, repository, source_config):
+    target, target2 = _host(standin, "target"), _host(standin, "target2")
+    virtual_source, snapshot = _provision(standin, staged_source, repository, source_config, [_node(target2)])
+    del target.files[VDB_MOUNT + "/.delphix/vdb_nodes.json"]
+
+    with pytest.raises(UserError):
+        virtual.vdb_stop(virtual_source, repository, None)
+    with pytest.raises(UserError):
+        virtual.vdb_reconfigure(virtual_source, repository, None, snapshot)
+
+
+def test_vdb_configure_small_target_host(standin, staged_source, repository, source_config):
+    target = _host(standin, "target")
+    target.memory_total_mb = 700
+
+    _provision(standin, staged_source, repository, source_config)
+
+    # 80% of the memory for data and index, buckets of the snapshot squeezed into the data quota
+    cluster = target.server.cluster
+    assert (cluster.memory_quota_mb, cluster.index_memory_quota_mb) == (304, 256)
+    assert sum(bucket.ram_quota_mb for bucket in cluster.buckets.values()) <= cluster.memory_quota_mb
+    assert [bucket.eviction_policy for bucket in cluster.buckets.values()] == ["fullEviction"] * 2
+    assert cluster.buckets["travel"].items == 120000
+
+
+def test_vdb_configure_selected_buckets(standin, staged_source, repository, source_config):
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    snapshot = link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    standin.clone_mount(_host(standin, "staging"), STAGING_MOUNT, _host(standin, "target"), VDB_MOUNT)
+    virtual_source = _virtual_source(standin)
+    virtual_source.parameters.provision_buckets = ["travel", "missing"]
+    with pytest.raises(UserError):
+        virtual.vdb_configure(virtual_source, snapshot, repository)
+
+    virtual_source.parameters.provision_buckets = ["travel"]
+    virtual.vdb_configure(virtual_source, snapshot, repository)
+
+    # data files of beer are removed before the start, the bucket and its quota are gone
+    cluster = _host(standin, "target").server.cluster
+    assert list(cluster.buckets) == ["travel"]
+    assert any(record.command.endswith("rm  -rf  {}/data_1/beer".format(VDB_MOUNT)) for record in standin.records)
+    assert cluster.buckets["travel"].items == 120000
+
+
+def test_vdb_configure_fails_if_data_of_unselected_bucket_stays(standin, staged_source, repository, source_config):
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    snapshot = link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    standin.clone_mount(_host(standin, "staging"), STAGING_MOUNT, _host(standin, "target"), VDB_MOUNT)
+    virtual_source = _virtual_source(standin)
+    virtual_source.parameters.provision_buckets = ["travel"]
+
+    with mock.patch.object(virtual.CouchbaseOperation, "remove_bucket_data",
+                           return_value=["", "rm: cannot remove 'beer': Permission denied", 1]):
+        with pytest.raises(UserError):
+            virtual.vdb_configure(virtual_source, snapshot, repository)
+    assert not _host(standin, "target").server.running
+
+
+def test_vdb_start_waits_for_warmup(standin, staged_source, repository, source_config):
+    target = _host(standin, "target")
+    virtual_source, _ = _provision(standin, staged_source, repository, source_config)
+    standin.warmup_values_per_second = 2000
+
+    def start():
+        virtual.vdb_stop(virtual_source, repository, None)
+        started = standin.clock.now
+        virtual.vdb_start(virtual_source, repository, None)
+        return standin.clock.now - started
+
+    # all values of travel are loaded before the VDB is reported running
+    full_warmup = start()
+    travel = target.server.cluster.buckets["travel"]
+    assert target.server.warmup(travel, standin.clock.now, standin.warmup_seconds,
+                                standin.warmup_values_per_second) == (120000, True)
+
+    # thresholds are set again after the restart and warmup of travel ends at 10% of its items
+    virtual_source.parameters.warmup_min_items_threshold = 10
+    virtual_source.parameters.ready_buckets = ["travel"]
+    assert start() < full_warmup
+    assert target.server.bucket_params["travel"]["warmup_min_items_threshold"] == "10"
+    assert target.server.warmup(travel, standin.clock.now, standin.warmup_seconds,
+                                standin.warmup_values_per_second)[1]
+
+
+def test_vdb_configure_placement_advisor(standin, staged_source, repository, source_config):
+    target2, target3 = _host(standin, "target2"), standin.add_host("target3", ips=("10.0.0.32",))
+    node_list = [{"environment": host.reference, "environmentUser": host.user_reference,
+                  "node_addr": host.name} for host in (target2, target3)]
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    snapshot = link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    standin.clone_mount(_host(standin, "staging"), STAGING_MOUNT, _host(standin, "target"), VDB_MOUNT)
+    virtual_source = _virtual_source(standin, node_list)
+    virtual_source.parameters.service_placement = SERVICE_PLACEMENT_ADVISOR
+
+    virtual.vdb_configure(virtual_source, snapshot, repository)
+
+    # 3 indexes of 2 buckets, indexer gets its own node
+    assert target2.server.services == ["kv"]
+    assert target3.server.services == ["index", "n1ql"]
+
+
+def test_resync_xdcr_resumes_after_failure(standin, staged_source, repository, source_config):
+    from controller.couchbase_operation import CouchbaseOperation
+    staging = _host(standin, "staging")
+    journal = STAGING_MOUNT + "/.delphix/resync_journal.json"
+    profile = STAGING_MOUNT + "/.delphix/ingest_profile.json"
+
+    with mock.patch.object(CouchbaseOperation, "unbuilt_indexes", side_effect=RuntimeError("index build timeout")):
+        with pytest.raises(RuntimeError):
+            link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    assert sorted(json.loads(staging.read(journal))["buckets"]) == ["beer", "travel"]
+    # failed resync reverts ingest profile, staging cluster isn't left with the bulk load settings
+    assert staging.server.cluster.memcached_settings == {}
+    assert staging.server.cluster.auto_compaction["databaseFragmentationThreshold"]["percentage"] == 30
+    assert profile not in staging.files
+    uuid = staging.server.cluster.uuid
+    standin.reset()
+
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+
+    # cluster and buckets of the failed resync are reused, only indexes are built again
+    cluster = [cluster for cluster in standin.clusters.values() if cluster.name == "staging_cluster"][0]
+    assert cluster.uuid == uuid
+    assert cluster.buckets["travel"].items == 120000
+    assert all(index.state == "online" for index in cluster.indexes.values())
+    assert standin.count(name="start") == 0
+    # status of the stopped server is answered by REST call, it isn't repeated by couchbase-cli
+    assert standin.count(name="server-list") == 0
+    assert journal not in staging.files
+    assert cluster.memcached_settings == {}
+    assert cluster.auto_compaction["databaseFragmentationThreshold"]["percentage"] == 30
+    assert profile not in staging.files
+
+
+def test_failed_revert_of_ingest_profile_keeps_error_of_resync(standin, staged_source, repository, source_config):
+    from controller.couchbase_operation import CouchbaseOperation
+    from controller.ingest_profile import IngestProfile
+
+    with mock.patch.object(CouchbaseOperation, "unbuilt_indexes", side_effect=RuntimeError("index build timeout")):
+        with mock.patch.object(IngestProfile, "revert", side_effect=RuntimeError("connection reset")):
+            with pytest.raises(RuntimeError, match="index build timeout"):
+                link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    assert STAGING_MOUNT + "/.delphix/ingest_profile.json" in _host(standin, "staging").files
+
+
+def test_resync_xdcr_fails_if_index_build_cannot_be_checked(standin, staged_source, repository, source_config):
+    from controller.couchbase_operation import CouchbaseOperation
+
+    with mock.patch.object(CouchbaseOperation, "unbuilt_indexes", return_value=None) as unbuilt_indexes:
+        with pytest.raises(UserError):
+            link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    assert unbuilt_indexes.call_count == 11
+
+
+def _staging_cluster(standin):
+    return [cluster for cluster in standin.clusters.values() if cluster.name == "staging_cluster"][0]
+
+
+def test_pre_snapshot_compacts_fragmented_buckets(standin, staged_source, repository, source_config):
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    cluster = _staging_cluster(standin)
+    cluster.buckets["travel"].fragmentation = 60
+    cluster.buckets["beer"].fragmentation = 10
+
+    link_xdcr.pre_snapshot_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    snapshot = link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+
+    # only the bucket above the threshold is compacted
+    assert cluster.buckets["travel"].fragmentation == 0
+    assert cluster.buckets["beer"].fragmentation == 10
+    assert snapshot.disk_used_before_compaction == 120000 * 1024 * 100 // 40 + 7300 * 1024 * 100 // 90
+    assert snapshot.disk_used_after_compaction == 120000 * 1024 + 7300 * 1024 * 100 // 90
+
+
+def test_pre_snapshot_compaction_cancelled_after_time_budget(standin, staged_source, repository, source_config):
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    cluster = _staging_cluster(standin)
+    cluster.buckets["travel"].fragmentation = 60
+    staged_source.parameters.compaction_time_budget = 0
+
+    link_xdcr.pre_snapshot_xdcr(staged_source, repository, source_config, staged_source.parameters)
+
+    assert cluster.buckets["travel"].fragmentation == 60
+    assert cluster.buckets["travel"].compacted_at is None
+
+
+def _staging_node(host):
+    return {"environment": host.reference, "environmentUser": host.user_reference, "node_addr": host.name,
+            "fts_service": False, "analytics_service": False, "eventing_service": False}
+
+
+def test_resync_xdcr_multinode_staging(standin, staged_source, repository, source_config):
+    staging, staging2 = _host(standin, "staging"), standin.add_host("staging2", ips=("10.0.0.21",))
+    staged_source.parameters.node_list = [_staging_node(staging2)]
+
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+
+    # both nodes joined by one rebalance and moved out by another one before the snapshot
+    cluster = _staging_cluster(standin)
+    assert [node.host for node in cluster.nodes] == [staging]
+    assert standin.count(tool="couchbase-cli", name="rebalance") == 2
+    assert not staging.server.running and not staging2.server.running
+    assert [member["host"] for member in json.loads(staging.read(STAGING_MOUNT + "/.delphix/config.dat_1"))[
+        "members"]] == [staging.reference]
+
+    snapshot = link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    assert staging.server.running and staging2.server.running
+    assert [node.host for node in cluster.nodes] == [staging, staging2]
+    assert [node.status(standin.clock.now, standin.warmup_seconds) for node in cluster.nodes] == ["healthy"] * 2
+
+    # VDB of multinode staging snapshot has all vBuckets and no staging host as member
+    standin.clone_mount(staging, STAGING_MOUNT, _host(standin, "target"), VDB_MOUNT)
+    virtual.vdb_configure(_virtual_source(standin), snapshot, repository)
+    vdb = [cluster for cluster in standin.clusters.values() if cluster.name == "vdb_cluster"][0]
+    assert [node.host for node in vdb.nodes] == [_host(standin, "target")]
+    assert vdb.buckets["travel"].items == 120000
+    assert vdb.buckets["beer"].items == 7300
+
+
+def test_staging_node_removed_from_node_list_leaves_cluster(standin, staged_source, repository, source_config):
+    staging = _host(standin, "staging")
+    staging2 = standin.add_host("staging2", ips=("10.0.0.21",))
+    staging3 = standin.add_host("staging3", ips=("10.0.0.22",))
+    staged_source.parameters.node_list = [_staging_node(staging2), _staging_node(staging3)]
+    link_xdcr.resync_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    cluster = _staging_cluster(standin)
+    assert [node.host for node in cluster.nodes] == [staging, staging2, staging3]
+    assert "data_" not in staging2.server.data_path
+
+    # node removed from node_list is moved out of the cluster together with the rest before the snapshot
+    staged_source.parameters.node_list = [_staging_node(staging3)]
+    link_xdcr.pre_snapshot_xdcr(staged_source, repository, source_config, staged_source.parameters)
+    assert [node.host for node in cluster.nodes] == [staging]
+    assert not staging2.server.running and not staging3.server.running
+
+    link_xdcr.post_snapshot_xdcr(staged_source, repository, source_config, "XDCR")
+    assert [node.host for node in cluster.nodes] == [staging, staging3]
+    assert not staging2.server.running
+
+    # disabled dSource keeps configuration of the first node only, nodes join again when it is enabled
+    link_xdcr.stop_staging_xdcr(staged_source, repository, source_config)
+    assert not staging3.server.running
+    link_xdcr.start_staging_xdcr(staged_source, repository, source_config)
+    assert [node.host for node in _staging_cluster(standin).nodes] == [staging, staging3]
+    assert [node.status(standin.clock.now, standin.warmup_seconds)
+            for node in _staging_cluster(standin).nodes] == ["healthy"] * 2
+
+
+def test_rebalance_job_survives_lost_connection(standin, staged_source, repository, source_config):
+    target2 = _host(standin, "target2")
+    node_list = [{"environment": target2.reference, "environmentUser": target2.user_reference,
+                  "node_addr": "target2", "fts_service": False, "analytics_service": False,
+                  "eventing_service": False}]
+    run_bash = standin.run_bash
+    lost = []
+
+    def flaky_run_bash(connection, command, *args, **kwargs):
+        # connection to the host is lost for 20 checks (over 3 minutes) while rebalance is running
+        if "size=$(wc -c < stdout)" in command and len(lost) < 20:
+            lost.append(command)
+            raise RuntimeError("SSH connection reset")
+        return run_bash(connection, command, *args, **kwargs)
+
+    with mock.patch("dlpx.virtualization.libs.run_bash", new=flaky_run_bash):
+        _provision(standin, staged_source, repository, source_config, node_list)
+
+    target = _host(standin, "target")
+    assert len(lost) == 20
+    assert target2.server.cluster is target.server.cluster
+    assert standin.count(tool="couchbase-cli", name="rebalance") == 1
+    assert [record.detached for record in standin.records if record.name == "rebalance"] == [True]
+    assert target.read(VDB_MOUNT + "/.delphix/jobs/rebalance/exit_code") == "0\n"
+
+
+def test_job_given_up_when_host_is_unreachable(standin, staged_source, repository, source_config):
+    from db_commands.constants import JOB_UNREACHABLE_TIMEOUT
+    vdb = virtual.CouchbaseOperation(
+        virtual.Resource.ObjectBuilder.set_virtual_source(_virtual_source(standin)).set_repository(
+            repository).build())
+    vdb.start_job("sleep", "sleep 1")
+    started = standin.clock.time()
+
+    with mock.patch.object(virtual.CouchbaseOperation, "job_state", side_effect=RuntimeError("SSH connection reset")):
+        with pytest.raises(UserError):
+            vdb.wait_for_job("sleep")
+    assert JOB_UNREACHABLE_TIMEOUT < standin.clock.time() - started < JOB_UNREACHABLE_TIMEOUT + 60
+
+
+def test_running_job_is_attached_again(standin, staged_source, repository, source_config):
+    target2 = _host(standin, "target2")
+    virtual_source, snapshot = _provision(standin, staged_source, repository, source_config, [
+        {"environment": target2.reference, "environmentUser": target2.user_reference, "node_addr": "target2",
+         "fts_service": False, "analytics_service": False, "eventing_service": False}])
+    vdb = virtual.CouchbaseOperation(
+        virtual.Resource.ObjectBuilder.set_virtual_source(virtual_source).set_repository(repository).build())
+    standin.reset()
+
+    # operation fails while rebalance job is running, the retry waits for the same job
+    with mock.patch.object(virtual.CouchbaseOperation, "wait_for_job", side_effect=RuntimeError("timeout")):
+        with pytest.raises(RuntimeError):
+            vdb.rebalance()
+    vdb.rebalance()
+
+    assert standin.count(tool="couchbase-cli", name="rebalance") == 1
+    assert standin.count(name="job_start") == 2
+    assert len(target2.server.cluster.nodes) == 2
+
+
+def test_resync_cbbkpmgr_reports_restore_progress(standin, staged_source, repository, source_config, caplog):
+    from operations import link_cbbkpmgr
+    staging = _host(standin, "staging")
+    standin.add_backup(staging, "/backup", "PROD", "2021-10-01T10_00_00.000000000Z",
+                       [Bucket("travel", ram_quota_mb=256, items=120000), Bucket("beer", ram_quota_mb=128, items=7300)])
+    staged_source.parameters.d_source_type = "Couchbase Backup Manager"
+    staged_source.parameters.couchbase_bak_loc = "/backup"
+    staged_source.parameters.couchbase_bak_repo = "PROD"
+    standin.restore_docs_per_second = 1000
+
+    with caplog.at_level("INFO"):
+        link_cbbkpmgr.resync_cbbkpmgr(staged_source, repository, source_config, staged_source.parameters)
+
+    assert _staging_cluster(standin).buckets["travel"].items == 120000
+    assert _staging_cluster(standin).buckets["beer"].items == 7300
+    # both buckets are restored by one run of cbbackupmgr, backup info is read once
+    assert standin.count(tool="cbbackupmgr", name="restore") == 1
+    assert standin.count(tool="cbbackupmgr", name="info") == 1
+    running = [record.getMessage() for record in caplog.records
+               if record.getMessage().startswith("Restore of travel, beer running")]
+    assert running and all("items/s" in message and "ETA" in message for message in running)
+    progress = json.loads(staging.read(STAGING_MOUNT + "/.delphix/restore_progress.json"))
+    assert (progress["state"], progress["percent"], progress["eta_seconds"]) == ("complete", 100.0, None)
+
+
+def test_restore_succeeds_if_progress_report_fails(standin, staged_source, repository, source_config):
+    from controller.restore_progress import RestoreProgress
+    from operations import link_cbbkpmgr
+    staging = _host(standin, "staging")
+    standin.add_backup(staging, "/backup", "PROD", "2021-10-01T10_00_00.000000000Z",
+                       [Bucket("travel", ram_quota_mb=256, items=120000)])
+    staged_source.parameters.d_source_type = "Couchbase Backup Manager"
+    staged_source.parameters.couchbase_bak_loc = "/backup"
+    staged_source.parameters.couchbase_bak_repo = "PROD"
+    standin.restore_docs_per_second = 1000
+
+    with mock.patch.object(RestoreProgress, "sample", side_effect=RuntimeError("bucket statistics")) as sample:
+        link_cbbkpmgr.resync_cbbkpmgr(staged_source, repository, source_config, staged_source.parameters)
+
+    assert sample.call_count > 0
+    assert _staging_cluster(standin).buckets["travel"].items == 120000
+
+
+def test_snapsync_keeps_auto_compaction_settings_outside_ingest_profile(standin, staged_source, repository,
+                                                                        source_config):
+    from operations import link_cbbkpmgr
+    staging = _host(standin, "staging")
+    standin.add_backup(staging, "/backup", "PROD", "2021-10-01T10_00_00.000000000Z",
+                       [Bucket("travel", ram_quota_mb=256, items=120000)])
+    staged_source.parameters.d_source_type = "Couchbase Backup Manager"
+    staged_source.parameters.couchbase_bak_loc = "/backup"
+    staged_source.parameters.couchbase_bak_repo = "PROD"
+    standin.restore_docs_per_second = 1000
+    link_cbbkpmgr.resync_cbbkpmgr(staged_source, repository, source_config, staged_source.parameters)
+    link_cbbkpmgr.post_snapshot_cbbkpmgr(staged_source, repository, source_config, "Couchbase Backup Manager")
+    cluster = _staging_cluster(standin)
+    cluster.auto_compaction["allowedTimePeriod"] = {"fromHour": 1, "fromMinute": 30, "toHour": 5, "toMinute": 0,
+                                                    "abortOutside": True}
+    cluster.auto_compaction["indexFragmentationThreshold"] = {"percentage": 45}
+    settings = json.loads(json.dumps(cluster.auto_compaction))
+    posted = []
+    set_auto_compaction = standin.shell._set_auto_compaction
+
+    def record_auto_compaction(cluster, data):
+        posted.append(dict(data))
+        return set_auto_compaction(cluster, data)
+
+    with mock.patch.object(standin.shell, "_set_auto_compaction", side_effect=record_auto_compaction):
+        link_cbbkpmgr.pre_snapshot_cbbkpmgr(staged_source, repository, source_config, staged_source.parameters)
+
+    # profile pauses fragmentation thresholds only, time period and index compaction are posted as they were
+    assert len(posted) == 2
+    assert posted[0]["databaseFragmentationThreshold[percentage]"] == "undefined"
+    assert (posted[0]["allowedTimePeriod[fromMinute]"], posted[0]["indexFragmentationThreshold[percentage]"]) == \
+        ("30", "45")
+    assert cluster.auto_compaction == settings
+
+
+def test_restore_reported_failed_if_job_cannot_be_waited_for(standin, staged_source, repository, source_config):
+    from controller.couchbase_operation import CouchbaseOperation
+    from operations import link_cbbkpmgr
+    staging = _host(standin, "staging")
+    standin.add_backup(staging, "/backup", "PROD", "2021-10-01T10_00_00.000000000Z",
+                       [Bucket("travel", ram_quota_mb=256, items=120000)])
+    staged_source.parameters.d_source_type = "Couchbase Backup Manager"
+    staged_source.parameters.couchbase_bak_loc = "/backup"
+    staged_source.parameters.couchbase_bak_repo = "PROD"
+
+    with mock.patch.object(CouchbaseOperation, "wait_for_job", side_effect=RuntimeError("SSH connection reset")):
+        with pytest.raises(RuntimeError, match="SSH connection reset"):
+            link_cbbkpmgr.resync_cbbkpmgr(staged_source, repository, source_config, staged_source.parameters)
+
+    progress = json.loads(staging.read(STAGING_MOUNT + "/.delphix/restore_progress.json"))
+    assert progress["state"] == "failed"
+
+
+def test_restore_job_is_named_by_backup(standin, staged_source, repository, source_config):
+    from operations import link_cbbkpmgr
+    staging = _host(standin, "staging")
+    standin.add_backup(staging, "/backup", "PROD", "2021-10-01T10_00_00.000000000Z",
+                       [Bucket("travel", ram_quota_mb=256, items=120000)])
+    staged_source.parameters.d_source_type = "Couchbase Backup Manager"
+    staged_source.parameters.couchbase_bak_loc = "/backup"
+    staged_source.parameters.couchbase_bak_repo = "PROD"
+    standin.restore_docs_per_second = 1000
+    link_cbbkpmgr.resync_cbbkpmgr(staged_source, repository, source_config, staged_source.parameters)
+    standin.add_backup(staging, "/backup", "PROD", "2021-10-02T10_00_00.000000000Z",
+                       [Bucket("travel", ram_quota_mb=256, items=130000)])
+
+    link_cbbkpmgr.resync_cbbkpmgr(staged_source, repository, source_config, staged_source.parameters)
+
+    # restore of the newer backup doesn't reuse the job of the older one
+    jobs = set(name.split("/")[6] for name in staging.files
+               if name.startswith(STAGING_MOUNT + "/.delphix/jobs/restore_"))
+    assert len(jobs) == 2
+    assert _staging_cluster(standin).buckets["travel"].items == 130000
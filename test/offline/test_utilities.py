@@ -0,0 +1,102 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Execution of remote commands without login shell, see src/utils/utilities.py
+#######################################################################################################################
+
+import os
+import sys
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from db_commands.commands import CommandFactory
+from utils import instrumentation, utilities
+
+
+class _Result(object):
+    def __init__(self, stdout, stderr="", exit_code=0):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+
+
+@pytest.fixture
+def connection():
+    utilities.reset_captured_environments()
+    yield mock.Mock()
+    utilities.reset_captured_environments()
+
+
+def _calls(run_bash):
+    return [(call[1]["command"], call[1]["variables"], call[1]["use_login_shell"]) for call in run_bash.call_args_list]
+
+
+def test_environment_captured_once(connection):
+    capture = "COUCHBASE_PATH=/opt/couchbase/bin\nPATH=/usr/bin:/bin\nLANG=en_US.UTF-8"
+    with mock.patch("dlpx.virtualization.libs.run_bash",
+                    side_effect=[_Result(capture), _Result("/opt/couchbase/bin"), _Result("1234")]) as run_bash:
+        assert utilities.execute_bash(connection, CommandFactory.find_binary_path())[0] == "/opt/couchbase/bin"
+        utilities.execute_bash(connection, CommandFactory.get_process(), environment_vars={"password": "secret"})
+
+    environment = {"COUCHBASE_PATH": "/opt/couchbase/bin", "PATH": "/usr/bin:/bin", "LANG": "en_US.UTF-8"}
+    calls = _calls(run_bash)
+    assert calls[0] == (CommandFactory.capture_environment(), None, True)
+    assert calls[1] == (CommandFactory.find_binary_path(), environment, False)
+    assert calls[2] == (CommandFactory.get_process(), dict(environment, password="secret"), False)
+
+
+def test_whole_environment_captured(connection):
+    capture = "JAVA_HOME=/usr/lib/jvm\nSHLVL=2\nPWD=/home/couchbase\nMOTD=first line\nsecond line\n_=/usr/bin/env"
+    with mock.patch("dlpx.virtualization.libs.run_bash", side_effect=[_Result(capture), _Result("ok")]) as run_bash:
+        utilities.execute_bash(connection, "hostname")
+
+    assert _calls(run_bash)[1][1] == {"JAVA_HOME": "/usr/lib/jvm", "MOTD": "first line\nsecond line"}
+
+
+def test_fallback_to_login_shell(connection):
+    with mock.patch("dlpx.virtualization.libs.run_bash",
+                    side_effect=[_Result("PATH=/usr/bin"), _Result("", "bash: cbq: command not found", 127),
+                                 _Result("", "", 1), _Result("ok"), _Result("ok")]) as run_bash:
+        assert utilities.execute_bash(connection, "cbq --version") == ["ok", "", 0]
+        utilities.execute_bash(connection, "cbq --version")
+
+    calls = _calls(run_bash)
+    assert calls[2] == (CommandFactory.find_command("cbq"), {"PATH": "/usr/bin"}, False)
+    assert [use_login_shell for _, _, use_login_shell in calls] == [True, False, False, True, True]
+
+
+def test_failed_command_found_without_login_shell_is_not_run_again(connection):
+    # exit code 127 of a command which ran, e.g. a script calling a missing tool
+    with mock.patch("dlpx.virtualization.libs.run_bash",
+                    side_effect=[_Result("PATH=/usr/bin"), _Result("", "sh: 1: unzip: not found", 127),
+                                 _Result("/usr/bin/unzip"), _Result("", "", 127)]) as run_bash:
+        assert utilities.execute_bash(connection, "sh restore.sh") == ["", "sh: 1: unzip: not found", 127]
+        utilities.execute_bash(connection, "sh restore.sh")
+
+    assert [use_login_shell for _, _, use_login_shell in _calls(run_bash)] == [True, False, False, False]
+
+
+def test_environment_captured_by_every_operation(connection):
+    run = instrumentation.operation("resync")(lambda: utilities.execute_bash(connection, "hostname"))
+    with mock.patch("dlpx.virtualization.libs.run_bash", return_value=_Result("PATH=/usr/bin")) as run_bash:
+        run()
+        run()
+
+    # login shell environment is read again by the next operation
+    assert [use_login_shell for _, _, use_login_shell in _calls(run_bash)] == [True, False, True, False]
+
+
+def test_login_shell_when_disabled(connection):
+    with mock.patch("db_commands.constants.USE_CAPTURED_ENVIRONMENT", False), \
+            mock.patch("dlpx.virtualization.libs.run_bash", return_value=_Result("ok")) as run_bash:
+        utilities.execute_bash(connection, "hostname")
+
+    assert _calls(run_bash) == [("hostname", None, True)]
@@ -0,0 +1,64 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+#######################################################################################################################
+# Warmup tuning and readiness gate of VDB buckets, see src/controller/warmup.py
+#######################################################################################################################
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+
+from controller import warmup
+from controller.bucket_catalog import BucketCatalog
+from generated.definitions import VirtualSourceDefinition
+
+CATALOG = BucketCatalog.from_json([{"name": "travel", "bucketType": "membase"},
+                                   {"name": "beer", "bucketType": "membase"},
+                                   {"name": "sessions", "bucketType": "ephemeral"}])
+
+STATS = """******************************************************************************
+beer
+
+ ep_warmup:                       enabled
+ ep_warmup_estimated_value_count: 7300
+ ep_warmup_state:                 done
+ ep_warmup_thread:                complete
+ ep_warmup_value_count:           7300
+******************************************************************************
+travel
+
+ ep_warmup:                       enabled
+ ep_warmup_estimated_value_count: unknown
+ ep_warmup_state:                 loading keys
+ ep_warmup_thread:                running
+"""
+
+
+def test_warmup_params():
+    assert warmup.warmup_params(VirtualSourceDefinition()) == []
+    assert warmup.warmup_params(VirtualSourceDefinition(warmup_min_items_threshold=100,
+                                                        warmup_min_memory_threshold=100,
+                                                        access_log_warmup=True)) == []
+    assert warmup.warmup_params(VirtualSourceDefinition(warmup_min_items_threshold=20,
+                                                        access_log_warmup=False)) == [
+        ("warmup_min_items_threshold", 20), ("warmup_min_memory_threshold", 100),
+        ("access_scanner_enabled", "false")]
+
+
+def test_ready_buckets():
+    # ephemeral buckets and buckets not in the VDB are not waited for
+    assert warmup.ready_buckets(VirtualSourceDefinition(), CATALOG) == ["travel", "beer"]
+    assert warmup.ready_buckets(VirtualSourceDefinition(ready_buckets=["beer", "sessions", "missing"]),
+                                CATALOG) == ["beer"]
+
+
+def test_parse_warmup_stats():
+    buckets = warmup.parse_warmup_stats(STATS)
+
+    assert sorted(buckets) == ["beer", "travel"]
+    assert warmup.warmup_complete(buckets["beer"])
+    assert warmup.warmup_progress(buckets["beer"]) == "done, 7300 of 7300 values"
+    assert not warmup.warmup_complete(buckets["travel"])
+    assert warmup.warmup_progress(buckets["travel"]) == "loading keys"
@@ -0,0 +1,14 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Local stand-in of Delphix remote execution and Couchbase servers. Plugin operations run against in-memory hosts and
+clusters, every command is recorded with simulated latency. Used by end to end tests and benchmarks of plugin
+workflows (resync, snapshot, provisioning) without Delphix Engine.
+"""
+#######################################################################################################################
+
+from .harness import StandIn, VirtualClock, CommandRecord
+from .model import Bucket, Index, Cluster, Host, BackupArchive
@@ -0,0 +1,312 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+StandIn replaces dlpx.virtualization.libs.run_bash, time.time and time.sleep, so plugin operations can run end to end
+without Delphix Engine and Couchbase servers. Every command is served by CouchbaseShell on the in-memory model and
+the virtual clock is moved forward by the configured latency of the command plus the work done by the command
+(restore, rebalance, bucket creation). Loops of the plugin waiting for replication, index builds or server start
+are driven by the same clock, so a whole resync takes milliseconds of real time.
+Every command is recorded, so tests and benchmarks can count round trips, CLI spawns and simulated time. Commands of
+detached jobs are recorded as well, they are not round trips, the plugin waits for them by polling.
+"""
+#######################################################################################################################
+
+import contextlib
+import json
+from collections import Counter, OrderedDict
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .model import INDEX_HTTP_PORT, MB, BackupArchive, Cluster, Host, dumps, new_uuid
+from .shell import CouchbaseShell
+
+
+class VirtualClock(object):
+
+    def __init__(self, start=1600000000.0):
+        self.now = float(start)
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept = self.slept + seconds
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now = self.now + max(0.0, float(seconds))
+
+
+class CommandRecord(object):
+    __slots__ = ('host', 'tool', 'name', 'command', 'exit_code', 'started', 'elapsed', 'requests', 'login_shell',
+                 'detached')
+
+    def __init__(self, host, tool, name, command, exit_code, started, elapsed, requests, login_shell=True,
+                 detached=False):
+        self.host = host
+        self.tool = tool
+        self.name = name
+        self.command = command
+        self.exit_code = exit_code
+        self.started = started
+        self.elapsed = elapsed
+        self.requests = requests
+        self.login_shell = login_shell
+        self.detached = detached
+
+    def __repr__(self):
+        return "CommandRecord({} {} {} exit_code={})".format(self.host, self.tool, self.name, self.exit_code)
+
+
+class BashResponse(object):
+    """ same attributes as RunBashResponse of Virtualization SDK """
+
+    def __init__(self, stdout, stderr, exit_code):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+
+
+class StandIn(object):
+    # seconds per command, looked up by "<tool> <name>", then by tool, then default
+    DEFAULT_LATENCY = {"default": 0.05, "couchbase-cli": 0.8, "curl": 0.1, "cbq": 0.5, "cbbackupmgr": 1.0,
+                       "couchbase-server": 0.2}
+
+    def __init__(self, latency=None, clock=None):
+        self.latency = dict(self.DEFAULT_LATENCY)
+        self.latency.update(latency or {})
+        self.clock = clock or VirtualClock()
+        self.shell = CouchbaseShell(self)
+        self.hosts = OrderedDict()
+        self.clusters = OrderedDict()
+        self.records = []
+        self.warmup_seconds = 5
+        self.warmup_values_per_second = 20000
+        self.xdcr_docs_per_second = 10000
+        self.index_build_seconds = 20
+        self.restore_docs_per_second = 50000
+        self.compaction_bytes_per_second = 50 * MB
+        self.rebalance_seconds = 10
+        self.bucket_create_seconds = 1
+        self.bucket_delete_seconds = 1
+        # sourcing of user profile by login shell
+        self.login_shell_seconds = 0.3
+
+    # environment setup
+
+    def add_host(self, name, **kwargs):
+        host = Host(name, **kwargs)
+        self.hosts[host.reference] = host
+        return host
+
+    def add_cluster(self, host, name, username, password, buckets=(), indexes=()):
+        """ running single node cluster, e.g. XDCR source """
+        server = host.server
+        server.running = True
+        server.started_at = self.clock.now - 3600
+        server.ip = host.ips[0]
+        host.write(host.var_dir + "/ip", server.ip)
+        cluster = Cluster(name, username, password)
+        self.register_cluster(cluster, [server])
+        for bucket in buckets:
+            cluster.add_bucket(bucket)
+        for index in indexes:
+            cluster.add_index(index)
+        self.sync_config()
+        return cluster
+
+    def register_cluster(self, cluster, servers):
+        self.clusters[cluster.uuid] = cluster
+        cluster.last_tick = self.clock.now
+        for server in servers:
+            server.cluster = cluster
+            server.membership = "active"
+            if server not in cluster.nodes:
+                cluster.nodes.append(server)
+
+    def add_backup(self, host, archive_path, repo, date, buckets, indexes=()):
+        """ cbbackupmgr backup with bucket-config.json files read by source_bucket_catalog_offline """
+        archive = host.archives.setdefault(host.normalize(archive_path), BackupArchive(archive_path))
+        archive.add_backup(repo, date, buckets, indexes)
+        for bucket in buckets:
+            host.write("{}/{}/{}/{}-{}/bucket-config.json".format(archive_path, repo, date, bucket.name, new_uuid()),
+                       json.dumps(bucket.rest()))
+        return archive
+
+    def mount(self, host, path):
+        host.mount(path)
+
+    def clone_mount(self, source_host, path, target_host, target_path=None):
+        """ Delphix provisioning: files under path of source host are copied to target_path and mounted there """
+        target_path = target_host.normalize(target_path or path)
+        prefix = source_host.normalize(path).rstrip("/") + "/"
+        for name, content in list(source_host.files.items()):
+            if name.startswith(prefix):
+                target_host.write(target_path + "/" + name[len(prefix):], content)
+        for name in list(source_host.dirs):
+            if name.startswith(prefix):
+                target_host.makedirs(target_path + "/" + name[len(prefix):])
+        target_host.mount(target_path)
+
+    def connection(self, host):
+        from dlpx.virtualization.common import RemoteConnection, RemoteEnvironment, RemoteHost, RemoteUser
+        remote_host = RemoteHost(name=host.name, reference="{}-HOST".format(host.name.upper()),
+                                 binary_path="/var/opt/delphix/toolkit", scratch_path="/var/opt/delphix/toolkit")
+        environment = RemoteEnvironment(name=host.name, reference=host.reference, host=remote_host)
+        return RemoteConnection(environment=environment, user=RemoteUser(name="delphix",
+                                                                         reference=host.user_reference))
+
+    def host_for(self, connection):
+        """ host is selected by environment reference, see make_nonprimary_connection """
+        return self.hosts[connection.environment.reference]
+
+    def find_host(self, name):
+        for host in self.hosts.values():
+            if name == host.name or name in host.ips:
+                return host
+        for host in self.hosts.values():
+            if host.server.ip == name and name != "127.0.0.1":
+                return host
+        return None
+
+    def resolve(self, caller, hostname, port):
+        """ running Couchbase server reachable from caller host by hostname and port or None """
+        if hostname in ("127.0.0.1", "localhost"):
+            host = caller
+        else:
+            host = self.find_host(hostname)
+        if host is None or not host.server.running or int(port) not in (host.server.port, INDEX_HTTP_PORT):
+            return None
+        return host.server
+
+    # Couchbase server process
+
+    def start_server(self, host):
+        server = host.server
+        if server.running:
+            return
+        server.running = True
+        server.started_at = self.clock.now
+        server.ip = host.ip_file() or "127.0.0.1"
+        server.cluster = None
+        server.membership = "active"
+        server.bucket_params = {}
+        config = host.read(host.config_dat)
+        if config:
+            self.attach(server, json.loads(config))
+
+    def attach(self, server, state):
+        """ join cluster from config.dat, config copied from other host makes a new cluster (provisioned VDB) """
+        host = server.host
+        member = [entry for entry in state["members"] if entry["host"] == host.reference]
+        cluster = self.clusters.get(state["uuid"])
+        if member and cluster is not None:
+            self.register_cluster(cluster, [])
+            server.cluster = cluster
+            if server not in cluster.nodes:
+                cluster.nodes.append(server)
+        else:
+            cluster, members = Cluster.load(state)
+            if member:
+                servers = [self.hosts[entry["host"]].server for entry in members if entry["host"] in self.hosts]
+                self.register_cluster(cluster, [])
+                cluster.nodes = servers
+                server.cluster = cluster
+            else:
+                cluster.uuid = new_uuid()
+                # vBuckets are spread over data nodes, configuration and data of one node have only its share
+                data_nodes = [entry for entry in members if "kv" in entry["services"]]
+                for bucket in cluster.buckets.values():
+                    bucket.items = bucket.items // max(1, len(data_nodes))
+                member = [{"services": members[0]["services"] if members else server.services,
+                           "membership": "active"}]
+                self.register_cluster(cluster, [server])
+        server.services = list(member[0]["services"])
+        server.membership = member[0]["membership"]
+
+    def stop_server(self, host):
+        server = host.server
+        if not server.running:
+            return
+        self.sync_config()
+        server.running = False
+        server.started_at = None
+        server.cluster = None
+
+    def sync_config(self):
+        """ running members persist cluster state into config.dat """
+        for cluster in self.clusters.values():
+            state = None
+            for node in cluster.running_nodes():
+                state = state or dumps(cluster.dump())
+                node.host.write(node.host.config_dat, state)
+
+    def tick(self):
+        for cluster in list(self.clusters.values()):
+            cluster.tick(self.clock.now, self.clusters, self.xdcr_docs_per_second)
+
+    # run_bash replacement
+
+    def command_latency(self, tool, name):
+        for key in ("{} {}".format(tool, name), tool):
+            if key in self.latency:
+                return self.latency[key]
+        return self.latency["default"]
+
+    def run_bash(self, connection, command, variables=None, use_login_shell=False, check=False):
+        host = self.host_for(connection)
+        self.tick()
+        started = self.clock.now
+        result = self.shell.run(host, command, variables, use_login_shell)
+        elapsed = self.command_latency(result.tool, result.name) + result.work
+        if use_login_shell:
+            elapsed = elapsed + self.login_shell_seconds
+        self.clock.advance(elapsed)
+        self.tick()
+        self.sync_config()
+        self.records.append(CommandRecord(host.name, result.tool, result.name, command, result.exit_code, started,
+                                          elapsed, result.requests, use_login_shell))
+        return BashResponse(result.stdout, result.stderr, result.exit_code)
+
+    def record_job(self, host, command, result, started, elapsed):
+        """ command of detached job started by shell """
+        self.records.append(CommandRecord(host.name, result.tool, result.name, command, result.exit_code, started,
+                                          elapsed, result.requests, False, detached=True))
+
+    @contextlib.contextmanager
+    def patch(self):
+        with mock.patch("dlpx.virtualization.libs.run_bash", new=self.run_bash), \
+                mock.patch("time.time", new=self.clock.time), \
+                mock.patch("time.sleep", new=self.clock.sleep):
+            yield self
+
+    # statistics
+
+    def count(self, tool=None, name=None, host=None):
+        return len([record for record in self.records
+                    if (tool is None or record.tool == tool) and (name is None or record.name == name) and
+                    (host is None or record.host == host)])
+
+    def summary(self):
+        """ statistics of recorded commands """
+        round_trips = [record for record in self.records if not record.detached]
+        by_command = Counter("{} {}".format(record.tool, record.name) for record in round_trips)
+        return {"commands": len(round_trips),
+                "cli_spawns": self.count(tool="couchbase-cli"),
+                "rest_requests": sum(record.requests for record in self.records),
+                "login_shells": len([record for record in self.records if record.login_shell]),
+                "detached_jobs": len(self.records) - len(round_trips),
+                "simulated_seconds": round(sum(record.elapsed for record in round_trips) + self.clock.slept, 3),
+                "slept_seconds": round(self.clock.slept, 3),
+                "by_command": OrderedDict(sorted(by_command.items()))}
+
+    def reset(self):
+        self.records = []
+        self.clock.slept = 0.0
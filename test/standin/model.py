@@ -0,0 +1,506 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+In-memory model of hosts and Couchbase clusters used by the stand-in. A Host keeps files, mount points and one
+CouchbaseServer process. A Cluster keeps nodes, buckets, indexes, XDCR remote cluster references and replications.
+Cluster state is persisted into var/lib/couchbase/config/config.dat of every running member, so copying config.dat
+between hosts (save_config / restore_config, VDB provisioning) behaves like with a real server.
+"""
+#######################################################################################################################
+
+import copy
+import hashlib
+import json
+import posixpath
+import uuid as uuidlib
+from collections import OrderedDict
+
+MB = 1024 * 1024
+DOC_BYTES = 1024  # size of document in data files
+INDEX_ENTRY_BYTES = 64  # size of one index entry in index files
+INDEX_HTTP_PORT = 9102
+
+DEFAULT_VERSION = "7.0.2-6703"
+# toolkit directory is 6 levels above jq binary
+TOOLKIT_DIRECTORY = "/var/opt/delphix/toolkit"
+JQ_PATH = TOOLKIT_DIRECTORY + "/Delphix_COMMON_1/plugin/couchbase/bin/x86_64/jq"
+
+
+def new_uuid():
+    return uuidlib.uuid4().hex
+
+
+class Bucket(object):
+
+    def __init__(self, name, bucket_type="couchbase", ram_quota_mb=100, eviction_policy="valueOnly",
+                 compression_mode="passive", items=0, flush_enabled=False, fragmentation=0, compacted_at=None, restore=None):
+        self.name = name
+        self.bucket_type = bucket_type
+        self.ram_quota_mb = int(ram_quota_mb)
+        self.eviction_policy = eviction_policy
+        self.compression_mode = compression_mode
+        self.items = items
+        self.flush_enabled = flush_enabled
+        # percent of data files taken by stale documents, compacted_at - end of running compaction
+        self.fragmentation = fragmentation
+        self.compacted_at = compacted_at
+        # running restore: start, end, items at start and at end
+        self.restore = restore
+
+    @property
+    def data_used(self):
+        return self.items * DOC_BYTES
+
+    @property
+    def disk_used(self):
+        return self.data_used * 100 // (100 - self.fragmentation)
+
+    @property
+    def resident_items(self):
+        """ items fitting into the RAM quota """
+        if self.data_used <= self.ram_quota_mb * MB:
+            return self.items
+        return self.ram_quota_mb * MB // DOC_BYTES
+
+    def rest(self):
+        """ bucket as returned by /pools/default/buckets """
+        bucket = {"name": self.name,
+                  "bucketType": "membase" if self.bucket_type == "couchbase" else self.bucket_type,
+                  "quota": {"ram": self.ram_quota_mb * MB, "rawRAM": self.ram_quota_mb * MB},
+                  "evictionPolicy": self.eviction_policy,
+                  "replicaNumber": 0,
+                  "basicStats": {"itemCount": self.items, "diskUsed": self.disk_used, "dataUsed": self.data_used,
+                                 "memUsed": self.resident_items * DOC_BYTES,
+                                 "vbActiveNumNonResident": self.items - self.resident_items}}
+        if self.bucket_type != "memcached":
+            bucket["compressionMode"] = self.compression_mode
+        if self.flush_enabled:
+            bucket["controllers"] = {"flush": "/pools/default/buckets/{}/controller/doFlush".format(self.name)}
+        return bucket
+
+    def dump(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def load(cls, state):
+        return cls(**state)
+
+
+class Index(object):
+    """ GSI index, state is one of deferred, building, online """
+
+    def __init__(self, bucket, name, fields=("id",), primary=False, deferred=False, state="online", ready_at=0):
+        self.bucket = bucket
+        self.name = name
+        self.fields = list(fields)
+        self.primary = primary
+        self.deferred = deferred
+        self.state = state
+        self.ready_at = ready_at
+
+    def definition(self):
+        if self.primary:
+            statement = "CREATE PRIMARY INDEX `{}` ON `{}`".format(self.name, self.bucket)
+        else:
+            statement = "CREATE INDEX `{}` ON `{}`({})".format(
+                self.name, self.bucket, ",".join("`{}`".format(field) for field in self.fields))
+        if self.deferred:
+            statement = statement + ' WITH { "defer_build":true }'
+        return statement
+
+    def rest(self, hostname):
+        return {"bucket": self.bucket, "indexName": self.name, "index": self.name, "definition": self.definition(),
+                "status": {"online": "Ready", "building": "Building", "deferred": "Created"}[self.state],
+                "hosts": [hostname]}
+
+    def dump(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def load(cls, state):
+        return cls(**state)
+
+
+class RemoteCluster(object):
+
+    def __init__(self, name, uuid, hostname, username):
+        self.name = name
+        self.uuid = uuid
+        self.hostname = hostname
+        self.username = username
+
+    def rest(self):
+        return {"name": self.name, "uuid": self.uuid, "hostname": self.hostname, "username": self.username,
+                "uri": "/pools/default/remoteClusters/{}".format(self.name), "deleted": False,
+                "demandEncryption": False}
+
+    def dump(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def load(cls, state):
+        return cls(**state)
+
+
+class Replication(object):
+    """ XDCR replication, id is <remote cluster uuid>/<source bucket>/<target bucket> """
+
+    def __init__(self, remote_uuid, from_bucket, to_bucket, docs_done=0, paused=False):
+        self.remote_uuid = remote_uuid
+        self.from_bucket = from_bucket
+        self.to_bucket = to_bucket
+        self.docs_done = docs_done
+        self.paused = paused
+
+    @property
+    def id(self):
+        return "{}/{}/{}".format(self.remote_uuid, self.from_bucket, self.to_bucket)
+
+    def dump(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def load(cls, state):
+        return cls(**state)
+
+
+class Cluster(object):
+
+    def __init__(self, name, username, password, uuid=None, memory_quota_mb=1024, index_memory_quota_mb=512,
+                 fts_memory_quota_mb=256, eventing_memory_quota_mb=256, analytics_memory_quota_mb=1024,
+                 memcached_settings=None, auto_compaction=None, purge_interval=3):
+        self.uuid = uuid or new_uuid()
+        self.name = name
+        self.username = username
+        self.password = password
+        self.memory_quota_mb = int(memory_quota_mb)
+        self.index_memory_quota_mb = int(index_memory_quota_mb)
+        self.fts_memory_quota_mb = int(fts_memory_quota_mb)
+        self.eventing_memory_quota_mb = int(eventing_memory_quota_mb)
+        self.analytics_memory_quota_mb = int(analytics_memory_quota_mb)
+        self.nodes = []
+        self.buckets = OrderedDict()
+        self.indexes = OrderedDict()
+        self.remote_clusters = OrderedDict()
+        self.replications = OrderedDict()
+        # not configured memcached thread settings are missing, as on Couchbase Server
+        self.memcached_settings = memcached_settings or {}
+        self.auto_compaction = auto_compaction or {
+            "databaseFragmentationThreshold": {"percentage": 30, "size": "undefined"},
+            "viewFragmentationThreshold": {"percentage": 30, "size": "undefined"},
+            "parallelDBAndViewCompaction": False, "indexCompactionMode": "circular",
+            "indexCircularCompaction": {"daysOfWeek": "Sunday,Monday,Tuesday,Wednesday,Thursday,Friday,Saturday",
+                                        "interval": {"fromHour": 0, "toHour": 0, "fromMinute": 0, "toMinute": 0,
+                                                     "abortOutside": False}},
+            "indexFragmentationThreshold": {"percentage": 30}}
+        self.purge_interval = purge_interval
+        self.last_tick = None
+
+    def authorized(self, username, password):
+        return username == self.username and password == self.password
+
+    def add_bucket(self, bucket):
+        self.buckets[bucket.name] = bucket
+        return bucket
+
+    def add_index(self, index):
+        self.indexes[(index.bucket, index.name)] = index
+        return index
+
+    def delete_bucket(self, name):
+        del self.buckets[name]
+        for key in [key for key in self.indexes if key[0] == name]:
+            del self.indexes[key]
+
+    def running_nodes(self):
+        return [node for node in self.nodes if node.running and node.cluster is self]
+
+    def tick(self, now, clusters, docs_per_second):
+        """ move replications, index builds and compactions forward to the current time """
+        elapsed = 0 if self.last_tick is None else max(0, now - self.last_tick)
+        self.last_tick = now
+        for index in self.indexes.values():
+            if index.state == "building" and now >= index.ready_at:
+                index.state = "online"
+        for bucket in self.buckets.values():
+            if bucket.compacted_at is not None and now >= bucket.compacted_at:
+                bucket.fragmentation = 0
+                bucket.compacted_at = None
+            if bucket.restore is not None:
+                started, ends_at, from_items, to_items = bucket.restore
+                if now >= ends_at:
+                    bucket.items = to_items
+                    bucket.restore = None
+                elif now > started:
+                    bucket.items = from_items + int((to_items - from_items) * (now - started) / (ends_at - started))
+        if not self.running_nodes():
+            return
+        for replication in self.replications.values():
+            source = self.buckets.get(replication.from_bucket)
+            target_cluster = clusters.get(replication.remote_uuid)
+            if source is None or target_cluster is None or replication.paused:
+                continue
+            target = target_cluster.buckets.get(replication.to_bucket)
+            if target is None or not target_cluster.running_nodes():
+                continue
+            replication.docs_done = min(source.items, replication.docs_done + int(elapsed * docs_per_second))
+            target.items = max(target.items, replication.docs_done)
+
+    def changes_left(self, replication_id):
+        replication = self.replications.get(replication_id)
+        if replication is None or replication.from_bucket not in self.buckets:
+            return None
+        return self.buckets[replication.from_bucket].items - replication.docs_done
+
+    def dump(self):
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ("nodes", "buckets", "indexes", "remote_clusters", "replications", "last_tick")}
+        state["members"] = [{"host": node.host.reference, "ip": node.ip, "services": node.services,
+                             "membership": node.membership} for node in self.nodes]
+        state["buckets"] = [bucket.dump() for bucket in self.buckets.values()]
+        state["indexes"] = [index.dump() for index in self.indexes.values()]
+        state["remote_clusters"] = [remote.dump() for remote in self.remote_clusters.values()]
+        state["replications"] = [replication.dump() for replication in self.replications.values()]
+        return state
+
+    @classmethod
+    def load(cls, state):
+        state = copy.deepcopy(state)
+        members = state.pop("members")
+        buckets = state.pop("buckets")
+        indexes = state.pop("indexes")
+        remote_clusters = state.pop("remote_clusters")
+        replications = state.pop("replications")
+        cluster = cls(**state)
+        for bucket in buckets:
+            cluster.add_bucket(Bucket.load(bucket))
+        for index in indexes:
+            cluster.add_index(Index.load(index))
+        for remote in remote_clusters:
+            remote = RemoteCluster.load(remote)
+            cluster.remote_clusters[remote.name] = remote
+        for replication in replications:
+            replication = Replication.load(replication)
+            cluster.replications[replication.id] = replication
+        return cluster, members
+
+
+class CouchbaseServer(object):
+    """ Couchbase server process of one host. Node of a cluster if cluster is not None """
+
+    def __init__(self, host, port=8091):
+        self.host = host
+        self.port = port
+        self.running = False
+        self.started_at = None
+        self.cluster = None
+        self.ip = "127.0.0.1"
+        self.services = ["kv", "index", "n1ql"]
+        self.membership = "active"
+        self.data_path = None
+        # ep-engine parameters set by cbepctl, bucket name -> {parameter: value}, lost on restart
+        self.bucket_params = {}
+
+    def status(self, now, warmup_seconds):
+        if not self.running:
+            return "unhealthy"
+        if now < self.started_at + warmup_seconds:
+            return "warmup"
+        return "healthy"
+
+    def warmup(self, bucket, now, warmup_seconds, values_per_second):
+        """
+        Warmup of bucket after the node is up, values are loaded until the lower of warmup thresholds is reached
+        :return: tuple (loaded values, warmup complete)
+        """
+        params = self.bucket_params.get(bucket.name, {})
+        threshold = min(int(params.get("warmup_min_items_threshold", 100)),
+                        int(params.get("warmup_min_memory_threshold", 100)))
+        target = bucket.items * threshold // 100
+        loaded = max(0, int((now - self.started_at - warmup_seconds) * values_per_second))
+        return min(loaded, target), loaded >= target
+
+    @property
+    def hostname(self):
+        return "{}:{}".format(self.ip, self.port)
+
+
+class BackupArchive(object):
+    """ cbbackupmgr archive: repository name -> list of backups (date, bucket states, index states) """
+
+    def __init__(self, path):
+        self.path = path
+        self.repos = OrderedDict()
+
+    def add_backup(self, repo, date, buckets, indexes=()):
+        backup = {"date": date, "buckets": [bucket.dump() for bucket in buckets],
+                  "indexes": [index.dump() for index in indexes]}
+        self.repos.setdefault(repo, []).append(backup)
+        return backup
+
+    def latest(self, repo):
+        backups = self.repos.get(repo)
+        return sorted(backups, key=lambda backup: backup["date"])[-1] if backups else None
+
+
+class Host(object):
+
+    def __init__(self, name, reference=None, ips=("127.0.0.2",), install_dir="/opt/couchbase",
+                 version=DEFAULT_VERSION, uid=996, gid=993, user_uid=None, user_gid=None, port=8091,
+                 memory_total_mb=16384):
+        self.name = name
+        self.reference = reference or "{}-ENVIRONMENT".format(name.upper())
+        self.user_reference = "{}-USER".format(name.upper())
+        self.ips = list(ips)
+        self.install_dir = install_dir
+        self.version = version
+        self.uid = uid
+        self.gid = gid
+        self.user_uid = uid if user_uid is None else user_uid
+        self.user_gid = gid if user_gid is None else user_gid
+        self.__memory_total_mb = memory_total_mb
+        # DLPX_BIN_JQ is set by Delphix for every command, profile_environ only by login shell
+        self.environ = {"DLPX_BIN_JQ": JQ_PATH}
+        self.profile_environ = {"PATH": "/usr/local/bin:/usr/bin:/bin", "LANG": "en_US.UTF-8",
+                                "HOME": "/home/delphix"}
+        self.files = OrderedDict()
+        self.dirs = set(["/"])
+        self.mounts = OrderedDict()
+        self.server = CouchbaseServer(self, port)
+        self.archives = OrderedDict()
+        # detached jobs by their folder: result of the command and time when it ends
+        self.jobs = OrderedDict()
+        self.install()
+
+    @property
+    def memory_total_mb(self):
+        return self.__memory_total_mb
+
+    @memory_total_mb.setter
+    def memory_total_mb(self, memory_total_mb):
+        self.__memory_total_mb = memory_total_mb
+        self.write("/proc/meminfo", "MemTotal:       {} kB\nMemFree:        {} kB\n".format(memory_total_mb * 1024,
+                                                                                         memory_total_mb * 512))
+
+    # layout of Couchbase installation
+
+    @property
+    def bin_dir(self):
+        return self.install_dir + "/bin"
+
+    @property
+    def install_path(self):
+        return self.bin_dir + "/couchbase-server"
+
+    @property
+    def shell_path(self):
+        return self.bin_dir + "/couchbase-cli"
+
+    @property
+    def var_dir(self):
+        return self.install_dir + "/var/lib/couchbase"
+
+    @property
+    def config_dat(self):
+        return self.var_dir + "/config/config.dat"
+
+    @property
+    def local_ini(self):
+        return self.install_dir + "/etc/couchdb/local.ini"
+
+    def install(self):
+        for binary in ("couchbase-server", "couchbase-cli", "cbq", "cbbackupmgr"):
+            self.write(self.bin_dir + "/" + binary, "#!/bin/sh\n# {} {}\n".format(binary, self.version))
+        self.write(self.install_dir + "/etc/couchbase/static_config",
+                   '{{path_config_datadir, "{}/data"}}.'.format(self.var_dir))
+        self.write(self.local_ini, "[couchdb]\ndatabase_dir={0}/data\nview_index_dir={0}/data\n".format(self.var_dir))
+        self.makedirs(self.var_dir + "/config")
+        self.makedirs(self.var_dir + "/data")
+        self.memory_total_mb = self.__memory_total_mb
+
+    # file system
+
+    @staticmethod
+    def normalize(path):
+        return posixpath.normpath(path) if path else path
+
+    def makedirs(self, path):
+        path = self.normalize(path)
+        while path not in self.dirs:
+            self.dirs.add(path)
+            path = posixpath.dirname(path)
+
+    def write(self, path, content):
+        path = self.normalize(path)
+        self.makedirs(posixpath.dirname(path))
+        self.files[path] = content
+
+    def read(self, path):
+        return self.files.get(self.normalize(path))
+
+    def is_file(self, path):
+        return self.normalize(path) in self.files
+
+    def is_dir(self, path):
+        return self.normalize(path) in self.dirs
+
+    def remove(self, path):
+        path = self.normalize(path)
+        if path in self.files:
+            del self.files[path]
+            return True
+        if path in self.dirs:
+            prefix = path.rstrip("/") + "/"
+            for name in [name for name in self.files if name.startswith(prefix)]:
+                del self.files[name]
+            self.dirs -= set(name for name in self.dirs if name == path or name.startswith(prefix))
+            return True
+        return False
+
+    def move(self, source, target):
+        source = self.normalize(source)
+        target = self.normalize(target)
+        if source in self.files:
+            self.write(target, self.files.pop(source))
+            return True
+        if source in self.dirs:
+            prefix = source.rstrip("/") + "/"
+            for name in [name for name in self.files if name.startswith(prefix)]:
+                self.write(target + "/" + name[len(prefix):], self.files.pop(name))
+            for name in [name for name in self.dirs if name == source or name.startswith(prefix)]:
+                self.dirs.discard(name)
+                self.makedirs(target + name[len(source):])
+            return True
+        return False
+
+    def fingerprint(self, path):
+        """ inode:size:uid:gid:mtime (from ls -lni) used by discovery cache """
+        content = self.read(path) or ""
+        inode = int(hashlib.md5(path.encode()).hexdigest()[:6], 16)
+        return "{}:{}:{}:{}:Jan 30 2020".format(inode, len(content), self.uid, self.gid)
+
+    def mount(self, path, device=None):
+        self.mounts[self.normalize(path)] = device or \
+            "delphix-engine:/domain0/group-2/appdata_container-3/appdata_timeflow-4/datafile"
+        self.makedirs(path)
+
+    def umount(self, path):
+        return self.mounts.pop(self.normalize(path), None) is not None
+
+    def ip_file(self):
+        """ content of ip or ip_start file of Couchbase server """
+        for name in ("ip", "ip_start"):
+            content = self.read(self.var_dir + "/" + name)
+            if content is not None:
+                return content.strip()
+        return None
+
+    def __repr__(self):
+        return "Host({})".format(self.name)
+
+
+def dumps(state):
+    return json.dumps(state, sort_keys=True)
@@ -0,0 +1,1122 @@
+#
+# Copyright (c) 2021 by Delphix. All rights reserved.
+#
+
+#######################################################################################################################
+"""
+Interpreter of command lines built by CommandFactory and RestCommand. OS commands work on the Host file system,
+couchbase-cli, cbq, cbbackupmgr and curl are served by a REST router working on the in-memory clusters.
+Same as the real couchbase-cli, CLI subcommands are thin wrappers of REST calls, so both backends share one
+implementation of every cluster operation.
+"""
+#######################################################################################################################
+
+import fnmatch
+import json
+import posixpath
+import re
+import shlex
+from collections import Counter
+from urllib.parse import unquote, urlsplit
+
+from db_commands.constants import ALREADY_CLUSTER_INIT, MULTIPLE_VDB_ERROR, CLUSTER_ALREADY_PRESENT, \
+    ALREADY_CLUSTER_FOR_BUCKET, BUCKET_NAME_ALREADY_EXIST, JOB_ATTACHED, JOB_STDERR_DELIMITER
+
+from .model import Bucket, Cluster, Index, RemoteCluster, Replication, DOC_BYTES, INDEX_ENTRY_BYTES, INDEX_HTTP_PORT, \
+    MB
+
+# couchbase-cli service names -> service names used by REST API
+SERVICES = {"data": "kv", "index": "index", "query": "n1ql", "fts": "fts", "eventing": "eventing",
+            "analytics": "cbas"}
+
+SHORT_OPTIONS = {"c": "cluster", "u": "username", "p": "password", "e": "engine", "s": "script", "q": "quiet",
+                 "o": "output", "X": "request", "w": "write-out"}
+
+
+class CommandResult(object):
+    """
+    Output of one command. tool and name classify the command (couchbase-cli / bucket-create, curl / rest, os / cat),
+    work is the time spent by the command itself on top of the configured latency, requests is the number of
+    REST calls sent by one curl invocation.
+    """
+
+    def __init__(self, stdout="", stderr="", exit_code=0, tool="os", name="", work=0.0, requests=0):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+        self.tool = tool
+        self.name = name
+        self.work = work
+        self.requests = requests
+
+
+class RestResponse(object):
+
+    def __init__(self, code, body="", work=0.0):
+        self.code = code
+        self.body = body if isinstance(body, str) else json.dumps(body)
+        self.work = work
+
+    @property
+    def ok(self):
+        return 200 <= self.code < 300
+
+    def error(self):
+        """ error message from response body """
+        try:
+            body = json.loads(self.body)
+        except ValueError:
+            return self.body
+        if isinstance(body, dict):
+            errors = body.get("errors", body)
+            if isinstance(errors, dict):
+                return ", ".join("{}".format(value) for value in errors.values())
+            return str(errors)
+        return str(body)
+
+
+def parse_options(arguments):
+    """ --name value, --name=value, -n value and flags into dict, positional arguments under key None """
+    options = {None: []}
+    i = 0
+    while i < len(arguments):
+        argument = arguments[i]
+        if argument.startswith("-") and len(argument) > 1:
+            name = argument.lstrip("-")
+            if "=" in name:
+                name, value = name.split("=", 1)
+            elif i + 1 < len(arguments) and not arguments[i + 1].startswith("-"):
+                value = arguments[i + 1]
+                i = i + 1
+            else:
+                value = True
+            if not argument.startswith("--"):
+                name = SHORT_OPTIONS.get(name, name)
+            options[name] = value
+        else:
+            options[None].append(argument)
+        i = i + 1
+    return options
+
+
+class CouchbaseShell(object):
+
+    def __init__(self, standin):
+        self.standin = standin
+
+    @property
+    def now(self):
+        return self.standin.clock.now
+
+    def run(self, host, command, variables, use_login_shell=True):
+        environment = dict(host.environ)
+        if use_login_shell:
+            environment.update(host.profile_environ)
+        environment.update(variables or {})
+
+        if command.startswith("IFS=';'"):
+            return self._discover(host, command, environment)
+        if "<<'DLPX_EOF'" in command:
+            return self._here_document(host, command)
+        if command == "env":
+            lines = ["{}={}".format(name, value) for name, value in sorted(environment.items())]
+            return CommandResult("\n".join(lines), "", 0, name="env")
+
+        match = re.match(r"^mkdir -p (\S+) && cd \S+ && if .* else rm -f pid exit_code stdout stderr && "
+                         r"\(setsid nohup sh -c (.*) > stdout 2> stderr < /dev/null & echo \$! > pid\); fi$", command, re.S)
+        if match:
+            return self._job_start(host, match.group(1), shlex.split(match.group(2))[0], variables, use_login_shell)
+        match = re.match(r"^cd (\S+) && size=\$\(wc -c < stdout\) .* tail -c \+(\d+) stdout", command, re.S)
+        if match:
+            return self._job_status(host, match.group(1), int(match.group(2)) - 1)
+
+        command = re.sub(r"\$\{?(\w+)\}?", lambda match: str(environment.get(match.group(1), "")), command)
+        command = command.replace("\\\n", " ").strip()
+        command = re.sub(r"^sudo -u \\#\d+ ", "", command)
+
+        match = re.match(r"^\[ -([fd]) (.+?) \] && echo 'Found'$", command)
+        if match:
+            return self._test(host, match.group(1), match.group(2))
+        match = re.match(r"^echo 'Yes' \| (.*)$", command)
+        if match:
+            return self.run(host, match.group(1), {})
+        if " && " in command:
+            for part in command.split(" && "):
+                result = self.run(host, part, {}, use_login_shell)
+                if result.exit_code != 0:
+                    break
+            return result
+        match = re.match(r"^getent ahostsv4 (\S+) \|", command)
+        if match:
+            return self._resolve_name(match.group(1))
+        match = re.match(r"^echo (.*?) > (\S+)$", command, re.S)
+        if match:
+            host.write(match.group(2), match.group(1) + "\n")
+            return CommandResult(name="echo")
+        match = re.match(r"^cat (\S+)\|grep (\S+)$", command)
+        if match:
+            content = host.read(match.group(1)) or ""
+            return CommandResult("\n".join(line for line in content.split("\n") if match.group(2) in line),
+                                 name="cat")
+
+        arguments = shlex.split(command)
+        if arguments[0] == "sudo":
+            arguments = arguments[1:]
+        program = posixpath.basename(arguments[0])
+        if program == "couchbase-server":
+            return self._couchbase_server(host, arguments[1:])
+        if program == "couchbase-cli":
+            return self._couchbase_cli(host, arguments[1], parse_options(arguments[2:]))
+        if program == "cbq":
+            return self._cbq(host, parse_options(arguments[1:]))
+        if program == "cbbackupmgr":
+            return self._cbbackupmgr(host, arguments[1], parse_options(arguments[2:]))
+        if program == "cbstats":
+            return self._cbstats(host, parse_options(arguments[1:]))
+        if program == "cbepctl":
+            return self._cbepctl(host, parse_options(arguments[1:]))
+        if program == "curl":
+            return self._curl(host, arguments[1:])
+        handler = getattr(self, "_os_{}".format(program), None)
+        if handler is None:
+            return CommandResult("", "bash: {}: command not found".format(arguments[0]), 127, name=program)
+        result = handler(host, arguments[1:])
+        result.name = program
+        return result
+
+    # detached jobs, the command is executed when the job starts, its output and exit status are visible once the
+    # time of its work passes
+
+    def _job_start(self, host, job_dir, script, variables, use_login_shell):
+        command = re.match(r"^\((.*)\); echo \$\? > exit_code\.tmp; mv exit_code\.tmp exit_code$",
+                           script, re.S).group(1)
+        job_dir = host.normalize(job_dir)
+        if job_dir in host.jobs and host.is_dir(job_dir) and self.now < host.jobs[job_dir][1]:
+            return CommandResult(JOB_ATTACHED, name="job_start")
+        for name in ("pid", "exit_code", "stdout", "stderr"):
+            host.remove(job_dir + "/" + name)
+        started = self.now
+        result = self.run(host, command, variables, use_login_shell)
+        host.makedirs(job_dir)
+        host.write(job_dir + "/pid", "{}\n".format(4000 + len(host.jobs)))
+        elapsed = self.standin.command_latency(result.tool, result.name) + result.work
+        self.standin.record_job(host, command, result, started, elapsed)
+        host.jobs[job_dir] = (result, started + elapsed)
+        return CommandResult(name="job_start")
+
+    def _job_status(self, host, job_dir, offset):
+        job_dir = host.normalize(job_dir)
+        if not host.is_dir(job_dir) or job_dir not in host.jobs:
+            return CommandResult("", "bash: cd: {}: No such file or directory".format(job_dir), 1, name="job_status")
+        result, ends_at = host.jobs[job_dir]
+        if self.now < ends_at:
+            return CommandResult("running 0\n", name="job_status")
+        host.write(job_dir + "/stdout", result.stdout)
+        host.write(job_dir + "/stderr", result.stderr)
+        host.write(job_dir + "/exit_code", "{}\n".format(result.exit_code))
+        return CommandResult("exited {} {}\n{}\n{}\n{}".format(result.exit_code, len(result.stdout),
+                                                          result.stdout[offset:], JOB_STDERR_DELIMITER, result.stderr),
+                             name="job_status")
+
+    # OS commands
+
+    def _test(self, host, kind, path):
+        check = host.is_file if kind == "f" else host.is_dir
+        if "*" in path:
+            names = host.files if kind == "f" else host.dirs
+            matches = [name for name in names if fnmatch.fnmatch(name, path)]
+            if len(matches) > 1:
+                return CommandResult("", "bash: [: too many arguments", 2, name="[")
+            found = len(matches) == 1
+        else:
+            found = check(path)
+        return CommandResult("Found", "", 0, name="[") if found else CommandResult("", "", 1, name="[")
+
+    def _here_document(self, host, command):
+        match = re.search(r"cat > ([^\s']+)'? <<'DLPX_EOF'\n(.*)\nDLPX_EOF\Z", command, re.S)
+        host.write(match.group(1), match.group(2) + "\n")
+        return CommandResult(name="cat")
+
+    def _resolve_name(self, name):
+        host = self.standin.find_host(name)
+        if host is None:
+            return CommandResult("", "", 2, name="getent")
+        return CommandResult(host.ips[0], name="getent")
+
+    def _os_echo(self, host, arguments):
+        return CommandResult(" ".join(arguments))
+
+    def _os_id(self, host, arguments):
+        return CommandResult("uid={0}(delphix) gid={1}(delphix) groups={1}(delphix)".format(host.user_uid,
+                                                                                         host.user_gid))
+
+    def _os_ps(self, host, arguments):
+        processes = ["UID        PID  PPID  C STIME TTY          TIME CMD", "root         1     0  0 10:00 ?        "
+                     "00:00:01 /usr/lib/systemd/systemd"]
+        if host.server.running:
+            processes.append("couchba+  2001     1  1 10:00 ?        00:00:10 {}/../lib/erlang/erts/bin/beam.smp"
+                             .format(host.bin_dir))
+            processes.append("couchba+  2002  2001  0 10:00 ?        00:00:00 {}/gosecrets".format(host.bin_dir))
+        return CommandResult("\n".join(processes))
+
+    def _os_hostname(self, host, arguments):
+        return CommandResult(" ".join(host.ips))
+
+    def _os_mkdir(self, host, arguments):
+        for path in arguments:
+            if path != "-p":
+                host.makedirs(path)
+        return CommandResult()
+
+    def _os_chmod(self, host, arguments):
+        path = arguments[-1]
+        if host.is_file(path) or host.is_dir(path):
+            return CommandResult()
+        return CommandResult("", "chmod: cannot access '{}': No such file or directory".format(path), 1)
+
+    def _os_cat(self, host, arguments):
+        content = host.read(arguments[0])
+        if content is None:
+            return CommandResult("", "cat: {}: No such file or directory".format(arguments[0]), 1)
+        return CommandResult(content)
+
+    def _os_rm(self, host, arguments):
+        for path in arguments:
+            if not path.startswith("-"):
+                host.remove(path)
+        return CommandResult()
+
+    def _os_mv(self, host, arguments):
+        source, target = arguments
+        if host.is_dir(target):
+            target = target + "/" + posixpath.basename(source)
+        if not host.move(source, target):
+            return CommandResult("", "mv: cannot stat '{}': No such file or directory".format(source), 1)
+        return CommandResult()
+
+    def _os_cp(self, host, arguments):
+        source, target = arguments
+        content = host.read(source)
+        if content is None:
+            return CommandResult("", "cp: cannot stat '{}': No such file or directory".format(source), 1)
+        if host.is_dir(target):
+            target = target + "/" + posixpath.basename(source)
+        host.write(target, content)
+        return CommandResult()
+
+    def _os_sed(self, host, arguments):
+        expression, path = arguments[-2], arguments[-1]
+        content = host.read(path)
+        if content is None:
+            return CommandResult("", "sed: can't read {}: No such file or directory".format(path), 2)
+        delimiter = expression[1]
+        _, pattern, replacement, flags = expression.split(delimiter)
+        count = 0 if "g" in flags else 1
+        lines = [re.sub(pattern, replacement, line, count=count) for line in content.split("\n")]
+        host.write(path, "\n".join(lines))
+        return CommandResult()
+
+    def _os_df(self, host, arguments):
+        path = host.normalize(arguments[-1])
+        if not host.is_dir(path) and not host.is_file(path):
+            return CommandResult("", "df: {}: No such file or directory".format(path), 1)
+        device = host.mounts.get(path, "/dev/sda1")
+        return CommandResult("Filesystem      Size  Used Avail Use% Mounted on\n{} 100G  10G   90G  10% {}"
+                             .format(device, path if path in host.mounts else "/"))
+
+    def _os_mount(self, host, arguments):
+        lines = ["/dev/sda1 on / type xfs (rw,relatime,seclabel,attr2,inode64,noquota)"]
+        for path, device in host.mounts.items():
+            lines.append("{} on {} type nfs4 (rw,relatime,vers=4.0,hard,proto=tcp)".format(device, path))
+        return CommandResult("\n".join(lines))
+
+    def _os_umount(self, host, arguments):
+        path = arguments[-1]
+        if not host.umount(path):
+            return CommandResult("", "umount: {}: not mounted".format(path), 32)
+        return CommandResult()
+
+    def _os_find(self, host, arguments):
+        path = host.normalize(arguments[0]).rstrip("/") + "/"
+        pattern = arguments[arguments.index("-name") + 1]
+        found = [name for name in host.files
+                 if name.startswith(path) and fnmatch.fnmatch(posixpath.basename(name), pattern)]
+        return CommandResult("\n".join(found))
+
+    def _os_ls(self, host, arguments):
+        path = arguments[-1]
+        if not host.is_file(path):
+            return CommandResult("", "ls: cannot access {}: No such file or directory".format(path), 2)
+        return CommandResult("-rwxr-xr-x. 1 {} {} {} Jan 30  2020 {}".format(host.uid, host.gid,
+                                                                             len(host.read(path)), path))
+
+    def _discover(self, host, command, environment):
+        """ output of OSCommand.discover_repositories """
+        default_path = re.search(r"\$\{COUCHBASE_PATH:-([^}]*)\}", command).group(1)
+        cache_filename = re.search(r'/\.delphix/([^"]+)"', command).group(1)
+        lines = []
+        cache_file = ""
+        cache = []
+        if environment.get("DLPX_BIN_JQ"):
+            toolkit = environment["DLPX_BIN_JQ"]
+            for _ in range(6):
+                toolkit = posixpath.dirname(toolkit)
+            cache_file = toolkit + "/.delphix/" + cache_filename
+            cache = [line for line in (host.read(cache_file) or "").split("\n") if line]
+        lines.append("CACHE|{}|{}".format(cache_file, len(cache)))
+        for path in (environment.get("COUCHBASE_PATH") or default_path).split(";"):
+            if not host.is_dir(path):
+                continue
+            install = shell = version = fingerprint = ""
+            ids = "|"
+            for directory in (path, path + "/bin"):
+                if not install and host.is_file(directory + "/couchbase-server"):
+                    install = directory + "/couchbase-server"
+                if not shell and host.is_file(directory + "/couchbase-cli"):
+                    shell = directory + "/couchbase-cli"
+            if install:
+                fingerprint = host.fingerprint(install)
+                key = "{}|{}|{}|{}|".format(path, install, shell, fingerprint)
+                entry = [line for line in cache if fingerprint and line.startswith(key)]
+                if entry:
+                    lines.append("CACHED|" + entry[0][len(key):])
+                    continue
+                version = "Couchbase Server {} (EE)".format(host.version)
+                ids = "{}|{}".format(host.uid, host.gid)
+            lines.append("REPO|{}|{}|{}|{}|{}|{}".format(path, install, shell, version, ids, fingerprint))
+        return CommandResult("\n".join(lines), name="discover")
+
+    # Couchbase server process
+
+    def _couchbase_server(self, host, arguments):
+        if arguments and arguments[0] == "--version":
+            return CommandResult("Couchbase Server {} (EE)".format(host.version), tool="couchbase-server",
+                                 name="version")
+        if arguments and arguments[0] == "-k":
+            self.standin.stop_server(host)
+            return CommandResult(tool="couchbase-server", name="stop")
+        self.standin.start_server(host)
+        return CommandResult(tool="couchbase-server", name="start")
+
+    # REST API
+
+    def rest(self, caller, method, url, username, password, data=None):
+        """
+        Serve one REST call sent from caller host
+        :return: RestResponse or None if server is not reachable
+        """
+        if "://" not in url:
+            url = "http://" + url
+        parts = urlsplit(url)
+        server = self.standin.resolve(caller, parts.hostname, parts.port or 8091)
+        if server is None:
+            return None
+        data = dict(data or [])
+        segments = [unquote(segment) for segment in parts.path.strip("/").split("/")]
+        cluster = server.cluster
+        if parts.port == INDEX_HTTP_PORT:
+            return self._index_stats(server, segments, username, password)
+
+        if segments == ["nodes", "self"]:
+            if cluster is not None and not cluster.authorized(username, password):
+                return RestResponse(401)
+            return RestResponse(200, self._node_info(server))
+        if cluster is None:
+            if segments[:2] == ["pools", "default"]:
+                return RestResponse(404, '"unknown pool"')
+            return RestResponse(404, '"Requested resource not found."')
+        if not cluster.authorized(username, password):
+            return RestResponse(401)
+
+        if segments == ["pools", "default"]:
+            if method == "GET":
+                return RestResponse(200, self._pool(cluster))
+            return self._cluster_settings(cluster, data)
+        if segments == ["settings", "web"]:
+            cluster.username = data.get("username", cluster.username)
+            cluster.password = data.get("password", cluster.password)
+            return RestResponse(200, {"newBaseUri": "http://{}/".format(server.hostname)})
+        if segments[:3] == ["pools", "default", "buckets"]:
+            return self._buckets(server, method, segments[3:], data)
+        if segments[:3] == ["pools", "default", "remoteClusters"]:
+            return self._remote_clusters(server, method, segments[3:], data)
+        if segments == ["pools", "default", "tasks"]:
+            return RestResponse(200, self._tasks(cluster))
+        if segments == ["controller", "createReplication"]:
+            return self._create_replication(cluster, data)
+        if segments[:2] == ["controller", "cancelXDCR"]:
+            if cluster.replications.pop(segments[2], None) is None:
+                return RestResponse(404, {"_": "Replication does not exist"})
+            return RestResponse(200, {})
+        if segments[:2] == ["settings", "replications"] and len(segments) > 2:
+            replication = cluster.replications.get(segments[2])
+            if replication is None:
+                return RestResponse(404, {"_": "Replication does not exist"})
+            replication.paused = data.get("pauseRequested") == "true"
+            return RestResponse(200, {})
+        if segments == ["controller", "addNode"]:
+            return self._add_node(server, data)
+        if segments == ["controller", "rebalance"]:
+            ejected = [otp_node for otp_node in data.get("ejectedNodes", "").split(",") if otp_node]
+            for node in list(cluster.nodes):
+                node.membership = "active"
+                if "ns_1@{}".format(node.ip) in ejected:
+                    cluster.nodes.remove(node)
+                    node.cluster = None
+            return RestResponse(200, {}, self.standin.rebalance_seconds * max(1, len(cluster.buckets)))
+        if segments == ["pools", "default", "settings", "memcached", "global"]:
+            if method == "GET":
+                return RestResponse(200, cluster.memcached_settings)
+            return self._memcached_settings(cluster, data)
+        if segments == ["settings", "autoCompaction"]:
+            return RestResponse(200, {"autoCompactionSettings": cluster.auto_compaction,
+                                      "purgeInterval": cluster.purge_interval})
+        if segments == ["controller", "setAutoCompaction"]:
+            return self._set_auto_compaction(cluster, data)
+        if segments == ["indexStatus"]:
+            return RestResponse(200, {"indexes": [index.rest(server.hostname) for index in cluster.indexes.values()],
+                                      "version": 1, "warnings": []})
+        return RestResponse(404, '"Requested resource not found."')
+
+    def _index_stats(self, server, segments, username, password):
+        """ REST API of the index service, only /api/v1/stats """
+        cluster = server.cluster
+        if cluster is None or "index" not in server.services or segments != ["api", "v1", "stats"]:
+            return RestResponse(404, '"Requested resource not found."')
+        if not cluster.authorized(username, password):
+            return RestResponse(401)
+        stats = {"indexer": {"indexer_state": "Active"}}
+        for index in cluster.indexes.values():
+            bucket = cluster.buckets.get(index.bucket)
+            stats["{}:{}".format(index.bucket, index.name)] = {
+                "disk_size": bucket.items * INDEX_ENTRY_BYTES if bucket is not None and index.state == "online" else 0}
+        return RestResponse(200, stats)
+
+    def _node_info(self, server):
+        return {"hostname": server.hostname,
+                "status": server.status(self.now, self.standin.warmup_seconds),
+                "clusterMembership": server.membership if server.cluster else "inactiveAdded",
+                "services": server.services,
+                "version": "{}-enterprise".format(server.host.version),
+                "memoryTotal": server.host.memory_total_mb * MB,
+                "memoryFree": server.host.memory_total_mb * MB // 2,
+                "ports": {"direct": 11210, "httpsMgmt": 18091}}
+
+    def _pool(self, cluster):
+        return {"name": "default", "clusterName": cluster.name,
+                "memoryQuota": cluster.memory_quota_mb, "indexMemoryQuota": cluster.index_memory_quota_mb,
+                "ftsMemoryQuota": cluster.fts_memory_quota_mb,
+                "eventingMemoryQuota": cluster.eventing_memory_quota_mb,
+                "cbasMemoryQuota": cluster.analytics_memory_quota_mb,
+                "nodes": [{"hostname": node.hostname,
+                           "status": node.status(self.now, self.standin.warmup_seconds)
+                           if node.cluster is cluster else "unhealthy",
+                           "clusterMembership": node.membership,
+                           "services": node.services,
+                           "otpNode": "ns_1@{}".format(node.ip)} for node in cluster.nodes]}
+
+    def _cluster_settings(self, cluster, data):
+        quotas = {"memoryQuota": "memory_quota_mb", "indexMemoryQuota": "index_memory_quota_mb",
+                  "ftsMemoryQuota": "fts_memory_quota_mb", "eventingMemoryQuota": "eventing_memory_quota_mb",
+                  "cbasMemoryQuota": "analytics_memory_quota_mb"}
+        if "memoryQuota" in data and int(data["memoryQuota"]) < sum(bucket.ram_quota_mb
+                                                                    for bucket in cluster.buckets.values()):
+            return RestResponse(400, {"errors": {"memoryQuota": "Total quota must be larger than sum of bucket "
+                                                                "quotas"}})
+        for key, attribute in quotas.items():
+            if key in data:
+                setattr(cluster, attribute, int(data[key]))
+        cluster.name = data.get("clusterName", cluster.name)
+        return RestResponse(200)
+
+    @staticmethod
+    def _memcached_settings(cluster, data):
+        for key, value in data.items():
+            if key not in ("num_reader_threads", "num_writer_threads"):
+                return RestResponse(400, {"errors": {key: "Unsupported key"}})
+            if value == "default":
+                cluster.memcached_settings.pop(key, None)
+            elif value.isdigit() and 1 <= int(value) <= 64:
+                cluster.memcached_settings[key] = int(value)
+            else:
+                return RestResponse(400, {"errors": {key: "Value must be an integer between 1 and 64"}})
+        return RestResponse(200, cluster.memcached_settings)
+
+    @staticmethod
+    def _set_auto_compaction(cluster, data):
+        # settings are replaced as a whole, missing thresholds are undefined
+        if data.get("parallelDBAndViewCompaction") not in ("true", "false"):
+            return RestResponse(400, {"errors": {"parallelDBAndViewCompaction": "parallelDBAndViewCompaction is "
+                                                                                "missing"}})
+        settings = {}
+        for field, value in data.items():
+            if field == "purgeInterval":
+                continue
+            # form fields of nested settings, e.g. allowedTimePeriod[fromHour]
+            names = field.replace("]", "").split("[")
+            target = settings
+            for name in names[:-1]:
+                target = target.setdefault(name, {})
+            target[names[-1]] = int(value) if value.isdigit() else {"true": True, "false": False}.get(value, value)
+        for threshold in ("databaseFragmentationThreshold", "viewFragmentationThreshold"):
+            for unit in ("percentage", "size"):
+                settings.setdefault(threshold, {}).setdefault(unit, "undefined")
+        cluster.auto_compaction = settings
+        purge_interval = float(data.get("purgeInterval", 3))
+        cluster.purge_interval = int(purge_interval) if purge_interval.is_integer() else purge_interval
+        return RestResponse(200, {})
+
+    def _buckets(self, server, method, segments, data):
+        cluster = server.cluster
+        if not segments:
+            if method == "GET":
+                return RestResponse(200, [bucket.rest() for bucket in cluster.buckets.values()])
+            return self._create_bucket(cluster, data)
+        bucket = cluster.buckets.get(segments[0])
+        if bucket is None:
+            return RestResponse(404, '"Requested resource not found."')
+        if len(segments) == 1:
+            if method == "GET":
+                return RestResponse(200, bucket.rest())
+            if method == "DELETE":
+                cluster.delete_bucket(bucket.name)
+                return RestResponse(200, work=self.standin.bucket_delete_seconds)
+            if "ramQuotaMB" in data:
+                ram = int(data["ramQuotaMB"])
+                if ram < 100:
+                    return RestResponse(400, {"errors": {"ramQuotaMB": "RAM quota cannot be less than 100 MB"}})
+                if ram + sum(other.ram_quota_mb for other in cluster.buckets.values() if other is not bucket) > \
+                        cluster.memory_quota_mb:
+                    return RestResponse(400, {"errors": {"ramQuotaMB": "RAM quota specified is too large to be "
+                                                                       "provisioned into this cluster."}})
+                bucket.ram_quota_mb = ram
+            if "evictionPolicy" in data:
+                bucket.eviction_policy = data["evictionPolicy"]
+            if "flushEnabled" in data:
+                bucket.flush_enabled = str(data["flushEnabled"]) == "1"
+            return RestResponse(200)
+        if segments[1:] == ["controller", "doFlush"]:
+            if not bucket.flush_enabled:
+                return RestResponse(400, '"Flush is disabled for the bucket"')
+            bucket.items = 0
+            return RestResponse(200)
+        if segments[1:] == ["controller", "compactBucket"]:
+            if bucket.compacted_at is None:
+                bucket.compacted_at = self.now + max(1, bucket.disk_used // self.standin.compaction_bytes_per_second)
+            return RestResponse(200)
+        if segments[1:] == ["controller", "cancelBucketCompaction"]:
+            bucket.compacted_at = None
+            return RestResponse(200)
+        if segments[1] == "stats" and len(segments) == 3:
+            # replications/<remote uuid>/<source bucket>/<target bucket>/changes_left
+            stat = segments[2].split("/")
+            samples = []
+            if stat[0] == "replications" and stat[-1] == "changes_left":
+                changes_left = cluster.changes_left("/".join(stat[1:4]))
+                if changes_left is not None:
+                    samples = [changes_left] * 3
+            return RestResponse(200, {"samplesCount": 60, "isPersistent": True, "lastTStamp": self.now * 1000,
+                                      "interval": 1000, "timestamp": [self.now * 1000] * len(samples),
+                                      "nodeStats": {server.hostname: samples}})
+        return RestResponse(404, '"Requested resource not found."')
+
+    def _create_bucket(self, cluster, data):
+        name = data.get("name")
+        if name in cluster.buckets:
+            return RestResponse(400, {"errors": {"name": BUCKET_NAME_ALREADY_EXIST}})
+        ram = int(data.get("ramQuotaMB", 0))
+        if ram < 100:
+            return RestResponse(400, {"errors": {"ramQuotaMB": "RAM quota cannot be less than 100 MB"}})
+        if ram + sum(bucket.ram_quota_mb for bucket in cluster.buckets.values()) > cluster.memory_quota_mb:
+            return RestResponse(400, {"errors": {"ramQuotaMB": "RAM quota specified is too large to be provisioned "
+                                                               "into this cluster."}})
+        bucket_type = data.get("bucketType", "couchbase")
+        cluster.add_bucket(Bucket(name, "couchbase" if bucket_type == "membase" else bucket_type, ram,
+                                  data.get("evictionPolicy", "valueOnly"), data.get("compressionMode", "passive"),
+                                  flush_enabled=str(data.get("flushEnabled", "0")) == "1"))
+        return RestResponse(202, work=self.standin.bucket_create_seconds)
+
+    def _remote_clusters(self, server, method, segments, data):
+        cluster = server.cluster
+        if method == "GET":
+            return RestResponse(200, [remote.rest() for remote in cluster.remote_clusters.values()])
+        if method == "DELETE":
+            remote = cluster.remote_clusters.pop(segments[0], None) if segments else None
+            if remote is None:
+                return RestResponse(404, '"unknown remote cluster"')
+            for replication_id in [key for key, replication in cluster.replications.items()
+                                   if replication.remote_uuid == remote.uuid]:
+                del cluster.replications[replication_id]
+            return RestResponse(200, '"ok"')
+        name = data.get("name")
+        if name in cluster.remote_clusters:
+            return RestResponse(400, {"_": "Duplicate cluster names are not allowed"})
+        hostname, _, port = data.get("hostname", "").partition(":")
+        target = self.standin.resolve(server.host, hostname, port or 8091)
+        if target is None or target.cluster is None:
+            return RestResponse(400, {"_": "Failed to contact remote cluster {}".format(data.get("hostname"))})
+        if not target.cluster.authorized(data.get("username"), data.get("password")):
+            return RestResponse(400, {"_": "Authentication failed. Verify username and password."})
+        for remote in cluster.remote_clusters.values():
+            if remote.uuid == target.cluster.uuid:
+                return RestResponse(400, {"_": "{} {}".format(CLUSTER_ALREADY_PRESENT, remote.name)})
+        remote = RemoteCluster(name, target.cluster.uuid, data.get("hostname"), data.get("username"))
+        cluster.remote_clusters[name] = remote
+        return RestResponse(200, remote.rest())
+
+    def _create_replication(self, cluster, data):
+        remote = cluster.remote_clusters.get(data.get("toCluster"))
+        if remote is None:
+            return RestResponse(400, {"errors": {"toCluster": "unknown remote cluster"}})
+        if data.get("fromBucket") not in cluster.buckets:
+            return RestResponse(400, {"errors": {"fromBucket": "unknown bucket"}})
+        target_cluster = self.standin.clusters.get(remote.uuid)
+        if target_cluster is None or data.get("toBucket") not in target_cluster.buckets:
+            return RestResponse(400, {"errors": {"toBucket": "unknown target bucket"}})
+        replication = Replication(remote.uuid, data.get("fromBucket"), data.get("toBucket"))
+        if replication.id in cluster.replications:
+            return RestResponse(400, {"errors": {"_": ALREADY_CLUSTER_FOR_BUCKET}})
+        cluster.replications[replication.id] = replication
+        return RestResponse(200, {"id": replication.id})
+
+    def _tasks(self, cluster):
+        tasks = [{"type": "rebalance", "status": "notRunning", "statusIsStale": False}]
+        for replication in cluster.replications.values():
+            tasks.append({"type": "xdcr", "id": replication.id, "source": replication.from_bucket,
+                          "target": "/remoteClusters/{}/buckets/{}".format(replication.remote_uuid,
+                                                                           replication.to_bucket),
+                          "status": "paused" if replication.paused else "running",
+                          "changesLeft": cluster.changes_left(replication.id),
+                          "replicationType": "xmem"})
+        for bucket in cluster.buckets.values():
+            if bucket.compacted_at is not None:
+                tasks.append({"type": "bucket_compaction", "bucket": bucket.name, "status": "running",
+                              "progress": 50})
+        return tasks
+
+    def _add_node(self, server, data):
+        cluster = server.cluster
+        hostname = data.get("hostname", "").replace("http://", "")
+        address, _, port = hostname.partition(":")
+        target = self.standin.resolve(server.host, address, port or 8091)
+        if target is None:
+            return RestResponse(400, ["Failed to reach erlang port mapper at node {}".format(address)])
+        if target.cluster is not None:
+            return RestResponse(400, ["Node is already part of cluster."])
+        target.cluster = cluster
+        target.membership = "inactiveAdded"
+        target.ip = address
+        target.services = [SERVICES.get(service, service) for service in data.get("services", "").split(",")
+                           if service]
+        target.host.write(target.host.var_dir + "/ip_start", address)
+        target.host.remove(target.host.var_dir + "/ip")
+        cluster.nodes.append(target)
+        return RestResponse(200, {"otpNode": "ns_1@{}".format(address)})
+
+    # curl
+
+    def _curl(self, host, arguments):
+        requests = []
+        for segment in " ".join(shlex.quote(argument) for argument in arguments).split(" --next "):
+            request = {"method": None, "user": ":", "data": [], "write_out": "", "url": None}
+            tokens = shlex.split(segment)
+            i = 0
+            while i < len(tokens):
+                token = tokens[i]
+                if token == "-X":
+                    request["method"] = tokens[i + 1]
+                    i = i + 1
+                elif token == "-u":
+                    request["user"] = tokens[i + 1]
+                    i = i + 1
+                elif token == "--data-urlencode":
+                    request["data"].append(tuple(tokens[i + 1].split("=", 1)))
+                    i = i + 1
+                elif token == "-w":
+                    request["write_out"] = tokens[i + 1]
+                    i = i + 1
+                elif not token.startswith("-"):
+                    request["url"] = token
+                i = i + 1
+            if request["method"] is None:
+                request["method"] = "POST" if request["data"] else "GET"
+            if "@" in request["url"] and "://" not in request["url"]:
+                request["user"], request["url"] = request["url"].rsplit("@", 1)
+            requests.append(request)
+
+        output = []
+        errors = []
+        work = 0.0
+        for request in requests:
+            username, _, password = request["user"].partition(":")
+            response = self.rest(host, request["method"], request["url"], username, password, request["data"])
+            if response is None:
+                code = "000"
+                errors.append("curl: (7) Failed to connect to {}: Connection refused".format(request["url"]))
+            else:
+                code = "{:03d}".format(response.code)
+                output.append(response.body)
+                work = work + response.work
+            output.append(request["write_out"].replace("\\n", "\n").replace("%{http_code}", code))
+        return CommandResult("".join(output), "\n".join(errors), 7 if errors else 0, tool="curl", name="rest",
+                             work=work, requests=len(requests))
+
+    # couchbase-cli
+
+    def _couchbase_cli(self, host, subcommand, options):
+        result = self._cli_subcommand(host, subcommand, options)
+        result.tool = "couchbase-cli"
+        result.name = subcommand
+        return result
+
+    def _cli_call(self, host, options, method, path, data=None):
+        """ REST call of couchbase-cli, returns (response, error result) """
+        url = "http://{}{}".format(options.get("cluster"), path)
+        response = self.rest(host, method, url, options.get("username"), options.get("password"), data)
+        if response is None:
+            return None, CommandResult("ERROR: Unable to connect to host at http://{}".format(options.get("cluster")),
+                                       "", 1)
+        if response.code == 401:
+            return None, CommandResult("ERROR: Incorrect username/password", "", 1)
+        if not response.ok:
+            return None, CommandResult("ERROR: {}".format(response.error()), "", 1)
+        return response, None
+
+    def _cli_subcommand(self, host, subcommand, options):
+        handler = getattr(self, "_cli_{}".format(subcommand.replace("-", "_")), None)
+        if handler is None:
+            return CommandResult("", "couchbase-cli: error: invalid choice: '{}'".format(subcommand), 2)
+        return handler(host, options)
+
+    def _cli_server_info(self, host, options):
+        response, error = self._cli_call(host, options, "GET", "/nodes/self")
+        return error or CommandResult(response.body)
+
+    def _cli_server_list(self, host, options):
+        response, error = self._cli_call(host, options, "GET", "/pools/default")
+        if error:
+            return error
+        nodes = json.loads(response.body)["nodes"]
+        return CommandResult("\n".join("{} {} {} {}".format(node["otpNode"], node["hostname"], node["status"],
+                                                             node["clusterMembership"]) for node in nodes))
+
+    def _cli_bucket_list(self, host, options):
+        response, error = self._cli_call(host, options, "GET", "/pools/default/buckets")
+        return error or CommandResult(response.body)
+
+    def _cli_node_init(self, host, options):
+        server = self.standin.resolve(host, *options["cluster"].split(":"))
+        if server is None:
+            return CommandResult("ERROR: Unable to connect to host at http://{}".format(options["cluster"]), "", 1)
+        if server.cluster is not None and len(server.cluster.nodes) > 1:
+            return CommandResult("ERROR: {}".format(MULTIPLE_VDB_ERROR), "", 1)
+        server.data_path = options.get("node-init-data-path")
+        if options.get("node-init-hostname"):
+            server.ip = options["node-init-hostname"]
+            server.host.write(server.host.var_dir + "/ip", server.ip)
+        return CommandResult("SUCCESS: Node initialized")
+
+    def _cli_cluster_init(self, host, options):
+        server = self.standin.resolve(host, *options["cluster"].split(":"))
+        if server is None:
+            return CommandResult("ERROR: Unable to connect to host at http://{}".format(options["cluster"]), "", 1)
+        if server.cluster is not None:
+            return CommandResult("ERROR: {}".format(ALREADY_CLUSTER_INIT), "", 1)
+        cluster = Cluster(options.get("cluster-name"), options.get("cluster-username"),
+                          options.get("cluster-password"), memory_quota_mb=options.get("cluster-ramsize"),
+                          index_memory_quota_mb=options.get("cluster-index-ramsize"),
+                          fts_memory_quota_mb=options.get("cluster-fts-ramsize"),
+                          eventing_memory_quota_mb=options.get("cluster-eventing-ramsize"),
+                          analytics_memory_quota_mb=options.get("cluster-analytics-ramsize"))
+        server.services = [SERVICES.get(service, service) for service in options.get("services", "").split(",")
+                           if service]
+        self.standin.register_cluster(cluster, [server])
+        return CommandResult("SUCCESS: Cluster initialized")
+
+    def _cli_setting_cluster(self, host, options):
+        if "cluster-username" in options:
+            response, error = self._cli_call(host, options, "POST", "/settings/web",
+                                             [("username", options["cluster-username"]),
+                                              ("password", options.get("cluster-password"))])
+            if error:
+                return error
+            options = dict(options, username=options["cluster-username"], password=options.get("cluster-password"))
+        data = [("clusterName", options["cluster-name"])] if "cluster-name" in options else []
+        for option, key in (("cluster-ramsize", "memoryQuota"), ("cluster-index-ramsize", "indexMemoryQuota"),
+                            ("cluster-fts-ramsize", "ftsMemoryQuota"),
+                            ("cluster-eventing-ramsize", "eventingMemoryQuota"),
+                            ("cluster-analytics-ramsize", "cbasMemoryQuota")):
+            if option in options:
+                data.append((key, options[option]))
+        response, error = self._cli_call(host, options, "POST", "/pools/default", data)
+        return error or CommandResult("SUCCESS: Cluster settings modified")
+
+    def _cli_bucket_create(self, host, options):
+        data = [("name", options.get("bucket")), ("bucketType", options.get("bucket-type", "couchbase")),
+                ("ramQuotaMB", options.get("bucket-ramsize")),
+                ("evictionPolicy", options.get("bucket-eviction-policy", "valueOnly"))]
+        if "compression-mode" in options:
+            data.append(("compressionMode", options["compression-mode"]))
+        response, error = self._cli_call(host, options, "POST", "/pools/default/buckets", data)
+        return error or CommandResult("SUCCESS: Bucket created", work=response.work)
+
+    def _cli_bucket_edit(self, host, options):
+        data = []
+        if "enable-flush" in options:
+            data.append(("flushEnabled", options["enable-flush"]))
+        if "bucket-ramsize" in options:
+            data.append(("ramQuotaMB", options["bucket-ramsize"]))
+        if "bucket-eviction-policy" in options:
+            data.append(("evictionPolicy", options["bucket-eviction-policy"]))
+        response, error = self._cli_call(host, options, "POST", "/pools/default/buckets/{}".format(options["bucket"]),
+                                         data)
+        return error or CommandResult("SUCCESS: Bucket edited")
+
+    def _cli_bucket_delete(self, host, options):
+        response, error = self._cli_call(host, options, "DELETE",
+                                         "/pools/default/buckets/{}".format(options["bucket"]))
+        return error or CommandResult("SUCCESS: Bucket deleted", work=response.work)
+
+    def _cli_bucket_flush(self, host, options):
+        response, error = self._cli_call(host, options, "POST",
+                                         "/pools/default/buckets/{}/controller/doFlush".format(options["bucket"]))
+        return error or CommandResult("SUCCESS: Bucket flushed")
+
+    def _cli_xdcr_setup(self, host, options):
+        if options.get("list"):
+            response, error = self._cli_call(host, options, "GET", "/pools/default/remoteClusters")
+            if error:
+                return error
+            lines = []
+            for remote in json.loads(response.body):
+                lines.extend(["cluster name: {}".format(remote["name"]), "        uuid: {}".format(remote["uuid"]),
+                              "   host name: {}".format(remote["hostname"]),
+                              "   user name: {}".format(remote["username"]),
+                              "         uri: {}".format(remote["uri"])])
+            return CommandResult("\n".join(lines))
+        if options.get("delete"):
+            response, error = self._cli_call(host, options, "DELETE", "/pools/default/remoteClusters/{}".format(
+                options.get("xdcr-cluster-name")))
+            return error or CommandResult("SUCCESS: Cluster reference deleted")
+        response, error = self._cli_call(host, options, "POST", "/pools/default/remoteClusters",
+                                         [("name", options.get("xdcr-cluster-name")),
+                                          ("hostname", options.get("xdcr-hostname")),
+                                          ("username", options.get("xdcr-username")),
+                                          ("password", options.get("xdcr-password"))])
+        return error or CommandResult("SUCCESS: Cluster reference created")
+
+    def _cli_xdcr_replicate(self, host, options):
+        if options.get("list"):
+            response, error = self._cli_call(host, options, "GET", "/pools/default/tasks")
+            if error:
+                return error
+            lines = []
+            for task in json.loads(response.body):
+                if task["type"] == "xdcr":
+                    lines.extend(["stream id: {}".format(task["id"]), "   status: {}".format(task["status"]),
+                                  "   source: {}".format(task["source"]), "   target: {}".format(task["target"])])
+            return CommandResult("\n".join(lines))
+        replicator = options.get("xdcr-replicator")
+        if options.get("delete"):
+            response, error = self._cli_call(host, options, "DELETE", "/controller/cancelXDCR/{}".format(replicator))
+            return error or CommandResult("SUCCESS: XDCR replication deleted")
+        if options.get("pause") or options.get("resume"):
+            response, error = self._cli_call(host, options, "POST", "/settings/replications/{}".format(replicator),
+                                             [("pauseRequested", "true" if options.get("pause") else "false")])
+            return error or CommandResult("SUCCESS: XDCR replication {}".format(
+                "paused" if options.get("pause") else "resumed"))
+        response, error = self._cli_call(host, options, "POST", "/controller/createReplication",
+                                         [("fromBucket", options.get("xdcr-from-bucket")),
+                                          ("toCluster", options.get("xdcr-cluster-name")),
+                                          ("toBucket", options.get("xdcr-to-bucket")),
+                                          ("replicationType", "continuous")])
+        return error or CommandResult("SUCCESS: XDCR replication created")
+
+    def _cli_server_add(self, host, options):
+        response, error = self._cli_call(host, options, "POST", "/controller/addNode",
+                                         [("hostname", options.get("server-add")),
+                                          ("user", options.get("server-add-username")),
+                                          ("password", options.get("server-add-password")),
+                                          ("services", ",".join(SERVICES.get(service, service) for service in
+                                                                options.get("services", "").split(",")))])
+        return error or CommandResult("SUCCESS: Server added")
+
+    def _cli_rebalance(self, host, options):
+        ejected = ["ns_1@{}".format(address) for address in options.get("server-remove", "").split(",") if address]
+        response, error = self._cli_call(host, options, "POST", "/controller/rebalance",
+                                         [("ejectedNodes", ",".join(ejected))])
+        return error or CommandResult("SUCCESS: Rebalance complete", work=response.work)
+
+    # cbq
+
+    def _cbq(self, host, options):
+        result = CommandResult(tool="cbq", name="query")
+        engine = options.get("engine", "").replace("http://", "")
+        address, _, port = engine.partition(":")
+        server = self.standin.resolve(host, address, port or 8091)
+        if server is None or server.cluster is None:
+            result.stdout = json.dumps({"status": "fatal", "errors": [
+                {"code": 5000, "msg": "Unable to connect to {}".format(engine)}]})
+            return result
+        cluster = server.cluster
+        if not cluster.authorized(options.get("username"), options.get("password")):
+            result.stdout = json.dumps({"status": "fatal", "errors": [{"code": 10000, "msg": "Authentication "
+                                                                                               "failed"}]})
+            return result
+        statement = options.get("script", "").strip()
+        response = self._query(cluster, statement)
+        response.update({"requestID": "00000000-0000-0000-0000-000000000000", "signature": {"*": "*"}})
+        if "results" not in response:
+            response["results"] = []
+        result.stdout = json.dumps(response, indent=4)
+        return result
+
+    def _query(self, cluster, statement):
+        match = re.match(r"SELECT COUNT\(\*\) as (\w+) FROM system:indexes WHERE state <> 'online'", statement, re.I)
+        if match:
+            return {"status": "success", "results": [
+                {match.group(1): len([index for index in cluster.indexes.values() if index.state != "online"])}]}
+        match = re.match(r"SELECT keyspace_id as (\w+), COUNT\(\*\) as (\w+) FROM system:indexes "
+                         r"WHERE state <> 'online' GROUP BY keyspace_id", statement, re.I)
+        if match:
+            unbuilt = Counter(index.bucket for index in cluster.indexes.values() if index.state != "online")
+            return {"status": "success", "results": [{match.group(1): bucket, match.group(2): count}
+                                                     for bucket, count in sorted(unbuilt.items())]}
+        match = re.match(r"CREATE\s+(PRIMARY\s+)?INDEX\s+`?([^`\s(]*)`?\s*ON\s+`([^`]+)`\s*(\((.*?)\))?\s*"
+                         r"(WITH\s+(\{.*\}))?\s*$", statement, re.I | re.S)
+        if match:
+            name = match.group(2) or "#primary"
+            bucket = match.group(3)
+            if bucket not in cluster.buckets:
+                return {"status": "errors", "errors": [{"code": 12003,
+                                                        "msg": "Keyspace not found in CB datastore: "
+                                                               "default:{}".format(bucket)}]}
+            if (bucket, name) in cluster.indexes:
+                return {"status": "errors", "errors": [{"code": 4300,
+                                                        "msg": "The index {} already exists.".format(name)}]}
+            deferred = bool(match.group(7)) and json.loads(match.group(7)).get("defer_build", False)
+            fields = [field.strip().strip("`") for field in (match.group(5) or "").split(",") if field.strip()]
+            index = Index(bucket, name, fields, primary=bool(match.group(1)), deferred=deferred,
+                          state="deferred" if deferred else "building")
+            self._build(cluster, [index])
+            cluster.add_index(index)
+            return {"status": "success"}
+        match = re.match(r"BUILD\s+INDEX\s+ON\s+`([^`]+)`\s*\((.*)\)\s*$", statement, re.I | re.S)
+        if match:
+            names = [name.strip().strip("`") for name in match.group(2).split(",")]
+            indexes = [cluster.indexes.get((match.group(1), name)) for name in names]
+            if None in indexes:
+                return {"status": "errors", "errors": [{"code": 12016, "msg": "Index Not Found"}]}
+            self._build(cluster, [index for index in indexes if index.state == "deferred"])
+            return {"status": "success"}
+        match = re.match(r"DROP\s+INDEX\s+`([^`]+)`\.`([^`]+)`\s*$", statement, re.I)
+        if match:
+            if cluster.indexes.pop((match.group(1), match.group(2)), None) is None:
+                return {"status": "errors", "errors": [{"code": 12004, "msg": "Index Not Found"}]}
+            return {"status": "success"}
+        return {"status": "fatal", "errors": [{"code": 3000, "msg": "syntax error"}]}
+
+    def _build(self, cluster, indexes):
+        """ indexes of one build are built together, every next build waits for the previous ones """
+        start = max([self.now] + [index.ready_at for index in cluster.indexes.values() if index.state == "building"])
+        for index in indexes:
+            if index.state != "deferred" or index in cluster.indexes.values():
+                index.state = "building"
+                index.ready_at = start + self.standin.index_build_seconds
+
+    # cbstats / cbepctl, memcached connection to the data service of the local server
+
+    def _memcached_bucket(self, host, options):
+        """ (bucket, error result) of local server addressed by host:11210 and -b bucket """
+        server = host.server
+        if not server.running or server.cluster is None or "kv" not in server.services:
+            return None, CommandResult("", "Connection refused", 1)
+        if not server.cluster.authorized(options.get("username"), options.get("password")):
+            return None, CommandResult("", "Authentication failed", 1)
+        bucket = server.cluster.buckets.get(options.get("b"))
+        if bucket is None:
+            return None, CommandResult("", "No such bucket", 1)
+        return bucket, None
+
+    def _cbstats(self, host, options):
+        """ cbstats -a warmup """
+        options = dict(options, b=None)
+        _, error = self._memcached_bucket(host, options)
+        result = CommandResult(tool="cbstats", name=" ".join(options[None][1:]))
+        if error is not None and error.stderr != "No such bucket":
+            error.tool, error.name = result.tool, result.name
+            return error
+        sections = []
+        for bucket in host.server.cluster.buckets.values():
+            if bucket.bucket_type != "couchbase":
+                continue
+            loaded, complete = host.server.warmup(bucket, self.now, self.standin.warmup_seconds,
+                                                  self.standin.warmup_values_per_second)
+            stats = [("ep_warmup", "enabled"), ("ep_warmup_estimated_key_count", bucket.items),
+                     ("ep_warmup_estimated_value_count", bucket.items),
+                     ("ep_warmup_state", "done" if complete else "loading data"),
+                     ("ep_warmup_thread", "complete" if complete else "running"), ("ep_warmup_value_count", loaded)]
+            sections.append("{}\n{}\n\n{}".format("*" * 78, bucket.name,
+                                                   "\n".join(" {}: {}".format(name, value) for name, value in stats)))
+        result.stdout = "\n".join(sections)
+        return result
+
+    def _cbepctl(self, host, options):
+        bucket, error = self._memcached_bucket(host, options)
+        result = error or CommandResult()
+        result.tool, result.name = "cbepctl", "set"
+        if error is not None:
+            return result
+        _, _, kind, param, value = options[None]
+        host.server.bucket_params.setdefault(bucket.name, {})[param] = value
+        result.stdout = "setting param: {} {}\nset {} to {}".format(param, value, param, value)
+        return result
+
+    # cbbackupmgr
+
+    def _cbbackupmgr(self, host, subcommand, options):
+        result = CommandResult(tool="cbbackupmgr", name=subcommand)
+        archive = host.archives.get(host.normalize(options.get("archive", "")))
+        backup = archive.latest(options.get("repo")) if archive else None
+        if backup is None:
+            result.stdout = "Error restoring cluster: Backup Repository `{}` not found".format(options.get("repo"))
+            result.exit_code = 1
+            return result
+        if subcommand == "info":
+            backups = [{"date": state["date"], "type": "FULL", "complete": True,
+                        "buckets": [{"name": bucket["name"], "items": bucket["items"],
+                                     "mutations": bucket["items"], "size": bucket["items"] * DOC_BYTES}
+                                    for bucket in state["buckets"]]}
+                       for state in archive.repos[options.get("repo")]]
+            result.stdout = json.dumps({"name": options.get("repo"), "count": len(backups), "backups": backups})
+            return result
+        address, _, port = options.get("cluster", "").replace("couchbase://", "").partition(":")
+        server = self.standin.resolve(host, address, port or 8091)
+        if server is None or server.cluster is None or \
+                not server.cluster.authorized(options.get("username"), options.get("password")):
+            result.stdout = "Error restoring cluster: Unable to connect to couchbase://{}".format(address)
+            result.exit_code = 1
+            return result
+        cluster = server.cluster
+        included = options.get("include-buckets", "").split(",")
+        restored = 0
+        for state in backup["buckets"]:
+            if state["name"] not in included:
+                continue
+            bucket = cluster.buckets.get(state["name"])
+            if bucket is None:
+                result.stdout = "Error restoring cluster: Bucket {} doesn't exist".format(state["name"])
+                result.exit_code = 1
+                return result
+            # buckets are restored one by one, items of the bucket grow while it's restored
+            bucket.restore = (self.now + float(restored) / self.standin.restore_docs_per_second,
+                              self.now + float(restored + state["items"]) / self.standin.restore_docs_per_second,
+                              bucket.items, state["items"])
+            restored = restored + state["items"]
+        for state in backup["indexes"]:
+            if state["bucket"] in included and (state["bucket"], state["name"]) not in cluster.indexes:
+                cluster.add_index(Index(state["bucket"], state["name"], state["fields"], state["primary"],
+                                        deferred=True, state="deferred"))
+        result.stdout = "Restore completed successfully"
+        result.work = float(restored) / self.standin.restore_docs_per_second
+        return result